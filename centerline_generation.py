@@ -1,81 +1,66 @@
 import os
-import gc
 import pickle
+import shutil
 import numpy as np
 import torch
-from copy import deepcopy
+from functools import lru_cache, partial
+from tqdm import tqdm
+from datasets import Dataset, Features, Array2D, concatenate_datasets
 from shapely.geometry import Point
-import time
 from nuplan.common.actor_state.state_representation import StateSE2
 from nuplan.common.maps.nuplan_map.map_factory import get_maps_api
-from transformer4planning.preprocess.pdm_vectorize import (get_discrete_centerline, 
-                                                           get_drivable_area_map,
-                                                           load_route_dicts,
-                                                           route_roadblock_correction,
+from transformer4planning.preprocess.pdm_vectorize import (get_cached_centerline,
+                                                           get_cached_route_dicts,
+                                                           get_cached_route_lane_map,
                                                            get_starting_lane,
                                                            convert_absolute_to_relative_se2_array,
-                                                           PDMPath,
                                                            )
 
-MAP_API=dict()
-for map in ['sg-one-north', 'us-ma-boston', 'us-nv-las-vegas-strip', 'us-pa-pittsburgh-hazelwood']:
-    MAP_API[map] = get_maps_api(
-                        map_root="/public/MARS/datasets/nuPlan/nuplan-maps-v1.1",
-                        # map_root="/localdata_ssd/nuplan/nuplan-maps-v1.1",
-                        map_version="nuplan-maps-v1.0",
-                        map_name=map
-                        )
-    
-def get_centerline(sample, split, data_path, 
-                   map_radius=50, centerline_samples=120, centerline_interval=1.0,
-                   frame_rate=20, past_seconds=2, frame_frequency_rate=2):
-    """
-    Args:
-        sample: the data unit in datasets, include file_name, frame_id and map etc.
-        
-    """
-    filename = sample["file_name"]
-    map = sample["map"]
-    frame_id = sample["frame_id"]
-    route_ids = sample["route_ids"]
-    if isinstance(frame_id, torch.Tensor):
-        frame_id = frame_id.item()
-    if isinstance(route_ids, torch.Tensor):
-        route_ids = route_ids.tolist()
+MAP_ROOT = "/public/MARS/datasets/nuPlan/nuplan-maps-v1.1"
+# MAP_ROOT = "/localdata_ssd/nuplan/nuplan-maps-v1.1"
+MAP_VERSION = "nuplan-maps-v1.0"
+
+
+@lru_cache(maxsize=None)
+def get_map_api(map_name, map_root=MAP_ROOT, map_version=MAP_VERSION):
+    # map apis are built lazily, once per process and map
+    return get_maps_api(map_root=map_root, map_version=map_version, map_name=map_name)
+
+def load_agent_dic(filename, map, split, data_path):
     pickle_path = os.path.join(data_path, f"{split}", f"{map}", f"{filename}.pkl")
-    if os.path.exists(pickle_path):
-        with open(pickle_path, "rb") as f:
-            data_dic = pickle.load(f)
-            if 'agent_dic' in data_dic:
-                agent_dic = data_dic["agent_dic"]
-            elif 'agent' in data_dic:
-                agent_dic = data_dic['agent']
-            else:
-                raise ValueError(f'cannot find agent_dic or agent in pickle file, keys: {data_dic.keys()}')
-    else:
+    if not os.path.exists(pickle_path):
         print(f"Error: cannot load {filename} from {data_path} with {map}")
         return None
-    
-    map_api = MAP_API[map]
+    with open(pickle_path, "rb") as f:
+        data_dic = pickle.load(f)
+    if 'agent_dic' in data_dic:
+        return data_dic["agent_dic"]
+    elif 'agent' in data_dic:
+        return data_dic['agent']
+    else:
+        raise ValueError(f'cannot find agent_dic or agent in pickle file, keys: {data_dic.keys()}')
+
+def compute_centerline(agent_dic, frame_id, route_ids, map_api,
+                       centerline_samples=120, centerline_interval=1.0,
+                       frame_rate=20, past_seconds=2, frame_frequency_rate=2):
+    """
+    Args:
+        agent_dic: agent dictionary of the scenario pickle
+        frame_id: frame of the sample
+        route_ids: on-route roadblock ids
+    Returns:
+        centerline (centerline_samples, 3) relative to the ego pose at frame_id
+    """
     # convert ego poses to nuplan format (x, y, heading)
-    ego_poses = deepcopy(agent_dic["ego"]["pose"][(frame_id - past_seconds * frame_rate) // frame_frequency_rate:frame_id // frame_frequency_rate, :])
+    ego_poses = agent_dic["ego"]["pose"][(frame_id - past_seconds * frame_rate) // frame_frequency_rate:frame_id // frame_frequency_rate, :]
     ego_shape = agent_dic["ego"]["shape"][0]
-    nuplan_ego_poses = [StateSE2(x=ego_pose[0], y=ego_pose[1], heading=ego_pose[-1]) for ego_pose in ego_poses]
-    anchor_ego_pose = nuplan_ego_poses[-1]
-    # build drivable area map and extract centerline    
-    drivable_area_map = get_drivable_area_map(map_api, ego_poses[-1], map_radius=map_radius)
-    # compute centerlines
-    # _, init_route_dict = load_route_dicts(route_ids, map_api)
-    # gc.collect()
-    # gc.disable()
-    # route_ids = route_roadblock_correction(ego_poses[-1], map_api, init_route_dict)
-    route_lane_dict, route_block_dict = load_route_dicts(route_ids, map_api)
-    # e2_time = time.time()
-    # print("time to load corrected routes:", e2_time - e1_time)
-    current_lane = get_starting_lane(ego_poses[-1], drivable_area_map, route_lane_dict, ego_shape)
-    # e5_time = time.time()
-    # print("time to get lane:", e5_time - e4_time)
-    centerline = PDMPath(get_discrete_centerline(current_lane, route_block_dict, route_lane_dict))
+    anchor_ego_pose = StateSE2(x=ego_poses[-1][0], y=ego_poses[-1][1], heading=ego_poses[-1][-1])
+    # route dicts, lane map and centerline are cached per route (and starting lane), thus shared by all samples of a group
+    route_ids = tuple(route_ids)
+    route_lane_dict, _ = get_cached_route_dicts(route_ids, map_api)
+    route_lane_map = get_cached_route_lane_map(route_ids, map_api)
+    current_lane = get_starting_lane(ego_poses[-1], route_lane_map, route_lane_dict, ego_shape)
+    centerline = get_cached_centerline(route_ids, current_lane.id, map_api)
     current_progress = centerline.project(Point(*anchor_ego_pose.array))
     centerline_progress_values = (
         np.arange(centerline_samples, dtype=np.float64) * centerline_interval + current_progress
@@ -87,81 +72,123 @@ def get_centerline(sample, split, data_path,
 
     return planner_centerline
 
-def centerline_map(sample, split, data_path):
+def get_centerline(sample, split, data_path, **kwargs):
+    """
+    Args:
+        sample: the data unit in datasets, include file_name, frame_id and map etc.
+
+    """
+    frame_id = sample["frame_id"]
+    route_ids = sample["route_ids"]
+    if isinstance(frame_id, torch.Tensor):
+        frame_id = frame_id.item()
+    if isinstance(route_ids, torch.Tensor):
+        route_ids = route_ids.tolist()
+    agent_dic = load_agent_dic(sample["file_name"], sample["map"], split, data_path)
+    if agent_dic is None:
+        return None
+    return compute_centerline(agent_dic, frame_id, route_ids, get_map_api(sample["map"]), **kwargs)
+
+def group_samples(dataset):
+    """
+    Groups samples of a dataset by scenario and route.
+    Returns:
+        list of groups (file_name, map, route_ids, [(index, frame_id), ...])
+    """
+    columns = dataset.select_columns(["file_name", "map", "frame_id", "route_ids"]).with_format(None)
+    groups = dict()
+    for index, (filename, map, frame_id, route_ids) in enumerate(zip(columns["file_name"], columns["map"],
+                                                                      columns["frame_id"], columns["route_ids"])):
+        key = (filename, map, tuple(route_ids))
+        groups.setdefault(key, []).append((index, frame_id))
+    return [key + (samples,) for key, samples in groups.items()]
+
+def centerline_group(group, split, data_path, map_root=MAP_ROOT, centerline_samples=120):
+    """
+    Computes centerlines of all samples of a group, the scenario pickle is loaded once per group.
+    Returns:
+        indices and centerlines (num_samples, centerline_samples, 3), zeros for failed samples
+    """
+    filename, map, route_ids, samples = group
+    indices = np.array([index for index, _ in samples], dtype=np.int64)
+    centerlines = np.zeros((len(samples), centerline_samples, 3), dtype=np.float32)
     try:
-        centerline = get_centerline(sample, split, data_path)
-        sample["centerline"] = centerline
-    except:
-        print("Error: routes is incorrect")
-        sample["centerline"] = None
-    return sample
+        agent_dic = load_agent_dic(filename, map, split, data_path)
+    except Exception:
+        agent_dic = None
+    if agent_dic is None:
+        return indices, centerlines
+    map_api = get_map_api(map, map_root)
+    for i, (_, frame_id) in enumerate(samples):
+        try:
+            centerlines[i] = compute_centerline(agent_dic, frame_id, route_ids, map_api,
+                                                centerline_samples=centerline_samples)
+        except Exception:
+            print(f"Error: routes is incorrect, {filename} frame {frame_id}")
+    return indices, centerlines
+
+def generate_shard(pool, dataset, output_path, split, data_path, map_root=MAP_ROOT, centerline_samples=120):
+    """
+    Adds a fixed-shape centerline column to the dataset (shard) and saves it to output_path.
+    The shard is written to a temporary directory first, such that existing shards are always complete.
+    """
+    groups = group_samples(dataset)
+    print(f"{len(dataset)} samples in {len(groups)} scenario / route groups")
+    centerlines = np.zeros((len(dataset), centerline_samples, 3), dtype=np.float32)
+    func = partial(centerline_group, split=split, data_path=data_path, map_root=map_root,
+                   centerline_samples=centerline_samples)
+    for indices, group_centerlines in tqdm(pool.imap_unordered(func, groups, chunksize=4), total=len(groups)):
+        centerlines[indices] = group_centerlines
+
+    features = Features({"centerline": Array2D(shape=(centerline_samples, 3), dtype="float32")})
+    centerline_column = Dataset.from_dict({"centerline": centerlines}, features=features)
+    dataset = concatenate_datasets([dataset, centerline_column], axis=1)
+
+    # temporary directory next to (not inside) the dataset root, which only contains finished shards
+    tmp_path = os.path.join(os.path.dirname(output_path) + ".tmp", os.path.basename(output_path))
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+    dataset.save_to_disk(tmp_path)
+    os.rename(tmp_path, output_path)
 
 if __name__ == "__main__":
     import multiprocessing as mp
     import datasets
-    from datasets.arrow_dataset import _concatenate_map_style_datasets
-    from datasets import Dataset
-    from functools import partial
-    from tqdm import tqdm
     import argparse
-    
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--data_path", type=str, default="/localdata_ssd/nuplan/online_float32_opt")
     # parser.add_argument("--data_path", type=str, default="/public/MARS/datasets/nuPlanCache/online_float32_opt")
+    parser.add_argument("--map_root", type=str, default=MAP_ROOT)
     parser.add_argument("--split", type=str, default="train")
     parser.add_argument("--cache_dir", type=str, default="/localdata_ssd/nuplan/centerline")
     parser.add_argument("--dataset_name", type=str, default="train")
     parser.add_argument("--num_proc", type=int, default=40)
     parser.add_argument("--start_id", type=int, default=0)
     parser.add_argument("--end_id", type=int, default=1)
-    parser.add_argument("--method", type=str, default="map", help="choose from ['map', 'mp', 'sequential'], map is recommended")
+    parser.add_argument("--centerline_samples", type=int, default=120)
 
-    
     args = parser.parse_args()
-        
+
     data_path = args.data_path
     # root = "/localdata_ssd/nuplan/online_float32_opt/index/val/"
     root = os.path.join(data_path, "index", args.split)
-    subset_dirs = os.listdir(root)
-    alldatasets = list()
-    for i, subset_dir in enumerate(subset_dirs):
-        if i >= args.start_id and i < args.end_id:
+    # every index subset is a shard, saved to cache_dir/dataset_name/subset (loadable with runner.load_dataset),
+    # finished shards are skipped, so an interrupted job can be restarted
+    output_root = os.path.join(args.cache_dir, args.dataset_name)
+    os.makedirs(output_root, exist_ok=True)
+    subset_dirs = sorted(os.listdir(root))
+    with mp.Pool(processes=args.num_proc) as pool:
+        for i, subset_dir in enumerate(subset_dirs):
+            if i < args.start_id or i >= args.end_id:
+                continue
+            output_path = os.path.join(output_root, subset_dir)
+            if os.path.exists(output_path):
+                print(f"skipping {subset_dir}, already generated")
+                continue
             print(f"loading {subset_dir}")
             dataset = datasets.load_from_disk(os.path.join(root, subset_dir))
-            alldatasets.append(dataset)
-        
-    dataset = _concatenate_map_style_datasets(alldatasets)
-    print(dataset)
-    
-    
-    def yield_centerline(shards):
-        for shard in shards:
-            # filename, map, frame_id, route_id = filenames[shard], maps[shard], frame_ids[shard], route_ids[shard]
-            # centerline_dic = get_centerline(filename, map, frame_id, route_id, args.split, data_path)
-            sample = dataset[shard]
-            centerline_dic = get_centerline(sample, args.split, data_path)
-            yield centerline_dic 
-
-    indices = range(len(dataset))
-    print("begin to generate dataset, length is", len(indices))
-    
-    # dataset map
-    if args.method == "map":
-        func = partial(centerline_map, split=args.split, data_path=data_path)
-        dataset = dataset.map(func, num_proc=args.num_proc)
-        dataset.save_to_disk(os.path.join(args.cache_dir, args.dataset_name))
-    
-    # multiprocessing
-    elif args.method == "mp":
-        func = partial(get_centerline, split="train", data_path=data_path)
-        with mp.Pool(processes=40) as pool:
-            result = list(tqdm(pool.imap(func, dataset), total=len(indices)))
-    
-    elif args.method == "sequential":
-        for i in tqdm(indices):
-            try:
-                centerline = get_centerline(dataset[i], args.split, data_path)
-            except:
-                print(f"Error: cannot load from {data_path} with {map}")
-        
-        
\ No newline at end of file
+            print("begin to generate dataset, length is", len(dataset))
+            generate_shard(pool, dataset, output_path, args.split, data_path,
+                           map_root=args.map_root, centerline_samples=args.centerline_samples)
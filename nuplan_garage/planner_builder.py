@@ -47,7 +47,10 @@ def _build_planner(planner_cfg: DictConfig, scenario: Optional[AbstractScenario]
         planner: AbstractPlanner = instantiate(config, model=model)
     elif is_target_type(planner_cfg, STRPlanner):
         # planner: AbstractPlanner = instantiate(config)
-        if True: # planner_counter % 200 == 0:  # model is None:  # for small models
+        if planner_cfg.get('exported_model_path', None) is not None:
+            # STRPlanner loads the exported model itself
+            new_model = None
+        elif True: # planner_counter % 200 == 0:  # model is None:  # for small models
             # initialize model args by default values
             parser = HfArgumentParser((ModelArguments))
             # load model args from config.json
@@ -14,6 +14,9 @@ from nuplan.common.maps.maps_datatypes import SemanticMapLayer
 from nuplan.planning.simulation.planner.abstract_planner import AbstractPlanner
 from shapely.geometry import Point
 
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.compiled_graph import (
+    get_lane_graph,
+)
 from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.dijkstra import (
     Dijkstra,
 )
@@ -104,7 +107,11 @@ class AbstractPDMPlanner(AbstractPlanner, ABC):
         )
         roadblock_window = roadblocks[start_idx : start_idx + search_depth]
 
-        graph_search = Dijkstra(current_lane, list(self._route_lane_dict.keys()))
+        graph_search = Dijkstra(
+            current_lane,
+            list(self._route_lane_dict.keys()),
+            lane_graph=get_lane_graph(self._map_api),
+        )
         route_plan, path_found = graph_search.search(roadblock_window[-1])
 
         centerline_discrete_path: List[StateSE2] = []
@@ -1,5 +1,4 @@
-import copy
-from typing import Dict, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import numpy.typing as npt
@@ -15,6 +14,7 @@ from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_enums impor
 )
 from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_geometry_utils import (
     normalize_angle,
+    translate_lon_and_lat,
 )
 
 MAX_DYNAMIC_OBJECTS: Dict[TrackedObjectType, int] = {
@@ -25,6 +25,122 @@ MAX_DYNAMIC_OBJECTS: Dict[TrackedObjectType, int] = {
 
 MAX_STATIC_OBJECTS: int = 50
 
+# initial capacity of object arrays, doubled when exceeded
+INITIAL_OBJECT_CAPACITY: int = 64
+
+
+class ObjectArrays:
+    """Preallocated arrays of box states (x, y, heading, length, width), velocities and tokens."""
+
+    def __init__(self, capacity: int = INITIAL_OBJECT_CAPACITY):
+        """
+        Constructor of ObjectArrays
+        :param capacity: initial number of objects to allocate, defaults to INITIAL_OBJECT_CAPACITY
+        """
+        self._num_objects: int = 0
+        self._tokens: npt.NDArray[np.object_] = np.empty(capacity, dtype=np.object_)
+        self._boxes: npt.NDArray[np.float64] = np.zeros(
+            (capacity, 5), dtype=np.float64
+        )  # x, y, heading, length, width
+        self._dxy: npt.NDArray[np.float64] = np.zeros((capacity, 2), dtype=np.float64)
+
+    def __len__(self) -> int:
+        """
+        Number of stored objects
+        :return: int
+        """
+        return self._num_objects
+
+    def append(
+        self,
+        token: str,
+        box: Tuple[float, float, float, float, float],
+        dxy: Optional[Tuple[float, float]] = None,
+    ) -> None:
+        """
+        Adds object to arrays, increases capacity if necessary.
+        :param token: Temporally consistent object identifier
+        :param box: box state (x, y, heading, length, width)
+        :param dxy: velocity (x,y) [m/s], defaults to None (static)
+        """
+        if self._num_objects == len(self._tokens):
+            capacity = 2 * max(len(self._tokens), 1)
+            self._tokens = np.resize(self._tokens, capacity)
+            self._boxes = np.resize(self._boxes, (capacity, 5))
+            self._dxy = np.resize(self._dxy, (capacity, 2))
+
+        self._tokens[self._num_objects] = token
+        self._boxes[self._num_objects] = box
+        self._dxy[self._num_objects] = dxy if dxy is not None else (0.0, 0.0)
+        self._num_objects += 1
+
+    def get_nearest(
+        self, position_coords: npt.NDArray[np.float64], max_objects: int
+    ) -> Tuple[List[str], npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+        """
+        Retrieves nearest objects, sorted by distance of the box centers.
+        :param position_coords: (x,y) position to sort around
+        :param max_objects: maximum number of objects to return
+        :return: tuple of tokens, coords of shape (objects, 5, 2), and velocities of shape (objects, 2)
+        """
+        if self._num_objects == 0:
+            return (
+                [],
+                np.zeros((0, len(BBCoordsIndex), 2), dtype=np.float64),
+                np.zeros((0, 2), dtype=np.float64),
+            )
+
+        boxes = self._boxes[: self._num_objects]
+        position_to_center_dist = np.hypot(
+            boxes[:, 0] - position_coords[0], boxes[:, 1] - position_coords[1]
+        )
+
+        # select k nearest without sorting all objects, then sort selection
+        if self._num_objects > max_objects:
+            nearest_idcs = np.argpartition(position_to_center_dist, max_objects - 1)[
+                :max_objects
+            ]
+        else:
+            nearest_idcs = np.arange(self._num_objects)
+        nearest_idcs = nearest_idcs[
+            np.argsort(position_to_center_dist[nearest_idcs], kind="stable")
+        ]
+
+        return (
+            self._tokens[nearest_idcs].tolist(),
+            boxes_to_coords(boxes[nearest_idcs]),
+            self._dxy[nearest_idcs],
+        )
+
+
+def boxes_to_coords(boxes: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """
+    Converts box states to bounding box coordinates (corners and center).
+    :param boxes: array of (x, y, heading, length, width), shape (objects, 5)
+    :return: array of coordinates, shape (objects, 5, 2)
+    """
+    centers, headings = boxes[:, :2], boxes[:, 2]
+    half_lengths, half_widths = boxes[:, 3] / 2.0, boxes[:, 4] / 2.0
+
+    coords: npt.NDArray[np.float64] = np.zeros(
+        (len(boxes), len(BBCoordsIndex), 2), dtype=np.float64
+    )
+    coords[:, BBCoordsIndex.FRONT_LEFT] = translate_lon_and_lat(
+        centers, headings, half_lengths, half_widths
+    )
+    coords[:, BBCoordsIndex.REAR_LEFT] = translate_lon_and_lat(
+        centers, headings, -half_lengths, half_widths
+    )
+    coords[:, BBCoordsIndex.REAR_RIGHT] = translate_lon_and_lat(
+        centers, headings, -half_lengths, -half_widths
+    )
+    coords[:, BBCoordsIndex.FRONT_RIGHT] = translate_lon_and_lat(
+        centers, headings, half_lengths, -half_widths
+    )
+    coords[:, BBCoordsIndex.CENTER] = centers
+
+    return coords
+
 
 class PDMObjectManager:
     """Class that stores and sorts tracked objects around the ego-vehicle."""
@@ -38,13 +154,12 @@ class PDMObjectManager:
         self._unique_objects: Dict[str, TrackedObject] = {}
 
         # dynamic objects
-        self._dynamic_object_tokens = {key: [] for key in MAX_DYNAMIC_OBJECTS.keys()}
-        self._dynamic_object_coords = {key: [] for key in MAX_DYNAMIC_OBJECTS.keys()}
-        self._dynamic_object_dxy = {key: [] for key in MAX_DYNAMIC_OBJECTS.keys()}
+        self._dynamic_objects: Dict[TrackedObjectType, ObjectArrays] = {
+            key: ObjectArrays() for key in MAX_DYNAMIC_OBJECTS.keys()
+        }
 
         # static objects
-        self._static_object_tokens = []
-        self._static_object_coords = []
+        self._static_objects: ObjectArrays = ObjectArrays()
 
     @property
     def unique_objects(self) -> Dict[str, TrackedObject]:
@@ -61,12 +176,8 @@ class PDMObjectManager:
         """
         self._unique_objects[object.track_token] = object
 
-        coords_list = [
-            [corner.x, corner.y] for corner in copy.deepcopy(object.box.all_corners())
-        ]
-        coords_list.append([object.center.x, object.center.y])
-
-        coords: np.ndarray = np.array(coords_list, dtype=np.float64)
+        center = object.box.center
+        box = (center.x, center.y, center.heading, object.box.length, object.box.width)
 
         if object.tracked_object_type in AGENT_TYPES:
             velocity = object.velocity
@@ -82,22 +193,18 @@ class PDMObjectManager:
                 else normalize_angle(object.center.heading + np.pi)
             )
 
-            dxy = np.array(
-                [
-                    np.cos(track_heading) * velocity.magnitude(),
-                    np.sin(track_heading) * velocity.magnitude(),
-                ],
-                dtype=np.float64,
-            ).T  # x,y velocity [m/s]
+            speed = velocity.magnitude()
+            dxy = (
+                np.cos(track_heading) * speed,
+                np.sin(track_heading) * speed,
+            )  # x,y velocity [m/s]
 
             self._add_dynamic_object(
-                object.tracked_object_type, object.track_token, coords, dxy
+                object.tracked_object_type, object.track_token, box, dxy
             )
 
         else:
-            self._add_static_object(
-                object.tracked_object_type, object.track_token, coords
-            )
+            self._add_static_object(object.tracked_object_type, object.track_token, box)
 
     def get_nearest_objects(self, position: Point2D) -> Tuple:
         """
@@ -118,7 +225,7 @@ class PDMObjectManager:
                 dynamic_object_dxy_,
             ) = self._get_nearest_dynamic_objects(position, dynamic_object_type)
 
-            if dynamic_object_coords_.ndim != 3:
+            if len(dynamic_object_tokens_) == 0:
                 continue
 
             dynamic_object_tokens.extend(dynamic_object_tokens_)
@@ -152,34 +259,31 @@ class PDMObjectManager:
         self,
         type: TrackedObjectType,
         token: str,
-        coords: npt.NDArray[np.float64],
-        dxy: npt.NDArray[np.float64],
+        box: Tuple[float, float, float, float, float],
+        dxy: Tuple[float, float],
     ) -> None:
         """
         Adds dynamic obstacle to the manager.
         :param type: Object type (vehicle, pedestrian, etc.)
         :param token: Temporally consistent object identifier
-        :param coords: Bounding-box coordinates
+        :param box: Bounding-box state (x, y, heading, length, width)
         :param dxy: velocity (x,y) [m/s]
         """
-        self._dynamic_object_tokens[type].append(token)
-        self._dynamic_object_coords[type].append(coords)
-        self._dynamic_object_dxy[type].append(dxy)
+        self._dynamic_objects[type].append(token, box, dxy)
 
     def _add_static_object(
         self,
         type: TrackedObjectType,
         token: str,
-        coords: npt.NDArray[np.float64],
+        box: Tuple[float, float, float, float, float],
     ) -> None:
         """
         Adds static obstacle to manager.
         :param type: Object type (e.g. generic, traffic cone, etc.), currently ignored
         :param token: Temporally consistent object identifier
-        :param coords: Bounding-box coordinates
+        :param box: Bounding-box state (x, y, heading, length, width)
         """
-        self._static_object_tokens.append(token)
-        self._static_object_coords.append(coords)
+        self._static_objects.append(token, box)
 
     def _get_nearest_dynamic_objects(
         self, position: Point2D, type: TrackedObjectType
@@ -190,31 +294,9 @@ class PDMObjectManager:
         :param type: Object type to sort
         :return: Tuple of tokens, coords, and velocity of nearest objects.
         """
-        position_coords = position.array[None, ...]  # shape: (1,2)
-
-        object_tokens = self._dynamic_object_tokens[type]
-        object_coords = np.array(self._dynamic_object_coords[type], dtype=np.float64)
-        object_dxy = np.array(self._dynamic_object_dxy[type], dtype=np.float64)
-
-        if len(object_tokens) > 0:
-            # add axis if single object found
-            if object_coords.ndim == 1:
-                object_coords = object_coords[None, ...]
-                object_dxy = object_dxy[None, ...]
-
-            position_to_center_dist = (
-                (object_coords[..., BBCoordsIndex.CENTER, :] - position_coords) ** 2.0
-            ).sum(axis=-1) ** 0.5
-
-            object_argsort = np.argsort(position_to_center_dist)
-
-            object_tokens = [object_tokens[i] for i in object_argsort][
-                : MAX_DYNAMIC_OBJECTS[type]
-            ]
-            object_coords = object_coords[object_argsort][: MAX_DYNAMIC_OBJECTS[type]]
-            object_dxy = object_dxy[object_argsort][: MAX_DYNAMIC_OBJECTS[type]]
-
-        return (object_tokens, object_coords, object_dxy)
+        return self._dynamic_objects[type].get_nearest(
+            position.array, MAX_DYNAMIC_OBJECTS[type]
+        )
 
     def _get_nearest_static_objects(
         self, position: Point2D, type: TrackedObjectType
@@ -225,25 +307,7 @@ class PDMObjectManager:
         :param type: type of static obstacle (currently ignored)
         :return: tuple of tokens and coords of nearest objects
         """
-        position_coords = position.array[None, ...]  # shape: (1,2)
-
-        object_tokens = self._static_object_tokens
-        object_coords = np.array(self._static_object_coords, dtype=np.float64)
-
-        if len(object_tokens) > 0:
-            # add axis if single object found
-            if object_coords.ndim == 1:
-                object_coords = object_coords[None, ...]
-
-            position_to_center_dist = (
-                (object_coords[..., BBCoordsIndex.CENTER, :] - position_coords) ** 2.0
-            ).sum(axis=-1) ** 0.5
-
-            object_argsort = np.argsort(position_to_center_dist)
-
-            object_tokens = [object_tokens[i] for i in object_argsort][
-                :MAX_STATIC_OBJECTS
-            ]
-            object_coords = object_coords[object_argsort][:MAX_STATIC_OBJECTS]
-
+        object_tokens, object_coords, _ = self._static_objects.get_nearest(
+            position.array, MAX_STATIC_OBJECTS
+        )
         return (object_tokens, object_coords)
@@ -1,7 +1,6 @@
 from typing import Dict, List, Optional, Tuple
 
 import numpy as np
-import shapely.creation
 from nuplan.common.actor_state.ego_state import EgoState
 from nuplan.common.actor_state.tracked_objects import TrackedObject
 from nuplan.common.actor_state.tracked_objects_types import TrackedObjectType
@@ -18,6 +17,7 @@ from nuplan_garage.planning.simulation.planner.pdm_planner.observation.pdm_objec
     PDMObjectManager,
 )
 from nuplan_garage.planning.simulation.planner.pdm_planner.observation.pdm_occupancy_map import (
+    PDMBoxOccupancyMap,
     PDMOccupancyMap,
 )
 from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_enums import (
@@ -68,12 +68,12 @@ class PDMObservation:
         self._red_light_token = "red_light"
 
         # lazy loaded (during update)
-        self._occupancy_maps: Optional[List[PDMOccupancyMap]] = None
+        self._occupancy_maps: Optional[List[PDMBoxOccupancyMap]] = None
         self._object_manager: Optional[PDMObjectManager] = None
 
         self._initialized: bool = False
 
-    def __getitem__(self, time_idx) -> PDMOccupancyMap:
+    def __getitem__(self, time_idx) -> PDMBoxOccupancyMap:
         """
         Retrieves occupancy map for time_idx and adapt temporal resolution.
         :param time_idx: index for future simulation iterations [10Hz]
@@ -129,7 +129,7 @@ class PDMObservation:
         :param map_api: map object of nuPlan
         """
 
-        self._occupancy_maps: List[PDMOccupancyMap] = []
+        self._occupancy_maps: List[PDMBoxOccupancyMap] = []
         self._object_manager = self._get_object_manager(ego_state, observation)
 
         (
@@ -157,51 +157,54 @@ class PDMObservation:
             dynamic_object_coords = dynamic_object_coords[None, ...]
             dynamic_object_dxy = dynamic_object_dxy[None, ...]
 
-        if has_static_object:
-            static_object_coords[..., BBCoordsIndex.CENTER, :] = static_object_coords[
-                ..., BBCoordsIndex.FRONT_LEFT, :
-            ]
-            static_object_polygons = shapely.creation.polygons(static_object_coords)
-
-        else:
-            static_object_polygons = np.array([], dtype=np.object_)
-
-        if has_dynamic_object:
-            dynamic_object_coords[..., BBCoordsIndex.CENTER, :] = dynamic_object_coords[
-                ..., BBCoordsIndex.FRONT_LEFT, :
-            ]
-        else:
-            dynamic_object_polygons = np.array([], dtype=np.object_)
+        # box corners without center, shape (objects, 4, 2)
+        static_object_corners = (
+            static_object_coords[:, : BBCoordsIndex.CENTER]
+            if has_static_object
+            else np.zeros((0, 4, 2), dtype=np.float64)
+        )
+        if not has_dynamic_object:
+            dynamic_object_coords = np.zeros((0, 5, 2), dtype=np.float64)
+            dynamic_object_dxy = np.zeros((0, 2), dtype=np.float64)
             dynamic_object_tokens = []
 
-        traffic_light_polygons = np.array(traffic_light_polygons, dtype=np.object_)
-
-        for sample in np.arange(
+        # forecast all dynamic objects for all samples at once, shape (samples, objects, 4, 2)
+        samples = np.arange(
             0,
             self._observation_samples + self._observation_sample_res,
             self._observation_sample_res,
-        ):
-            if has_dynamic_object:
-                delta_t = float(sample) * self._sample_interval
-                dynamic_object_coords_t = (
-                    dynamic_object_coords + delta_t * dynamic_object_dxy[:, None]
-                )
-                dynamic_object_polygons = shapely.creation.polygons(
-                    dynamic_object_coords_t
-                )
-
-            all_polygons = np.concatenate(
-                [
-                    static_object_polygons,
-                    dynamic_object_polygons,
-                    traffic_light_polygons,
-                ],
-                axis=0,
-            )
+        )
+        delta_t = samples.astype(np.float64) * self._sample_interval
+        dynamic_object_corners = (
+            dynamic_object_coords[None, :, : BBCoordsIndex.CENTER]
+            + delta_t[:, None, None, None] * dynamic_object_dxy[None, :, None]
+        )
+        all_object_corners = np.concatenate(
+            [
+                np.broadcast_to(
+                    static_object_corners[None],
+                    (len(samples),) + static_object_corners.shape,
+                ),
+                dynamic_object_corners,
+            ],
+            axis=1,
+        )
 
-            occupancy_map = PDMOccupancyMap(
-                static_object_tokens + dynamic_object_tokens + traffic_light_tokens,
-                all_polygons,
+        # red-light polygons are static, the str-tree is only build once
+        traffic_light_map = PDMOccupancyMap(
+            traffic_light_tokens, np.array(traffic_light_polygons, dtype=np.object_)
+        )
+        object_tokens = static_object_tokens + dynamic_object_tokens
+        tokens = object_tokens + traffic_light_tokens
+        token_to_idx = {token: idx for idx, token in enumerate(tokens)}
+
+        for object_corners in all_object_corners:
+            occupancy_map = PDMBoxOccupancyMap(
+                object_tokens,
+                object_corners,
+                traffic_light_map,
+                tokens=tokens,
+                token_to_idx=token_to_idx,
             )
             self._occupancy_maps.append(occupancy_map)
 
@@ -1,11 +1,17 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import numpy as np
 import numpy.typing as npt
-import shapely.vectorized
+import shapely
+import shapely.creation
 from nuplan.planning.simulation.occupancy_map.abstract_occupancy_map import Geometry
 from shapely.strtree import STRtree
 
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_geometry_utils import (
+    boxes_contain_points,
+    boxes_intersect_boxes,
+)
+
 
 class PDMOccupancyMap:
     """Occupancy map class of PDM, based on shapely's str-tree."""
@@ -93,7 +99,222 @@ class PDMOccupancyMap:
         :return: boolean array of shape (polygons, input-points)
         """
         output = np.zeros((len(self._geometries), len(points)), dtype=bool)
-        for i, polygon in enumerate(self._geometries):
-            output[i] = shapely.vectorized.contains(polygon, points[:, 0], points[:, 1])
+        if len(self._geometries) == 0 or len(points) == 0:
+            return output
+
+        # single str-tree query for all points, returns (point, polygon) index pairs
+        point_idcs, polygon_idcs = self._str_tree.query(
+            shapely.points(points), predicate="within"
+        )
+        output[polygon_idcs, point_idcs] = True
 
         return output
+
+
+class PDMBoxOccupancyMap:
+    """
+    Occupancy map class of PDM for oriented boxes, stored as corner arrays.
+    Box queries are vectorized (point-in-box, separating axis theorem), shapely
+    polygons of boxes are only created on demand. Remaining geometries (e.g.
+    red-light lanes) are kept in a polygon based PDMOccupancyMap.
+    """
+
+    def __init__(
+        self,
+        box_tokens: List[str],
+        box_corners: npt.NDArray[np.float64],
+        polygon_map: PDMOccupancyMap,
+        tokens: Optional[List[str]] = None,
+        token_to_idx: Optional[Dict[str, int]] = None,
+    ):
+        """
+        Constructor of PDMBoxOccupancyMap
+        :param box_tokens: list of tracked tokens of the boxes
+        :param box_corners: corner coordinates of boxes in ring order, shape (boxes, 4, 2)
+        :param polygon_map: occupancy map of non-box geometries, indexed after the boxes
+        :param tokens: box_tokens + polygon_map.tokens, to share between maps of several time-steps
+        :param token_to_idx: dictionary of tokens and indices, to share between maps of several time-steps
+        """
+        assert len(box_tokens) == len(
+            box_corners
+        ), f"PDMBoxOccupancyMap: Tokens/Boxes ({len(box_tokens)}/{len(box_corners)}) have unequal length!"
+
+        self._num_boxes: int = len(box_tokens)
+        self._box_corners = box_corners.reshape(-1, 4, 2)
+        self._polygon_map = polygon_map
+
+        self._tokens: List[str] = (
+            tokens if tokens is not None else box_tokens + polygon_map.tokens
+        )
+        self._token_to_idx: Dict[str, int] = (
+            token_to_idx
+            if token_to_idx is not None
+            else {token: idx for idx, token in enumerate(self._tokens)}
+        )
+
+        # lazy loaded
+        self._box_geometries: Optional[npt.NDArray[np.object_]] = None
+        self._box_bounds: Optional[npt.NDArray[np.float64]] = None
+
+    def __getitem__(self, token) -> Geometry:
+        """
+        Retrieves geometry of token.
+        :param token: geometry identifier
+        :return: Geometry of token
+        """
+        idx = self._token_to_idx[token]
+        if idx < self._num_boxes:
+            return self.box_geometries[idx]
+        return self._polygon_map[token]
+
+    def __len__(self) -> int:
+        """
+        Number of geometries in the occupancy map
+        :return: int
+        """
+        return len(self._tokens)
+
+    @property
+    def tokens(self) -> List[str]:
+        """
+        Getter for track tokens in occupancy map
+        :return: list of strings
+        """
+        return self._tokens
+
+    @property
+    def token_to_idx(self) -> Dict[str, int]:
+        """
+        Getter for track tokens in occupancy map
+        :return: dictionary of tokens and indices
+        """
+        return self._token_to_idx
+
+    @property
+    def box_corners(self) -> npt.NDArray[np.float64]:
+        """
+        Getter for corner coordinates of boxes
+        :return: array of shape (boxes, 4, 2)
+        """
+        return self._box_corners
+
+    @property
+    def box_geometries(self) -> npt.NDArray[np.object_]:
+        """
+        Getter for shapely polygons of boxes, created on first access
+        :return: array of polygons
+        """
+        if self._box_geometries is None:
+            self._box_geometries = shapely.creation.polygons(self._box_corners)
+        return self._box_geometries
+
+    def intersects(self, geometry: Geometry) -> List[str]:
+        """
+        Searches for intersecting geometries in the occupancy map
+        :param geometry: geometries to query
+        :return: list of tokens for intersecting geometries
+        """
+        indices = self.query(geometry, predicate="intersects")
+        return [self._tokens[idx] for idx in indices]
+
+    def query(self, geometry: Geometry, predicate=None):
+        """
+        Equivalent of shapely's str-tree query (see PDMOccupancyMap.query)
+        :param geometry: geometry or array of geometries to query
+        :param predicate: see shapely, defaults to None
+        :return: indices of geometries, or (2, n) array of input and geometry indices for array input
+        """
+        single_geometry = isinstance(geometry, shapely.Geometry)
+        geometries = np.array(
+            [geometry] if single_geometry else geometry, dtype=np.object_
+        )
+
+        input_idcs, box_idcs = self._query_boxes(geometries, predicate)
+        polygon_input_idcs, polygon_idcs = self._polygon_map.query(
+            geometries, predicate=predicate
+        )
+
+        input_idcs = np.concatenate([input_idcs, polygon_input_idcs]).astype(np.int64)
+        geometry_idcs = np.concatenate(
+            [box_idcs, polygon_idcs + self._num_boxes]
+        ).astype(np.int64)
+
+        order = np.lexsort((geometry_idcs, input_idcs))
+        input_idcs, geometry_idcs = input_idcs[order], geometry_idcs[order]
+
+        if single_geometry:
+            return geometry_idcs
+        return np.stack([input_idcs, geometry_idcs], axis=0)
+
+    def _query_boxes(self, geometries: npt.NDArray[np.object_], predicate=None):
+        """
+        Queries the boxes of the occupancy map, with the separating axis theorem for box-shaped inputs.
+        :param geometries: array of geometries to query
+        :param predicate: see shapely, defaults to None
+        :return: tuple of input and box indices
+        """
+        if self._num_boxes == 0 or len(geometries) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+        if predicate == "intersects":
+            query_corners = _get_box_corners(geometries)
+            if query_corners is not None:
+                return np.nonzero(
+                    boxes_intersect_boxes(query_corners, self._box_corners)
+                )
+
+        # bounding-box candidates, followed by shapely's predicate for arbitrary geometries
+        if self._box_bounds is None:
+            self._box_bounds = np.concatenate(
+                [self._box_corners.min(axis=1), self._box_corners.max(axis=1)], axis=-1
+            )
+        query_bounds = shapely.bounds(geometries)
+        candidates = (
+            (query_bounds[:, None, 0] <= self._box_bounds[None, :, 2])
+            & (query_bounds[:, None, 2] >= self._box_bounds[None, :, 0])
+            & (query_bounds[:, None, 1] <= self._box_bounds[None, :, 3])
+            & (query_bounds[:, None, 3] >= self._box_bounds[None, :, 1])
+        )
+        input_idcs, box_idcs = np.nonzero(candidates)
+        if predicate is not None and len(input_idcs) > 0:
+            valid = getattr(shapely, predicate)(
+                geometries[input_idcs], self.box_geometries[box_idcs]
+            )
+            input_idcs, box_idcs = input_idcs[valid], box_idcs[valid]
+        return input_idcs, box_idcs
+
+    def points_in_polygons(
+        self, points: npt.NDArray[np.float64]
+    ) -> npt.NDArray[np.bool_]:
+        """
+        Determines wether input-points are in polygons of the occupancy map
+        :param points: input-points
+        :return: boolean array of shape (polygons, input-points)
+        """
+        return np.concatenate(
+            [
+                boxes_contain_points(self._box_corners, points),
+                self._polygon_map.points_in_polygons(points),
+            ],
+            axis=0,
+        )
+
+
+def _get_box_corners(
+    geometries: npt.NDArray[np.object_],
+) -> Optional[npt.NDArray[np.float64]]:
+    """
+    Extracts corners of box-shaped geometries (polygons with 4 vertices and no holes).
+    :param geometries: array of geometries
+    :return: corners of shape (geometries, 4, 2) or None if any geometry is not box-shaped
+    """
+    if not np.all(shapely.get_type_id(geometries) == 3):  # polygons
+        return None
+    if np.any(shapely.get_num_interior_rings(geometries) > 0):
+        return None
+    exteriors = shapely.get_exterior_ring(geometries)
+    if not np.all(
+        shapely.get_num_coordinates(exteriors) == 5
+    ):  # closed ring of 4 corners
+        return None
+    return shapely.get_coordinates(exteriors).reshape(len(geometries), 5, 2)[:, :4]
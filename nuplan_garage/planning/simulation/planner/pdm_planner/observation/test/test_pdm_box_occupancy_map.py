@@ -0,0 +1,144 @@
+import unittest
+
+import numpy as np
+import numpy.typing as npt
+import shapely
+
+from nuplan_garage.planning.simulation.planner.pdm_planner.observation.pdm_occupancy_map import (
+    PDMBoxOccupancyMap,
+    PDMOccupancyMap,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_geometry_utils import (
+    boxes_contain_points,
+    boxes_intersect_boxes,
+)
+
+
+def _oriented_box_corners(
+    centers: npt.NDArray[np.float64],
+    headings: npt.NDArray[np.float64],
+    lengths: npt.NDArray[np.float64],
+    widths: npt.NDArray[np.float64],
+) -> npt.NDArray[np.float64]:
+    """
+    Corners of oriented boxes in ring order, as in PDMObservation
+    :return: array of shape (boxes, 4, 2)
+    """
+    half_extent = np.array([[1, 1], [-1, 1], [-1, -1], [1, -1]]) * 0.5
+    local_corners = half_extent[None] * np.stack([lengths, widths], axis=-1)[:, None]
+    cos, sin = np.cos(headings), np.sin(headings)
+    rotation = np.stack([np.stack([cos, -sin], -1), np.stack([sin, cos], -1)], -2)
+    return centers[:, None] + np.einsum("nij,nkj->nki", rotation, local_corners)
+
+
+def _shapely_map(box_corners: npt.NDArray[np.float64]) -> PDMOccupancyMap:
+    """Polygon based occupancy map of the boxes, the reference shapely str-tree path"""
+    tokens = [f"box_{idx}" for idx in range(len(box_corners))]
+    return PDMOccupancyMap(tokens, shapely.creation.polygons(box_corners))
+
+
+def _box_map(box_corners: npt.NDArray[np.float64]) -> PDMBoxOccupancyMap:
+    """Box array occupancy map of the boxes, without other geometries"""
+    tokens = [f"box_{idx}" for idx in range(len(box_corners))]
+    return PDMBoxOccupancyMap(
+        tokens, box_corners, PDMOccupancyMap([], np.array([], dtype=np.object_))
+    )
+
+
+class TestPDMBoxOccupancyMap(unittest.TestCase):
+    """Parity of the box array queries of PDMBoxOccupancyMap with the shapely str-tree of PDMOccupancyMap"""
+
+    def setUp(self) -> None:
+        """Random oriented boxes, plus touching and degenerate boxes with exact coordinates"""
+        rng = np.random.default_rng(0)
+        num_boxes = 200
+        random_corners = _oriented_box_corners(
+            rng.uniform(-30, 30, (num_boxes, 2)),
+            rng.uniform(-np.pi, np.pi, num_boxes),
+            rng.uniform(0.5, 6.0, num_boxes),
+            rng.uniform(0.5, 3.0, num_boxes),
+        )
+
+        def axis_aligned(x_min, y_min, x_max, y_max):
+            return [[x_max, y_max], [x_min, y_max], [x_min, y_min], [x_max, y_min]]
+
+        exact_corners = np.array(
+            [
+                axis_aligned(0, 0, 2, 1),
+                axis_aligned(2, 0, 4, 1),  # shares an edge with box 0
+                axis_aligned(4, 1, 5, 2),  # shares a corner with box 1
+                axis_aligned(10, 0, 10, 3),  # zero length
+                axis_aligned(10, 3, 10, 5),  # zero length, collinear and touching box 3
+                axis_aligned(
+                    10, 6, 10, 8
+                ),  # zero length, collinear and separated from box 4
+                axis_aligned(12, 1, 15, 1),  # zero width
+                axis_aligned(13, 1, 13, 1),  # single point on box 6
+                axis_aligned(14, 4, 14, 4),  # single point
+                [[20, 0], [21, 1], [20, 2], [19, 1]],  # rotated by 45 degrees
+                [[21, 1], [22, 2], [21, 3], [20, 2]],  # shares an edge with box 9
+            ],
+            dtype=np.float64,
+        )
+        self.box_corners = np.concatenate([random_corners, exact_corners], axis=0)
+
+        # random points, and the corners and edge midpoints of the exact boxes (on the boundary)
+        exact_points = np.concatenate(
+            [
+                exact_corners.reshape(-1, 2),
+                (exact_corners + np.roll(exact_corners, -1, axis=1)).reshape(-1, 2) / 2,
+            ]
+        )
+        self.points = np.concatenate(
+            [rng.uniform(-35, 35, (2000, 2)), exact_points], axis=0
+        )
+
+    def test_points_in_polygons(self):
+        """Point-in-box test equals shapely's within, points on the boundary are outside"""
+        expected = _shapely_map(self.box_corners).points_in_polygons(self.points)
+        self.assertTrue(expected.any())
+        np.testing.assert_array_equal(
+            boxes_contain_points(self.box_corners, self.points), expected
+        )
+        np.testing.assert_array_equal(
+            _box_map(self.box_corners).points_in_polygons(self.points), expected
+        )
+
+    def test_boxes_intersect_boxes(self):
+        """Separating axis theorem equals shapely's intersects, touching boxes intersect"""
+        polygons = shapely.creation.polygons(self.box_corners)
+        expected = shapely.intersects(polygons[:, None], polygons[None, :])
+        np.testing.assert_array_equal(
+            boxes_intersect_boxes(self.box_corners, self.box_corners), expected
+        )
+
+    def test_query_intersects(self):
+        """Box queries equal the str-tree query for boxes and for arbitrary geometries"""
+        shapely_map, box_map = _shapely_map(self.box_corners), _box_map(
+            self.box_corners
+        )
+        query_boxes = shapely.creation.polygons(self.box_corners[::3])
+        query_geometries = np.array(
+            [
+                shapely.Point(0, 0).buffer(5.0),
+                shapely.LineString([(-30, -30), (30, 30)]),
+                shapely.Point(13, 1),
+            ],
+            dtype=np.object_,
+        )
+        for geometries in [query_boxes, query_geometries]:
+            expected = shapely_map.query(geometries, predicate="intersects")
+            expected = expected[:, np.lexsort((expected[1], expected[0]))]
+            np.testing.assert_array_equal(
+                box_map.query(geometries, predicate="intersects"), expected
+            )
+
+        for geometry in list(query_boxes[:10]) + list(query_geometries):
+            self.assertEqual(
+                sorted(box_map.intersects(geometry)),
+                sorted(shapely_map.intersects(geometry)),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
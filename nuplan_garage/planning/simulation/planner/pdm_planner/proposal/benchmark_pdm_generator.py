@@ -0,0 +1,46 @@
+import argparse
+import time
+
+import numpy as np
+
+from nuplan_garage.planning.simulation.planner.pdm_planner.proposal.pdm_generator import (
+    PDMGenerator,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.proposal.test.test_pdm_generator import (
+    PROPOSAL_SAMPLING,
+    TRAJECTORY_SAMPLING,
+    SequentialPDMGenerator,
+    build_scenario,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run-time of batched vs sequential proposal generation, parity is tested in test/test_pdm_generator.py"
+    )
+    parser.add_argument("--scenarios", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    generators = {
+        "sequential": SequentialPDMGenerator(TRAJECTORY_SAMPLING, PROPOSAL_SAMPLING),
+        "batched": PDMGenerator(TRAJECTORY_SAMPLING, PROPOSAL_SAMPLING),
+    }
+    run_times = {name: 0.0 for name in generators.keys()}
+
+    for _ in range(args.scenarios):
+        ego_state, observation, proposal_manager = build_scenario(rng)
+        for name, generator in generators.items():
+            start = time.perf_counter()
+            generator.generate_proposals(ego_state, observation, proposal_manager)
+            run_times[name] += time.perf_counter() - start
+
+    for name, run_time in run_times.items():
+        print(
+            f"{name} generation: {run_time / args.scenarios * 1000:.1f} ms / scenario"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,14 @@
 import copy
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import numpy.typing as npt
+import shapely
 from nuplan.common.actor_state.agent import Agent
-from nuplan.common.actor_state.car_footprint import CarFootprint
 from nuplan.common.actor_state.ego_state import EgoState
 from nuplan.common.actor_state.scene_object import SceneObject
-from nuplan.common.actor_state.state_representation import StateSE2, TimePoint
+from nuplan.common.actor_state.state_representation import TimePoint
 from nuplan.common.actor_state.vehicle_parameters import VehicleParameters
-from nuplan.common.geometry.transform import transform
 from nuplan.planning.simulation.trajectory.interpolated_trajectory import (
     InterpolatedTrajectory,
 )
@@ -24,6 +23,8 @@ from nuplan_garage.planning.simulation.planner.pdm_planner.proposal.pdm_proposal
     PDMProposalManager,
 )
 from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_array_representation import (
+    coords_array_to_polygon_array,
+    state_array_to_coords_array,
     state_array_to_ego_states,
 )
 from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_enums import (
@@ -34,6 +35,7 @@ from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_enums impor
 from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_geometry_utils import (
     normalize_angle,
 )
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_path import PDMPath
 
 
 class PDMGenerator:
@@ -95,15 +97,22 @@ class PDMGenerator:
         self._reset(initial_ego_state, observation, proposal_manager)
         self._initialize_time_points()
 
-        # unroll proposals per path, to interpolate along batch-dim
-        lateral_batch_dict = self._get_lateral_batch_dict()
+        # unroll all proposals at once, ordered by path to interpolate along batch-dim
+        proposal_idcs = np.arange(len(self._proposal_manager))
+        self._initialize_states(proposal_idcs)
 
-        for lateral_idx, lateral_batch_idcs in lateral_batch_dict.items():
-            self._initialize_states(lateral_batch_idcs)
-            for time_idx in range(1, self._proposal_sampling.num_poses + 1, 1):
-                self._update_leading_agents(lateral_batch_idcs, time_idx)
-                self._update_idm_states(lateral_batch_idcs, time_idx)
-                self._update_states_se2(lateral_batch_idcs, time_idx)
+        # ego states are only required before updates of the leading agents (run-time)
+        remaining_time_idcs: List[int] = []
+        for time_idx in range(1, self._proposal_sampling.num_poses + 1, 1):
+            self._update_leading_agents(proposal_idcs, time_idx)
+            self._update_idm_states(proposal_idcs, time_idx)
+
+            if ((time_idx + 1) % self._leading_agent_update) == 0:
+                self._update_states_se2(proposal_idcs, [time_idx])
+            else:
+                remaining_time_idcs.append(time_idx)
+
+        self._update_states_se2(proposal_idcs, remaining_time_idcs)
 
         return self._state_array
 
@@ -120,7 +129,7 @@ class PDMGenerator:
             len(self._time_point_list) == self._proposal_sampling.num_poses + 1
         ), "PDMGenerator: Proposals must be generated first!"
 
-        lateral_batch_idcs = [proposal_idx]
+        proposal_idcs = np.array([proposal_idx])
         current_time_point = copy.deepcopy(self._time_point_list[-1])
 
         for time_idx in range(
@@ -131,9 +140,9 @@ class PDMGenerator:
             current_time_point += TimePoint(int(self._sample_interval * 1e6))
             self._time_point_list.append(current_time_point)
 
-            self._update_leading_agents(lateral_batch_idcs, time_idx)
-            self._update_idm_states(lateral_batch_idcs, time_idx)
-            self._update_states_se2(lateral_batch_idcs, time_idx)
+            self._update_leading_agents(proposal_idcs, time_idx)
+            self._update_idm_states(proposal_idcs, time_idx)
+            self._update_states_se2(proposal_idcs, [time_idx])
 
         # convert array representation to list of EgoState class
         ego_states: List[EgoState] = state_array_to_ego_states(
@@ -181,6 +190,22 @@ class PDMGenerator:
             dtype=np.float64,
         )  # progress, velocity, rear-length
 
+        # path and policy indices of proposals
+        self._lateral_idcs: npt.NDArray[np.int64] = np.array(
+            [
+                self._proposal_manager[proposal_idx].lateral_idx
+                for proposal_idx in range(len(self._proposal_manager))
+            ],
+            dtype=np.int64,
+        )
+        self._longitudinal_idcs: npt.NDArray[np.int64] = np.array(
+            [
+                self._proposal_manager[proposal_idx].longitudinal_idx
+                for proposal_idx in range(len(self._proposal_manager))
+            ],
+            dtype=np.int64,
+        )
+
         # reset caches
         self._driving_corridor_cache: Dict[int, Polygon] = {}
 
@@ -195,79 +220,79 @@ class PDMGenerator:
             current_time_point += TimePoint(int(self._sample_interval * 1e6))
             self._time_point_list.append(copy.deepcopy(current_time_point))
 
-    def _initialize_states(self, lateral_batch_idcs: List[int]) -> None:
+    def _initialize_states(self, proposal_idcs: npt.NDArray[np.int64]) -> None:
         """
         Initializes all state arrays for ego, IDM, and leading agent at t=0
-        :param lateral_batch_idcs: list of proposal indices, sharing a path.
+        :param proposal_idcs: array of proposal indices
         """
 
-        # all initial states are identical for shared lateral_idx
-        # thus states are created for lateral_batch_idcs[0] and repeated
-        dummy_proposal_idx = lateral_batch_idcs[0]
-
+        # all initial states are identical for a shared path
+        # thus states are created once per path and repeated
         ego_position = Point(*self._initial_ego_state.rear_axle.point.array)
-
-        ego_progress = self._proposal_manager[dummy_proposal_idx].linestring.project(
-            ego_position
-        )
         ego_velocity = self._initial_ego_state.dynamic_car_state.rear_axle_velocity_2d.x
 
-        self._state_idm_array[
-            lateral_batch_idcs, 0, StateIDMIndex.PROGRESS
-        ] = ego_progress
-        self._state_idm_array[
-            lateral_batch_idcs, 0, StateIDMIndex.VELOCITY
-        ] = ego_velocity
+        for path, path_proposal_idcs in self._get_lateral_batches(proposal_idcs):
+            ego_progress = path.linestring.project(ego_position)
+
+            self._state_idm_array[
+                path_proposal_idcs, 0, StateIDMIndex.PROGRESS
+            ] = ego_progress
+            self._state_idm_array[
+                path_proposal_idcs, 0, StateIDMIndex.VELOCITY
+            ] = ego_velocity
 
-        state_array = self._proposal_manager[dummy_proposal_idx].path.interpolate(
-            [ego_progress], as_array=True
-        )[0]
-        self._state_array[lateral_batch_idcs, 0, StateIndex.STATE_SE2] = state_array
+            state_array = path.interpolate([ego_progress], as_array=True)[0]
+            self._state_array[path_proposal_idcs, 0, StateIndex.STATE_SE2] = state_array
 
-    def _update_states_se2(self, lateral_batch_idcs: List[int], time_idx: int) -> None:
+    def _update_states_se2(
+        self, proposal_idcs: npt.NDArray[np.int64], time_idcs: List[int]
+    ) -> None:
         """
-        Updates state array for ego, at current time-step.
-        :param lateral_batch_idcs: list of proposal indices, sharing a path.
-        :param time_idx: index of unrolling iteration (for proposal/trajectory samples)
+        Updates state array for ego, at given time-steps.
+        :param proposal_idcs: array of proposal indices
+        :param time_idcs: indices of unrolling iterations (for proposal/trajectory samples)
         """
-        assert time_idx > 0, "PDMGenerator: call _initialize_states first!"
-        dummy_proposal_idx = lateral_batch_idcs[0]
-        current_progress = self._state_idm_array[
-            lateral_batch_idcs, time_idx, StateIDMIndex.PROGRESS
-        ]
-        states_se2_array: npt.NDArray[np.float64] = self._proposal_manager[
-            dummy_proposal_idx
-        ].path.interpolate(current_progress, as_array=True)
-        self._state_array[
-            lateral_batch_idcs, time_idx, StateIndex.STATE_SE2
-        ] = states_se2_array
-
-    def _update_idm_states(self, lateral_batch_idcs: List[int], time_idx: int) -> None:
+        if len(time_idcs) == 0:
+            return
+
+        time_idcs = np.asarray(time_idcs, dtype=np.int64)
+        assert np.all(time_idcs > 0), "PDMGenerator: call _initialize_states first!"
+
+        # one interpolation call per path for all proposals and time-steps
+        for path, path_proposal_idcs in self._get_lateral_batches(proposal_idcs):
+            current_progress = self._state_idm_array[
+                path_proposal_idcs[:, None], time_idcs[None, :], StateIDMIndex.PROGRESS
+            ]
+            states_se2_array: npt.NDArray[np.float64] = path.interpolate(
+                current_progress.reshape(-1), as_array=True
+            )
+            self._state_array[
+                path_proposal_idcs[:, None], time_idcs[None, :], StateIndex.STATE_SE2
+            ] = states_se2_array.reshape(*current_progress.shape, -1)
+
+    def _update_idm_states(
+        self, proposal_idcs: npt.NDArray[np.int64], time_idx: int
+    ) -> None:
         """
         Updates idm state array, by propagating policy for one step.
-        :param lateral_batch_idcs: list of proposal indices, sharing a path.
+        :param proposal_idcs: array of proposal indices
         :param time_idx: index of unrolling iteration (for proposal/trajectory samples)
         """
         assert time_idx > 0, "PDMGenerator: call _initialize_states first!"
-        longitudinal_idcs = [
-            self._proposal_manager[proposal_idx].longitudinal_idx
-            for proposal_idx in lateral_batch_idcs
-        ]
         next_idm_states = self._proposal_manager.longitudinal_policies.propagate(
-            self._state_idm_array[lateral_batch_idcs, time_idx - 1],
-            self._leading_agent_array[lateral_batch_idcs, time_idx],
-            longitudinal_idcs,
+            self._state_idm_array[proposal_idcs, time_idx - 1],
+            self._leading_agent_array[proposal_idcs, time_idx],
+            self._longitudinal_idcs[proposal_idcs],
             self._sample_interval,
         )
-        self._state_idm_array[lateral_batch_idcs, time_idx] = next_idm_states
+        self._state_idm_array[proposal_idcs, time_idx] = next_idm_states
 
     def _update_leading_agents(
-        self, lateral_batch_idcs: List[int], time_idx: int
+        self, proposal_idcs: npt.NDArray[np.int64], time_idx: int
     ) -> None:
         """
         Update leading agent state array by searching for agents/obstacles in driving corridor.
-        :param lateral_idx: index indicating the path of proposals
-        :param lateral_batch_idcs: list of proposal indices, sharing a path.
+        :param proposal_idcs: array of proposal indices
         :param time_idx: index of unrolling iteration (for proposal/trajectory samples)
         """
         assert time_idx > 0, "PDMGenerator: call _initialize_states first!"
@@ -277,113 +302,164 @@ class PDMGenerator:
 
         if not update_leading_agent:
             self._leading_agent_array[
-                lateral_batch_idcs, time_idx
-            ] = self._leading_agent_array[lateral_batch_idcs, time_idx - 1]
+                proposal_idcs, time_idx
+            ] = self._leading_agent_array[proposal_idcs, time_idx - 1]
+            return
 
-        else:
-            dummy_proposal_idx = lateral_batch_idcs[0]
+        # order proposals by path, as in the previous per-path unrolling
+        proposal_idcs = proposal_idcs[
+            np.argsort(self._lateral_idcs[proposal_idcs], kind="stable")
+        ]
+        lateral_batches = self._get_lateral_batches(proposal_idcs)
+        num_proposals = len(proposal_idcs)
 
-            leading_agent_array = np.zeros(len(LeadingAgentIndex), dtype=np.float64)
-            intersecting_objects: List[str] = self._get_intersecting_objects(
-                lateral_batch_idcs, time_idx
+        # row of each proposal's path and first row of each path batch
+        path_rows = np.repeat(
+            np.arange(len(lateral_batches)),
+            [len(batch_idcs) for _, batch_idcs in lateral_batches],
+        )
+        batch_start_rows = np.searchsorted(path_rows, path_rows, side="left")
+
+        # collect all leading vehicles for all paths with one query (run-time)
+        occupancy_map = self._observation[time_idx]
+        driving_corridors = np.array(
+            [
+                self._get_driving_corridor(batch_idcs[0])
+                for _, batch_idcs in lateral_batches
+            ],
+            dtype=np.object_,
+        )
+        path_idcs, geometry_idcs = occupancy_map.query(
+            driving_corridors, predicate="intersects"
+        )
+        collided_track_ids = set(self._observation.collided_track_ids)
+        not_collided = np.array(
+            [
+                occupancy_map.tokens[geometry_idx] not in collided_track_ids
+                for geometry_idx in geometry_idcs
+            ],
+            dtype=bool,
+        )
+        path_idcs, geometry_idcs = (
+            path_idcs[not_collided],
+            geometry_idcs[not_collided],
+        )
+
+        # objects along any path, progress of object centroids projected on paths
+        object_geometry_idcs, object_columns = np.unique(
+            geometry_idcs, return_inverse=True
+        )
+        object_tokens: List[str] = [
+            occupancy_map.tokens[geometry_idx] for geometry_idx in object_geometry_idcs
+        ]
+        object_geometries = np.array(
+            [occupancy_map[token] for token in object_tokens], dtype=np.object_
+        )
+        path_linestrings = np.array(
+            [path.linestring for path, _ in lateral_batches], dtype=np.object_
+        )
+        object_progress = np.full(
+            (len(lateral_batches), len(object_tokens)), np.nan, dtype=np.float64
+        )
+        object_centroids = shapely.centroid(object_geometries)
+        object_progress[path_idcs, object_columns] = shapely.line_locate_point(
+            path_linestrings[path_idcs], object_centroids[object_columns]
+        )
+
+        # filter all objects ahead for each proposal individually
+        current_ego_progress = self._state_idm_array[
+            proposal_idcs, time_idx - 1, StateIDMIndex.PROGRESS
+        ]
+        agents_ahead = object_progress[path_rows] > current_ego_progress[:, None]
+        has_agent_ahead = agents_ahead.any(axis=-1)
+
+        # distances of ego's footprint to all objects ahead
+        current_states = self._state_array[proposal_idcs, time_idx - 1]
+        # padded with a column to select from if no object is present
+        relative_distances = np.full(
+            (num_proposals, max(len(object_tokens), 1)), np.inf, dtype=np.float64
+        )
+        ahead_rows, ahead_columns = np.nonzero(agents_ahead)
+        if len(ahead_rows) > 0:
+            ego_polygons = coords_array_to_polygon_array(
+                state_array_to_coords_array(
+                    current_states[has_agent_ahead, None], self._vehicle_parameters
+                )
+            )[:, 0]
+            ego_polygon_rows = np.cumsum(has_agent_ahead) - 1
+            relative_distances[ahead_rows, ahead_columns] = shapely.distance(
+                ego_polygons[ego_polygon_rows[ahead_rows]],
+                object_geometries[ahead_columns],
             )
+        nearest_columns = np.argmin(relative_distances, axis=-1)
+        nearest_distances = relative_distances[
+            np.arange(num_proposals), nearest_columns
+        ]
 
-            # collect all leading vehicles ones for all proposals (run-time)
-            object_progress_dict: Dict[str, float] = {}
-            for object in intersecting_objects:
-                if object not in self._observation.collided_track_ids:
-                    object_progress = self._proposal_manager[
-                        dummy_proposal_idx
-                    ].linestring.project(self._observation[time_idx][object].centroid)
-                    object_progress_dict[object] = object_progress
-
-            # select leading agent for each proposal individually
-            for proposal_idx in lateral_batch_idcs:
-                current_ego_progress = self._state_idm_array[
-                    proposal_idx, time_idx - 1, StateIDMIndex.PROGRESS
-                ]
-
-                # filter all objects ahead
-                agents_ahead: Dict[str, float] = {
-                    agent: progress
-                    for agent, progress in object_progress_dict.items()
-                    if progress > current_ego_progress
-                }
-
-                if len(agents_ahead) > 0:  # red light, object or agent ahead
-                    current_state_se2 = StateSE2(
-                        *self._state_array[
-                            proposal_idx, time_idx - 1, StateIndex.STATE_SE2
-                        ]
-                    )
-                    ego_polygon: Polygon = CarFootprint.build_from_rear_axle(
-                        current_state_se2, self._vehicle_parameters
-                    ).oriented_box.geometry
-
-                    relative_distances = [
-                        ego_polygon.distance(self._observation[time_idx][agent])
-                        for agent in agents_ahead.keys()
-                    ]
-
-                    argmin = np.argmin(relative_distances)
-                    nearest_agent = list(agents_ahead.keys())[argmin]
-
-                    # add rel. distance for red light, object or agent
-                    relative_distance = (
-                        current_ego_progress + relative_distances[argmin]
-                    )
-                    leading_agent_array[LeadingAgentIndex.PROGRESS] = relative_distance
-
-                    # calculate projected velocity if not red light
-                    if self._observation.red_light_token not in nearest_agent:
-                        leading_agent_array[
-                            LeadingAgentIndex.VELOCITY
-                        ] = self._get_leading_agent_velocity(
-                            current_state_se2.heading,
-                            self._observation.unique_objects[nearest_agent],
-                        )
-
-                else:  # nothing ahead, free driving
-                    path_length = self._proposal_manager[proposal_idx].linestring.length
-                    path_rear = self._vehicle_parameters.length / 2
-
-                    leading_agent_array[LeadingAgentIndex.PROGRESS] = path_length
-                    leading_agent_array[LeadingAgentIndex.LENGTH_REAR] = path_rear
-
-                self._leading_agent_array[proposal_idx, time_idx] = leading_agent_array
-
-    @staticmethod
-    def _get_leading_agent_velocity(ego_heading: float, agent: SceneObject) -> float:
-        """
-        Calculates velocity of leading vehicle projected to ego's heading.
-        :param ego_heading: heading angle [rad]
-        :param agent: SceneObject class
-        :return: projected velocity [m/s]
-        """
+        # projected velocity of nearest object, if not red light
+        object_is_red_light, object_speeds, object_headings = self._get_object_states(
+            object_tokens
+        )
+        nearest_is_red_light = object_is_red_light[nearest_columns]
+        relative_headings = normalize_angle(
+            object_headings[nearest_columns] - current_states[:, StateIndex.HEADING]
+        )
+        projected_velocities = object_speeds[nearest_columns] * np.cos(
+            relative_headings
+        )
 
-        if isinstance(agent, Agent):  # dynamic object
-            relative_heading = normalize_angle(agent.center.heading - ego_heading)
-            projected_velocity = transform(
-                StateSE2(agent.velocity.magnitude(), 0, 0),
-                StateSE2(0, 0, relative_heading).as_matrix(),
-            ).x
-        else:  # static object
-            projected_velocity = 0.0
+        # add rel. distance for red light, object or agent, else free driving
+        path_lengths = np.array(
+            [path.linestring.length for path, _ in lateral_batches], dtype=np.float64
+        )[path_rows]
+        leading_agent_array = np.zeros(
+            (num_proposals, len(LeadingAgentIndex)), dtype=np.float64
+        )
+        leading_agent_array[:, LeadingAgentIndex.PROGRESS] = np.where(
+            has_agent_ahead,
+            current_ego_progress + nearest_distances,
+            path_lengths,
+        )
 
-        return projected_velocity
+        # values not set for a proposal are carried over from the previous proposal
+        # on the same path, as in the former sequential loop over each path's batch
+        leading_agent_array[:, LeadingAgentIndex.VELOCITY] = _carry_forward(
+            projected_velocities,
+            has_agent_ahead & ~nearest_is_red_light,
+            batch_start_rows,
+        )
+        leading_agent_array[:, LeadingAgentIndex.LENGTH_REAR] = _carry_forward(
+            np.full(num_proposals, self._vehicle_parameters.length / 2),
+            ~has_agent_ahead,
+            batch_start_rows,
+        )
+
+        self._leading_agent_array[proposal_idcs, time_idx] = leading_agent_array
 
-    def _get_intersecting_objects(
-        self, lateral_batch_idcs: List[int], time_idx: int
-    ) -> List[str]:
+    def _get_object_states(
+        self, object_tokens: List[str]
+    ) -> Tuple[npt.NDArray[np.bool_], npt.NDArray[np.float64], npt.NDArray[np.float64]]:
         """
-        Returns and caches all intersecting objects for the proposals path and time-step.
-        :param lateral_batch_idcs: list of proposal indices, sharing a path
-        :param time_idx: index indicating the path of proposals
-        :return: list of object tokens
+        Collects red light indicator, speed and heading of objects for the leading agent velocity.
+        Arrays are padded to one entry, if no object is present.
+        :param object_tokens: list of object tokens
+        :return: tuple of red light indicators, speeds [m/s] (zero for static objects) and headings [rad]
         """
-        dummy_proposal_idx = lateral_batch_idcs[0]
-        driving_corridor: Polygon = self._get_driving_corridor(dummy_proposal_idx)
-        return self._observation[time_idx].intersects(driving_corridor)
+        num_objects = max(len(object_tokens), 1)
+        is_red_light = np.zeros(num_objects, dtype=bool)
+        speeds = np.zeros(num_objects, dtype=np.float64)
+        headings = np.zeros(num_objects, dtype=np.float64)
+
+        for object_idx, token in enumerate(object_tokens):
+            if self._observation.red_light_token in token:
+                is_red_light[object_idx] = True
+                continue
+            agent: SceneObject = self._observation.unique_objects[token]
+            if isinstance(agent, Agent):  # dynamic object
+                speeds[object_idx] = agent.velocity.magnitude()
+                headings[object_idx] = agent.center.heading
+
+        return is_red_light, speeds, headings
 
     def _get_driving_corridor(self, proposal_idx: int) -> Polygon:
         """
@@ -410,23 +486,46 @@ class PDMGenerator:
                 self._vehicle_parameters.width / 2, cap_style=CAP_STYLE.square
             )
 
+            # corridor is queried every update step, prepare once (run-time)
+            shapely.prepare(expanded_path)
             self._driving_corridor_cache[lateral_idx] = expanded_path
 
         return self._driving_corridor_cache[lateral_idx]
 
-    def _get_lateral_batch_dict(self) -> Dict[int, List[int]]:
+    def _get_lateral_batches(
+        self, proposal_idcs: npt.NDArray[np.int64]
+    ) -> List[Tuple[PDMPath, npt.NDArray[np.int64]]]:
         """
-        Creates a dictionary for lateral paths and their proposal indices.
-        :return: dictionary of lateral and proposal indices
+        Groups proposal indices by their path, in order of appearance.
+        :param proposal_idcs: array of proposal indices
+        :return: list of paths and the proposal indices sharing each path
         """
-        lateral_batch_dict: Dict[int, List[int]] = {}
-
-        for proposal_idx in range(len(self._proposal_manager)):
-            lateral_idx = self._proposal_manager[proposal_idx].lateral_idx
-
-            if lateral_idx not in lateral_batch_dict.keys():
-                lateral_batch_dict[lateral_idx] = [proposal_idx]
-            else:
-                lateral_batch_dict[lateral_idx].append(proposal_idx)
+        lateral_idcs = self._lateral_idcs[proposal_idcs]
+        unique_lateral_idcs, first_idcs = np.unique(lateral_idcs, return_index=True)
+
+        lateral_batches: List[Tuple[PDMPath, npt.NDArray[np.int64]]] = []
+        for lateral_idx in unique_lateral_idcs[np.argsort(first_idcs)]:
+            batch_idcs = proposal_idcs[lateral_idcs == lateral_idx]
+            lateral_batches.append(
+                (self._proposal_manager[batch_idcs[0]].path, batch_idcs)
+            )
 
-        return lateral_batch_dict
+        return lateral_batches
+
+
+def _carry_forward(
+    values: npt.NDArray[np.float64],
+    is_set: npt.NDArray[np.bool_],
+    batch_start_rows: npt.NDArray[np.int64],
+) -> npt.NDArray[np.float64]:
+    """
+    Fills each row with the value of the last row that was set within its batch, or zero.
+    :param values: values of shape (rows,)
+    :param is_set: boolean mask of rows that set their value
+    :param batch_start_rows: first row of the batch of each row
+    :return: filled values of shape (rows,)
+    """
+    rows = np.arange(len(values))
+    last_set_rows = np.maximum.accumulate(np.where(is_set, rows, -1))
+    valid = last_set_rows >= batch_start_rows
+    return np.where(valid, values[np.maximum(last_set_rows, 0)], 0.0)
@@ -0,0 +1,385 @@
+import unittest
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+import numpy as np
+import numpy.typing as npt
+from nuplan.common.actor_state.agent import Agent
+from nuplan.common.actor_state.car_footprint import CarFootprint
+from nuplan.common.actor_state.ego_state import EgoState
+from nuplan.common.actor_state.oriented_box import OrientedBox
+from nuplan.common.actor_state.scene_object import SceneObject, SceneObjectMetadata
+from nuplan.common.actor_state.state_representation import (
+    StateSE2,
+    StateVector2D,
+    TimePoint,
+)
+from nuplan.common.actor_state.static_object import StaticObject
+from nuplan.common.actor_state.tracked_objects import TrackedObjects
+from nuplan.common.actor_state.tracked_objects_types import TrackedObjectType
+from nuplan.common.actor_state.vehicle_parameters import get_pacifica_parameters
+from nuplan.common.geometry.transform import transform
+from nuplan.common.maps.maps_datatypes import (
+    TrafficLightStatusData,
+    TrafficLightStatusType,
+)
+from nuplan.planning.simulation.observation.observation_type import DetectionsTracks
+from nuplan.planning.simulation.trajectory.trajectory_sampling import TrajectorySampling
+from shapely.geometry import Polygon
+
+from nuplan_garage.planning.simulation.planner.pdm_planner.observation.pdm_observation import (
+    PDMObservation,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.proposal.batch_idm_policy import (
+    BatchIDMPolicy,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.proposal.pdm_generator import (
+    PDMGenerator,
+    _carry_forward,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.proposal.pdm_proposal import (
+    PDMProposalManager,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_enums import (
+    LeadingAgentIndex,
+    StateIDMIndex,
+    StateIndex,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_geometry_utils import (
+    normalize_angle,
+    parallel_discrete_path,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_path import PDMPath
+
+# parameters of pdm_closed_planner.yaml
+TRAJECTORY_SAMPLING = TrajectorySampling(num_poses=80, interval_length=0.1)
+PROPOSAL_SAMPLING = TrajectorySampling(num_poses=40, interval_length=0.1)
+LATERAL_OFFSETS = [-1.0, 1.0]
+MAP_RADIUS = 50.0
+
+
+class SequentialPDMGenerator(PDMGenerator):
+    """
+    Reference of PDMGenerator before batching, which unrolls the proposals of each
+    path separately and selects the leading agent per proposal.
+    """
+
+    # resets the leading agent of each proposal, which the original generator did not
+    _reset_leading_agent = False
+
+    def generate_proposals(
+        self,
+        initial_ego_state: EgoState,
+        observation: PDMObservation,
+        proposal_manager: PDMProposalManager,
+    ) -> npt.NDArray[np.float64]:
+        """Inherited, see superclass."""
+        self._reset(initial_ego_state, observation, proposal_manager)
+        self._initialize_time_points()
+
+        for _, lateral_batch_idcs in self._get_lateral_batches(
+            np.arange(len(self._proposal_manager))
+        ):
+            self._initialize_states(lateral_batch_idcs)
+            for time_idx in range(1, self._proposal_sampling.num_poses + 1, 1):
+                self._update_leading_agents(lateral_batch_idcs, time_idx)
+                self._update_idm_states(lateral_batch_idcs, time_idx)
+                self._update_states_se2(lateral_batch_idcs, [time_idx])
+
+        return self._state_array
+
+    def _update_states_se2(
+        self, lateral_batch_idcs: npt.NDArray[np.int64], time_idcs: List[int]
+    ) -> None:
+        """Inherited, see superclass."""
+        path = self._proposal_manager[lateral_batch_idcs[0]].path
+        for time_idx in time_idcs:
+            current_progress = self._state_idm_array[
+                lateral_batch_idcs, time_idx, StateIDMIndex.PROGRESS
+            ]
+            self._state_array[
+                lateral_batch_idcs, time_idx, StateIndex.STATE_SE2
+            ] = path.interpolate(current_progress, as_array=True)
+
+    def _update_leading_agents(
+        self, lateral_batch_idcs: npt.NDArray[np.int64], time_idx: int
+    ) -> None:
+        """Inherited, see superclass."""
+        if (time_idx % self._leading_agent_update) != 0:
+            self._leading_agent_array[
+                lateral_batch_idcs, time_idx
+            ] = self._leading_agent_array[lateral_batch_idcs, time_idx - 1]
+            return
+
+        dummy_proposal_idx = lateral_batch_idcs[0]
+        driving_corridor: Polygon = self._get_driving_corridor(dummy_proposal_idx)
+        intersecting_objects: List[str] = self._observation[time_idx].intersects(
+            driving_corridor
+        )
+
+        object_progress_dict: Dict[str, float] = {}
+        for object in intersecting_objects:
+            if object not in self._observation.collided_track_ids:
+                object_progress_dict[object] = self._proposal_manager[
+                    dummy_proposal_idx
+                ].linestring.project(self._observation[time_idx][object].centroid)
+
+        # shared by all proposals of the path, values are not reset between proposals
+        leading_agent_array = np.zeros(len(LeadingAgentIndex), dtype=np.float64)
+        for proposal_idx in lateral_batch_idcs:
+            if self._reset_leading_agent:
+                leading_agent_array = np.zeros_like(leading_agent_array)
+            current_ego_progress = self._state_idm_array[
+                proposal_idx, time_idx - 1, StateIDMIndex.PROGRESS
+            ]
+            agents_ahead: Dict[str, float] = {
+                agent: progress
+                for agent, progress in object_progress_dict.items()
+                if progress > current_ego_progress
+            }
+
+            if len(agents_ahead) > 0:  # red light, object or agent ahead
+                current_state_se2 = StateSE2(
+                    *self._state_array[proposal_idx, time_idx - 1, StateIndex.STATE_SE2]
+                )
+                ego_polygon: Polygon = CarFootprint.build_from_rear_axle(
+                    current_state_se2, self._vehicle_parameters
+                ).oriented_box.geometry
+                relative_distances = [
+                    ego_polygon.distance(self._observation[time_idx][agent])
+                    for agent in agents_ahead.keys()
+                ]
+                argmin = np.argmin(relative_distances)
+                nearest_agent = list(agents_ahead.keys())[argmin]
+
+                leading_agent_array[LeadingAgentIndex.PROGRESS] = (
+                    current_ego_progress + relative_distances[argmin]
+                )
+                if self._observation.red_light_token not in nearest_agent:
+                    leading_agent_array[
+                        LeadingAgentIndex.VELOCITY
+                    ] = self._get_leading_agent_velocity(
+                        current_state_se2.heading,
+                        self._observation.unique_objects[nearest_agent],
+                    )
+
+            else:  # nothing ahead, free driving
+                leading_agent_array[
+                    LeadingAgentIndex.PROGRESS
+                ] = self._proposal_manager[proposal_idx].linestring.length
+                leading_agent_array[LeadingAgentIndex.LENGTH_REAR] = (
+                    self._vehicle_parameters.length / 2
+                )
+
+            self._leading_agent_array[proposal_idx, time_idx] = leading_agent_array
+
+    @staticmethod
+    def _get_leading_agent_velocity(ego_heading: float, agent: SceneObject) -> float:
+        """
+        Calculates velocity of leading vehicle projected to ego's heading.
+        :param ego_heading: heading angle [rad]
+        :param agent: SceneObject class
+        :return: projected velocity [m/s]
+        """
+        if not isinstance(agent, Agent):  # static object
+            return 0.0
+        relative_heading = normalize_angle(agent.center.heading - ego_heading)
+        return transform(
+            StateSE2(agent.velocity.magnitude(), 0, 0),
+            StateSE2(0, 0, relative_heading).as_matrix(),
+        ).x
+
+
+def build_scenario(
+    rng: np.random.Generator,
+) -> Tuple[EgoState, PDMObservation, PDMProposalManager]:
+    """
+    Creates a random scenario along a curved centerline, with static objects, agents
+    in and next to the driving corridors, partly oncoming, and optionally a red light ahead.
+    :param rng: random generator
+    :return: tuple of ego state, updated observation and updated proposal manager
+    """
+    vehicle_parameters = get_pacifica_parameters()
+
+    # centerline and proposal paths as in AbstractPDMClosedPlanner
+    x = np.linspace(-20.0, 150.0, 341)
+    y = rng.uniform(-0.003, 0.003) * x**2
+    heading = np.arctan2(np.gradient(y), np.gradient(x))
+    centerline = [StateSE2(*pose) for pose in zip(x, y, heading)]
+    proposal_paths = [PDMPath(centerline)] + [
+        PDMPath(parallel_discrete_path(discrete_path=centerline, offset=offset))
+        for offset in LATERAL_OFFSETS
+    ]
+    proposal_manager = PDMProposalManager(
+        lateral_proposals=proposal_paths,
+        longitudinal_policies=BatchIDMPolicy(
+            fallback_target_velocity=15.0,
+            speed_limit_fraction=[0.2, 0.4, 0.6, 0.8, 1.0],
+            min_gap_to_lead_agent=1.0,
+            headway_time=1.5,
+            accel_max=1.5,
+            decel_max=3.0,
+        ),
+    )
+    proposal_manager.update(rng.uniform(8.0, 20.0))
+
+    ego_state = EgoState.build_from_rear_axle(
+        rear_axle_pose=StateSE2(0.0, rng.uniform(-0.5, 0.5), 0.0),
+        rear_axle_velocity_2d=StateVector2D(rng.uniform(0.0, 15.0), 0.0),
+        rear_axle_acceleration_2d=StateVector2D(0.0, 0.0),
+        tire_steering_angle=0.0,
+        time_point=TimePoint(0),
+        vehicle_parameters=vehicle_parameters,
+    )
+
+    # objects close to the centerline, some overlapping ego (collided)
+    tracked_objects = []
+    num_static, num_agents = rng.integers(0, 8), rng.integers(0, 20)
+    for object_idx in range(num_static + num_agents):
+        object_x = rng.uniform(-5.0, 90.0)
+        center = StateSE2(
+            object_x,
+            np.interp(object_x, x, y) + rng.uniform(-6.0, 6.0),
+            np.interp(object_x, x, heading) + rng.uniform(-0.5, 0.5),
+        )
+        metadata = SceneObjectMetadata(
+            timestamp_us=0,
+            token=f"token_{object_idx}",
+            track_id=object_idx,
+            track_token=f"track_{object_idx}",
+        )
+        if object_idx < num_static:
+            tracked_objects.append(
+                StaticObject(
+                    tracked_object_type=TrackedObjectType.BARRIER,
+                    oriented_box=OrientedBox(center, 1.0, 2.0, 1.0),
+                    metadata=metadata,
+                )
+            )
+        else:
+            if rng.random() < 0.5:  # oncoming, passed by faster proposals first
+                center = StateSE2(center.x, center.y, center.heading + np.pi)
+            speed = rng.uniform(0.0, 12.0)
+            tracked_objects.append(
+                Agent(
+                    tracked_object_type=TrackedObjectType.VEHICLE,
+                    oriented_box=OrientedBox(center, 4.5, 2.0, 1.5),
+                    velocity=StateVector2D(
+                        speed * np.cos(center.heading), speed * np.sin(center.heading)
+                    ),
+                    metadata=metadata,
+                )
+            )
+
+    # red light on a lane connector of the route
+    traffic_light_data, route_lane_dict = [], {}
+    if rng.random() < 0.5:
+        start = rng.uniform(10.0, 60.0)
+        lane_connector_id = 1
+        traffic_light_data.append(
+            TrafficLightStatusData(
+                status=TrafficLightStatusType.RED,
+                lane_connector_id=lane_connector_id,
+                timestamp=0,
+            )
+        )
+        route_lane_dict[str(lane_connector_id)] = SimpleNamespace(
+            polygon=proposal_paths[0].substring(start, start + 10.0).buffer(2.0)
+        )
+
+    observation = PDMObservation(TRAJECTORY_SAMPLING, PROPOSAL_SAMPLING, MAP_RADIUS)
+    observation.update(
+        ego_state,
+        DetectionsTracks(TrackedObjects(tracked_objects)),
+        traffic_light_data,
+        route_lane_dict,
+    )
+    return ego_state, observation, proposal_manager
+
+
+NUM_SCENARIOS = 30
+# seed of the scenarios, three of which carry leading agent values between proposals
+SCENARIO_SEED = 15
+
+
+class ResetPDMGenerator(SequentialPDMGenerator):
+    """Sequential reference without carrying leading agent values between proposals"""
+
+    _reset_leading_agent = True
+
+
+class TestPDMGenerator(unittest.TestCase):
+    """Parity of the batched PDMGenerator with the sequential reference"""
+
+    def setUp(self) -> None:
+        """Batched and sequential generators with the closed planner sampling"""
+        self.generator = PDMGenerator(TRAJECTORY_SAMPLING, PROPOSAL_SAMPLING)
+        self.reference_generator = SequentialPDMGenerator(
+            TRAJECTORY_SAMPLING, PROPOSAL_SAMPLING
+        )
+        self.reset_generator = ResetPDMGenerator(TRAJECTORY_SAMPLING, PROPOSAL_SAMPLING)
+
+    def test_generate_proposals(self) -> None:
+        """
+        Proposals, leading agents and the trajectory of a proposal match the reference
+        on random scenarios, including the leading agent values that proposals carry
+        forward from the previous proposal of their path
+        """
+        rng = np.random.default_rng(SCENARIO_SEED)
+        num_carried_scenarios = 0
+        for _ in range(NUM_SCENARIOS):
+            ego_state, observation, proposal_manager = build_scenario(rng)
+            best_proposal_idx = int(rng.integers(0, len(proposal_manager)))
+
+            outputs = []
+            for generator in [self.generator, self.reference_generator]:
+                proposals = generator.generate_proposals(
+                    ego_state, observation, proposal_manager
+                ).copy()
+                leading_agents = generator._leading_agent_array[
+                    :, : PROPOSAL_SAMPLING.num_poses + 1
+                ].copy()
+                generator.generate_trajectory(best_proposal_idx)
+                trajectory = generator._state_array[best_proposal_idx].copy()
+                outputs.append((proposals, leading_agents, trajectory))
+
+            for array, reference_array in zip(*outputs):
+                np.testing.assert_allclose(array, reference_array, rtol=0, atol=1e-9)
+
+            reset_proposals = self.reset_generator.generate_proposals(
+                ego_state, observation, proposal_manager
+            ).copy()
+            reset_leading_agents = self.reset_generator._leading_agent_array[
+                :, : PROPOSAL_SAMPLING.num_poses + 1
+            ]
+            if not (
+                np.array_equal(outputs[1][0], reset_proposals)
+                and np.array_equal(outputs[1][1], reset_leading_agents)
+            ):
+                num_carried_scenarios += 1
+
+        # the scenarios cover the carried values, which a reset would change
+        self.assertGreater(num_carried_scenarios, 0)
+
+    def test_carry_forward(self) -> None:
+        """Rows that are not set take the last set value of their batch, or zero"""
+        rng = np.random.default_rng(0)
+        batch_sizes = [5, 1, 5, 3]
+        values = rng.normal(size=sum(batch_sizes))
+        is_set = rng.random(len(values)) < 0.4
+        batch_start_rows = np.repeat(np.cumsum([0] + batch_sizes[:-1]), batch_sizes)
+
+        expected = np.zeros_like(values)
+        for row in range(len(values)):
+            if is_set[row]:
+                expected[row] = values[row]
+            elif row > batch_start_rows[row]:
+                expected[row] = expected[row - 1]
+
+        np.testing.assert_array_equal(
+            _carry_forward(values, is_set, batch_start_rows), expected
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Optional
 
 import numpy as np
@@ -29,115 +30,42 @@ max_abs_lon_jerk = 4.13  # [m/s^3]
 # (6) ego_yaw_rate_metric
 max_abs_yaw_rate = 0.95  # [rad/s]
 
+# decimal precision of filtered signals
+COMFORT_DECIMALS = 8
 
-def _extract_ego_acceleration(
-    states: npt.NDArray[np.float64],
-    acceleration_coordinate: str,
-    decimals: int = 8,
-    poly_order: int = 2,
-    window_length: int = 8,
-) -> npt.NDArray[np.float32]:
+
+@lru_cache(maxsize=32)
+def _savgol_operator(
+    n_time: int,
+    window_length: int,
+    poly_order: int,
+    deriv_order: int = 0,
+    delta: float = 1.0,
+) -> npt.NDArray[np.float64]:
     """
-    Extract acceleration of ego pose in simulation history over batch-dim
-    :param states: array representation of ego state values
-    :param acceleration_coordinate: string of axis to extract
-    :param decimals: decimal precision, defaults to 8
-    :param poly_order: polynomial order, defaults to 2
-    :param window_length: window size for extraction, defaults to 8
-    :raises ValueError: when coordinate not available
-    :return: array containing acceleration values
+    Linear operator of scipy's Savitzky-Golay filter (incl. polynomial edge handling) for fixed length.
+    Applying the operator along the time-dim is equivalent to savgol_filter(..., axis=-1).
+    :param n_time: length of time dim
+    :param window_length: window size of filter
+    :param poly_order: polynomial order
+    :param deriv_order: order of derivative, defaults to 0
+    :param delta: spacing of samples, defaults to 1.0
+    :return: operator of shape (n_time, n_time)
     """
+    if not (poly_order < window_length):
+        raise ValueError(f"{poly_order} < {window_length} does not hold!")
 
-    n_batch, n_time, n_states = states.shape
-    if acceleration_coordinate == "x":
-        acceleration: npt.NDArray[np.float64] = states[..., StateIndex.ACCELERATION_X]
-
-    elif acceleration_coordinate == "y":
-        acceleration: npt.NDArray[np.float64] = states[..., StateIndex.ACCELERATION_Y]
-
-    elif acceleration_coordinate == "magnitude":
-        acceleration: npt.NDArray[np.float64] = np.hypot(
-            states[..., StateIndex.ACCELERATION_X],
-            states[..., StateIndex.ACCELERATION_Y],
-        )
-    else:
-        raise ValueError(
-            f"acceleration_coordinate option: {acceleration_coordinate} not available. "
-            f"Available options are: x, y or magnitude"
-        )
-
-    acceleration = savgol_filter(
-        acceleration,
+    # filter response to unit impulses, column j is the response to an impulse at j
+    operator: npt.NDArray[np.float64] = savgol_filter(
+        np.eye(n_time, dtype=np.float64),
         polyorder=poly_order,
-        window_length=min(window_length, n_time),
-        axis=-1,
-    )
-    acceleration = np.round(acceleration, decimals=decimals)
-    return acceleration
-
-
-def _extract_ego_jerk(
-    states: npt.NDArray[np.float64],
-    acceleration_coordinate: str,
-    time_steps_s: npt.NDArray[np.float64],
-    decimals: int = 8,
-    deriv_order: int = 1,
-    poly_order: int = 2,
-    window_length: int = 15,
-) -> npt.NDArray[np.float32]:
-    """
-    Extract jerk of ego pose in simulation history over batch-dim
-    :param states: array representation of ego state values
-    :param acceleration_coordinate: string of axis to extract
-    :param time_steps_s: time steps [s] of time dim
-    :param decimals: decimal precision, defaults to 8
-    :param deriv_order: order of derivative, defaults to 1
-    :param poly_order: polynomial order, defaults to 2
-    :param window_length: window size for extraction, defaults to 15
-    :return: array containing jerk values
-    """
-    n_batch, n_time, n_states = states.shape
-    ego_acceleration = _extract_ego_acceleration(
-        states, acceleration_coordinate=acceleration_coordinate
-    )
-    jerk = _approximate_derivatives(
-        ego_acceleration,
-        time_steps_s,
-        deriv_order=deriv_order,
-        poly_order=poly_order,
-        window_length=min(window_length, n_time),
+        window_length=window_length,
+        deriv=deriv_order,
+        delta=delta,
+        axis=0,
     )
-    jerk = np.round(jerk, decimals=decimals)
-    return jerk
-
-
-def _extract_ego_yaw_rate(
-    states: npt.NDArray[np.float64],
-    time_steps_s: npt.NDArray[np.float64],
-    deriv_order: int = 1,
-    poly_order: int = 2,
-    decimals: int = 8,
-    window_length: int = 15,
-) -> npt.NDArray[np.float32]:
-    """
-    Extract yaw-rate of simulation history over batch-dim
-    :param states: array representation of ego state values
-    :param time_steps_s: time steps [s] of time dim
-    :param deriv_order: order of derivative, defaults to 1
-    :param poly_order: polynomial order, defaults to 2
-    :param decimals:  decimal precision, defaults to 8
-    :param window_length: window size for extraction, defaults to 15
-    :return: array containing ego's yaw rate
-    """
-    ego_headings = states[..., StateIndex.HEADING]
-    ego_yaw_rate = _approximate_derivatives(
-        _phase_unwrap(ego_headings),
-        time_steps_s,
-        deriv_order=deriv_order,
-        poly_order=poly_order,
-    )  # convert to seconds
-    ego_yaw_rate = np.round(ego_yaw_rate, decimals=decimals)
-    return ego_yaw_rate
+    operator.setflags(write=False)
+    return operator
 
 
 def _phase_unwrap(headings: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
@@ -163,48 +91,17 @@ def _phase_unwrap(headings: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
     return unwrapped
 
 
-def _approximate_derivatives(
-    y: npt.NDArray[np.float32],
-    x: npt.NDArray[np.float32],
-    window_length: int = 5,
-    poly_order: int = 2,
-    deriv_order: int = 1,
-    axis: int = -1,
-) -> npt.NDArray[np.float32]:
+def _get_time_delta(time_steps_s: npt.NDArray[np.float64]) -> float:
     """
-    Given two equal-length sequences y and x, compute an approximation to the n-th
-    derivative of some function interpolating the (x, y) data points, and return its
-    values at the x's.  We assume the x's are increasing and equally-spaced.
-    :param y: The dependent variable (say of length n)
-    :param x: The independent variable (must have the same length n).  Must be strictly
-        increasing and equally-spaced.
-    :param window_length: The order (default 5) of the Savitsky-Golay filter used.
-        (Ignored if the x's are not equally-spaced.)  Must be odd and at least 3
-    :param poly_order: The degree (default 2) of the filter polynomial used.  Must
-        be less than the window_length
-    :param deriv_order: The order of derivative to compute (default 1)
-    :param axis: The axis of the array x along which the filter is to be applied. Default is -1.
-    :return Derivatives.
+    Mean spacing of equally spaced time-steps.
+    :param time_steps_s: time steps [s] of time dim, strictly increasing
+    :raises RuntimeError: when time steps are not increasing
+    :return: time delta [s]
     """
-    window_length = min(window_length, len(x))
-
-    if not (poly_order < window_length):
-        raise ValueError(f"{poly_order} < {window_length} does not hold!")
-
-    dx = np.diff(x, axis=-1)
+    dx = np.diff(time_steps_s, axis=-1)
     if not (dx > 0).all():
         raise RuntimeError("dx is not monotonically increasing!")
-
-    dx = dx.mean()
-    derivative: npt.NDArray[np.float32] = savgol_filter(
-        y,
-        polyorder=poly_order,
-        window_length=window_length,
-        deriv=deriv_order,
-        delta=dx,
-        axis=axis,
-    )
-    return derivative
+    return float(dx.mean())
 
 
 def _within_bound(
@@ -226,143 +123,86 @@ def _within_bound(
     return np.all(metric_within_bound, axis=-1)
 
 
-def _compute_lon_acceleration(
-    states: npt.NDArray[np.float64], time_steps_s: npt.NDArray[np.float64]
-) -> npt.NDArray[np.bool_]:
-    """
-    Compute longitudinal acceleration over batch-dim of simulated proposals
-    :param states: array representation of ego state values
-    :param time_steps_s: time steps [s] of time dim
-    :return: longitudinal acceleration within bound
-    """
-    n_batch, n_time, n_states = states.shape
-    lon_acceleration = _extract_ego_acceleration(
-        states, acceleration_coordinate="x", window_length=n_time
-    )
-    return _within_bound(
-        lon_acceleration, min_bound=min_lon_accel, max_bound=max_lon_accel
-    )
-
-
-def _compute_lat_acceleration(
-    states: npt.NDArray[np.float64], time_steps_s: npt.NDArray[np.float64]
-) -> npt.NDArray[np.bool_]:
-    """
-    Compute lateral acceleration over batch-dim of simulated proposals
-    :param states: array representation of ego state values
-    :param time_steps_s: time steps [s] of time dim
-    :return: lateral acceleration within bound
-    """
-    n_batch, n_time, n_states = states.shape
-    lat_acceleration = _extract_ego_acceleration(
-        states, acceleration_coordinate="y", window_length=n_time
-    )
-    return _within_bound(
-        lat_acceleration, min_bound=-max_abs_lat_accel, max_bound=max_abs_lat_accel
-    )
-
-
-def _compute_jerk_metric(
-    states: npt.NDArray[np.float64], time_steps_s: npt.NDArray[np.float64]
-) -> npt.NDArray[np.bool_]:
-    """
-    Compute absolute jerk over batch-dim of simulated proposals
-    :param states: array representation of ego state values
-    :param time_steps_s: time steps [s] of time dim
-    :return: absolute jerk within bound
-    """
-    n_batch, n_time, n_states = states.shape
-    jerk_metric = _extract_ego_jerk(
-        states,
-        acceleration_coordinate="magnitude",
-        time_steps_s=time_steps_s,
-        window_length=n_time,
-    )
-    return _within_bound(
-        jerk_metric, min_bound=-max_abs_mag_jerk, max_bound=max_abs_mag_jerk
-    )
-
-
-def _compute_lon_jerk_metric(
-    states: npt.NDArray[np.float64], time_steps_s: npt.NDArray[np.float64]
-) -> npt.NDArray[np.bool_]:
-    """
-    Compute longitudinal jerk over batch-dim of simulated proposals
-    :param states: array representation of ego state values
-    :param time_steps_s: time steps [s] of time dim
-    :return: longitudinal jerk within bound
-    """
-    n_batch, n_time, n_states = states.shape
-    lon_jerk_metric = _extract_ego_jerk(
-        states,
-        acceleration_coordinate="x",
-        time_steps_s=time_steps_s,
-        window_length=n_time,
-    )
-    return _within_bound(
-        lon_jerk_metric, min_bound=-max_abs_lon_jerk, max_bound=max_abs_lon_jerk
-    )
-
-
-def _compute_yaw_accel(
-    states: npt.NDArray[np.float64], time_steps_s: npt.NDArray[np.float64]
-) -> npt.NDArray[np.bool_]:
-    """
-    Compute acceleration of yaw-angle over batch-dim of simulated proposals
-    :param states: array representation of ego state values
-    :param time_steps_s: time steps [s] of time dim
-    :return: acceleration of yaw-angle within bound
-    """
-    n_batch, n_time, n_states = states.shape
-    yaw_accel_metric = _extract_ego_yaw_rate(
-        states, time_steps_s, deriv_order=2, poly_order=3, window_length=n_time
-    )
-    return _within_bound(
-        yaw_accel_metric, min_bound=-max_abs_yaw_accel, max_bound=max_abs_yaw_accel
-    )
-
-
-def _compute_yaw_rate(
-    states: npt.NDArray[np.float64], time_steps_s: npt.NDArray[np.float64]
-) -> npt.NDArray[np.bool_]:
-    """
-    Compute velocity of yaw-angle over batch-dim of simulated proposals
-    :param states: array representation of ego state values
-    :param time_steps_s: time steps [s] of time dim
-    :return: velocity of yaw-angle within bound
-    """
-    n_batch, n_time, n_states = states.shape
-    yaw_rate_metric = _extract_ego_yaw_rate(states, time_steps_s, window_length=n_time)
-    return _within_bound(
-        yaw_rate_metric, min_bound=-max_abs_yaw_rate, max_bound=max_abs_yaw_rate
-    )
-
-
 def ego_is_comfortable(
     states: npt.NDArray[np.float64], time_point_s: npt.NDArray[np.float64]
 ) -> npt.NDArray[np.bool_]:
     """
-    Accumulates all within-bound comfortability metrics
+    Accumulates all within-bound comfortability metrics.
+    All Savitzky-Golay filters are applied as precomputed linear operators, in one batched
+    product for acceleration and yaw signals and one for jerk, over all proposals.
     :param states: array representation of ego state values
     :param time_point_s: time steps [s] of time dim
-    :return: _description_
+    :return: boolean array of shape (proposals, metrics), wether metrics are within bounds
     """
     n_batch, n_time, n_states = states.shape
     assert n_time == len(time_point_s)
     assert n_states == StateIndex.size()
 
-    comfort_metric_functions = [
-        _compute_lon_acceleration,
-        _compute_lat_acceleration,
-        _compute_jerk_metric,
-        _compute_lon_jerk_metric,
-        _compute_yaw_accel,
-        _compute_yaw_rate,
-    ]
-    results: npt.NDArray[np.bool_] = np.zeros(
-        (n_batch, len(comfort_metric_functions)), dtype=np.bool_
+    delta = _get_time_delta(time_point_s)
+
+    # (1) filter signals, shape (batch, signals, time)
+    accel_x = states[..., StateIndex.ACCELERATION_X]
+    accel_y = states[..., StateIndex.ACCELERATION_Y]
+    accel_magnitude = np.hypot(accel_x, accel_y)
+    headings = _phase_unwrap(states[..., StateIndex.HEADING])
+
+    signals = np.stack(
+        [accel_x, accel_y, accel_magnitude, accel_x, headings, headings], axis=1
+    )
+    operators = np.stack(
+        [
+            # longitudinal and lateral acceleration
+            _savgol_operator(n_time, n_time, 2),
+            _savgol_operator(n_time, n_time, 2),
+            # acceleration magnitude and longitudinal acceleration, for jerk metrics
+            _savgol_operator(n_time, min(8, n_time), 2),
+            _savgol_operator(n_time, min(8, n_time), 2),
+            # yaw acceleration and yaw rate
+            _savgol_operator(n_time, min(5, n_time), 3, 2, delta),
+            _savgol_operator(n_time, min(5, n_time), 2, 1, delta),
+        ],
+        axis=0,
+    )
+    filtered = np.round(
+        np.einsum("kts,bks->bkt", operators, signals), decimals=COMFORT_DECIMALS
+    )
+
+    # (2) jerk of filtered accelerations, shape (batch, 2, time)
+    jerk = np.round(
+        np.einsum(
+            "ts,bks->bkt",
+            _savgol_operator(n_time, n_time, 2, 1, delta),
+            filtered[:, 2:4],
+        ),
+        decimals=COMFORT_DECIMALS,
+    )
+
+    results: npt.NDArray[np.bool_] = np.stack(
+        [
+            _within_bound(
+                filtered[:, 0], min_bound=min_lon_accel, max_bound=max_lon_accel
+            ),
+            _within_bound(
+                filtered[:, 1],
+                min_bound=-max_abs_lat_accel,
+                max_bound=max_abs_lat_accel,
+            ),
+            _within_bound(
+                jerk[:, 0], min_bound=-max_abs_mag_jerk, max_bound=max_abs_mag_jerk
+            ),
+            _within_bound(
+                jerk[:, 1], min_bound=-max_abs_lon_jerk, max_bound=max_abs_lon_jerk
+            ),
+            _within_bound(
+                filtered[:, 4],
+                min_bound=-max_abs_yaw_accel,
+                max_bound=max_abs_yaw_accel,
+            ),
+            _within_bound(
+                filtered[:, 5], min_bound=-max_abs_yaw_rate, max_bound=max_abs_yaw_rate
+            ),
+        ],
+        axis=-1,
     )
-    for idx, metric_function in enumerate(comfort_metric_functions):
-        results[:, idx] = metric_function(states, time_point_s)
 
     return results
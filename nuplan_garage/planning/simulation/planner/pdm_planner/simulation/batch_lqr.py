@@ -400,55 +400,62 @@ class BatchLQRTracker:
         # lateral_error_N = A @ lateral_error_0 + B @ steering_rate + g
         n_lateral_states = len(LateralStateIndex)
 
-        I: npt.NDArray[np.float64] = np.eye(n_lateral_states, dtype=np.float64)
-
-        in_matrix: npt.NDArray[np.float64] = np.zeros(
-            (n_lateral_states, 1), np.float64
-        )  # no batch dim
-        in_matrix[LateralStateIndex.STEERING_ANGLE] = self._discretization_time
-
-        states_matrix_at_step: npt.NDArray[np.float64] = np.tile(
-            I[None, None, ...], [self._tracking_horizon, batch_dim, 1, 1]
-        )  # (horizon, batch, 3, 3)
-
-        states_matrix_at_step[
-            :, :, LateralStateIndex.LATERAL_ERROR, LateralStateIndex.HEADING_ERROR
-        ] = (velocity_profile.T * self._discretization_time)
-
-        states_matrix_at_step[
-            :, :, LateralStateIndex.HEADING_ERROR, LateralStateIndex.STEERING_ANGLE
-        ] = (velocity_profile.T * self._discretization_time / self._wheel_base)
-
-        affine_terms: npt.NDArray[np.float64] = np.zeros(
-            (self._tracking_horizon, batch_dim, n_lateral_states), dtype=np.float64
-        )
+        # The state matrix at step k is the identity plus the entries
+        #   a_k = velocity_k * dt                (lateral_error <- heading_error)
+        #   b_k = velocity_k * dt / wheel_base   (heading_error <- steering_angle)
+        # and the affine term is c_k = -velocity_k * curvature_k * dt (heading_error).
+        # Since the steering angle after k steps is steering_angle_0 + k * dt * steering_rate,
+        # the product over the horizon reduces to (exclusive) cumulative sums over steps:
+        #   heading_error_k = heading_error_0 + Sb_k * steering_angle_0 + dt * Skb_k * steering_rate + Sc_k
+        #   lateral_error_N = lateral_error_0 + sum_k a_k * heading_error_k
+        # with Sb_k = sum_{j<k} b_j, Skb_k = sum_{j<k} j * b_j and Sc_k = sum_{j<k} c_j.
+        a = velocity_profile * self._discretization_time  # (batch, horizon)
+        b = velocity_profile * self._discretization_time / self._wheel_base
+        c = -velocity_profile * curvature_profile * self._discretization_time
+        steps = np.arange(self._tracking_horizon, dtype=np.float64)
+
+        def _exclusive_cumsum(x: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+            # (batch, horizon) -> (batch, horizon + 1), starting with zero
+            return np.concatenate(
+                [np.zeros((batch_dim, 1), dtype=np.float64), np.cumsum(x, axis=-1)],
+                axis=-1,
+            )
 
-        affine_terms[:, :, LateralStateIndex.HEADING_ERROR] = (
-            -velocity_profile.T * curvature_profile.T * self._discretization_time
-        )
+        sum_b = _exclusive_cumsum(b)
+        sum_step_b = _exclusive_cumsum(steps * b)
+        sum_c = _exclusive_cumsum(c)
 
         A: npt.NDArray[np.float64] = np.tile(
-            I[None, ...], [batch_dim, 1, 1]
+            np.eye(n_lateral_states, dtype=np.float64)[None, ...], [batch_dim, 1, 1]
         )  # (batch, 3, 3)
+        A[:, LateralStateIndex.LATERAL_ERROR, LateralStateIndex.HEADING_ERROR] = a.sum(
+            axis=-1
+        )
+        A[:, LateralStateIndex.LATERAL_ERROR, LateralStateIndex.STEERING_ANGLE] = (
+            a * sum_b[:, :-1]
+        ).sum(axis=-1)
+        A[:, LateralStateIndex.HEADING_ERROR, LateralStateIndex.STEERING_ANGLE] = sum_b[
+            :, -1
+        ]
+
         B: npt.NDArray[np.float64] = np.zeros(
             (batch_dim, n_lateral_states, 1), dtype=np.float64
         )  # (batch, 3, 1)
+        B[:, LateralStateIndex.LATERAL_ERROR, 0] = self._discretization_time * (
+            a * sum_step_b[:, :-1]
+        ).sum(axis=-1)
+        B[:, LateralStateIndex.HEADING_ERROR, 0] = (
+            self._discretization_time * sum_step_b[:, -1]
+        )
+        B[:, LateralStateIndex.STEERING_ANGLE, 0] = (
+            self._discretization_time * self._tracking_horizon
+        )
+
         g: npt.NDArray[np.float64] = np.zeros(
             (batch_dim, n_lateral_states), dtype=np.float64
         )  # (batch, 3)
-
-        for index_step, (state_matrix_at_step, affine_term) in enumerate(
-            zip(states_matrix_at_step, affine_terms)
-        ):
-            # state_matrix_at_step (batch, 3, 3)
-            # affine_term (batch, 3)
-            A = np.einsum("bij, bjk -> bik", state_matrix_at_step, A)  # (batch, 3, 3)
-            B = (
-                np.einsum("bij, bjk -> bik", state_matrix_at_step, B) + in_matrix
-            )  # (batch, 3, 1)
-            g = (
-                np.einsum("bij, bj  -> bi", state_matrix_at_step, g) + affine_term
-            )  # (batch, 3)
+        g[:, LateralStateIndex.LATERAL_ERROR] = (a * sum_c[:, :-1]).sum(axis=-1)
+        g[:, LateralStateIndex.HEADING_ERROR] = sum_c[:, -1]
 
         steering_rate_cmd = self._solve_one_step_lateral_lqr(
             initial_state=initial_lateral_state_vector,
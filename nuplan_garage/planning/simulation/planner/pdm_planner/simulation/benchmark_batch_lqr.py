@@ -0,0 +1,53 @@
+import argparse
+import time
+
+import numpy as np
+
+from nuplan_garage.planning.simulation.planner.pdm_planner.simulation.batch_lqr import (
+    BatchLQRTracker,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.simulation.test.test_batch_lqr import (
+    SequentialLQRTracker,
+    random_lateral_problem,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run-time of the closed form vs step-wise lateral LQR, parity is tested in test/test_batch_lqr.py"
+    )
+    parser.add_argument(
+        "--batch_sizes", type=int, nargs="+", default=[15, 30, 60, 150, 300]
+    )
+    parser.add_argument("--repetitions", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    trackers = {
+        "step-wise": SequentialLQRTracker(),
+        "closed form": BatchLQRTracker(),
+    }
+    tracking_horizon = trackers["closed form"]._tracking_horizon
+
+    for batch_size in args.batch_sizes:
+        lateral_problem = random_lateral_problem(rng, batch_size, tracking_horizon)
+        run_times = []
+        for tracker in trackers.values():
+            tracker._lateral_lqr_controller(*lateral_problem)
+            start = time.perf_counter()
+            for _ in range(args.repetitions):
+                tracker._lateral_lqr_controller(*lateral_problem)
+            run_times.append((time.perf_counter() - start) / args.repetitions * 1e6)
+
+        print(
+            f"{batch_size:4d} proposals: "
+            + ", ".join(
+                f"{name} {run_time:.0f} us"
+                for name, run_time in zip(trackers.keys(), run_times)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import unittest
+from typing import Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from nuplan_garage.planning.simulation.planner.pdm_planner.simulation.batch_lqr import (
+    BatchLQRTracker,
+    LateralStateIndex,
+)
+
+
+class SequentialLQRTracker(BatchLQRTracker):
+    """
+    Reference of BatchLQRTracker before the closed form lateral dynamics, which
+    multiplies the state matrices of the tracking horizon step by step.
+    """
+
+    def _lateral_lqr_controller(
+        self,
+        initial_lateral_state_vector: npt.NDArray[np.float64],
+        velocity_profile: npt.NDArray[np.float64],
+        curvature_profile: npt.NDArray[np.float64],
+    ) -> npt.NDArray[np.float64]:
+        """Inherited, see superclass."""
+        batch_dim = velocity_profile.shape[0]
+        n_lateral_states = len(LateralStateIndex)
+
+        I: npt.NDArray[np.float64] = np.eye(n_lateral_states, dtype=np.float64)
+
+        in_matrix: npt.NDArray[np.float64] = np.zeros(
+            (n_lateral_states, 1), np.float64
+        )  # no batch dim
+        in_matrix[LateralStateIndex.STEERING_ANGLE] = self._discretization_time
+
+        states_matrix_at_step: npt.NDArray[np.float64] = np.tile(
+            I[None, None, ...], [self._tracking_horizon, batch_dim, 1, 1]
+        )  # (horizon, batch, 3, 3)
+        states_matrix_at_step[
+            :, :, LateralStateIndex.LATERAL_ERROR, LateralStateIndex.HEADING_ERROR
+        ] = (velocity_profile.T * self._discretization_time)
+        states_matrix_at_step[
+            :, :, LateralStateIndex.HEADING_ERROR, LateralStateIndex.STEERING_ANGLE
+        ] = (velocity_profile.T * self._discretization_time / self._wheel_base)
+
+        affine_terms: npt.NDArray[np.float64] = np.zeros(
+            (self._tracking_horizon, batch_dim, n_lateral_states), dtype=np.float64
+        )
+        affine_terms[:, :, LateralStateIndex.HEADING_ERROR] = (
+            -velocity_profile.T * curvature_profile.T * self._discretization_time
+        )
+
+        A: npt.NDArray[np.float64] = np.tile(I[None, ...], [batch_dim, 1, 1])
+        B: npt.NDArray[np.float64] = np.zeros(
+            (batch_dim, n_lateral_states, 1), dtype=np.float64
+        )
+        g: npt.NDArray[np.float64] = np.zeros(
+            (batch_dim, n_lateral_states), dtype=np.float64
+        )
+
+        for state_matrix_at_step, affine_term in zip(
+            states_matrix_at_step, affine_terms
+        ):
+            A = np.einsum("bij, bjk -> bik", state_matrix_at_step, A)
+            B = np.einsum("bij, bjk -> bik", state_matrix_at_step, B) + in_matrix
+            g = np.einsum("bij, bj  -> bi", state_matrix_at_step, g) + affine_term
+
+        steering_rate_cmd = self._solve_one_step_lateral_lqr(
+            initial_state=initial_lateral_state_vector,
+            A=A,
+            B=B,
+            g=g,
+        )
+
+        return np.squeeze(steering_rate_cmd, axis=-1)
+
+
+def random_lateral_problem(
+    rng: np.random.Generator, batch_size: int, tracking_horizon: int
+) -> Tuple[npt.NDArray[np.float64], npt.NDArray[np.float64], npt.NDArray[np.float64]]:
+    """
+    Lateral errors, velocities and curvatures of proposals in urban driving
+    :param rng: random number generator
+    :param batch_size: number of proposals
+    :param tracking_horizon: number of LQR steps
+    :return: initial lateral states, velocity profiles and curvature profiles
+    """
+    initial_lateral_states = np.stack(
+        [
+            rng.normal(0.0, 0.5, batch_size),
+            rng.normal(0.0, 0.1, batch_size),
+            rng.normal(0.0, 0.05, batch_size),
+        ],
+        axis=-1,
+    )
+    velocity_profiles = rng.uniform(0.0, 20.0, (batch_size, tracking_horizon))
+    curvature_profiles = rng.normal(0.0, 0.05, (batch_size, tracking_horizon))
+    return initial_lateral_states, velocity_profiles, curvature_profiles
+
+
+class TestBatchLQRTracker(unittest.TestCase):
+    """Parity of the closed form lateral LQR of BatchLQRTracker with the step-wise reference"""
+
+    def setUp(self) -> None:
+        """Trackers with the default and a longer tracking horizon"""
+        self.rng = np.random.default_rng(0)
+        self.tracker_pairs = [
+            (BatchLQRTracker(), SequentialLQRTracker()),
+            (
+                BatchLQRTracker(tracking_horizon=40),
+                SequentialLQRTracker(tracking_horizon=40),
+            ),
+        ]
+
+    def test_lateral_lqr_controller(self) -> None:
+        """Steering rates of random proposals match the step-wise reference"""
+        for tracker, reference_tracker in self.tracker_pairs:
+            for batch_size in [1, 15, 300]:
+                lateral_problem = random_lateral_problem(
+                    self.rng, batch_size, tracker._tracking_horizon
+                )
+                np.testing.assert_allclose(
+                    tracker._lateral_lqr_controller(*lateral_problem),
+                    reference_tracker._lateral_lqr_controller(*lateral_problem),
+                    rtol=1e-10,
+                    atol=1e-12,
+                )
+
+    def test_standing_still(self) -> None:
+        """Zero velocities, where the lateral dynamics do not depend on the steering angle"""
+        tracker, reference_tracker = self.tracker_pairs[0]
+        initial_lateral_states, _, curvature_profiles = random_lateral_problem(
+            self.rng, 15, tracker._tracking_horizon
+        )
+        velocity_profiles = np.zeros_like(curvature_profiles)
+        np.testing.assert_allclose(
+            tracker._lateral_lqr_controller(
+                initial_lateral_states, velocity_profiles, curvature_profiles
+            ),
+            reference_tracker._lateral_lqr_controller(
+                initial_lateral_states, velocity_profiles, curvature_profiles
+            ),
+            rtol=1e-10,
+            atol=1e-12,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import argparse
+import time
+from typing import Tuple
+
+import numpy as np
+
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils import route_utils
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.bfs_roadblock import (
+    BreadthFirstSearchRoadBlock,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.compiled_graph import (
+    get_lane_graph,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.dijkstra import (
+    Dijkstra,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.test.test_graph_search import (
+    ListDijkstra,
+    ObjectBreadthFirstSearchRoadBlock,
+    SyntheticMap,
+    random_dijkstra_search,
+    random_route,
+)
+
+
+def benchmark_dijkstra(
+    rng: np.random.Generator, map_api: SyntheticMap, num_searches: int
+) -> Tuple[float, float]:
+    """
+    Searches lane routes between random roadblocks with both Dijkstra implementations.
+    :return: mean run-times [ms] of the list and heap based searches
+    """
+    run_times = np.zeros(2, dtype=np.float64)
+    for _ in range(num_searches):
+        start_lane, candidate_lane_ids, target_roadblock = random_dijkstra_search(
+            rng, map_api
+        )
+
+        start = time.perf_counter()
+        ListDijkstra(start_lane, candidate_lane_ids).search(target_roadblock)
+        run_times[0] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        Dijkstra(
+            start_lane, candidate_lane_ids, lane_graph=get_lane_graph(map_api)
+        ).search(target_roadblock)
+        run_times[1] += time.perf_counter() - start
+
+    return tuple(run_times / num_searches * 1000)
+
+
+def benchmark_route_correction(
+    rng: np.random.Generator, map_api: SyntheticMap, num_corrections: int
+) -> Tuple[float, float]:
+    """
+    Corrects long routes with missing roadblocks, starting on or off route, with the
+    object and compiled graph based roadblock searches.
+    :return: mean run-times [ms] of the route corrections with both searches
+    """
+    run_times = np.zeros(2, dtype=np.float64)
+    for _ in range(num_corrections):
+        ego_state, route_roadblock_dict = random_route(rng, map_api)
+        for run_idx, search in enumerate(
+            [ObjectBreadthFirstSearchRoadBlock, BreadthFirstSearchRoadBlock]
+        ):
+            route_utils.BreadthFirstSearchRoadBlock = search
+            start = time.perf_counter()
+            route_utils.route_roadblock_correction(
+                ego_state, map_api, route_roadblock_dict
+            )
+            run_times[run_idx] += time.perf_counter() - start
+        route_utils.BreadthFirstSearchRoadBlock = BreadthFirstSearchRoadBlock
+
+    return tuple(run_times / num_corrections * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run-time of PDM graph searches on long synthetic routes, parity is tested in test/test_graph_search.py"
+    )
+    parser.add_argument(
+        "--num_roadblocks", type=int, nargs="+", default=[50, 300, 1500]
+    )
+    parser.add_argument("--searches", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for num_roadblocks in args.num_roadblocks:
+        map_api = SyntheticMap(rng, num_roadblocks, f"synthetic_{num_roadblocks}")
+        list_time, heap_time = benchmark_dijkstra(rng, map_api, args.searches)
+        object_time, compiled_time = benchmark_route_correction(
+            rng, map_api, args.searches
+        )
+        print(
+            f"{num_roadblocks:5d} roadblocks: "
+            f"dijkstra list {list_time:.2f} ms, heap {heap_time:.2f} ms; "
+            f"route correction object graph {object_time:.2f} ms, "
+            f"compiled graph {compiled_time:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
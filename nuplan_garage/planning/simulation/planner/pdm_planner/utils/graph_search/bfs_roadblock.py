@@ -1,9 +1,14 @@
 from collections import deque
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 from nuplan.common.maps.abstract_map import AbstractMap
 from nuplan.common.maps.abstract_map_objects import RoadBlockGraphEdgeMapObject
 
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.compiled_graph import (
+    CompiledRoadBlockGraph,
+    get_roadblock_graph,
+)
+
 
 class BreadthFirstSearchRoadBlock:
     """
@@ -15,20 +20,27 @@ class BreadthFirstSearchRoadBlock:
         start_roadblock_id: int,
         map_api: Optional[AbstractMap],
         forward_search: str = True,
+        roadblock_graph: Optional[CompiledRoadBlockGraph] = None,
     ):
         """
         Constructor of BreadthFirstSearchRoadBlock class
         :param start_roadblock_id: roadblock id where graph starts
         :param map_api: map class in nuPlan
         :param forward_search: whether to search in driving direction, defaults to True
+        :param roadblock_graph: compiled roadblock graph, defaults to the cached graph of map_api
         """
         self._map_api: Optional[AbstractMap] = map_api
-        self._queue = deque([self.id_to_roadblock(start_roadblock_id), None])
-        self._parent: Dict[str, Optional[RoadBlockGraphEdgeMapObject]] = dict()
+        self._graph: CompiledRoadBlockGraph = (
+            roadblock_graph
+            if roadblock_graph is not None
+            else get_roadblock_graph(map_api)
+        )
+        self._queue = deque([self._graph.get(start_roadblock_id), None])
+        self._parent: Dict[Tuple[int, int], Optional[int]] = dict()
         self._forward_search = forward_search
 
         #  lazy loaded
-        self._target_roadblock_ids: List[str] = None
+        self._target_roadblock_ids: Set[str] = None
 
     def search(
         self, target_roadblock_id: Union[str, List[str]], max_depth: int
@@ -42,27 +54,27 @@ class BreadthFirstSearchRoadBlock:
 
         if isinstance(target_roadblock_id, str):
             target_roadblock_id = [target_roadblock_id]
-        self._target_roadblock_ids = target_roadblock_id
+        self._target_roadblock_ids = set(target_roadblock_id)
 
-        start_edge = self._queue[0]
+        start_idx = self._queue[0]
 
         # Initial search states
         path_found: bool = False
-        end_edge: RoadBlockGraphEdgeMapObject = start_edge
+        end_idx: int = start_idx
         end_depth: int = 1
         depth: int = 1
 
-        self._parent[start_edge.id + f"_{depth}"] = None
+        self._parent[(start_idx, depth)] = None
 
         while self._queue:
-            current_edge = self._queue.popleft()
+            current_idx = self._queue.popleft()
 
             # Early exit condition
             if self._check_end_condition(depth, max_depth):
                 break
 
             # Depth tracking
-            if current_edge is None:
+            if current_idx is None:
                 depth += 1
                 self._queue.append(None)
                 if self._queue[0] is None:
@@ -70,27 +82,26 @@ class BreadthFirstSearchRoadBlock:
                 continue
 
             # Goal condition
-            if self._check_goal_condition(current_edge, depth, max_depth):
-                end_edge = current_edge
+            if self._check_goal_condition(current_idx, depth, max_depth):
+                end_idx = current_idx
                 end_depth = depth
                 path_found = True
                 break
 
             neighbors = (
-                current_edge.outgoing_edges
+                self._graph.outgoing(current_idx)
                 if self._forward_search
-                else current_edge.incoming_edges
+                else self._graph.incoming(current_idx)
             )
 
             # Populate queue
-            for next_edge in neighbors:
-                # if next_edge.id in self._candidate_lane_edge_ids_old:
-                self._queue.append(next_edge)
-                self._parent[next_edge.id + f"_{depth + 1}"] = current_edge
-                end_edge = next_edge
+            for next_idx in neighbors:
+                self._queue.append(next_idx)
+                self._parent[(next_idx, depth + 1)] = current_idx
+                end_idx = next_idx
                 end_depth = depth + 1
 
-        return self._construct_path(end_edge, end_depth), path_found
+        return self._construct_path(end_idx, end_depth), path_found
 
     def id_to_roadblock(self, id: str) -> RoadBlockGraphEdgeMapObject:
         """
@@ -98,9 +109,8 @@ class BreadthFirstSearchRoadBlock:
         :param id: id of roadblock
         :return: roadblock class
         """
-        block = self._map_api._get_roadblock(id)
-        block = block or self._map_api._get_roadblock_connector(id)
-        return block
+        idx = self._graph.get(id)
+        return self._graph.edges[idx] if idx is not None else None
 
     @staticmethod
     def _check_end_condition(depth: int, max_depth: int) -> bool:
@@ -114,39 +124,42 @@ class BreadthFirstSearchRoadBlock:
 
     def _check_goal_condition(
         self,
-        current_edge: RoadBlockGraphEdgeMapObject,
+        current_idx: int,
         depth: int,
         max_depth: int,
     ) -> bool:
         """
         Check if the current edge is at the target roadblock at the given depth.
-        :param current_edge: edge to check.
+        :param current_idx: node index of edge to check.
         :param depth: current depth to check.
         :param max_depth: maximum depth the edge should be at.
         :return: True if the lane edge is contain the in the target roadblock. False, otherwise.
         """
-        return current_edge.id in self._target_roadblock_ids and depth <= max_depth
+        return (
+            self._graph.ids[current_idx] in self._target_roadblock_ids
+            and depth <= max_depth
+        )
 
     def _construct_path(
-        self, end_edge: RoadBlockGraphEdgeMapObject, depth: int
+        self, end_idx: int, depth: int
     ) -> List[RoadBlockGraphEdgeMapObject]:
         """
         Constructs a path when goal was found.
-        :param end_edge: The end edge to start back propagating back to the start edge.
+        :param end_idx: node index of the end edge to start back propagating back to the start edge.
         :param depth: The depth of the target edge.
         :return: The constructed path as a list of RoadBlockGraphEdgeMapObject
         """
-        path = [end_edge]
-        path_id = [end_edge.id]
+        path_idcs = [end_idx]
 
-        while self._parent[end_edge.id + f"_{depth}"] is not None:
-            path.append(self._parent[end_edge.id + f"_{depth}"])
-            path_id.append(path[-1].id)
-            end_edge = self._parent[end_edge.id + f"_{depth}"]
+        while self._parent[(end_idx, depth)] is not None:
+            end_idx = self._parent[(end_idx, depth)]
+            path_idcs.append(end_idx)
             depth -= 1
 
         if self._forward_search:
-            path.reverse()
-            path_id.reverse()
+            path_idcs.reverse()
+
+        path = [self._graph.edges[idx] for idx in path_idcs]
+        path_id = [self._graph.ids[idx] for idx in path_idcs]
 
         return (path, path_id)
@@ -0,0 +1,189 @@
+from typing import Dict, List, Optional
+
+from nuplan.common.maps.abstract_map import AbstractMap
+from nuplan.common.maps.abstract_map_objects import (
+    GraphEdgeMapObject,
+    LaneGraphEdgeMapObject,
+    RoadBlockGraphEdgeMapObject,
+)
+
+
+class CompiledGraph:
+    """
+    Integer-indexed graph of map objects, compiled on first visit of each node.
+    Map objects, their ids and neighbor indices are cached, such that repeated searches
+    do not query the map-api again.
+    """
+
+    def __init__(self):
+        """Constructor of CompiledGraph."""
+        self._id_to_idx: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._edges: List[GraphEdgeMapObject] = []
+
+        # lazy loaded neighbor indices, per node
+        self._outgoing: List[Optional[List[int]]] = []
+        self._incoming: List[Optional[List[int]]] = []
+
+    def __len__(self) -> int:
+        """
+        Number of compiled nodes
+        :return: int
+        """
+        return len(self._ids)
+
+    @property
+    def ids(self) -> List[str]:
+        """
+        Getter for node ids
+        :return: list of ids, by node index
+        """
+        return self._ids
+
+    @property
+    def edges(self) -> List[GraphEdgeMapObject]:
+        """
+        Getter for map objects
+        :return: list of map objects, by node index
+        """
+        return self._edges
+
+    def add(self, edge: GraphEdgeMapObject) -> int:
+        """
+        Adds map object to graph, if not present.
+        :param edge: map object
+        :return: node index of map object
+        """
+        idx = self._id_to_idx.get(edge.id)
+        if idx is None:
+            idx = len(self._ids)
+            self._id_to_idx[edge.id] = idx
+            self._ids.append(edge.id)
+            self._edges.append(edge)
+            self._outgoing.append(None)
+            self._incoming.append(None)
+            self._add_node_attributes(edge)
+        return idx
+
+    def index(self, id: str) -> Optional[int]:
+        """
+        Retrieves node index of id.
+        :param id: id of map object
+        :return: node index or None if not compiled
+        """
+        return self._id_to_idx.get(id)
+
+    def outgoing(self, idx: int) -> List[int]:
+        """
+        Retrieves (and caches) indices of outgoing nodes.
+        :param idx: node index
+        :return: list of node indices
+        """
+        if self._outgoing[idx] is None:
+            self._outgoing[idx] = [
+                self.add(edge) for edge in self._edges[idx].outgoing_edges
+            ]
+        return self._outgoing[idx]
+
+    def incoming(self, idx: int) -> List[int]:
+        """
+        Retrieves (and caches) indices of incoming nodes.
+        :param idx: node index
+        :return: list of node indices
+        """
+        if self._incoming[idx] is None:
+            self._incoming[idx] = [
+                self.add(edge) for edge in self._edges[idx].incoming_edges
+            ]
+        return self._incoming[idx]
+
+    def _add_node_attributes(self, edge: GraphEdgeMapObject) -> None:
+        """
+        Hook to cache further attributes of a newly added node.
+        :param edge: map object
+        """
+        pass
+
+
+class CompiledLaneGraph(CompiledGraph):
+    """Compiled graph of lanes and lane-connectors, with cached lengths and roadblock ids."""
+
+    def __init__(self):
+        """Constructor of CompiledLaneGraph."""
+        super().__init__()
+        self._lengths: List[float] = []
+        self._roadblock_ids: List[str] = []
+
+    @property
+    def lengths(self) -> List[float]:
+        """
+        Getter for lengths of lane baseline paths
+        :return: list of lengths [m], by node index
+        """
+        return self._lengths
+
+    @property
+    def roadblock_ids(self) -> List[str]:
+        """
+        Getter for roadblock ids of lanes
+        :return: list of roadblock ids, by node index
+        """
+        return self._roadblock_ids
+
+    def _add_node_attributes(self, edge: LaneGraphEdgeMapObject) -> None:
+        """Inherited, see superclass."""
+        self._lengths.append(edge.baseline_path.length)
+        self._roadblock_ids.append(edge.get_roadblock_id())
+
+
+class CompiledRoadBlockGraph(CompiledGraph):
+    """Compiled graph of roadblocks and roadblock-connectors, with lookup from the map-api."""
+
+    def __init__(self, map_api: AbstractMap):
+        """
+        Constructor of CompiledRoadBlockGraph
+        :param map_api: map class in nuPlan
+        """
+        super().__init__()
+        self._map_api = map_api
+
+    def get(self, id: str) -> Optional[int]:
+        """
+        Retrieves node index of a roadblock (or roadblock-connector), compiled from map-api if necessary.
+        :param id: id of roadblock
+        :return: node index or None if not in map
+        """
+        idx = self.index(id)
+        if idx is None:
+            roadblock: RoadBlockGraphEdgeMapObject = self._map_api._get_roadblock(id)
+            roadblock = roadblock or self._map_api._get_roadblock_connector(id)
+            if roadblock is not None:
+                idx = self.add(roadblock)
+        return idx
+
+
+# compiled graphs are shared across planners and scenarios of the same map
+_LANE_GRAPH_CACHE: Dict[str, CompiledLaneGraph] = {}
+_ROADBLOCK_GRAPH_CACHE: Dict[str, CompiledRoadBlockGraph] = {}
+
+
+def get_lane_graph(map_api: AbstractMap) -> CompiledLaneGraph:
+    """
+    Returns compiled lane graph of map, created at first call.
+    :param map_api: map class in nuPlan
+    :return: CompiledLaneGraph class
+    """
+    if map_api.map_name not in _LANE_GRAPH_CACHE:
+        _LANE_GRAPH_CACHE[map_api.map_name] = CompiledLaneGraph()
+    return _LANE_GRAPH_CACHE[map_api.map_name]
+
+
+def get_roadblock_graph(map_api: AbstractMap) -> CompiledRoadBlockGraph:
+    """
+    Returns compiled roadblock graph of map, created at first call.
+    :param map_api: map class in nuPlan
+    :return: CompiledRoadBlockGraph class
+    """
+    if map_api.map_name not in _ROADBLOCK_GRAPH_CACHE:
+        _ROADBLOCK_GRAPH_CACHE[map_api.map_name] = CompiledRoadBlockGraph(map_api)
+    return _ROADBLOCK_GRAPH_CACHE[map_api.map_name]
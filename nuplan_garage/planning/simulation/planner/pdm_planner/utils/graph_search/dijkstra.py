@@ -1,11 +1,16 @@
-from typing import Dict, List, Optional, Tuple
+import heapq
+import itertools
+from typing import Dict, List, Optional, Set, Tuple
 
-import numpy as np
 from nuplan.common.maps.abstract_map_objects import (
     LaneGraphEdgeMapObject,
     RoadBlockGraphEdgeMapObject,
 )
 
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.compiled_graph import (
+    CompiledLaneGraph,
+)
+
 
 class Dijkstra:
     """
@@ -14,16 +19,23 @@ class Dijkstra:
     """
 
     def __init__(
-        self, start_edge: LaneGraphEdgeMapObject, candidate_lane_edge_ids: List[str]
+        self,
+        start_edge: LaneGraphEdgeMapObject,
+        candidate_lane_edge_ids: List[str],
+        lane_graph: Optional[CompiledLaneGraph] = None,
     ):
         """
         Constructor for the Dijkstra class.
         :param start_edge: The starting edge for the search
         :param candidate_lane_edge_ids: The candidates lane ids that can be included in the search.
+        :param lane_graph: compiled lane graph to reuse across searches (see get_lane_graph), defaults to None
         """
-        self._queue = list([start_edge])
-        self._parent: Dict[str, Optional[LaneGraphEdgeMapObject]] = dict()
-        self._candidate_lane_edge_ids = candidate_lane_edge_ids
+        self._start_edge = start_edge
+        self._candidate_lane_edge_ids = set(candidate_lane_edge_ids)
+        self._graph: CompiledLaneGraph = (
+            lane_graph if lane_graph is not None else CompiledLaneGraph()
+        )
+        self._parent: Dict[int, Optional[int]] = dict()
 
     def search(
         self, target_roadblock: RoadBlockGraphEdgeMapObject
@@ -37,85 +49,60 @@ class Dijkstra:
               from the start edge to an edge contained in the end roadblock.
               If unsuccessful the shortest deepest path is returned.
         """
-        start_edge = self._queue[0]
+        graph = self._graph
+        start_idx = graph.add(self._start_edge)
 
         # Initial search states
         path_found: bool = False
-        end_edge: LaneGraphEdgeMapObject = start_edge
+        end_idx: int = start_idx
 
-        self._parent[start_edge.id] = None
-        self._frontier = [start_edge.id]
-        self._dist = [1]
-        self._depth = [1]
+        self._parent = {start_idx: None}
+        dist: Dict[int, float] = {start_idx: 1}
+        depth: Dict[int, int] = {start_idx: 1}
+        expanded: Set[int] = set()
 
-        self._expanded = []
-        self._expanded_id = []
-        self._expanded_dist = []
-        self._expanded_depth = []
+        # shortest deepest expanded node, as fallback if target is not found
+        fallback_key: Tuple[int, float] = (0, 0.0)
+        fallback_idx: int = start_idx
 
-        while len(self._queue) > 0:
-            dist, idx = min((val, idx) for (idx, val) in enumerate(self._dist))
-            current_edge = self._queue[idx]
-            current_depth = self._depth[idx]
+        # priority queue of (distance, insertion count, node), ties in order of insertion
+        counter = itertools.count()
+        queue: List[Tuple[float, int, int]] = [(1, next(counter), start_idx)]
 
-            del self._dist[idx], self._queue[idx], self._frontier[idx], self._depth[idx]
+        while len(queue) > 0:
+            current_dist, _, current_idx = heapq.heappop(queue)
+            if current_idx in expanded or current_dist > dist[current_idx]:
+                continue  # outdated queue entry
 
-            if self._check_goal_condition(current_edge, target_roadblock):
-                end_edge = current_edge
+            if self._check_goal_condition(current_idx, target_roadblock):
+                end_idx = current_idx
                 path_found = True
                 break
 
-            self._expanded.append(current_edge)
-            self._expanded_id.append(current_edge.id)
-            self._expanded_dist.append(dist)
-            self._expanded_depth.append(current_depth)
+            expanded.add(current_idx)
+            current_depth = depth[current_idx]
+            if (current_depth, -current_dist) > fallback_key:
+                fallback_key, fallback_idx = (current_depth, -current_dist), current_idx
 
             # Populate queue
-            for next_edge in current_edge.outgoing_edges:
-                if next_edge.id not in self._candidate_lane_edge_ids:
-                    continue
-
-                alt = dist + self._edge_cost(next_edge)
+            for next_idx in graph.outgoing(current_idx):
                 if (
-                    next_edge.id not in self._expanded_id
-                    and next_edge.id not in self._frontier
+                    next_idx in expanded
+                    or graph.ids[next_idx] not in self._candidate_lane_edge_ids
                 ):
-                    self._parent[next_edge.id] = current_edge
-                    self._queue.append(next_edge)
-                    self._frontier.append(next_edge.id)
-                    self._dist.append(alt)
-                    self._depth.append(current_depth + 1)
-                    end_edge = next_edge
-
-                elif next_edge.id in self._frontier:
-                    next_edge_idx = self._frontier.index(next_edge.id)
-                    current_cost = self._dist[next_edge_idx]
-                    if alt < current_cost:
-                        self._parent[next_edge.id] = current_edge
-                        self._dist[next_edge_idx] = alt
-                        self._depth[next_edge_idx] = current_depth + 1
-
-        if not path_found:
-            # filter max depth
-            max_depth = max(self._expanded_depth)
-            idx_max_depth = list(
-                np.where(np.array(self._expanded_depth) == max_depth)[0]
-            )
-            dist_at_max_depth = [self._expanded_dist[i] for i in idx_max_depth]
+                    continue
 
-            dist, _idx = min((val, idx) for (idx, val) in enumerate(dist_at_max_depth))
-            end_edge = self._expanded[idx_max_depth[_idx]]
+                alt = current_dist + graph.lengths[next_idx]
+                if next_idx not in dist or alt < dist[next_idx]:
+                    self._parent[next_idx] = current_idx
+                    dist[next_idx] = alt
+                    depth[next_idx] = current_depth + 1
+                    heapq.heappush(queue, (alt, next(counter), next_idx))
 
-        return self._construct_path(end_edge), path_found
+        if not path_found:
+            end_idx = fallback_idx
 
-    @staticmethod
-    def _edge_cost(lane: LaneGraphEdgeMapObject) -> float:
-        """
-        Edge cost of given lane.
-        :param lane: lane class
-        :return: length of lane
-        """
-        return lane.baseline_path.length
+        return self._construct_path(end_idx), path_found
 
     @staticmethod
     def _check_end_condition(depth: int, target_depth: int) -> bool:
@@ -128,32 +115,28 @@ class Dijkstra:
         """
         return depth > target_depth
 
-    @staticmethod
     def _check_goal_condition(
-        current_edge: LaneGraphEdgeMapObject,
+        self,
+        current_idx: int,
         target_roadblock: RoadBlockGraphEdgeMapObject,
     ) -> bool:
         """
         Check if the current edge is at the target roadblock at the given depth.
-        :param current_edge: The edge to check.
+        :param current_idx: The node index of the edge to check.
         :param target_roadblock: The target roadblock the edge should be contained in.
         :return: whether the current edge is in the target roadblock
         """
-        return current_edge.get_roadblock_id() == target_roadblock.id
+        return self._graph.roadblock_ids[current_idx] == target_roadblock.id
 
-    def _construct_path(
-        self, end_edge: LaneGraphEdgeMapObject
-    ) -> List[LaneGraphEdgeMapObject]:
+    def _construct_path(self, end_idx: int) -> List[LaneGraphEdgeMapObject]:
         """
-        :param end_edge: The end edge to start back propagating back to the start edge.
-        :param depth: The depth of the target edge.
+        :param end_idx: The node index of the end edge to start back propagating back to the start edge.
         :return: The constructed path as a list of LaneGraphEdgeMapObject
         """
-        path = [end_edge]
-        while self._parent[end_edge.id] is not None:
-            node = self._parent[end_edge.id]
-            path.append(node)
-            end_edge = node
+        path = [self._graph.edges[end_idx]]
+        while self._parent[end_idx] is not None:
+            end_idx = self._parent[end_idx]
+            path.append(self._graph.edges[end_idx])
         path.reverse()
 
         return path
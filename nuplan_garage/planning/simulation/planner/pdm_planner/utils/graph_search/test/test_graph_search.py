@@ -0,0 +1,441 @@
+import unittest
+from collections import deque
+from unittest.mock import patch
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from nuplan.common.actor_state.ego_state import EgoState
+from nuplan.common.actor_state.state_representation import (
+    Point2D,
+    StateSE2,
+    StateVector2D,
+    TimePoint,
+)
+from nuplan.common.actor_state.vehicle_parameters import get_pacifica_parameters
+from nuplan.common.maps.maps_datatypes import SemanticMapLayer
+
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils import route_utils
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.bfs_roadblock import (
+    BreadthFirstSearchRoadBlock,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.compiled_graph import (
+    get_lane_graph,
+)
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.dijkstra import (
+    Dijkstra,
+)
+
+
+class ListDijkstra:
+    """
+    Reference of Dijkstra before the binary heap, which scans all queued distances
+    and searches the frontier lists for each expansion.
+    """
+
+    def __init__(self, start_edge, candidate_lane_edge_ids: List[str]):
+        """
+        Constructor of ListDijkstra
+        :param start_edge: The starting edge for the search
+        :param candidate_lane_edge_ids: The candidates lane ids that can be included in the search.
+        """
+        self._queue = list([start_edge])
+        self._parent = dict()
+        self._candidate_lane_edge_ids = candidate_lane_edge_ids
+
+    def search(self, target_roadblock) -> Tuple[List, bool]:
+        """
+        Performs dijkstra's shortest path to find a route to the target roadblock.
+        :param target_roadblock: The target roadblock the path should end at.
+        :return: tuple of route and whether the target roadblock was reached
+        """
+        start_edge = self._queue[0]
+        path_found: bool = False
+        end_edge = start_edge
+
+        self._parent[start_edge.id] = None
+        frontier, dists, depths = [start_edge.id], [1], [1]
+        expanded, expanded_ids, expanded_dists, expanded_depths = [], [], [], []
+
+        while len(self._queue) > 0:
+            dist, idx = min((val, idx) for (idx, val) in enumerate(dists))
+            current_edge = self._queue[idx]
+            current_depth = depths[idx]
+            del dists[idx], self._queue[idx], frontier[idx], depths[idx]
+
+            if current_edge.get_roadblock_id() == target_roadblock.id:
+                end_edge = current_edge
+                path_found = True
+                break
+
+            expanded.append(current_edge)
+            expanded_ids.append(current_edge.id)
+            expanded_dists.append(dist)
+            expanded_depths.append(current_depth)
+
+            for next_edge in current_edge.outgoing_edges:
+                if next_edge.id not in self._candidate_lane_edge_ids:
+                    continue
+
+                alt = dist + next_edge.baseline_path.length
+                if next_edge.id not in expanded_ids and next_edge.id not in frontier:
+                    self._parent[next_edge.id] = current_edge
+                    self._queue.append(next_edge)
+                    frontier.append(next_edge.id)
+                    dists.append(alt)
+                    depths.append(current_depth + 1)
+                elif next_edge.id in frontier:
+                    next_edge_idx = frontier.index(next_edge.id)
+                    if alt < dists[next_edge_idx]:
+                        self._parent[next_edge.id] = current_edge
+                        dists[next_edge_idx] = alt
+                        depths[next_edge_idx] = current_depth + 1
+
+        if not path_found:
+            # shortest of the deepest expanded edges
+            max_depth = max(expanded_depths)
+            idx_max_depth = list(np.where(np.array(expanded_depths) == max_depth)[0])
+            dist_at_max_depth = [expanded_dists[i] for i in idx_max_depth]
+            _, _idx = min((val, idx) for (idx, val) in enumerate(dist_at_max_depth))
+            end_edge = expanded[idx_max_depth[_idx]]
+
+        path = [end_edge]
+        while self._parent[end_edge.id] is not None:
+            end_edge = self._parent[end_edge.id]
+            path.append(end_edge)
+        path.reverse()
+
+        return path, path_found
+
+
+class ObjectBreadthFirstSearchRoadBlock:
+    """
+    Reference of BreadthFirstSearchRoadBlock before the compiled roadblock graph,
+    which follows the edges of the map objects with string parent keys.
+    """
+
+    def __init__(self, start_roadblock_id: str, map_api, forward_search: bool = True):
+        """
+        Constructor of ObjectBreadthFirstSearchRoadBlock
+        :param start_roadblock_id: roadblock id where graph starts
+        :param map_api: map class in nuPlan
+        :param forward_search: whether to search in driving direction, defaults to True
+        """
+        block = map_api._get_roadblock(start_roadblock_id)
+        block = block or map_api._get_roadblock_connector(start_roadblock_id)
+        self._queue = deque([block, None])
+        self._parent = dict()
+        self._forward_search = forward_search
+
+    def search(
+        self, target_roadblock_id: Union[str, List[str]], max_depth: int
+    ) -> Tuple[Tuple[List, List[str]], bool]:
+        """
+        Apply BFS to find route to target roadblock.
+        :param target_roadblock_id: id of target roadblock
+        :param max_depth: maximum search depth
+        :return: tuple of route and whether a path was found
+        """
+        if isinstance(target_roadblock_id, str):
+            target_roadblock_id = [target_roadblock_id]
+
+        start_edge = self._queue[0]
+        path_found: bool = False
+        end_edge, end_depth, depth = start_edge, 1, 1
+        self._parent[start_edge.id + f"_{depth}"] = None
+
+        while self._queue:
+            current_edge = self._queue.popleft()
+            if depth > max_depth:
+                break
+
+            if current_edge is None:
+                depth += 1
+                self._queue.append(None)
+                if self._queue[0] is None:
+                    break
+                continue
+
+            if current_edge.id in target_roadblock_id:
+                end_edge, end_depth = current_edge, depth
+                path_found = True
+                break
+
+            neighbors = (
+                current_edge.outgoing_edges
+                if self._forward_search
+                else current_edge.incoming_edges
+            )
+            for next_edge in neighbors:
+                self._queue.append(next_edge)
+                self._parent[next_edge.id + f"_{depth + 1}"] = current_edge
+                end_edge, end_depth = next_edge, depth + 1
+
+        path, path_id = [end_edge], [end_edge.id]
+        while self._parent[end_edge.id + f"_{end_depth}"] is not None:
+            end_edge = self._parent[end_edge.id + f"_{end_depth}"]
+            path.append(end_edge)
+            path_id.append(end_edge.id)
+            end_depth -= 1
+
+        if self._forward_search:
+            path.reverse()
+            path_id.reverse()
+
+        return (path, path_id), path_found
+
+
+class SyntheticBaselinePath:
+    """Straight baseline path of a synthetic lane."""
+
+    def __init__(self, start_x: float, length: float, y: float):
+        self.length = length
+        self.discrete_path = [
+            StateSE2(x, y, 0.0) for x in np.linspace(start_x, start_x + length, 10)
+        ]
+
+
+class SyntheticLane:
+    """Lane with the interface of LaneGraphEdgeMapObject used by the graph searches."""
+
+    def __init__(
+        self, id: str, roadblock_id: str, baseline_path: SyntheticBaselinePath
+    ):
+        self.id = id
+        self.baseline_path = baseline_path
+        self.outgoing_edges: List[SyntheticLane] = []
+        self.incoming_edges: List[SyntheticLane] = []
+        self._roadblock_id = roadblock_id
+
+    def get_roadblock_id(self) -> str:
+        return self._roadblock_id
+
+
+class SyntheticRoadBlock:
+    """Roadblock with the interface of RoadBlockGraphEdgeMapObject used by the graph searches."""
+
+    def __init__(self, id: str, start_x: float, length: float):
+        self.id = id
+        self.start_x, self.length = start_x, length
+        self.interior_edges: List[SyntheticLane] = []
+        self.outgoing_edges: List[SyntheticRoadBlock] = []
+        self.incoming_edges: List[SyntheticRoadBlock] = []
+
+
+class SyntheticMap:
+    """
+    Map-api of roadblocks along the x-axis, each linked to its successor and to a few
+    random roadblocks ahead, with lanes linked to random lanes of linked roadblocks.
+    """
+
+    def __init__(self, rng: np.random.Generator, num_roadblocks: int, map_name: str):
+        self.map_name = map_name
+        self.roadblocks: List[SyntheticRoadBlock] = []
+
+        start_x = 0.0
+        for roadblock_idx in range(num_roadblocks):
+            roadblock = SyntheticRoadBlock(
+                str(roadblock_idx), start_x, rng.uniform(10.0, 50.0)
+            )
+            for lane_idx in range(rng.integers(1, 4)):
+                roadblock.interior_edges.append(
+                    SyntheticLane(
+                        f"{roadblock_idx}_{lane_idx}",
+                        roadblock.id,
+                        SyntheticBaselinePath(
+                            start_x,
+                            roadblock.length * rng.uniform(1.0, 1.5),
+                            3.5 * lane_idx,
+                        ),
+                    )
+                )
+            self.roadblocks.append(roadblock)
+            start_x += roadblock.length
+
+        for roadblock_idx, roadblock in enumerate(self.roadblocks[:-1]):
+            successor_idcs = {roadblock_idx + 1} | set(
+                rng.integers(
+                    roadblock_idx + 1,
+                    min(roadblock_idx + 20, num_roadblocks),
+                    rng.integers(0, 3),
+                ).tolist()
+            )
+            for successor_idx in sorted(successor_idcs):
+                self._link(roadblock, self.roadblocks[successor_idx], rng)
+
+        self._id_to_roadblock = {
+            roadblock.id: roadblock for roadblock in self.roadblocks
+        }
+
+    @staticmethod
+    def _link(
+        roadblock: SyntheticRoadBlock,
+        successor: SyntheticRoadBlock,
+        rng: np.random.Generator,
+    ) -> None:
+        roadblock.outgoing_edges.append(successor)
+        successor.incoming_edges.append(roadblock)
+        for lane in roadblock.interior_edges:
+            for successor_lane in successor.interior_edges:
+                if rng.random() < 0.6:
+                    lane.outgoing_edges.append(successor_lane)
+                    successor_lane.incoming_edges.append(lane)
+
+    def _get_roadblock(self, id: str) -> Optional[SyntheticRoadBlock]:
+        return self._id_to_roadblock.get(id)
+
+    def _get_roadblock_connector(self, id: str) -> Optional[SyntheticRoadBlock]:
+        return None
+
+    def get_proximal_map_objects(
+        self, point: Point2D, radius: float, layers: List[SemanticMapLayer]
+    ) -> Dict[SemanticMapLayer, List[SyntheticRoadBlock]]:
+        roadblocks = [
+            roadblock
+            for roadblock in self.roadblocks
+            if roadblock.start_x - radius
+            <= point.x
+            <= roadblock.start_x + roadblock.length + radius
+        ]
+        return {
+            SemanticMapLayer.ROADBLOCK: roadblocks,
+            SemanticMapLayer.ROADBLOCK_CONNECTOR: [],
+        }
+
+
+def random_dijkstra_search(
+    rng: np.random.Generator, map_api: SyntheticMap, ordered: bool = True
+) -> Tuple[SyntheticLane, List[str], SyntheticRoadBlock]:
+    """
+    Random lane search between two roadblocks, on 95% of the lanes.
+    :param rng: random generator
+    :param map_api: synthetic map
+    :param ordered: whether the target lies ahead of the start, otherwise random
+    :return: tuple of start lane, candidate lane ids and target roadblock
+    """
+    lanes = [
+        lane for roadblock in map_api.roadblocks for lane in roadblock.interior_edges
+    ]
+    roadblock_idcs = rng.integers(0, len(map_api.roadblocks), 2)
+    start_idx, target_idx = np.sort(roadblock_idcs) if ordered else roadblock_idcs
+    start_lane = map_api.roadblocks[start_idx].interior_edges[0]
+    candidate_lane_ids = [lane.id for lane in lanes if rng.random() < 0.95]
+    return start_lane, candidate_lane_ids, map_api.roadblocks[target_idx]
+
+
+def random_route(
+    rng: np.random.Generator, map_api: SyntheticMap
+) -> Tuple[EgoState, Dict[str, SyntheticRoadBlock]]:
+    """
+    Random long route with missing roadblocks and ego on or before the route.
+    :param rng: random generator
+    :param map_api: synthetic map
+    :return: tuple of ego state and route roadblock dictionary
+    """
+    start_idx = int(rng.integers(0, len(map_api.roadblocks) // 2))
+    route_roadblocks = [
+        roadblock for roadblock in map_api.roadblocks[start_idx:] if rng.random() < 0.9
+    ]
+    route_roadblock_dict = {roadblock.id: roadblock for roadblock in route_roadblocks}
+
+    ego_roadblock = map_api.roadblocks[max(start_idx - rng.integers(0, 3), 0)]
+    ego_state = EgoState.build_from_rear_axle(
+        rear_axle_pose=StateSE2(ego_roadblock.start_x + 1.0, 0.0, 0.0),
+        rear_axle_velocity_2d=StateVector2D(0.0, 0.0),
+        rear_axle_acceleration_2d=StateVector2D(0.0, 0.0),
+        tire_steering_angle=0.0,
+        time_point=TimePoint(0),
+        vehicle_parameters=get_pacifica_parameters(),
+    )
+    return ego_state, route_roadblock_dict
+
+
+class TestGraphSearch(unittest.TestCase):
+    """Parity of the heap and compiled graph searches with the list and object based references"""
+
+    def setUp(self) -> None:
+        """Synthetic maps of short and long routes"""
+        self.rng = np.random.default_rng(0)
+        self.maps = [
+            SyntheticMap(self.rng, num_roadblocks, f"test_synthetic_{num_roadblocks}")
+            for num_roadblocks in [50, 300]
+        ]
+
+    def test_dijkstra(self) -> None:
+        """Routes to targets ahead and unreachable targets match the list based search"""
+        for map_api in self.maps:
+            for search_idx in range(20):
+                (
+                    start_lane,
+                    candidate_lane_ids,
+                    target_roadblock,
+                ) = random_dijkstra_search(
+                    self.rng, map_api, ordered=search_idx % 4 != 0
+                )
+                route, path_found = ListDijkstra(start_lane, candidate_lane_ids).search(
+                    target_roadblock
+                )
+                heap_route, heap_path_found = Dijkstra(
+                    start_lane, candidate_lane_ids, lane_graph=get_lane_graph(map_api)
+                ).search(target_roadblock)
+
+                self.assertEqual(path_found, heap_path_found)
+                self.assertEqual(
+                    [lane.id for lane in route], [lane.id for lane in heap_route]
+                )
+
+    def test_bfs_roadblock(self) -> None:
+        """Forward and backward searches match the object based search"""
+        for map_api in self.maps:
+            num_roadblocks = len(map_api.roadblocks)
+            for forward_search in [True, False]:
+                for _ in range(20):
+                    start_id = str(self.rng.integers(0, num_roadblocks))
+                    target_ids = [
+                        str(idx)
+                        for idx in self.rng.integers(
+                            0, num_roadblocks, self.rng.integers(1, 4)
+                        )
+                    ]
+                    # the object based search has no visited set, its queue grows exponentially
+                    max_depth = int(self.rng.integers(1, 12))
+
+                    (path, path_id), path_found = ObjectBreadthFirstSearchRoadBlock(
+                        start_id, map_api, forward_search=forward_search
+                    ).search(target_ids, max_depth)
+                    (
+                        (compiled_path, compiled_path_id),
+                        compiled_path_found,
+                    ) = BreadthFirstSearchRoadBlock(
+                        start_id, map_api, forward_search=forward_search
+                    ).search(
+                        target_ids, max_depth
+                    )
+
+                    self.assertEqual(path_found, compiled_path_found)
+                    self.assertEqual(path_id, compiled_path_id)
+                    self.assertEqual(
+                        [roadblock.id for roadblock in path],
+                        [roadblock.id for roadblock in compiled_path],
+                    )
+
+    def test_route_roadblock_correction(self) -> None:
+        """Corrected routes match the correction with the object based search"""
+        for map_api in self.maps:
+            for _ in range(10):
+                ego_state, route_roadblock_dict = random_route(self.rng, map_api)
+                with patch.object(
+                    route_utils,
+                    "BreadthFirstSearchRoadBlock",
+                    ObjectBreadthFirstSearchRoadBlock,
+                ):
+                    route_ids = route_utils.route_roadblock_correction(
+                        ego_state, map_api, route_roadblock_dict
+                    )
+                compiled_route_ids = route_utils.route_roadblock_correction(
+                    ego_state, map_api, route_roadblock_dict
+                )
+                self.assertEqual(route_ids, compiled_route_ids)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -99,3 +99,70 @@ def convert_absolute_to_relative_se2_array(
     points_rel[:, 2] = normalize_angle(points_rel[:, 2])
 
     return points_rel
+
+
+def boxes_contain_points(
+    box_corners: npt.NDArray[np.float64], points: npt.NDArray[np.float64]
+) -> npt.NDArray[np.bool_]:
+    """
+    Vectorized point-in-box test for oriented boxes (or any convex quadrilaterals).
+    Points on the boundary are not contained (as in shapely's contains).
+    :param box_corners: corner coordinates in ring order, shape (boxes, 4, 2)
+    :param points: input-points, shape (points, 2)
+    :return: boolean array of shape (boxes, points)
+    """
+    edges = np.roll(box_corners, -1, axis=1) - box_corners  # (boxes, 4, 2)
+    to_points = (
+        points[None, None, :, :] - box_corners[:, :, None, :]
+    )  # (boxes, 4, points, 2)
+    cross = (
+        edges[:, :, None, 0] * to_points[..., 1]
+        - edges[:, :, None, 1] * to_points[..., 0]
+    )  # (boxes, 4, points)
+
+    # inside if on the same side of all edges, independent of the ring orientation
+    return np.logical_or(np.all(cross > 0, axis=1), np.all(cross < 0, axis=1))
+
+
+def boxes_intersect_boxes(
+    box_corners_a: npt.NDArray[np.float64], box_corners_b: npt.NDArray[np.float64]
+) -> npt.NDArray[np.bool_]:
+    """
+    Pairwise intersection of oriented boxes (or any convex quadrilaterals) with the separating axis theorem.
+    Touching boxes intersect (as in shapely's intersects). The coordinate axes are tested besides the edge normals,
+    which separates degenerate boxes (zero length or width, single points) without a normal along their extent.
+    :param box_corners_a: corner coordinates in ring order, shape (boxes_a, 4, 2)
+    :param box_corners_b: corner coordinates in ring order, shape (boxes_b, 4, 2)
+    :return: boolean array of shape (boxes_a, boxes_b)
+    """
+
+    def _edge_normals(box_corners: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        edges = np.roll(box_corners, -1, axis=1) - box_corners
+        return np.stack([-edges[..., 1], edges[..., 0]], axis=-1)  # (boxes, 4, 2)
+
+    # coordinate axes, i.e. bounding boxes
+    min_a, max_a = box_corners_a.min(axis=1), box_corners_a.max(axis=1)  # (a, 2)
+    min_b, max_b = box_corners_b.min(axis=1), box_corners_b.max(axis=1)  # (b, 2)
+    separated = np.logical_or(
+        max_a[:, None] < min_b[None, :], max_b[None, :] < min_a[:, None]
+    ).any(axis=-1)
+    for axes, axes_of_a in [
+        (_edge_normals(box_corners_a), True),
+        (_edge_normals(box_corners_b), False),
+    ]:
+        if axes_of_a:
+            # axes: (a, 4, 2) -> projections (a, 1, axes, corners) and (a, b, axes, corners)
+            proj_a = np.einsum("mkd,mjd->mkj", axes, box_corners_a)[:, None]
+            proj_b = np.einsum("mkd,njd->mnkj", axes, box_corners_b)
+        else:
+            # axes: (b, 4, 2) -> projections (a, b, axes, corners) and (1, b, axes, corners)
+            proj_a = np.einsum("nkd,mjd->mnkj", axes, box_corners_a)
+            proj_b = np.einsum("nkd,njd->nkj", axes, box_corners_b)[None]
+
+        gap = np.logical_or(
+            proj_a.max(axis=-1) < proj_b.min(axis=-1),
+            proj_b.max(axis=-1) < proj_a.min(axis=-1),
+        )  # (a, b, axes)
+        separated |= gap.any(axis=-1)
+
+    return ~separated
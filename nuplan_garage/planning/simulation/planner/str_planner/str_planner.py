@@ -70,6 +70,11 @@ class STRPlanner(AbstractPlanner):
         self.vehicle = get_pacifica_parameters()
         self.motion_model = KinematicBicycleModel(self.vehicle)
         # model initialization and configuration
+        exported_model_path = kwargs.get('exported_model_path', None)
+        if model is None and exported_model_path is not None:
+            # TorchScript model exported by transformer4planning.models.export, for faster cpu inference
+            from transformer4planning.models.export import ExportedSTR
+            model = ExportedSTR(exported_model_path)
         assert model is not None
         self.model = model
         scenario = kwargs.get('scenario', None)
@@ -147,44 +147,51 @@ class PGP(nn.Module):
     def aggregate(
         self, sampled_traversals, node_encodings, target_agent_encoding
     ) -> torch.Tensor:
+        """
+        Aggregates node encodings along unique sampled traversals, for the whole batch at once.
+        :param sampled_traversals: node indices of traversals, [batch_size, num_traversals, horizon]
+        :param node_encodings: tensor of node encodings provided by the encoder
+        :param target_agent_encoding: tensor encoding the target agent's past motion
+        :return: aggregated encodings, [batch_size, num_samples, agg_enc_size]
+        """
 
         # Useful variables:
-        batch_size = node_encodings.shape[0]
+        batch_size, num_traversals = sampled_traversals.shape[:2]
         max_nodes = node_encodings.shape[1]
-        # num_traversals = sampled_traversals.shape[1]
+        device = sampled_traversals.device
+
+        # Sort traversals of each sample lexicographically, as torch.unique(..., dim=0)
+        sorted_traversals = sort_traversals(
+            sampled_traversals, num_node_ids=2 * max_nodes
+        )
 
         # Get unique traversals and form consolidated batch:
-        counted_unique_traversals = [
-            torch.unique(i, dim=0, return_counts=True) for i in sampled_traversals
-        ]
-        unique_traversals = [i[0] for i in counted_unique_traversals]
-        traversal_counts = [i[1] for i in counted_unique_traversals]
+        is_unique = torch.ones(
+            batch_size, num_traversals, dtype=torch.bool, device=device
+        )
+        is_unique[:, 1:] = torch.any(
+            sorted_traversals[:, 1:] != sorted_traversals[:, :-1], dim=-1
+        )
+        # index of unique traversal in consolidated batch, for each sampled traversal
+        unique_idcs = is_unique.view(-1).cumsum(dim=0) - 1
+        traversal_counts = torch.bincount(unique_idcs)
+
         if self.keep_only_best_traversal:
             # only a single traversal is used and passed to the decoder
-            most_frequent_traversal_idcs = [
-                torch.argmax(traversal_counts_sample)
-                for traversal_counts_sample in traversal_counts
-            ]
-            best_traversals = [
-                unique_traversals[i][most_frequent_traversal_idx].unsqueeze(0)
-                for i, most_frequent_traversal_idx in enumerate(
-                    most_frequent_traversal_idcs
-                )
-            ]
-            traversal_counts = [
-                torch.tensor([self.num_samples], device=sampled_traversals.device)
-                for _ in traversal_counts
-            ]
-            unique_traversals = best_traversals
-
-        traversals_batched = torch.cat(unique_traversals, dim=0)
-        counts_batched = torch.cat(traversal_counts, dim=0)
-        batch_idcs = torch.cat(
-            [
-                j * torch.ones(len(count)).long()
-                for j, count in enumerate(traversal_counts)
+            counts = torch.where(
+                is_unique,
+                traversal_counts[unique_idcs].view(batch_size, num_traversals),
+                0,
+            )
+            most_frequent_traversal_idcs = torch.argmax(counts, dim=1)
+            traversals_batched = sorted_traversals[
+                torch.arange(batch_size, device=device), most_frequent_traversal_idcs
             ]
-        )
+            batch_idcs = torch.arange(batch_size, device=device)
+            unique_idcs = batch_idcs.repeat_interleave(self.num_samples)
+        else:
+            traversals_batched = sorted_traversals[is_unique]
+            batch_idcs = torch.nonzero(is_unique)[:, 0]
         batch_idcs = batch_idcs.unsqueeze(1).repeat(1, self.horizon)
 
         # Dummy encodings for goal nodes
@@ -207,11 +214,7 @@ class PGP(nn.Module):
         att_op, _ = self.mha(query, keys, vals, key_padding_mask)
 
         # Repeat based on counts
-        att_op = (
-            att_op.squeeze(0)
-            .repeat_interleave(counts_batched, dim=0)
-            .view(batch_size, self.num_samples, -1)
-        )
+        att_op = att_op.squeeze(0)[unique_idcs].view(batch_size, self.num_samples, -1)
 
         # Concatenate target agent encoding
         agg_enc = torch.cat(
@@ -412,3 +415,36 @@ class PGP(nn.Module):
         input_exp[:, :, -1] += torch.as_tensor(input_exp_sum == 0).float().squeeze(-1)
         input_exp_sum = input_exp.sum(dim=dim, keepdim=True)
         return input_exp / input_exp_sum
+
+
+def sort_traversals(traversals: torch.Tensor, num_node_ids: int) -> torch.Tensor:
+    """
+    Sorts traversals of each sample lexicographically. Node sequences are encoded into few integer keys,
+        which are sorted with a stable radix sort (starting with the least significant key).
+    :param traversals: node indices of traversals, [batch_size, num_traversals, horizon]
+    :param num_node_ids: upper bound (exclusive) of node indices
+    :return: sorted traversals, [batch_size, num_traversals, horizon]
+    """
+    horizon = traversals.shape[-1]
+
+    # number of nodes per key, s.t. keys do not overflow int64
+    nodes_per_key = 1
+    while num_node_ids ** (nodes_per_key + 1) < 2**63:
+        nodes_per_key += 1
+
+    order = None
+    for key_start in reversed(range(0, horizon, nodes_per_key)):
+        key_nodes = traversals[..., key_start : key_start + nodes_per_key].long()
+        weights = num_node_ids ** torch.arange(
+            key_nodes.shape[-1] - 1, -1, -1, device=traversals.device
+        )
+        keys = (key_nodes * weights).sum(dim=-1)
+        if order is None:
+            order = torch.argsort(keys, dim=1, stable=True)
+        else:
+            order = order.take_along_dim(
+                torch.argsort(keys.take_along_dim(order, dim=1), dim=1, stable=True),
+                dim=1,
+            )
+
+    return traversals.take_along_dim(order.unsqueeze(-1), dim=1)
@@ -28,6 +28,7 @@ class LVM(nn.Module):
         encoding_size: int Dimension of encoded scene + agent context
         hidden_size: int Size of output mlp hidden layer
         num_clusters: int Number of final clustered trajectories to output
+        use_ray: bool Whether to cluster with scikit-learn in ray workers, instead of batched k-means on the device
         """
         super().__init__()
         if agg_type not in ["combined", "sample_specific"]:
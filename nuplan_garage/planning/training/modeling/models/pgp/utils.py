@@ -1,16 +1,10 @@
+from typing import Tuple
+
 import numpy as np
-import ray
 import torch
-from nuplan.common.actor_state.ego_state import EgoState
-from nuplan.common.actor_state.state_representation import (
-    ProgressStateSE2,
-    StateVector2D,
-)
+import torch.nn.functional as F
 from nuplan.common.actor_state.vehicle_parameters import get_pacifica_parameters
-from nuplan.planning.simulation.path.interpolated_path import InterpolatedPath
-from scipy.interpolate._bsplines import make_interp_spline
 from scipy.spatial.distance import cdist
-from sklearn.cluster import KMeans
 
 
 def bivariate_gaussian_activation(ip: torch.Tensor) -> torch.Tensor:
@@ -29,15 +23,11 @@ def bivariate_gaussian_activation(ip: torch.Tensor) -> torch.Tensor:
     return out
 
 
-@ray.remote
-def cluster_and_rank_ray(k: int, data: np.ndarray, random_state: int = None):
-    return cluster_and_rank(k, data, random_state)
-
-
 def cluster_and_rank(k: int, data: np.ndarray, random_state: int = None):
     """
     Combines the clustering and ranking steps so that ray.remote gets called just once
     """
+    from sklearn.cluster import KMeans
 
     def cluster(n_clusters: int, x: np.ndarray, random_state=None):
         """
@@ -101,6 +91,154 @@ def cluster_and_rank(k: int, data: np.ndarray, random_state: int = None):
     return {"lbls": cluster_lbls, "ranks": cluster_ranks, "counts": cluster_cnts}
 
 
+def batched_kmeans(
+    k: int,
+    data: torch.Tensor,
+    num_iterations: int = 30,
+    random_state: int = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Clusters all samples in parallel with k-means, initialized with k-means++ and a fixed number of iterations.
+        Empty clusters are relocated to the points farthest from their cluster center (as in scikit-learn).
+    :param k: number of clusters
+    :param data: points to cluster, shape [batch_size, num_points, dim]
+    :param num_iterations: number of iterations (without early stopping)
+    :param random_state: seed for initialization
+    :return: labels: cluster of each point, shape [batch_size, num_points]
+             cluster_centers: shape [batch_size, k, dim]
+    """
+    batch_size, num_points, _ = data.shape
+    device = data.device
+    batch_idcs = torch.arange(batch_size, device=device)
+    generator = torch.Generator(device=device)
+    if random_state is None:
+        generator.seed()
+    else:
+        generator.manual_seed(random_state)
+
+    # k-means++ initialization: sample centers proportional to squared distance to closest center
+    center_idcs = torch.randint(
+        num_points, (batch_size,), generator=generator, device=device
+    )
+    cluster_centers = [data[batch_idcs, center_idcs]]
+    min_sq_dists = ((data - cluster_centers[0][:, None]) ** 2).sum(dim=-1)
+    for _ in range(1, k):
+        weights = torch.where(
+            min_sq_dists.sum(dim=-1, keepdim=True) > 0,
+            min_sq_dists,
+            torch.ones_like(min_sq_dists),
+        )
+        center_idcs = torch.multinomial(weights, 1, generator=generator).squeeze(-1)
+        cluster_centers.append(data[batch_idcs, center_idcs])
+        min_sq_dists = torch.minimum(
+            min_sq_dists, ((data - cluster_centers[-1][:, None]) ** 2).sum(dim=-1)
+        )
+    cluster_centers = torch.stack(cluster_centers, dim=1)
+
+    labels = _assign_clusters(data, cluster_centers)
+    for _ in range(num_iterations):
+        cluster_counts = torch.zeros(
+            batch_size, k, dtype=data.dtype, device=device
+        ).scatter_add_(1, labels, torch.ones_like(data[..., 0]))
+        cluster_centers = torch.zeros_like(cluster_centers).scatter_add_(
+            1, labels[..., None].expand_as(data), data
+        )
+        cluster_centers = cluster_centers / cluster_counts.clamp(min=1)[..., None]
+        labels = _assign_clusters(data, cluster_centers)
+
+    return labels, cluster_centers
+
+
+def _assign_clusters(data: torch.Tensor, cluster_centers: torch.Tensor) -> torch.Tensor:
+    """
+    Assigns points to closest cluster center. Empty clusters get assigned the points
+        farthest from their cluster centers instead.
+    :param data: shape [batch_size, num_points, dim]
+    :param cluster_centers: shape [batch_size, k, dim]
+    :return: labels: shape [batch_size, num_points]
+    """
+    batch_size, num_points, _ = data.shape
+    k = cluster_centers.shape[1]
+
+    sq_dists = (
+        (data**2).sum(dim=-1, keepdim=True)
+        - 2 * data @ cluster_centers.transpose(1, 2)
+        + (cluster_centers**2).sum(dim=-1)[:, None, :]
+    )
+    min_sq_dists, labels = sq_dists.min(dim=-1)
+
+    # relocate empty clusters, points are scattered into a dummy column for non-empty clusters
+    cluster_counts = torch.zeros_like(cluster_centers[..., 0]).scatter_add_(
+        1, labels, torch.ones_like(min_sq_dists)
+    )
+    empty = cluster_counts == 0
+    farthest_points = min_sq_dists.topk(k, dim=-1).indices
+    relocated_points = farthest_points.take_along_dim(
+        (empty.cumsum(dim=-1) - 1).clamp(min=0), dim=-1
+    )
+    cluster_ids = torch.arange(k, device=data.device).expand(batch_size, k)
+    labels = torch.cat([labels, labels[:, :1]], dim=1).scatter(
+        1, torch.where(empty, relocated_points, num_points), cluster_ids
+    )
+
+    return labels[:, :num_points]
+
+
+def batched_rank_clusters(
+    cluster_counts: torch.Tensor, cluster_centers: torch.Tensor
+) -> torch.Tensor:
+    """
+    Rank the K clustered trajectories using Ward's criterion, as in cluster_and_rank, for all samples at once.
+    Find the two clusters to merge based on Ward's criterion. Smaller of the two will get assigned rank K.
+    Merge the two clusters. Repeat process to assign ranks K-1, K-2, ..., 2.
+    :param cluster_counts: number of points per cluster, shape [batch_size, k]
+    :param cluster_centers: shape [batch_size, k, dim]
+    :return: ranks: shape [batch_size, k]
+    """
+    batch_size, num_clusters = cluster_counts.shape
+    device = cluster_counts.device
+    batch_idcs = torch.arange(batch_size, device=device)
+    cluster_counts = cluster_counts.double()
+    cluster_centers = cluster_centers.double()
+
+    ranks = torch.ones(batch_size, num_clusters, dtype=torch.float64, device=device)
+    merged = torch.zeros(batch_size, num_clusters, dtype=torch.bool, device=device)
+    diagonal = torch.eye(num_clusters, dtype=torch.bool, device=device)
+
+    for i in range(num_clusters, 1, -1):
+        # Compute Ward distances:
+        centroid_dists = torch.norm(
+            cluster_centers[:, :, None] - cluster_centers[:, None], dim=-1
+        )
+        n1 = cluster_counts[:, None, :]
+        n2 = cluster_counts[:, :, None]
+        wts = n1 * n2 / (n1 + n2).clamp(min=1)
+        dists = (wts * centroid_dists).masked_fill(
+            diagonal | merged[:, None, :] | merged[:, :, None], float("inf")
+        )
+
+        # Get clusters with min Ward distance and select cluster with fewer counts
+        min_idcs = dists.view(batch_size, -1).argmin(dim=-1)
+        c1, c2 = min_idcs // num_clusters, min_idcs % num_clusters
+        c1_is_smaller = cluster_counts[batch_idcs, c1] <= cluster_counts[batch_idcs, c2]
+        c = torch.where(c1_is_smaller, c1, c2)
+        c_ = torch.where(c1_is_smaller, c2, c1)
+
+        # Assign rank i to selected cluster
+        ranks[batch_idcs, c] = i
+
+        # Merge clusters and discard merged cluster
+        counts, counts_ = cluster_counts[batch_idcs, c], cluster_counts[batch_idcs, c_]
+        cluster_centers[batch_idcs, c_] = (
+            counts_[:, None] * cluster_centers[batch_idcs, c_]
+            + counts[:, None] * cluster_centers[batch_idcs, c]
+        ) / (counts_ + counts)[:, None]
+        cluster_counts[batch_idcs, c_] = counts_ + counts
+        merged[batch_idcs, c] = True
+
+    return ranks
+
+
 def cluster_traj(
     k: int, traj: torch.Tensor, use_ray: bool = False, random_state: int = None
 ):
@@ -108,6 +246,8 @@ def cluster_traj(
     clusters sampled trajectories to output K modes.
     :param k: number of clusters
     :param traj: set of sampled trajectories, shape [batch_size, num_samples, traj_len, 2]
+    :param use_ray: whether to cluster with scikit-learn in ray workers instead of batched k-means on the device
+    :param random_state: seed for initialization of clustering
     :return: traj_clustered:  set of clustered trajectories, shape [batch_size, k, traj_len, 2]
              scores: scores for clustered trajectories (basically 1/rank), shape [batch_size, k]
     """
@@ -120,23 +260,26 @@ def cluster_traj(
 
     # Down-sample traj along time dimension for faster clustering
     data = traj[:, :, 0::3, :]
-    data = data.reshape(batch_size, num_samples, -1).detach().cpu().numpy()
+    data = data.reshape(batch_size, num_samples, -1).detach()
 
     # Cluster and rank
     if use_ray:
+        import ray
+
+        cluster_and_rank_ray = ray.remote(cluster_and_rank)
         cluster_ops = ray.get(
             [
                 cluster_and_rank_ray.remote(k, data_slice, random_state)
-                for data_slice in data
+                for data_slice in data.cpu().numpy()
             ]
         )
+        cluster_lbls = np.array([cluster_op["lbls"] for cluster_op in cluster_ops])
+        cluster_counts = np.array([cluster_op["counts"] for cluster_op in cluster_ops])
+        cluster_ranks = np.array([cluster_op["ranks"] for cluster_op in cluster_ops])
     else:
-        cluster_ops = [
-            cluster_and_rank(k, data_slice, random_state) for data_slice in data
-        ]
-    cluster_lbls = np.array([cluster_op["lbls"] for cluster_op in cluster_ops])
-    cluster_counts = np.array([cluster_op["counts"] for cluster_op in cluster_ops])
-    cluster_ranks = np.array([cluster_op["ranks"] for cluster_op in cluster_ops])
+        cluster_lbls, cluster_ctrs = batched_kmeans(k, data, random_state=random_state)
+        cluster_counts = F.one_hot(cluster_lbls, k).sum(dim=1)
+        cluster_ranks = batched_rank_clusters(cluster_counts, cluster_ctrs)
 
     # Compute mean (clustered) traj and scores
     lbls = (
@@ -162,6 +305,41 @@ def cluster_traj(
     return traj_clustered, scores
 
 
+def _spline_second_derivatives(
+    values: torch.Tensor, initial_slopes: torch.Tensor
+) -> torch.Tensor:
+    """
+    Computes second derivatives at the knots of cubic splines through values at unit spaced knots,
+        with given first derivative at the first knot and vanishing second derivative at the last knot.
+    :param values: [..., num_knots]
+    :param initial_slopes: [...]
+    :return: [..., num_knots]
+    """
+    num_knots = values.shape[-1]
+    system = torch.zeros(
+        [num_knots, num_knots], dtype=values.dtype, device=values.device
+    )
+    rhs = torch.zeros_like(values)
+
+    # first knot: clamped boundary condition
+    system[0, 0], system[0, 1] = 2.0, 1.0
+    rhs[..., 0] = 6.0 * (values[..., 1] - values[..., 0] - initial_slopes)
+
+    # interior knots: continuous first derivative
+    interior = torch.arange(1, num_knots - 1, device=values.device)
+    system[interior, interior - 1] = 1.0
+    system[interior, interior] = 4.0
+    system[interior, interior + 1] = 1.0
+    rhs[..., 1:-1] = 6.0 * (
+        values[..., 2:] - 2.0 * values[..., 1:-1] + values[..., :-2]
+    )
+
+    # last knot: natural boundary condition
+    system[-1, -1] = 1.0
+
+    return torch.linalg.solve(system, rhs.unsqueeze(-1)).squeeze(-1)
+
+
 def waypoints_to_trajectory(
     waypoints: torch.Tensor, current_velocity: torch.Tensor, supersampling_ratio=100
 ) -> torch.Tensor:
@@ -172,78 +350,58 @@ def waypoints_to_trajectory(
         The x-axis is assumed to be the cars longitudinal axis, and the y-axis is assumed to point to the left in direction of travel
     Note:
         Gradients are preserved for waypoints. Heading is calculated without gradient information.
-    :waypoints: [batch_size, num_poses, 2]
-    :current_velocity: [batch_size]
+        All samples (and modes) are processed at once on the device of the waypoints.
+    :waypoints: [batch_size, (num_modes,) num_poses, 2]
+    :current_velocity: [batch_size, (num_modes)]
     :supersampling_ratio: number of intermediate waypoints per original waypoint
-    :returns: [batch_size, num_poses, 3]
+    :returns: [batch_size, (num_modes,) num_poses, 3]
     """
-    batch_size = waypoints.shape[0]
-    device = waypoints.device
+    stationary_points = waypoints[..., 0] < 0.2
+    waypoints = waypoints.masked_fill(stationary_points.unsqueeze(-1), 0.0)
     # prepend current ego position
-    initial_position = torch.zeros([2], device=device).expand([batch_size, 1, 2])
-    stationary_points = waypoints[:, :, 0] < 0.2
-    waypoints[stationary_points] = 0.0
-    waypoints = torch.cat([initial_position, waypoints], dim=1)
-    # need to move waypoints to cpu for interpolation. Original tensor is kept to preserve gradients.
-    current_velocity_cpu = current_velocity.detach().cpu()
-    waypoints_cpu = waypoints.detach().cpu()
-    num_waypoints = waypoints.shape[-2]
-
-    time_steps_orig = torch.arange(0, num_waypoints)
-    time_steps_interp = torch.arange(
-        0, num_waypoints - 1 + 1.0 / supersampling_ratio, 1.0 / supersampling_ratio
-    )
-    output_slice = slice(
-        0, (num_waypoints - 1) * supersampling_ratio + 1, supersampling_ratio
-    )
+    initial_position = torch.zeros_like(waypoints[..., :1, :])
+    waypoints = torch.cat([initial_position, waypoints], dim=-2)
 
-    trajectories = []
-    for sample_idx in range(batch_size):
-        x_interp_func = make_interp_spline(
-            time_steps_orig,
-            waypoints_cpu[sample_idx, :, 0],
-            k=3,
-            bc_type=([(1, current_velocity_cpu[sample_idx])], [(2, 0.0)]),
+    with torch.no_grad():
+        # splines of x and y over time steps, in double precision as with scipy
+        knots = waypoints.detach().double().transpose(-1, -2)
+        initial_slopes = torch.stack(
+            [
+                current_velocity.detach().double().expand(knots.shape[:-2]),
+                torch.zeros(knots.shape[:-2], dtype=knots.dtype, device=knots.device),
+            ],
+            dim=-1,
         )
-
-        y_interp_func = make_interp_spline(
-            time_steps_orig,
-            waypoints_cpu[sample_idx, :, 1],
-            k=3,
-            bc_type=([(1, 0.0)], [(2, 0.0)]),
+        second_derivatives = _spline_second_derivatives(knots, initial_slopes)
+
+        # yaw of supersampled spline at each waypoint, i.e. direction from last intermediate waypoint
+        step = 1.0 / supersampling_ratio
+        last_intermediate = (
+            second_derivatives[..., :-1] * step**3 / 6.0
+            + second_derivatives[..., 1:] * (1.0 - step) ** 3 / 6.0
+            + (knots[..., :-1] - second_derivatives[..., :-1] / 6.0) * step
+            + (knots[..., 1:] - second_derivatives[..., 1:] / 6.0) * (1.0 - step)
         )
-
-        x_interp = torch.tensor(x_interp_func(time_steps_interp), device=device)
-        y_interp = torch.tensor(y_interp_func(time_steps_interp), device=device)
-        yaw_interp = torch.cat(
-            [
-                torch.tensor([0], device=device),
-                torch.atan2(y_interp[1:] - y_interp[:-1], x_interp[1:] - x_interp[:-1]),
-            ]
+        delta = knots[..., 1:] - last_intermediate
+        yaw = torch.atan2(delta[..., 1, :], delta[..., 0, :]).to(waypoints.dtype)
+        yaw = torch.cat([torch.zeros_like(yaw[..., :1]), yaw], dim=-1)
+
+    poses = torch.cat([waypoints, yaw.unsqueeze(-1)], dim=-1)
+
+    # Surpress noise when ego is not moving
+    MINIMAL_TRAVELED_DISTANCE = 0.5
+    valid_poses = [poses[..., 0, :]]
+    for pose in poses.unbind(dim=-2)[1:]:
+        traveled_distance = torch.norm(valid_poses[-1][..., :2] - pose[..., :2], dim=-1)
+        last_valid_pose = torch.where(
+            (traveled_distance > MINIMAL_TRAVELED_DISTANCE).unsqueeze(-1),
+            pose,
+            valid_poses[-1],
         )
+        valid_poses.append(last_valid_pose)
+    trajectories = torch.stack(valid_poses[1:], dim=-2)
 
-        yaw = yaw_interp[output_slice]
-
-        poses = torch.cat([waypoints[sample_idx], yaw.unsqueeze(-1)], dim=-1)
-
-        # Surpress noise when ego is not moving
-        MINIMAL_TRAVELED_DISTANCE = 0.5
-        valid_poses = [poses[0]]
-        for pose in poses[1:]:
-            traveled_distance = torch.norm(valid_poses[-1][:2] - pose[:2], p=2)
-            last_valid_pose = (
-                pose
-                if traveled_distance > MINIMAL_TRAVELED_DISTANCE
-                else valid_poses[-1]
-            )
-            valid_poses.append(last_valid_pose)
-        poses = torch.stack(valid_poses)
-
-        trajectories.append(poses[1:])
-
-    trajectories = torch.stack(trajectories)
-    trajectories[stationary_points, :] = 0.0
-    return trajectories
+    return trajectories.masked_fill(stationary_points.unsqueeze(-1), 0.0)
 
 
 def get_traversal_coordinates(
@@ -283,107 +441,135 @@ def get_traversal_coordinates(
     return traversal_coordinates
 
 
-def smooth_centerline_trajectory(trajectories: torch.Tensor):
+def smooth_centerline_trajectory(trajectories: torch.Tensor) -> torch.Tensor:
     """
-    trajectories: [batch_size, num_poses, 3]
+    Smooths trajectories by interpreting the poses as a path of rear-axle poses.
+        Each pose is replaced by the rear-axle pose of a vehicle, whose center is located on that path
+        rear_axle_to_center ahead of the original pose. All trajectories are processed at once on their device.
+    :param trajectories: [batch_size, (num_modes,) num_poses, 3]
+    :return: [batch_size, (num_modes,) num_poses, 3]
     """
     traj_shape = trajectories.shape
     assert torch.all(torch.isfinite(trajectories)), f"nans / infs in {trajectories}"
     device = trajectories.device
-    batch_size = trajectories.shape[0]
-    vehicle_parameters = get_pacifica_parameters()
+    rear_axle_to_center = get_pacifica_parameters().rear_axle_to_center
 
     # append current position
+    trajectories = trajectories.reshape(-1, *traj_shape[-2:])
     trajectories = torch.cat(
-        [torch.zeros([batch_size, 1, 3], device=device), trajectories], dim=1
+        [torch.zeros_like(trajectories[:, :1, :]), trajectories], dim=1
     )
-    smoothed_trajectories = []
-    for trajectory in trajectories:
-        _, idxs = np.unique(
-            trajectory.detach().cpu().numpy(), axis=0, return_index=True
-        )
-        idxs = np.sort(idxs)
-        unique_waypoints = trajectory[idxs, :]
-        if unique_waypoints.shape[0] == 1:
-            # only one unique point -> cannot interpolate
-            # and no smoothing necessary
-            smoothed_trajectories.append(trajectory[1:, :])
-        else:
-            original_waypoints_progress = [
-                torch.norm(current_waypoint[:2] - last_waypoint[:2], p=2)
-                for last_waypoint, current_waypoint in zip(
-                    trajectory[:-1], trajectory[1:]
-                )
-            ]
-            original_waypoints_progress = list(np.cumsum(original_waypoints_progress))
-            # remove duplicate points as they can cause nans
-            unique_waypoints_progress = [
-                torch.norm(current_waypoint[:2] - last_waypoint[:2], p=2)
-                for last_waypoint, current_waypoint in zip(
-                    unique_waypoints[:-1], unique_waypoints[1:]
-                )
-            ]
-            unique_waypoints_progress = list(np.cumsum(unique_waypoints_progress))
-            predicted_rear_axle_trajectory = [
-                ProgressStateSE2(
-                    x=current_waypoint[0],
-                    y=current_waypoint[1],
-                    heading=current_waypoint[2],
-                    progress=prog,
-                )
-                for current_waypoint, prog in zip(
-                    unique_waypoints[1:], unique_waypoints_progress
-                )
-            ]
-            # append a state to make sure path is long enough to sample all center states
-            final_heading = unique_waypoints[-1, 2]
-            extrapolated_point = (
-                unique_waypoints[-1, :]
-                + torch.tensor([torch.cos(final_heading), torch.sin(final_heading), 0])
-                * vehicle_parameters.rear_axle_to_center
-            )
-            predicted_rear_axle_trajectory.append(
-                ProgressStateSE2(
-                    x=extrapolated_point[0],
-                    y=extrapolated_point[1],
-                    heading=trajectory[-1, 2],
-                    progress=predicted_rear_axle_trajectory[-1].progress
-                    + vehicle_parameters.rear_axle_to_center,
-                )
-            )
-            predicted_rear_axle_trajectory = InterpolatedPath(
-                path=predicted_rear_axle_trajectory
-            )
-            # infer_centerline trajectory by moving states along the path
-            # note: last progress is excluded as this refers to an appended state
-            infered_smooth_centerline_trajectory = [
-                predicted_rear_axle_trajectory.get_state_at_progress(
-                    p + vehicle_parameters.rear_axle_to_center
-                )
-                for p in original_waypoints_progress
-            ]
-            infered_smooth_centerline_trajectory = [
-                EgoState.build_from_center(
-                    center=state,
-                    center_acceleration_2d=StateVector2D(0, 0),
-                    center_velocity_2d=StateVector2D(0, 0),
-                    tire_steering_angle=0.0,
-                    time_point=None,
-                    vehicle_parameters=vehicle_parameters,
-                )
-                for state in infered_smooth_centerline_trajectory
-            ]
-            smooth_rear_axle_trajectory = [
-                torch.tensor(
-                    [e.rear_axle.x, e.rear_axle.y, e.center.heading], device=device
-                )
-                for e in infered_smooth_centerline_trajectory
-            ]
-            smoothed_trajectories.append(torch.stack(smooth_rear_axle_trajectory))
-            assert not torch.all(
-                trajectory[1:, :] == torch.stack(smooth_rear_axle_trajectory)
-            ), f"{trajectory}, {torch.stack(smooth_rear_axle_trajectory)}"
-    smoothed_trajectories = torch.stack(smoothed_trajectories)
+    num_waypoints = trajectories.shape[1]
+
+    # remove duplicate points as they can cause nans, i.e. keep first occurrence of each waypoint
+    duplicates = (
+        (trajectories[:, :, None, :] == trajectories[:, None, :, :])
+        .all(dim=-1)
+        .tril(diagonal=-1)
+        .any(dim=-1)
+    )
+    num_unique = (~duplicates).sum(dim=-1, keepdim=True)
+    unique_order = torch.argsort(duplicates.int(), dim=-1, stable=True)
+    unique_waypoints = trajectories.take_along_dim(unique_order[..., None], dim=1)
+
+    original_waypoints_progress = torch.norm(
+        trajectories[:, 1:, :2] - trajectories[:, :-1, :2], dim=-1
+    ).cumsum(dim=-1)
+    unique_waypoints_progress = torch.norm(
+        unique_waypoints[:, 1:, :2] - unique_waypoints[:, :-1, :2], dim=-1
+    ).cumsum(dim=-1)
+
+    # path of unique waypoints (without current position) and an appended state,
+    # to make sure path is long enough to sample all center states
+    last_idcs = num_unique - 1
+    node_idcs = torch.arange(num_waypoints, device=device)[None, :]
+    is_appended = node_idcs == last_idcs
+    is_padding = node_idcs > last_idcs
+
+    final_waypoint = unique_waypoints.take_along_dim(last_idcs[..., None], dim=1)
+    final_heading = final_waypoint[..., 2]
+    appended_xy = final_waypoint[..., :2] + rear_axle_to_center * torch.stack(
+        [torch.cos(final_heading), torch.sin(final_heading)], dim=-1
+    )
+    appended_progress = (
+        unique_waypoints_progress.take_along_dim((last_idcs - 1).clamp(min=0), dim=1)
+        + rear_axle_to_center
+    )
+
+    path_xy = torch.where(
+        is_appended[..., None],
+        appended_xy,
+        torch.cat([unique_waypoints[:, 1:, :2], appended_xy], dim=1),
+    )
+    path_heading = torch.where(
+        is_appended,
+        trajectories[:, -1:, 2],
+        torch.cat([unique_waypoints[:, 1:, 2], final_heading], dim=1),
+    )
+    path_progress = torch.cat([unique_waypoints_progress, appended_progress], dim=1)
+    path_progress = torch.where(is_appended, appended_progress, path_progress)
+    path_progress = path_progress.masked_fill(is_padding, float("inf"))
+
+    # unwrap path heading for interpolation, as np.unwrap
+    heading_diffs = path_heading.diff(dim=-1)
+    wrapped_diffs = torch.remainder(heading_diffs + np.pi, 2 * np.pi) - np.pi
+    wrapped_diffs = torch.where(
+        (wrapped_diffs == -np.pi) & (heading_diffs > 0), np.pi, wrapped_diffs
+    )
+    heading_corrections = torch.where(
+        heading_diffs.abs() < np.pi, 0.0, wrapped_diffs - heading_diffs
+    )
+    path_heading = path_heading + torch.cat(
+        [torch.zeros_like(path_heading[:, :1]), heading_corrections.cumsum(dim=-1)],
+        dim=1,
+    )
+    path_states = torch.cat([path_xy, path_heading[..., None]], dim=-1)
+
+    # infer centerline states by moving states along the path, with linear interpolation
+    # note: progress is clipped to the path, which is only necessary for degenerated trajectories
+    center_progress = original_waypoints_progress + rear_axle_to_center
+    center_progress = torch.minimum(
+        torch.maximum(center_progress, path_progress[:, :1]), appended_progress
+    )
+    upper_idcs = torch.searchsorted(
+        path_progress.detach().contiguous(), center_progress.detach().contiguous()
+    )
+    upper_idcs = torch.minimum(upper_idcs.clamp(min=1), last_idcs)
+    lower_idcs = (upper_idcs - 1).clamp(min=0)
+
+    lower_progress = path_progress.take_along_dim(lower_idcs, dim=1)
+    progress_delta = path_progress.take_along_dim(upper_idcs, dim=1) - lower_progress
+    weights = (center_progress - lower_progress) / torch.where(
+        progress_delta > 0, progress_delta, torch.ones_like(progress_delta)
+    )
+    lower_states = path_states.take_along_dim(lower_idcs[..., None], dim=1)
+    upper_states = path_states.take_along_dim(upper_idcs[..., None], dim=1)
+    center_states = lower_states + weights[..., None] * (upper_states - lower_states)
+
+    # rear-axle of vehicle with inferred center state
+    center_heading = torch.remainder(center_states[..., 2] + np.pi, 2 * np.pi) - np.pi
+    smoothed_trajectories = torch.stack(
+        [
+            center_states[..., 0] - rear_axle_to_center * torch.cos(center_heading),
+            center_states[..., 1] - rear_axle_to_center * torch.sin(center_heading),
+            center_heading,
+        ],
+        dim=-1,
+    )
+
+    # only one unique point -> cannot interpolate and no smoothing necessary
+    single_point = num_unique[..., None] == 1
+    smoothed_trajectories = torch.where(
+        single_point, trajectories[:, 1:, :], smoothed_trajectories
+    )
+    unchanged = (
+        (trajectories[:, 1:, :] == smoothed_trajectories).all(dim=-1).all(dim=-1)
+    )
+    assert not torch.any(
+        unchanged & ~single_point[:, 0, 0]
+    ), f"{trajectories[unchanged]}, {smoothed_trajectories[unchanged]}"
+
+    smoothed_trajectories = smoothed_trajectories.reshape(traj_shape)
     assert torch.all(
         torch.isfinite(smoothed_trajectories)
     ), f"""
@@ -1,7 +1,11 @@
+import gzip
 import logging
 import pathlib
-from concurrent.futures import Future
-from typing import List, Optional, Union
+import pickle
+import queue
+import threading
+from concurrent.futures import Future, wait
+from typing import Any, BinaryIO, Dict, List, Optional, Union
 
 from nuplan.common.utils.s3_utils import is_s3_path
 from nuplan.planning.scenario_builder.abstract_scenario import AbstractScenario
@@ -13,8 +17,187 @@ from nuplan.planning.simulation.simulation_setup import SimulationSetup
 from nuplan.planning.simulation.trajectory.abstract_trajectory import AbstractTrajectory
 from nuplan.planning.utils.multithreading.worker_pool import Task, WorkerPool
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
 logger = logging.getLogger(__name__)
 
+# streamed logs are a sequence of pickled records: a header with the scenario, one record per simulation step and
+# a trailer with the remaining history attributes, written only when the simulation ended successfully
+STREAM_SUFFIX = ".stream.pkl"
+STREAM_CODEC_SUFFIXES = {"zstd": ".zst", "lz4": ".lz4", "gzip": ".gz"}
+STREAM_VERSION = 1
+# bounded number of pending records per simulation, the simulation blocks when the writer falls behind
+STREAM_QUEUE_SIZE = 256
+
+_STOP = object()
+
+
+def get_stream_codec(compression: str = "auto") -> str:
+    """
+    Resolves the codec of streamed logs, "auto" picks the fastest codec available.
+    :param compression: one of ["auto", "zstd", "lz4", "gzip"].
+    :return: name of the codec.
+    """
+    if compression == "auto":
+        if zstandard is not None:
+            return "zstd"
+        if lz4 is not None:
+            return "lz4"
+        return "gzip"
+    if compression not in STREAM_CODEC_SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression}")
+    if (compression == "zstd" and zstandard is None) or (compression == "lz4" and lz4 is None):
+        package = "zstandard" if compression == "zstd" else "lz4"
+        raise ImportError(f"Compression {compression} requires the {package} package")
+    return compression
+
+
+def _open_stream(file_name: pathlib.Path, codec: str, mode: str) -> BinaryIO:
+    """
+    Opens a compressed binary stream.
+    :param file_name: file to read from / write to.
+    :param codec: one of ["zstd", "lz4", "gzip"].
+    :param mode: "rb" or "wb".
+    :return: file object.
+    """
+    if codec == "zstd":
+        if mode == "wb":
+            return zstandard.ZstdCompressor(level=3).stream_writer(open(file_name, mode), closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(open(file_name, mode), closefd=True)
+    if codec == "lz4":
+        return lz4.frame.open(file_name, mode, compression_level=0)
+    # the fastest zlib level still compresses an order of magnitude faster than xz
+    return gzip.open(file_name, mode, compresslevel=1)
+
+
+def _stream_codec_of(file_name: Union[str, pathlib.Path]) -> Optional[str]:
+    """
+    Codec of a streamed log from its file name.
+    :param file_name: path of the log.
+    :return: name of the codec, None if the file is not a streamed log.
+    """
+    name = pathlib.Path(file_name).name
+    for codec, codec_suffix in STREAM_CODEC_SUFFIXES.items():
+        if name.endswith(STREAM_SUFFIX + codec_suffix):
+            return codec
+    return None
+
+
+class SimulationLogStreamWriter:
+    """
+    Writes the records of a streamed simulation log from a background thread.
+    Records are pickled and compressed by the writer thread, the caller only enqueues them.
+    """
+
+    def __init__(self, file_name: pathlib.Path, codec: str, max_queue_size: int = STREAM_QUEUE_SIZE):
+        """
+        Constructor of SimulationLogStreamWriter, starts the writer thread.
+        :param file_name: file to write to.
+        :param codec: one of ["zstd", "lz4", "gzip"].
+        :param max_queue_size: maximum number of pending records.
+        """
+        self._file_name = file_name
+        self._codec = codec
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._future: Future[None] = Future()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name=f"simulation_log_{file_name.name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def future(self) -> Future[None]:
+        """
+        Future completed when the log is fully written.
+        :return: future of the writer thread.
+        """
+        return self._future
+
+    def write(self, record: Any) -> None:
+        """
+        Enqueues a record, blocks when the queue is full.
+        :param record: picklable record.
+        """
+        if self._error is not None:
+            raise RuntimeError(f"Writing simulation log {self._file_name} failed") from self._error
+        self._queue.put(record)
+
+    def close(self, wait: bool = False) -> None:
+        """
+        Finishes the log after all pending records are written.
+        :param wait: block until the writer thread finished.
+        """
+        self._queue.put(_STOP)
+        if wait:
+            self._thread.join()
+            if self._error is not None:
+                raise RuntimeError(f"Writing simulation log {self._file_name} failed") from self._error
+
+    def _run(self) -> None:
+        """Writer thread, pickles records to the compressed stream until the log is closed."""
+        try:
+            with _open_stream(self._file_name, self._codec, "wb") as stream:
+                record = self._queue.get()
+                while record is not _STOP:
+                    pickle.dump(record, stream, protocol=pickle.HIGHEST_PROTOCOL)
+                    record = self._queue.get()
+        except BaseException as e:
+            self._error = e
+            logger.error(f"Writing simulation log {self._file_name} failed: {e}")
+            # keep draining the queue, such that the simulation never blocks on a dead writer
+            while self._queue.get() is not _STOP:
+                pass
+            self._future.set_exception(e)
+        else:
+            self._future.set_result(None)
+
+
+def load_simulation_log(file_name: Union[str, pathlib.Path]) -> SimulationLog:
+    """
+    Loads a simulation log, both streamed logs and xz compressed logs of SimulationLog.
+    :param file_name: path of the log.
+    :return: SimulationLog without planner, as written by SimulationLogCallback.
+    """
+    file_name = pathlib.Path(file_name)
+    codec = _stream_codec_of(file_name)
+    if codec is None:
+        return SimulationLog.load_data(file_name)
+
+    scenario = None
+    samples: List[SimulationHistorySample] = []
+    trailer: Optional[Dict[str, Any]] = None
+    with _open_stream(file_name, codec, "rb") as stream:
+        header = pickle.load(stream)
+        if header.get("version") != STREAM_VERSION:
+            raise RuntimeError(f"Unsupported simulation log version {header.get('version')} in {file_name}")
+        scenario = header["scenario"]
+        while True:
+            try:
+                record = pickle.load(stream)
+            except EOFError:
+                break
+            if isinstance(record, dict):
+                trailer = record
+                break
+            samples.append(record)
+
+    if trailer is None:
+        raise RuntimeError(f"Simulation log {file_name} is incomplete, the simulation did not finish")
+    if trailer["num_samples"] != len(samples):
+        raise RuntimeError(f"Simulation log {file_name} has {len(samples)} samples, {trailer['num_samples']} expected")
+
+    history = SimulationHistory(trailer["map_api"], trailer["mission_goal"])
+    for sample in samples:
+        history.add_sample(sample)
+    return SimulationLog(file_path=file_name, scenario=scenario, planner=None, simulation_history=history)
+
 
 def _save_log_to_file(
     file_name: pathlib.Path, scenario: AbstractScenario, planner: AbstractPlanner, history: SimulationHistory
@@ -41,12 +224,20 @@ class SimulationLogCallback(AbstractCallback):
         simulation_log_dir: Union[str, pathlib.Path],
         serialization_type: str,
         worker_pool: Optional[WorkerPool] = None,
+        compression: str = "xz",
+        max_queue_size: int = STREAM_QUEUE_SIZE,
     ):
         """
         Construct simulation log callback.
         :param output_directory: where scenes should be serialized.
         :param simulation_log_dir: Folder where to save simulation logs.
         :param serialization_type: A way to serialize output, options: ["json", "pickle", "msgpack"].
+        :param compression: codec of the log, options: ["xz", "auto", "zstd", "lz4", "gzip"], defaults to "xz".
+            "xz" serializes the full history at the end of the simulation, as SimulationLog does, readable by
+            SimulationLog.load_data and nuBoard.
+            Other codecs stream pickled samples at every step from a background thread, read with load_simulation_log.
+            Streamed logs are always pickled, serialization_type only applies to xz logs.
+        :param max_queue_size: maximum number of pending samples of a streamed log.
         """
         available_formats = ["pickle", "msgpack"]
         if serialization_type not in available_formats:
@@ -63,11 +254,40 @@ class SimulationLogCallback(AbstractCallback):
             file_suffix = '.msgpack.xz'
         else:
             raise ValueError(f"Unknown option: {serialization_type}")
+
+        # streams are written to local files, s3 outputs keep the xz logs of SimulationLog
+        self._stream_codec: Optional[str] = None
+        if compression != "xz" and not is_s3_path(self._output_directory):
+            self._stream_codec = get_stream_codec(compression)
+            file_suffix = STREAM_SUFFIX + STREAM_CODEC_SUFFIXES[self._stream_codec]
         self._file_suffix = file_suffix
+        self._max_queue_size = max_queue_size
+        # open streams by log file, simulations may run concurrently with the same callback
+        self._writers: Dict[pathlib.Path, SimulationLogStreamWriter] = {}
+        self._writers_lock = threading.Lock()
 
         self._pool = worker_pool
         self._futures: List[Future[None]] = []
 
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Drops the open streams, the lock and the futures, e.g. when the callback is sent to ray workers.
+        :return: picklable state of the callback.
+        """
+        state = self.__dict__.copy()
+        del state["_writers"], state["_writers_lock"]
+        state["_futures"] = []
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """
+        Restores the callback without open streams.
+        :param state: state of the callback.
+        """
+        self.__dict__.update(state)
+        self._writers = {}
+        self._writers_lock = threading.Lock()
+
     @property
     def futures(self) -> List[Future[None]]:
         """
@@ -87,6 +307,18 @@ class SimulationLogCallback(AbstractCallback):
         if not is_s3_path(scenario_directory):
             scenario_directory.mkdir(exist_ok=True, parents=True)
 
+        if self._stream_codec is not None:
+            file_name = scenario_directory / (setup.scenario.scenario_name + self._file_suffix)
+            with self._writers_lock:
+                previous_writer = self._writers.pop(file_name, None)
+            if previous_writer is not None:
+                # the log of an unfinished simulation is overwritten, errors of its writer were logged already
+                previous_writer.close()
+                wait([previous_writer.future])
+            writer = self._open_stream(file_name, setup.scenario)
+            with self._writers_lock:
+                self._writers[file_name] = writer
+
     def on_initialization_end(self, setup: SimulationSetup, planner: AbstractPlanner) -> None:
         """Inherited, see superclass."""
         pass
@@ -96,8 +328,17 @@ class SimulationLogCallback(AbstractCallback):
         pass
 
     def on_step_end(self, setup: SimulationSetup, planner: AbstractPlanner, sample: SimulationHistorySample) -> None:
-        """Inherited, see superclass."""
-        pass
+        """
+        Streams the sample of the step to the log.
+        :param setup: simulation setup.
+        :param planner: planner after the step.
+        :param sample: sample of the step, as added to the simulation history.
+        """
+        if self._stream_codec is None:
+            return
+        writer = self._writers.get(self._get_file_name(planner.name(), setup.scenario))
+        if writer is not None:
+            writer.write(sample)
 
     def on_planner_start(self, setup: SimulationSetup, planner: AbstractPlanner) -> None:
         """Inherited, see superclass."""
@@ -127,7 +368,9 @@ class SimulationLogCallback(AbstractCallback):
 
         scenario = setup.scenario
         file_name = scenario_directory / (scenario.scenario_name + self._file_suffix)
-        if self._pool is not None:
+        if self._stream_codec is not None:
+            self._close_stream(file_name, scenario, history)
+        elif self._pool is not None:
             self._futures = []
             self._futures.append(
                 self._pool.submit(
@@ -137,6 +380,50 @@ class SimulationLogCallback(AbstractCallback):
         else:
             _save_log_to_file(file_name, scenario, planner, history)
 
+    def _open_stream(self, file_name: pathlib.Path, scenario: AbstractScenario) -> SimulationLogStreamWriter:
+        """
+        Starts the streamed log of a simulation and writes its header.
+        :param file_name: file of the log.
+        :param scenario: simulated scenario.
+        :return: writer of the log.
+        """
+        writer = SimulationLogStreamWriter(file_name, self._stream_codec, self._max_queue_size)
+        writer.write({"version": STREAM_VERSION, "scenario": scenario})
+        return writer
+
+    def _close_stream(self, file_name: pathlib.Path, scenario: AbstractScenario, history: SimulationHistory) -> None:
+        """
+        Writes the trailer of a streamed log and finishes it.
+        :param file_name: file of the log.
+        :param scenario: simulated scenario.
+        :param history: resulting from simulation.
+        """
+        with self._writers_lock:
+            writer = self._writers.pop(file_name, None)
+        if writer is None:
+            # the simulation was not initialized with this callback, the log is written from the history
+            writer = self._open_stream(file_name, scenario)
+            for sample in history.data:
+                writer.write(sample)
+
+        writer.write({"map_api": history.map_api, "mission_goal": history.mission_goal, "num_samples": len(history)})
+        if self._pool is not None:
+            # the log is finished in the background, the main process blocks on the futures
+            self._futures = [future for future in self._futures if not future.done()]
+            self._futures.append(writer.future)
+            writer.close()
+        else:
+            writer.close(wait=True)
+
+    def _get_file_name(self, planner_name: str, scenario: AbstractScenario) -> pathlib.Path:
+        """
+        Compute file of the log.
+        :param planner_name: planner name.
+        :param scenario: for which to compute the file name.
+        :return file path.
+        """
+        return self._get_scenario_folder(planner_name, scenario) / (scenario.scenario_name + self._file_suffix)
+
     def _get_scenario_folder(self, planner_name: str, scenario: AbstractScenario) -> pathlib.Path:
         """
         Compute scenario folder directory where all files will be stored.
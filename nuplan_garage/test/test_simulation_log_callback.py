@@ -0,0 +1,166 @@
+import pathlib
+import pickle
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from nuplan.common.actor_state.ego_state import EgoState
+from nuplan.common.actor_state.state_representation import StateSE2, StateVector2D, TimePoint
+from nuplan.common.actor_state.tracked_objects import TrackedObjects
+from nuplan.planning.scenario_builder.test.mock_abstract_scenario import MockAbstractScenario
+from nuplan.planning.simulation.controller.abstract_controller import AbstractEgoController
+from nuplan.planning.simulation.history.simulation_history import SimulationHistory, SimulationHistorySample
+from nuplan.planning.simulation.observation.abstract_observation import AbstractObservation
+from nuplan.planning.simulation.observation.observation_type import DetectionsTracks
+from nuplan.planning.simulation.planner.simple_planner import SimplePlanner
+from nuplan.planning.simulation.simulation_log import SimulationLog
+from nuplan.planning.simulation.simulation_setup import SimulationSetup
+from nuplan.planning.simulation.simulation_time_controller.abstract_simulation_time_controller import (
+    AbstractSimulationTimeController,
+)
+from nuplan.planning.simulation.simulation_time_controller.simulation_iteration import SimulationIteration
+from nuplan.planning.simulation.trajectory.interpolated_trajectory import InterpolatedTrajectory
+
+from nuplan_garage.simulation_log_callback import SimulationLogCallback, load_simulation_log
+
+NUM_SAMPLES = 5
+
+
+class TestSimulationLogCallback(unittest.TestCase):
+    """Tests writing and reading the logs of SimulationLogCallback."""
+
+    def setUp(self) -> None:
+        """Creates a simulation history of a mock scenario."""
+        self.output_folder = tempfile.TemporaryDirectory()
+        self.scenario = MockAbstractScenario()
+        self.setup = SimulationSetup(
+            observations=Mock(AbstractObservation),
+            scenario=self.scenario,
+            time_controller=Mock(AbstractSimulationTimeController),
+            ego_controller=Mock(AbstractEgoController),
+        )
+        self.planner = SimplePlanner(2, 0.5, [0, 0])
+
+        self.history = SimulationHistory(self.scenario.map_api, self.scenario.get_mission_goal())
+        for index in range(NUM_SAMPLES):
+            ego_states = [
+                EgoState.build_from_rear_axle(
+                    StateSE2(index + offset, 0, 0),
+                    vehicle_parameters=self.scenario.ego_vehicle_parameters,
+                    rear_axle_velocity_2d=StateVector2D(x=1, y=0),
+                    rear_axle_acceleration_2d=StateVector2D(x=0, y=0),
+                    tire_steering_angle=0,
+                    time_point=TimePoint((index + offset) * 1000000),
+                )
+                for offset in range(2)
+            ]
+            self.history.add_sample(
+                SimulationHistorySample(
+                    iteration=SimulationIteration(time_point=TimePoint(index * 1000000), index=index),
+                    ego_state=ego_states[0],
+                    trajectory=InterpolatedTrajectory(ego_states),
+                    observation=DetectionsTracks(TrackedObjects()),
+                    traffic_light_status=self.scenario.get_traffic_light_status_at_iteration(index),
+                )
+            )
+
+    def tearDown(self) -> None:
+        """Removes the logs."""
+        self.output_folder.cleanup()
+
+    def _log_path(self, file_suffix: str) -> pathlib.Path:
+        """Path of the log of the mock scenario."""
+        return (
+            pathlib.Path(self.output_folder.name)
+            / "simulation_log"
+            / self.planner.name()
+            / self.scenario.scenario_type
+            / self.scenario.log_name
+            / self.scenario.scenario_name
+            / (self.scenario.scenario_name + file_suffix)
+        )
+
+    def _simulate(self, callback: SimulationLogCallback) -> None:
+        """Runs the callback hooks of a simulation over the history."""
+        callback.on_initialization_start(self.setup, self.planner)
+        for sample in self.history.data:
+            callback.on_step_end(self.setup, self.planner, sample)
+        callback.on_simulation_end(self.setup, self.planner, self.history)
+
+    def _assert_history_equal(self, simulation_log: SimulationLog) -> None:
+        """Checks the loaded log against the simulated history."""
+        self.assertEqual(simulation_log.scenario.scenario_name, self.scenario.scenario_name)
+        loaded_history = simulation_log.simulation_history
+        self.assertEqual(len(loaded_history), NUM_SAMPLES)
+        for loaded_sample, sample in zip(loaded_history.data, self.history.data):
+            self.assertEqual(loaded_sample.iteration.index, sample.iteration.index)
+            self.assertEqual(loaded_sample.ego_state.rear_axle.x, sample.ego_state.rear_axle.x)
+            self.assertEqual(loaded_sample.ego_state.time_point.time_us, sample.ego_state.time_point.time_us)
+
+    def test_default_log_is_simulation_log(self) -> None:
+        """By default, the log is written at the end of the simulation and readable by SimulationLog."""
+        callback = SimulationLogCallback(
+            output_directory=self.output_folder.name, simulation_log_dir="simulation_log", serialization_type="msgpack"
+        )
+        self._simulate(callback)
+
+        path = self._log_path(".msgpack.xz")
+        self.assertTrue(path.exists())
+        self._assert_history_equal(SimulationLog.load_data(file_path=path))
+        self._assert_history_equal(load_simulation_log(path))
+
+    def test_stream_round_trip(self) -> None:
+        """Streamed logs are read back with load_simulation_log."""
+        callback = SimulationLogCallback(
+            output_directory=self.output_folder.name,
+            simulation_log_dir="simulation_log",
+            serialization_type="msgpack",
+            compression="gzip",
+        )
+        self._simulate(callback)
+
+        path = self._log_path(".stream.pkl.gz")
+        self.assertTrue(path.exists())
+        simulation_log = load_simulation_log(path)
+        self.assertEqual(simulation_log.file_path, path)
+        self._assert_history_equal(simulation_log)
+
+    def test_incomplete_stream(self) -> None:
+        """Streams of simulations that did not end are rejected."""
+        callback = SimulationLogCallback(
+            output_directory=self.output_folder.name,
+            simulation_log_dir="simulation_log",
+            serialization_type="msgpack",
+            compression="gzip",
+        )
+        callback.on_initialization_start(self.setup, self.planner)
+        callback.on_step_end(self.setup, self.planner, self.history.data[0])
+        path = self._log_path(".stream.pkl.gz")
+        callback._writers.pop(path).close(wait=True)
+
+        with self.assertRaises(RuntimeError):
+            load_simulation_log(path)
+
+    def test_pickle(self) -> None:
+        """Callbacks with open streams can be pickled, e.g. for ray workers, and log independently."""
+        callback = SimulationLogCallback(
+            output_directory=self.output_folder.name,
+            simulation_log_dir="simulation_log",
+            serialization_type="msgpack",
+            compression="gzip",
+        )
+        callback.on_initialization_start(self.setup, self.planner)
+        unpickled_callback = pickle.loads(pickle.dumps(callback))
+        self.assertEqual(unpickled_callback._writers, {})
+
+        for sample in self.history.data:
+            callback.on_step_end(self.setup, self.planner, sample)
+        callback.on_simulation_end(self.setup, self.planner, self.history)
+        self._assert_history_equal(load_simulation_log(self._log_path(".stream.pkl.gz")))
+
+        self._simulate(unpickled_callback)
+        self._assert_history_equal(load_simulation_log(self._log_path(".stream.pkl.gz")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import argparse
+import copy
+import time
+
+import torch
+
+from mtr_trainer.config import cfg, cfg_from_yaml_file
+from models.model_builder import build_model
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='CPU latency of full vs incremental (kv cached) trajectory generation')
+    parser.add_argument('--cfg_file', type=str, default='configs/config_v1_aug.yaml', help='model and dataset config')
+    parser.add_argument('--ckpt', type=str, default=None, help='checkpoint to load, random weights if not given')
+    parser.add_argument('--scenarios', type=int, default=10, help='number of synthetic scenarios (batch size 1)')
+    parser.add_argument('--threads', type=int, default=None, help='torch cpu threads')
+    args = parser.parse_args()
+    cfg_from_yaml_file(args.cfg_file, cfg)
+    return args, cfg
+
+
+def build_synthetic_input(config, valid_polyline_num=64):
+    # one scenario with the first time set filled with random features, same layout as WaymoDatasetV1Aug
+    data_config = config.DATA_CONFIG
+    time_set_num = data_config.time_info.time_set_num
+    max_agent_num = data_config.max_agent_num
+    polyline_point_num = data_config.map_feature.polyline_point_num
+
+    input_dict = {}
+    for key in ['lane', 'road_line', 'road_edge', 'map_others']:
+        max_polyline_num = data_config.map_feature.max_polyline_num[key]
+        input_dict[key+'_feature'] = torch.randn(1, time_set_num, max_polyline_num, polyline_point_num, data_config.map_feature.feature_dim[key])*10
+        input_dict[key+'_mask'] = torch.zeros(1, time_set_num, max_polyline_num, polyline_point_num, dtype=torch.bool)
+        input_dict[key+'_mask'][:, :, :valid_polyline_num, :] = True
+    input_dict['ego_feature'] = torch.randn(1, time_set_num, 1, config.MODEL.data_dim.ego)
+    input_dict['agent_feature'] = torch.randn(1, time_set_num, max_agent_num, config.MODEL.data_dim.agent)*10
+    input_dict['agent_valid'] = (torch.rand(1, time_set_num, max_agent_num) > 0.3).float()
+    input_dict['agent_to_predict_num'] = torch.zeros(1, 1) + 4
+    input_dict['ego_current_pose'] = torch.randn(1, 1, 3)
+    return input_dict
+
+
+def main():
+    args, config = parse_config()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    model = build_model(config=config)
+    if args.ckpt is not None:
+        model.load_state_dict(torch.load(args.ckpt, map_location='cpu')['model_state'])
+    model.eval()
+
+    full_time, incremental_time, max_diff = 0.0, 0.0, 0.0
+    with torch.no_grad():
+        for _ in range(args.scenarios):
+            input_dict = build_synthetic_input(config)
+
+            start = time.perf_counter()
+            full_traj = model.traj_generation_full(copy.deepcopy(input_dict))
+            full_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            incremental_traj = model.traj_generation_incremental(copy.deepcopy(input_dict))
+            incremental_time += time.perf_counter() - start
+
+            max_diff = max(max_diff, (full_traj - incremental_traj).abs().max().item())
+
+    print(f'full generation:        {full_time / args.scenarios * 1000:.1f} ms / scenario')
+    print(f'incremental generation: {incremental_time / args.scenarios * 1000:.1f} ms / scenario')
+    print(f'max abs trajectory difference: {max_diff:.3e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import argparse
+
+from omegaconf import OmegaConf
+from utils.logger import log
+
+from dataset.waymo_dataset_v1_aug import WaymoDatasetV1Aug
+from dataset.feature_cache import build_feature_cache, validate_feature_cache
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='build the sharded memmap feature cache of WaymoDatasetV1Aug')
+    parser.add_argument('--cfg_file', type=str, default='configs/config_v1_aug.yaml', help='dataset config')
+    parser.add_argument('--split', choices=['train', 'val', 'all'], default='all', help='which split to cache')
+    parser.add_argument('--workers', type=int, default=16, help='number of processes building the cache')
+    parser.add_argument('--validate', type=int, default=0,
+                        help='after building, compare this many evenly spaced samples against on-the-fly features')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_config()
+    dataset_config = OmegaConf.load(args.cfg_file).DATA_CONFIG
+    dataset_config.dataset_info.cache_type = 'memmap'
+
+    splits = ['train', 'val'] if args.split == 'all' else [args.split]
+    for split in splits:
+        dataset = WaymoDatasetV1Aug(dataset_config, split == 'train', log)
+        build_feature_cache(dataset, num_workers=args.workers, logger=log)
+
+        if args.validate > 0:
+            indices = list(range(0, len(dataset), max(len(dataset) // args.validate, 1)))[:args.validate]
+            mismatches = validate_feature_cache(dataset, indices, logger=log)
+            assert len(mismatches) == 0, f'{len(mismatches)} mismatched features in {split} cache'
+
+
+if __name__ == '__main__':
+    main()
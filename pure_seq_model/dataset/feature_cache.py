@@ -0,0 +1,169 @@
+import os
+import json
+import pathlib
+from multiprocessing import Pool
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+
+
+class ShardedFeatureCache:
+    # Fixed-schema feature cache backed by a few large memmap files instead of one pickle per sample.
+    # Samples are grouped into shards of shard_size consecutive indices, every key of the schema is stored in its own
+    # .npy memmap of shape (shard_size, *shape) and the sample `index` lives at offset `index % shard_size`
+    # of shard `index // shard_size`. A per-shard `valid` flag array marks the offsets that have been fully written,
+    # so several processes can fill disjoint offsets in parallel and an interrupted build can be resumed.
+
+    # layout on disk:
+    # cache_path/schema.json
+    # cache_path/shard_00000/{key}.npy, ..., valid.npy
+
+    def __init__(self, cache_path: str, num_samples: int, schema: Dict[str, Tuple[Tuple[int, ...], str]], shard_size: int = 1024):
+        self.cache_path = cache_path
+        self.num_samples = num_samples
+        self.schema = {key: (tuple(shape), dtype) for key, (shape, dtype) in schema.items()}
+        self.shard_size = shard_size
+        self.num_shards = (num_samples + shard_size - 1) // shard_size
+
+        pathlib.Path(self.cache_path).mkdir(parents=True, exist_ok=True)
+        self._check_or_write_schema()
+        # memmaps are opened lazily so the cache can be pickled into dataloader workers
+        self._shards = {}
+
+    def _check_or_write_schema(self):
+        schema_file = os.path.join(self.cache_path, 'schema.json')
+        schema_info = {
+            'num_samples': self.num_samples,
+            'shard_size': self.shard_size,
+            'schema': {key: [list(shape), dtype] for key, (shape, dtype) in self.schema.items()},
+        }
+        if os.path.exists(schema_file):
+            with open(schema_file, 'r') as f:
+                saved_schema_info = json.load(f)
+            assert saved_schema_info == schema_info, \
+                f'feature cache at {self.cache_path} was built with a different schema, remove it or use another cache_dir'
+        else:
+            with open(schema_file, 'w') as f:
+                json.dump(schema_info, f, indent=2)
+
+    def _shard_len(self, shard_index: int):
+        return min(self.shard_size, self.num_samples - shard_index * self.shard_size)
+
+    def _get_shard(self, shard_index: int):
+        if shard_index not in self._shards:
+            shard_path = os.path.join(self.cache_path, f'shard_{shard_index:05d}')
+            pathlib.Path(shard_path).mkdir(parents=True, exist_ok=True)
+            shard_len = self._shard_len(shard_index)
+
+            shard = {}
+            for key, (shape, dtype) in list(self.schema.items()) + [('valid', ((), 'uint8'))]:
+                file_name = os.path.join(shard_path, f'{key}.npy')
+                if not os.path.exists(file_name):
+                    # np.lib.format.open_memmap creates a sparse file, zero-filled on read
+                    np.lib.format.open_memmap(file_name, mode='w+', dtype=np.dtype(dtype), shape=(shard_len, *shape)).flush()
+                shard[key] = np.load(file_name, mmap_mode='r+')
+            self._shards[shard_index] = shard
+        return self._shards[shard_index]
+
+    def _locate(self, index: int):
+        assert 0 <= index < self.num_samples, f'index {index} out of range [0, {self.num_samples})'
+        shard_index, offset = divmod(index, self.shard_size)
+        return self._get_shard(shard_index), offset
+
+    def is_cached(self, index: int):
+        shard, offset = self._locate(index)
+        return bool(shard['valid'][offset])
+
+    def missing_indices(self):
+        missing = []
+        for shard_index in range(self.num_shards):
+            valid = self._get_shard(shard_index)['valid']
+            missing.extend((np.nonzero(valid == 0)[0] + shard_index * self.shard_size).tolist())
+        return missing
+
+    def write(self, index: int, arrays: Dict[str, np.ndarray]):
+        shard, offset = self._locate(index)
+        for key in self.schema.keys():
+            shard[key][offset] = arrays[key]
+        # mark valid only after all keys are written, so a crashed writer leaves the sample as missing
+        shard['valid'][offset] = 1
+
+    def read(self, index: int):
+        shard, offset = self._locate(index)
+        assert shard['valid'][offset], f'sample {index} is not in the feature cache'
+        # np.array copies the slice out of the page cache so the returned arrays are writable and detached
+        return {key: np.array(shard[key][offset]) for key in self.schema.keys()}
+
+    def flush(self):
+        for shard in self._shards.values():
+            for value in shard.values():
+                value.flush()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+
+_worker_dataset = None
+
+
+def _init_cache_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _build_one_sample(index: int):
+    feature_dict = _worker_dataset.generate_from_raw_data(index)
+    _worker_dataset.feature_cache.write(index, _worker_dataset.feature_dict_to_arrays(feature_dict))
+    return index
+
+
+def build_feature_cache(dataset, num_workers: int = 8, logger=None):
+    # fill all missing samples of dataset.feature_cache, each worker writes disjoint offsets of the memmaps.
+    # missing_indices opens (and creates) every shard in the main process, so workers never race on file creation
+    missing_indices = dataset.feature_cache.missing_indices()
+    if logger is not None:
+        logger.info(f'Building feature cache at {dataset.feature_cache.cache_path}: '
+                    f'{len(missing_indices)} / {len(dataset)} samples missing')
+    if len(missing_indices) == 0:
+        return
+
+    log_interval = max(len(missing_indices) // 100, 1)
+    if num_workers <= 1:
+        _init_cache_worker(dataset)
+        for i, index in enumerate(missing_indices):
+            _build_one_sample(index)
+            if logger is not None and (i + 1) % log_interval == 0:
+                logger.info(f'Feature cache: {i + 1} / {len(missing_indices)} samples done')
+    else:
+        with Pool(num_workers, initializer=_init_cache_worker, initargs=(dataset,)) as pool:
+            for i, _ in enumerate(pool.imap_unordered(_build_one_sample, missing_indices, chunksize=16)):
+                if logger is not None and (i + 1) % log_interval == 0:
+                    logger.info(f'Feature cache: {i + 1} / {len(missing_indices)} samples done')
+    dataset.feature_cache.flush()
+
+
+def validate_feature_cache(dataset, indices: List[int], logger=None, atol: float = 0.0):
+    # compare cached features against features generated on the fly from raw data, return mismatched (index, key) pairs
+    mismatches = []
+    for index in indices:
+        cached_dict = dataset.arrays_to_feature_dict(dataset.feature_cache.read(index))
+        raw_dict = dataset.generate_from_raw_data(index)
+        for key, raw_value in raw_dict.items():
+            cached_value = cached_dict[key]
+            if isinstance(raw_value, torch.Tensor):
+                same = raw_value.shape == cached_value.shape and raw_value.dtype == cached_value.dtype and \
+                       torch.allclose(raw_value.double(), cached_value.double(), rtol=0.0, atol=atol)
+            else:
+                same = [[str(x) for x in v] if isinstance(v, list) else str(v) for v in raw_value] == \
+                       [[str(x) for x in v] if isinstance(v, list) else str(v) for v in cached_value]
+            if not same:
+                mismatches.append((index, key))
+                if logger is not None:
+                    logger.info(f'Feature cache mismatch: sample {index}, key {key}')
+
+    if logger is not None:
+        logger.info(f'Feature cache validation: {len(indices)} samples checked, {len(mismatches)} mismatches')
+    return mismatches
@@ -7,6 +7,7 @@ from typing import Dict, List, Tuple, cast
 import numpy as np
 from utils.torch_geometry import global_state_se2_tensor_to_local, coordinates_to_local_frame
 from utils.base_math import angle_to_range
+from dataset.feature_cache import ShardedFeatureCache
 
 import time
 
@@ -66,6 +67,17 @@ class WaymoDatasetV1Aug(torch.utils.data.Dataset):
         self.data_cache_path = os.path.join(self.data_root, self.dataset_config.dataset_info.cache_dir[self.mode])
         pathlib.Path(self.data_cache_path).mkdir(parents=True, exist_ok=True) 
 
+        # 'memmap': fixed-schema sharded memmap cache, 'pickle': one cache_{index}.pkl per sample (legacy)
+        self.cache_type = self.dataset_config.dataset_info.get('cache_type', 'pickle')
+        self.feature_cache = None
+        if self.cache_type == 'memmap':
+            self.feature_cache = ShardedFeatureCache(os.path.join(self.data_cache_path, 'memmap'), len(self.infos),
+                                                     self.get_feature_schema(),
+                                                     shard_size=self.dataset_config.dataset_info.get('cache_shard_size', 1024))
+            # opens (and creates) all shards up front, dataloader workers then only write into existing files
+            missing_num = len(self.feature_cache.missing_indices())
+            self.logger.info(f'Feature cache: {len(self.infos) - missing_num} / {len(self.infos)} samples cached')
+
         self.logger.info(f'Total scenes after filters: {len(self.infos)}')
 
     def get_all_infos(self, info_path: str):
@@ -82,6 +94,13 @@ class WaymoDatasetV1Aug(torch.utils.data.Dataset):
         return len(self.infos)
     
     def __getitem__(self, index):
+        if self.feature_cache is not None:
+            if self.feature_cache.is_cached(index):
+                return self.arrays_to_feature_dict(self.feature_cache.read(index))
+            feature_dict = self.generate_from_raw_data(index)
+            self.feature_cache.write(index, self.feature_dict_to_arrays(feature_dict))
+            return feature_dict
+
         # use cache if exist
         cache_file_name = os.path.join(self.data_cache_path, f'cache_{index}.pkl')
         if os.path.exists(cache_file_name):
@@ -99,6 +118,62 @@ class WaymoDatasetV1Aug(torch.utils.data.Dataset):
         # feature_dict = self.generate_from_raw_data(index)
         # return feature_dict
 
+    def get_feature_schema(self):
+        # fixed shape (without the leading batch dim of 1) and dtype of every key returned by generate_from_raw_data
+        time_set_num = self.dataset_config.time_info.time_set_num
+        time_sample_num = self.dataset_config.time_info.time_sample_num
+        max_agent_num = self.dataset_config.max_agent_num
+        polyline_point_num = self.dataset_config.map_feature.polyline_point_num
+        max_polyline_num = self.dataset_config.map_feature.max_polyline_num
+        feature_dim = self.dataset_config.map_feature.feature_dim
+
+        schema = {}
+        for map_type in ['lane', 'road_line', 'road_edge', 'map_others']:
+            schema[f'{map_type}_feature'] = ((time_set_num, max_polyline_num[map_type], polyline_point_num, feature_dim[map_type]), 'float32')
+            schema[f'{map_type}_mask'] = ((time_set_num, max_polyline_num[map_type], polyline_point_num), 'bool')
+        schema.update({
+            'ego_feature': ((time_set_num, 1, 7*time_sample_num + 5), 'float32'),
+            'ego_label': ((time_set_num, 1, 5*time_sample_num), 'float32'),
+            'agent_feature': ((time_set_num, max_agent_num, 14*time_sample_num + 5), 'float32'),
+            'agent_label': ((time_set_num, max_agent_num, 5*time_sample_num), 'float32'),
+            'agent_valid': ((time_set_num, max_agent_num), 'float32'),
+            'agent_to_predict_num': ((1,), 'float32'),
+            'track_index_to_predict': ((1, max_agent_num), 'float32'),
+            'center_gt_trajs_src': ((1, max_agent_num, 91, 10), 'float32'),
+            'ego_current_pose': ((1, 3), 'float32'),
+            # eval identifiers, padded to max_agent_num and cut back to agent_to_predict_num on read
+            'scenario_id': ((), '<U64'),
+            'center_objects_id': ((max_agent_num,), 'int64'),
+            'center_objects_type': ((max_agent_num,), '<U32'),
+        })
+        return schema
+
+    def feature_dict_to_arrays(self, feature_dict):
+        max_agent_num = self.dataset_config.max_agent_num
+        arrays = {}
+        for key, value in feature_dict.items():
+            if isinstance(value, torch.Tensor):
+                arrays[key] = value[0].numpy()
+        arrays['scenario_id'] = np.array(feature_dict['scenario_id'][0])
+        center_objects_id = np.zeros(max_agent_num, dtype=np.int64)
+        center_objects_id[:len(feature_dict['center_objects_id'][0])] = feature_dict['center_objects_id'][0]
+        center_objects_type = np.zeros(max_agent_num, dtype='<U32')
+        center_objects_type[:len(feature_dict['center_objects_type'][0])] = feature_dict['center_objects_type'][0]
+        arrays['center_objects_id'] = center_objects_id
+        arrays['center_objects_type'] = center_objects_type
+        return arrays
+
+    def arrays_to_feature_dict(self, arrays):
+        feature_dict = {}
+        for key, value in arrays.items():
+            if key not in ['scenario_id', 'center_objects_id', 'center_objects_type']:
+                feature_dict[key] = torch.from_numpy(value).unsqueeze(0)
+        agent_to_predict_num = int(arrays['agent_to_predict_num'][0])
+        feature_dict['scenario_id'] = [str(arrays['scenario_id'])]
+        feature_dict['center_objects_id'] = [arrays['center_objects_id'][:agent_to_predict_num].tolist()]
+        feature_dict['center_objects_type'] = [arrays['center_objects_type'][:agent_to_predict_num].tolist()]
+        return feature_dict
+
     def generate_from_raw_data(self, index):
         info = self.infos[index]
         scene_id = info['scenario_id']
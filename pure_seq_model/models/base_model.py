@@ -43,6 +43,27 @@ class SelfAttention(nn.Module):
         embed_states, atten_weights = self.multi_head_attention(embed_states, embed_states, embed_states, attn_mask=attn_mask)
         return embed_states
 
+    def forward_with_cache(self, embed_states, key_cache, value_cache, start, attn_mask=None):
+        # embed_states: [batch, n, embed_dim], only the new tokens
+        # key_cache, value_cache: [batch, num_heads, max_len, head_dim], preallocated, filled for [0, start)
+        # attn_mask: [batch, n, start+n], True means not allowed to attend (same as nn.MultiheadAttention)
+        mha = self.multi_head_attention
+        batch_size, n, embed_dim = embed_states.shape
+        num_heads = mha.num_heads
+        head_dim = embed_dim // num_heads
+
+        q, k, v = F.linear(embed_states, mha.in_proj_weight, mha.in_proj_bias).chunk(3, dim=-1)
+        q = q.view(batch_size, n, num_heads, head_dim).transpose(1, 2)
+        key_cache[:, :, start:start+n, :] = k.view(batch_size, n, num_heads, head_dim).transpose(1, 2)
+        value_cache[:, :, start:start+n, :] = v.view(batch_size, n, num_heads, head_dim).transpose(1, 2)
+
+        attn_weights = torch.matmul(q, key_cache[:, :, :start+n, :].transpose(-2, -1)) / math.sqrt(head_dim)
+        if attn_mask is not None:
+            attn_weights = attn_weights.masked_fill(attn_mask.unsqueeze(1), float('-inf'))
+        attn_output = torch.matmul(attn_weights.softmax(dim=-1), value_cache[:, :, :start+n, :])
+        attn_output = attn_output.transpose(1, 2).reshape(batch_size, n, embed_dim)
+        return mha.out_proj(attn_output)
+
 class CrossAttention(nn.Module):
     def __init__(self, embed_dim, num_heads, dropout=0):
         super(CrossAttention, self).__init__()
@@ -82,8 +103,9 @@ class PositionalEncoding(nn.Module):
             pe = pe.unsqueeze(0).unsqueeze(0)
         self.register_buffer("pe", pe)
 
-    def forward(self, x):
-        x = x + self.pe[..., :x.size(-2), :].requires_grad_(False)
+    def forward(self, x, offset=0):
+        # offset: position of the first token of x, used when only the newest tokens of a sequence are passed
+        x = x + self.pe[..., offset:offset+x.size(-2), :].requires_grad_(False)
         return self.dropout(x)
 
 class TransformerEncoderLayer(nn.Module):
@@ -100,6 +122,12 @@ class TransformerEncoderLayer(nn.Module):
         x = self.norm_self_attn(x + self.dropout_self_attn(self.self_attn(x, attn_mask=attn_mask)))
         x = self.norm_pff(x + self.dropout_pff(self.feed_forward(x)))
         return x
+
+    def forward_with_cache(self, x, key_cache, value_cache, start, attn_mask=None):
+        # x only contains the new tokens, keys/values of previous tokens are read from (and new ones written to) the cache
+        x = self.norm_self_attn(x + self.dropout_self_attn(self.self_attn.forward_with_cache(x, key_cache, value_cache, start, attn_mask=attn_mask)))
+        x = self.norm_pff(x + self.dropout_pff(self.feed_forward(x)))
+        return x
     
 class TransformerDecoderLayer(nn.Module):
     def __init__(self, embed_dim, self_attn, cross_attn, feed_forward, dropout=0):
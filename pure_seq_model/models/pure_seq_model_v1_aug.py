@@ -361,6 +361,123 @@ class PureSeqModelV1Aug(nn.Module):
 
     # auto-regessive generating future traj
     def traj_generation(self, input_dict):
+        if self.model_parameter.get('use_kv_cache', True):
+            return self.traj_generation_incremental(input_dict)
+        return self.traj_generation_full(input_dict)
+
+    # auto-regessive generation with cached keys/values: each step only encodes and attends from the newest time set.
+    # The attention mask is block causal (a time set never attends to later ones), so outputs of earlier time sets
+    # do not change when new time sets are appended and the result equals traj_generation_full.
+    def traj_generation_incremental(self, input_dict):
+        time_set_num = self.data_config.time_info.time_set_num
+        embed_dim = self.model_parameter.seq_embedding_dim
+        num_heads = self.model_parameter.seq_head
+
+        # preallocated input buffers for all time sets, filled in place as generation proceeds
+        for key in ['lane_feature', 'lane_mask', 'road_line_feature', 'road_line_mask', 'road_edge_feature', 'road_edge_mask', 
+                    'map_others_feature', 'map_others_mask', 'ego_feature', 'agent_feature', 'agent_valid']:
+            first_time_set = input_dict[key][:, 0, ...].unsqueeze(1)
+            input_dict[key] = first_time_set.new_zeros((first_time_set.size(0), time_set_num) + first_time_set.shape[2:])
+            input_dict[key][:, 0:1] = first_time_set
+
+        batch_size = input_dict['ego_feature'].size(0)
+        agent_num = input_dict['agent_feature'].size(2)
+        len_per_time_set = 4+1+agent_num # map:4, ego:1, agent:64
+        device = input_dict['ego_feature'].device
+
+        kv_cache = [(torch.zeros(batch_size, num_heads, time_set_num*len_per_time_set, embed_dim//num_heads, device=device),
+                     torch.zeros(batch_size, num_heads, time_set_num*len_per_time_set, embed_dim//num_heads, device=device))
+                    for _ in self.seq_layerlist]
+        ego_output = torch.zeros(batch_size, time_set_num, self.data_dim.ego_target, device=device)
+        agent_output = torch.zeros(batch_size, time_set_num*agent_num, self.data_dim.agent_target, device=device)
+
+        for i in range(time_set_num):
+            if i > 0:
+                self.write_next_input_from_output(input_dict, i, ego_output[:, i-1:i, :], agent_output[:, (i-1)*agent_num:i*agent_num, :])
+
+            step_input_dict = {key: input_dict[key][:, i:i+1, ...].clone() for key in 
+                               ['lane_feature', 'road_line_feature', 'road_edge_feature', 'map_others_feature', 'ego_feature', 'agent_feature']}
+            for key in ['lane_mask', 'road_line_mask', 'road_edge_mask', 'map_others_mask']:
+                step_input_dict[key] = input_dict[key][:, i:i+1, ...]
+            step_input_dict = self.normalize_input(step_input_dict)
+
+            normed_ego_output, normed_agent_output = self.model_forward_step(step_input_dict, input_dict['agent_valid'][:, :i+1, :], i, kv_cache)
+            ego_output[:, i:i+1, :], agent_output[:, i*agent_num:(i+1)*agent_num, :] = self.denormalize_output(normed_ego_output, normed_agent_output)
+
+        # get trajs in agent own frame
+        ego_traj, agent_traj = self.build_traj_from_output(ego_output, agent_output, input_dict['agent_to_predict_num'])
+
+        # transform agent trajs to ego frame
+        agent_traj = self.transform_agent_traj_to_origin_frame(input_dict['agent_feature'][:, 0, :, 0:3], agent_traj, input_dict['agent_to_predict_num'])
+
+        # transform agent
+        ego_current_frame = input_dict['ego_current_pose'][:, 0, :].unsqueeze(1).repeat(1, agent_traj.size(1), 1)
+        agent_global_traj = self.transform_agent_traj_to_origin_frame(ego_current_frame, agent_traj, input_dict['agent_to_predict_num'])
+
+        return agent_global_traj
+
+    def model_forward_step(self, input_dict: Dict, agent_valid: torch.Tensor, time_set_index: int, kv_cache: List):
+        # input_dict: features of the newest time set only, [batch, 1, ...]
+        # agent_valid: [batch, time_set_index+1, agent_num], validity of all time sets up to the newest one
+        # kv_cache: per layer (key_cache, value_cache), [batch, num_heads, time_set_num*len_per_time_set, head_dim]
+        device = input_dict['ego_feature'].device
+        batch_size = input_dict['ego_feature'].size(0)
+
+        # map encoder
+        lane_encoded_feature = self.encode_map_feature(input_dict['lane_feature'], input_dict['lane_mask'],
+                                                       self.lane_in_polyline_encoder, self.lane_between_polyline_encoder, device)
+        road_line_encoded_feature = self.encode_map_feature(input_dict['road_line_feature'], input_dict['road_line_mask'],
+                                                       self.road_line_in_polyline_encoder, self.road_line_between_polyline_encoder, device)
+        road_edge_encoded_feature = self.encode_map_feature(input_dict['road_edge_feature'], input_dict['road_edge_mask'],
+                                                       self.road_edge_in_polyline_encoder, self.road_edge_between_polyline_encoder, device)
+        map_others_encoded_feature = self.encode_map_feature(input_dict['map_others_feature'], input_dict['map_others_mask'],
+                                                       self.map_others_in_polyline_encoder, self.map_others_between_polyline_encoder, device)
+
+        # ego, agent embedding
+        ego_data_embeded = self.ego_seq_embedding(input_dict['ego_feature'])
+        agent_data_embeded = self.agent_seq_embedding(input_dict['agent_feature'])
+
+        # same token order as construct_input_seq: map:4, ego:1, agent:64
+        seq_tensor = torch.cat((lane_encoded_feature, road_line_encoded_feature, road_edge_encoded_feature, map_others_encoded_feature,
+                                ego_data_embeded[:, 0, ...], agent_data_embeded[:, 0, ...]), dim=1)
+        len_per_time_set = seq_tensor.size(1)
+        start = time_set_index*len_per_time_set
+
+        # new tokens attend to map and ego tokens of all time sets so far, and to valid agents of each time set
+        key_mask = torch.cat((torch.zeros(batch_size, time_set_index+1, 5, dtype=torch.bool, device=device), agent_valid == 0), dim=2)
+        seq_mask = key_mask.view(batch_size, 1, start+len_per_time_set).expand(batch_size, len_per_time_set, start+len_per_time_set)
+
+        seq_tensor = self.pos_encoder(seq_tensor, offset=start)
+
+        # transformer
+        for layer, (key_cache, value_cache) in zip(self.seq_layerlist, kv_cache):
+            seq_tensor = layer.forward_with_cache(seq_tensor, key_cache, value_cache, start, attn_mask=seq_mask)
+
+        # heads
+        ego_output = self.ego_head(seq_tensor[:, 4:5, :])
+        agent_output = self.agent_head(seq_tensor[:, 5:, :])
+
+        return ego_output, agent_output
+
+    def write_next_input_from_output(self, input_dict, time_set_index, ego_output, agent_output):
+        # in-place version of extend_input_based_on_last_output for the preallocated buffers of traj_generation_incremental
+        # ego_output: [batch, 1, 5*time_sample_num], agent_output: [batch, agent_num, 5*time_sample_num], outputs of time_set_index-1
+        i = time_set_index
+        ego_pose_rel_to_last = ego_output[:, -1, 0:3]
+
+        # transform map features
+        map_keys = ['lane', 'road_line', 'road_edge', 'map_others']
+        for key in map_keys:
+            input_dict[key+'_feature'][:, i:i+1, ...] = self.transform_map_feature_to_frame(input_dict[key+'_feature'][:, i-1:i, ...], ego_pose_rel_to_last)
+            input_dict[key+'_mask'][:, i:i+1, ...] = input_dict[key+'_mask'][:, i-1:i, ...]
+
+        # transform ego/agent output to ego/agent feature
+        input_dict['ego_feature'][:, i:i+1, ...] = self.transform_ego_feature_from_output(ego_output, input_dict['ego_feature'][:, i-1:i, ...])
+        input_dict['agent_feature'][:, i:i+1, ...] = self.transform_agent_feature_from_output(agent_output, input_dict['agent_feature'][:, i-1:i, ...], ego_output)
+        input_dict['agent_valid'][:, i:i+1, ...] = input_dict['agent_valid'][:, i-1:i, ...]
+
+    # auto-regessive generation re-running the full sequence every step, reference for traj_generation_incremental
+    def traj_generation_full(self, input_dict):
         # get first step input and output
         for key in ['lane_feature', 'lane_mask', 'road_line_feature', 'road_line_mask', 'road_edge_feature', 'road_edge_mask', 
                     'map_others_feature', 'map_others_mask', 'ego_feature', 'agent_feature', 'agent_valid']:
@@ -475,6 +592,9 @@ class PureSeqModelV1Aug(nn.Module):
     def transform_map_feature_to_frame(self, map_feature: torch.Tensor, ego_pose: torch.Tensor):
         batch_size = ego_pose.size(0)
 
+        # work on a copy, map_feature is usually a view of the last time set which must stay in its own frame
+        map_feature = map_feature.clone()
+
         for i in range(batch_size):
             ego_frame = ego_pose[i, :]
             rotation_frame = torch.tensor([0, 0, ego_frame[2]], device=ego_pose.device)
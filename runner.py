@@ -10,10 +10,7 @@ import random
 import shutil
 import sys
 import pickle
-import copy
 import torch
-from tqdm import tqdm
-import copy
 import multiprocessing as mp
 import datasets
 import numpy as np
@@ -37,9 +34,10 @@ from transformer4planning.utils.args import (
 )
 from transformers.trainer_utils import get_last_checkpoint
 from transformer4planning.trainer import (PlanningTrainer, CustomCallback)
-from torch.utils.data import DataLoader
 from transformers.trainer_callback import DefaultFlowCallback
-from transformer4planning.trainer import compute_metrics
+from transformer4planning.trainer import StreamingPlanningMetrics
+from transformer4planning.utils.prediction_shards import predict_shard
+from transformer4planning.utils.prediction_analysis import merge_prediction_shards
 
 from datasets import Dataset, Value
 
@@ -308,6 +306,22 @@ def main():
 
     # Load a model's pretrained weights from a path or from hugging face's model base
     model = build_models(model_args)
+
+    if training_args.build_camera_image_store:
+        from transformer4planning.preprocess.camera_image_store import build_camera_image_store, build_camera_feature_store
+        if model_args.camera_image_encoder is None or model_args.camera_image_store is None:
+            raise ValueError("Must provide camera_image_encoder and camera_image_store to build the camera image store")
+        build_camera_image_store([(train_dataset, model_args.train_camera_image_folder),
+                                  (val_dataset, model_args.val_camera_image_folder)],
+                                 model_args.camera_image_store, model.encoder.image_processor,
+                                 num_workers=max(training_args.dataloader_num_workers, 1))
+        if model_args.camera_feature_store is not None:
+            build_camera_feature_store(model_args.camera_image_store, model_args.camera_feature_store,
+                                       model.encoder.image_processor, model.encoder.camera_image_encoder,
+                                       device=training_args.device, batch_size=training_args.per_device_eval_batch_size * 8)
+        logger.info('Camera image store finished')
+        exit()
+
     # clf_metrics = dict(
     #     accuracy=evaluate.load("accuracy"),
     #     f1=evaluate.load("f1"),
@@ -342,9 +356,42 @@ def main():
     if model_args.task == "nuplan":
         if model_args.encoder_type == "raster":
             from transformer4planning.preprocess.nuplan_rasterize import nuplan_rasterize_collate_func
+            raster_embedding_store = None
+            if model_args.raster_embedding_cache is not None:
+                from transformer4planning.preprocess.raster_embedding_cache import get_raster_embedding_store, build_raster_embedding_cache
+                if not model_args.freeze_raster_encoder:
+                    raise ValueError("Must set freeze_raster_encoder to use the raster embedding cache")
+                if model_args.augment_current_pose_rate > 0 or model_args.augment_index != 0:
+                    raise ValueError("Augmented rasters can not be cached, set augment_current_pose_rate and augment_index to 0")
+                raster_embedding_store, raster_embedding_info = get_raster_embedding_store(model_args.raster_embedding_cache,
+                                                                                           model.encoder.raster_encoder,
+                                                                                           model_args.__dict__)
+                datasets_to_cache = []
+                if training_args.do_train:
+                    datasets_to_cache.append(train_dataset)
+                if training_args.do_eval:
+                    datasets_to_cache.append(eval_dataset)
+                if training_args.do_predict:
+                    datasets_to_cache.append(predict_dataset)
+                # encoded once by the world process zero, the others wait for it, camera images are not needed to encode rasters
+                if training_args.process_index == 0:
+                    build_raster_embedding_cache(model.encoder, datasets_to_cache,
+                                                 partial(nuplan_rasterize_collate_func,
+                                                         dic_path=data_args.saved_dataset_folder,
+                                                         all_maps_dic=all_maps_dic,
+                                                         **dict(model_args.__dict__, camera_image_encoder=None)),
+                                                 raster_embedding_store, raster_embedding_info,
+                                                 batch_size=training_args.per_device_eval_batch_size,
+                                                 num_workers=training_args.dataloader_num_workers,
+                                                 device=training_args.device)
+                if training_args.world_size > 1:
+                    torch.distributed.barrier()
+                logger.info(f'Using raster embedding cache at {raster_embedding_store}')
             collate_fn = partial(nuplan_rasterize_collate_func,
                                  dic_path=data_args.saved_dataset_folder,
                                  all_maps_dic=all_maps_dic,
+                                 pin_memory=training_args.dataloader_pin_memory,
+                                 raster_embedding_store=raster_embedding_store,
                                  **model_args.__dict__)
         elif model_args.encoder_type == "vector":
             from nuplan.common.maps.nuplan_map.map_factory import get_maps_api
@@ -362,10 +409,11 @@ def main():
         from transformer4planning.preprocess.waymo_vectorize import waymo_collate_func
         if model_args.encoder_type == "vector":
             collate_fn = partial(waymo_collate_func,
-                                 dic_path=data_args.saved_dataset_folder)
+                                 dic_path=data_args.saved_dataset_folder,
+                                 pin_memory=training_args.dataloader_pin_memory)
         elif model_args.encoder_type == "raster":
             raise NotImplementedError
-        from transformer4planning.trainer import compute_metrics_waymo
+        from transformer4planning.trainer import StreamingWaymoMetrics
     elif model_args.task == "train_diffusion_decoder":
         from torch.utils.data._utils.collate import default_collate
         def feat_collate_func(batch, predict_yaw):
@@ -384,6 +432,20 @@ def main():
     else:
         raise AttributeError("task must be nuplan or waymo or train_diffusion_decoder")
 
+    if training_args.quantize_model:
+        from transformer4planning.models.quantization import calibrate_and_evaluate
+        if model_args.task != "nuplan" or model_args.encoder_type != "raster":
+            raise ValueError("Only nuplan raster models can be quantized")
+        if model_args.raster_embedding_cache is not None:
+            raise ValueError("The raster encoder is calibrated with rasters, do not use the raster embedding cache to quantize")
+        calibrate_and_evaluate(model, dataset_dict["validation"], collate_fn, training_args.output_dir,
+                               calibration_samples=training_args.quantization_calibration_samples,
+                               eval_samples=training_args.quantization_eval_samples,
+                               batch_size=training_args.per_device_eval_batch_size,
+                               num_workers=training_args.dataloader_num_workers)
+        logger.info('Quantization finished')
+        exit()
+
     trainer = PlanningTrainer(
         model=model,  # the instantiated 🤗 Transformers model to be trained
         args=training_args,  # training arguments, defined above
@@ -391,7 +453,8 @@ def main():
         eval_dataset=eval_dataset if training_args.do_eval else None,
         callbacks=[CustomCallback,],
         data_collator=collate_fn,
-        compute_metrics=compute_metrics_waymo if model_args.task == "waymo" else compute_metrics
+        # with --batch_eval_metrics, metrics are accumulated per eval batch instead of gathering all predictions
+        compute_metrics=StreamingWaymoMetrics() if model_args.task == "waymo" else StreamingPlanningMetrics()
     )
     trainer.pop_callback(DefaultFlowCallback)
 
@@ -427,173 +490,32 @@ def main():
 
 
     if training_args.do_predict:
-        # Currently only supports single GPU predict outputs
         """
         Will save prediction results, and dagger results if dagger is enabled
+        Every process predicts a shard of the test set to arrow files under output_dir/prediction_shards,
+        rerun the same command to resume an interrupted prediction from the last checkpoint of each shard.
+        All models are predicted with model.generate (first mode if multi-modal) and scored against the full
+        trajectory_label, frames padded with -1 excluded, see prediction_shards.prediction_columns.
+        ade, fde, mse and the dagger rankings are thus not comparable with the former predict loop, which scored
+        model(**input).logits against trajectory_label[:, 1::2] for models without key points.
         """
-        # TODO: fit new online process pipeline to save dagger and prediction results
         logger.info("*** Predict ***")
-        with torch.no_grad():
-            dagger_results = {
-                'file_name':[],
-                'frame_id':[],
-                'rank':[],
-                'ADE':[],
-                'FDE':[],
-                'y_bias':[]
-            }
-            prediction_results = {
-                'file_names': [],
-                'current_frame': [],
-                'next_step_action': [],
-                'predicted_trajectory': [],
-            }
-            test_dataloader = DataLoader(
-                dataset=predict_dataset,
-                batch_size=training_args.per_device_eval_batch_size,
-                num_workers=training_args.per_device_eval_batch_size,
-                collate_fn=collate_fn,
-                pin_memory=True,
-                drop_last=True
-            )
-
-
-            if model_args.predict_trajectory:
-                end_bias_x = []
-                end_bias_y = []
-                all_bias_x = []
-                all_bias_y = []
-                losses = []
-                loss_fn = torch.nn.MSELoss(reduction="mean")
-
-            for itr, input in enumerate(tqdm(test_dataloader)):
-                # move batch to device
-                for each_key in input:
-                    if isinstance(input[each_key], type(torch.tensor(0))):
-                        input[each_key] = input[each_key].to("cuda")
-
-                eval_batch_size = training_args.per_device_eval_batch_size
-                if model_args.autoregressive or model_args.use_key_points is not None:
-                    # Todo: add autoregressive predict
-                    traj_pred = model.generate(**input)
-                else:
-                    output = model(**copy.deepcopy(input))
-                    traj_pred = output.logits                   
-                    try:
-                        file_name = input['file_name']
-                        current_frame_idx = input['frame_id']
-                    except:
-                        file_name = ["null"] * eval_batch_size
-                        current_frame_idx = -1 * torch.ones(eval_batch_size)
-                    prediction_results['file_names'].extend(file_name)
-                    prediction_results['current_frame'].extend(current_frame_idx.cpu().numpy())
-                    if data_args.dagger:
-                        dagger_results['file_name'].extend(file_name)
-                        dagger_results['frame_id'].extend(list(current_frame_idx.cpu().numpy()))
-                
-                if model_args.predict_trajectory:
-                    if model_args.autoregressive:# trajectory label as token case
-                        trajectory_label = model.compute_normalized_points(input["trajectory"][:, 10:, :])
-                        traj_pred = model.compute_normalized_points(traj_pred)
-                        
-                    else:
-                        if 'mmtransformer' in model_args.model_name and model_args.task == 'waymo':
-                            trajectory_label = input["trajectory_label"][:, :, :2]
-                            trajectory_label = torch.where(trajectory_label != -1, trajectory_label, traj_pred)
-                        else:
-                            trajectory_label = input["trajectory_label"][:, 1::2, :]
-
-                    loss = loss_fn(trajectory_label[:, :, :2], traj_pred[:, -trajectory_label.shape[1]:, :2])
-                    end_trajectory_label = trajectory_label[:, -1, :]
-                    end_point = traj_pred[:, -1, :]
-                    end_bias_x.append(end_trajectory_label[:, 0] - end_point[:, 0])
-                    end_bias_y.append(end_trajectory_label[:, 1] - end_point[:, 1])
-                    all_bias_x.append(trajectory_label[:, :, 0] - traj_pred[:, -trajectory_label.shape[1]:, 0])
-                    all_bias_y.append(trajectory_label[:, :, 1] - traj_pred[:, -trajectory_label.shape[1]:, 1])
-                    losses.append(loss)
-
-            if model_args.predict_trajectory:
-                end_bias_x = torch.stack(end_bias_x, 0).cpu().numpy()
-                end_bias_y = torch.stack(end_bias_y, 0).cpu().numpy()
-                all_bias_x = torch.stack(all_bias_x, 0).reshape(-1).cpu().numpy()
-                all_bias_y = torch.stack(all_bias_y, 0).reshape(-1).cpu().numpy()
-                final_loss = torch.mean(torch.stack(losses, 0)).item()
-                print('Mean L2 loss: ', final_loss)
-                print('End point x offset: ', np.average(np.abs(end_bias_x)))
-                print('End point y offset: ', np.average(np.abs(end_bias_y)))
-                distance_error = np.sqrt(np.abs(all_bias_x)**2 + np.abs(all_bias_y)**2).reshape(-1, 80)
-                final_distance_error = np.sqrt(np.abs(end_bias_x)**2 + np.abs(end_bias_y)**2)
-                if data_args.dagger:
-                    dagger_results['ADE'].extend(list(np.average(distance_error, axis=1).reshape(-1)))
-                    dagger_results['FDE'].extend(list(final_distance_error.reshape(-1)))
-                    dagger_results['y_bias'].extend(list(np.average(all_bias_y.reshape(-1, 80), axis=1).reshape(-1)))
-                print('ADE', np.average(distance_error))
-                print('FDE', np.average(final_distance_error))
-            
-            # print(dagger_results)
-            def compute_dagger_dict(dic):
-                tuple_list = list()
-                fde_result_list = dict()
-                y_bias_result_list = dict()
-                for filename, id, ade, fde, y_bias in zip(dic["file_name"], dic["frame_id"], dic["ADE"], dic["FDE"], dic["y_bias"]):
-                    if filename == "null":
-                        continue
-                    tuple_list.append((filename, id, ade, fde, abs(y_bias)))
-    
-                fde_sorted_list = sorted(tuple_list, key=lambda x:x[3], reverse=True)
-                for idx, tp in enumerate(fde_sorted_list): 
-                    if tp[0] in fde_result_list.keys():
-                        fde_result_list[tp[0]]["frame_id"].append(tp[1])
-                        fde_result_list[tp[0]]["ade"].append(tp[2])
-                        fde_result_list[tp[0]]["fde"].append(tp[3])
-                        fde_result_list[tp[0]]["y_bias"].append(tp[4])
-                        fde_result_list[tp[0]]["rank"].append((idx+1)/len(fde_sorted_list))
-                        
-                    else:
-                        fde_result_list[tp[0]] = dict(
-                            frame_id=[tp[1]], ade=[tp[2]], fde=[tp[3]], y_bias=[tp[4]], rank=[(idx+1)/len(fde_sorted_list)]
-                        )
-                y_bias_sorted_list = sorted(tuple_list, key=lambda x:x[-1], reverse=True)
-                for idx, tp in enumerate(y_bias_sorted_list): 
-                    if tp[0] in y_bias_result_list.keys():
-                        y_bias_result_list[tp[0]]["frame_id"].append(tp[1])
-                        y_bias_result_list[tp[0]]["ade"].append(tp[2])
-                        y_bias_result_list[tp[0]]["fde"].append(tp[3])
-                        y_bias_result_list[tp[0]]["y_bias"].append(tp[4])
-                        y_bias_result_list[tp[0]]["rank"].append((idx+1)/len(y_bias_sorted_list))
-                    else:
-                        y_bias_result_list[tp[0]] = dict(
-                            frame_id=[tp[1]], ade=[tp[2]], fde=[tp[3]], y_bias=[tp[4]], rank=[(idx+1)/len(y_bias_sorted_list)]
-                        )
-                return fde_result_list, y_bias_result_list
-            
-            def draw_histogram_graph(data, title, savepath):
-                import matplotlib.pyplot as plt
-                plt.hist(data, bins=range(20), edgecolor='black')
-                plt.title(title)
-                plt.xlabel("Value")
-                plt.ylabel("Frequency")
-                plt.savefig(os.path.join(savepath, "{}.png".format(title)))
-            if data_args.dagger:
-                draw_histogram_graph(dagger_results["FDE"], title="FDE-distributions", savepath=training_args.output_dir)
-                draw_histogram_graph(dagger_results["ADE"], title="ADE-distributions", savepath=training_args.output_dir)
-                draw_histogram_graph(dagger_results["y_bias"], title="ybias-distribution", savepath=training_args.output_dir)
-                fde_dagger_dic, y_bias_dagger_dic = compute_dagger_dict(dagger_results)
-
-
-            if training_args.output_dir is not None:
-                # save results
-                output_file_path = os.path.join(training_args.output_dir, 'generated_predictions.pickle')
-                with open(output_file_path, 'wb') as handle:
-                    pickle.dump(prediction_results, handle, protocol=pickle.HIGHEST_PROTOCOL)
-                if data_args.dagger:
-                    dagger_result_path = os.path.join(training_args.output_dir, "fde_dagger.pkl")
-                    with open(dagger_result_path, 'wb') as handle:
-                        pickle.dump(fde_dagger_dic, handle)
-                    dagger_result_path = os.path.join(training_args.output_dir, "ybias_dagger.pkl")
-                    with open(dagger_result_path, 'wb') as handle:
-                        pickle.dump(y_bias_dagger_dic, handle)
-                    print("dagger results save to {}".format(dagger_result_path))
+        num_shards = training_args.predict_num_shards or training_args.world_size
+        shard_id = training_args.predict_shard_id if training_args.predict_shard_id is not None else training_args.process_index
+        prediction_path = os.path.join(training_args.output_dir, 'prediction_shards')
+        predict_shard(model, predict_dataset, collate_fn, prediction_path,
+                      shard_id=shard_id,
+                      num_shards=num_shards,
+                      batch_size=training_args.per_device_eval_batch_size,
+                      num_workers=training_args.dataloader_num_workers,
+                      device=training_args.device,
+                      pin_memory=training_args.dataloader_pin_memory and training_args.device.type == "cuda",
+                      checkpoint_interval=training_args.predict_checkpoint_interval)
+        if training_args.world_size > 1:
+            torch.distributed.barrier()
+        if training_args.process_index == 0:
+            # merges only if all shards are finished, shards run as independent jobs are merged by the last one
+            merge_prediction_shards(prediction_path, training_args.output_dir, dagger=data_args.dagger)
 
         # predict_results = trainer.predict(predict_dataset, metric_key_prefix="predict")
         # metrics = predict_results.metrics
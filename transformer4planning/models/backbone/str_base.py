@@ -631,6 +631,10 @@ def build_models(model_args):
     if 'scratch' in model_args.model_name:
         model = ModelCls(config_p)
         print('Scratch ' + tag + ' Initialized!')
+    elif 'pretrain' in model_args.model_name and getattr(model_args, 'quantization', None) is not None:
+        from transformer4planning.models.quantization import load_quantized_model
+        model = load_quantized_model(ModelCls(config_p), model_args.model_pretrain_name_or_path)
+        print('Quantized ' + tag + ' from {}'.format(model_args.model_pretrain_name_or_path))
     elif 'pretrain' in model_args.model_name:
         model = ModelCls.from_pretrained(model_args.model_pretrain_name_or_path, config=config_p)
         print('Pretrained ' + tag + 'from {}'.format(model_args.model_pretrain_name_or_path))
@@ -128,12 +128,59 @@ class NuplanRasterizeEncoder(TrajectoryEncoder):
             self.camera_image_m_embed = STRMultiModalProjector(action_kwargs)
             for param in self.camera_image_encoder.parameters():
                 param.requires_grad = False
+
+        self.freeze_raster_encoder = getattr(self.config, "freeze_raster_encoder", False)
+        if self.freeze_raster_encoder:
+            for param in self.raster_encoder.parameters():
+                param.requires_grad = False
+
+    @property
+    def raster_encoder(self):
+        return self.image_downsample if hasattr(self, "image_downsample") else self.cnn_downsample
+
+    def train(self, mode=True):
+        super().train(mode)
+        if self.freeze_raster_encoder:
+            # the frozen raster encoder always runs in eval mode, batch norm statistics stay as loaded
+            self.raster_encoder.eval()
+        return self
         
+    def encode_rasters(self, high_res_raster, low_res_raster, action_seq_length, device):
+        """
+        Encodes the rasters of every past frame with the raster encoder.
+        Args:
+            high_res_raster, low_res_raster: torch.Tensor, shape (batch_size, 224, 224, channels)
+        Returns:
+            state_embeds: torch.Tensor, shape (batch_size, action_seq_length, n_embed) for resnet,
+            (batch_size, action_seq_length, 196, n_embed) for vit
+        """
+        high_res_seq = cat_raster_seq(high_res_raster.permute(0, 3, 2, 1).to(device), action_seq_length, self.config.with_traffic_light)
+        low_res_seq = cat_raster_seq(low_res_raster.permute(0, 3, 2, 1).to(device), action_seq_length, self.config.with_traffic_light)
+        # casted channel number: 33 - 1 goal, 20 raod types, 3 traffic light, 9 agent types for each time frame
+        # context_length: 8, 40 frames / 5
+        batch_size, action_seq_length, c, h, w = high_res_seq.shape
+        assert c == self.config.raster_channels, "raster channel number should be {}, but got {}".format(self.config.raster_channels, c)
+
+        if self.config.raster_encoder_type == 'vit':
+            high_res_embed = self.image_downsample(pixel_values=high_res_seq.to(torch.float32).reshape(batch_size * action_seq_length, c, h, w)).last_hidden_state[:, 1:, :]
+            low_res_embed = self.image_downsample(pixel_values=low_res_seq.to(torch.float32).reshape(batch_size * action_seq_length, c, h, w)).last_hidden_state[:, 1:, :]
+            # batch_size * context_length, 196 (14*14), embed_dim//2
+            _, sequence_length, half_embed = high_res_embed.shape
+            high_res_embed = high_res_embed.reshape(batch_size, action_seq_length, sequence_length, half_embed)
+            low_res_embed = low_res_embed.reshape(batch_size, action_seq_length, sequence_length, half_embed)
+        else:
+            high_res_embed = self.cnn_downsample(high_res_seq.to(torch.float32).reshape(batch_size * action_seq_length, c, h, w))
+            low_res_embed = self.cnn_downsample(low_res_seq.to(torch.float32).reshape(batch_size * action_seq_length, c, h, w))
+            high_res_embed = high_res_embed.reshape(batch_size, action_seq_length, -1)
+            low_res_embed = low_res_embed.reshape(batch_size, action_seq_length, -1)
+        return torch.cat((high_res_embed, low_res_embed), dim=-1).to(torch.float32)
+
     def forward(self, **kwargs):
         """
         Nuplan raster encoder require inputs:
         `high_res_raster`: torch.Tensor, shape (batch_size, 224, 224, seq)
         `low_res_raster`: torch.Tensor, shape (batch_size, 224, 224, seq)
+        or `raster_embeds`: torch.Tensor, outputs of the frozen raster encoder from the raster embedding cache, see encode_rasters
         `context_actions`: torch.Tensor, shape (batch_size, seq, 4 / 6)
         `trajectory_label`: torch.Tensor, shape (batch_size, seq, 2/4), depend on whether pred yaw value
         `pred_length`: int, the length of prediction trajectory
@@ -141,6 +188,8 @@ class NuplanRasterizeEncoder(TrajectoryEncoder):
 
         To use camera image encoder, the input should also contain:
         `camera_image`: torch.Tensor, shape (batch_size, 8(cameras), 1080, 1920, 3)
+        or `camera_pixel_values`: torch.Tensor, shape (batch_size, 8(cameras), 3, 224, 224), uint8 from the camera image store
+        or `camera_image_features`: torch.Tensor, shape (batch_size, 8(cameras), 257, 768), from the camera feature store
         """
         high_res_raster = kwargs.get("high_res_raster", None)
         low_res_raster = kwargs.get("low_res_raster", None)
@@ -162,22 +211,16 @@ class NuplanRasterizeEncoder(TrajectoryEncoder):
         # raster observation encoding & context action ecoding
         action_embeds = self.action_m_embed(context_actions)
         
-        high_res_seq = cat_raster_seq(high_res_raster.permute(0, 3, 2, 1).to(device), action_seq_length, self.config.with_traffic_light)
-        low_res_seq = cat_raster_seq(low_res_raster.permute(0, 3, 2, 1).to(device), action_seq_length, self.config.with_traffic_light)
-        # casted channel number: 33 - 1 goal, 20 raod types, 3 traffic light, 9 agent types for each time frame
-        # context_length: 8, 40 frames / 5
-        batch_size, action_seq_length, c, h, w = high_res_seq.shape
-        assert c == self.config.raster_channels, "raster channel number should be {}, but got {}".format(self.config.raster_channels, c)
+        raster_embeds = kwargs.get("raster_embeds", None)
+        if raster_embeds is not None:
+            # frozen raster encoder outputs from the raster embedding cache
+            state_embeds = raster_embeds.to(device=device, dtype=torch.float32)
+        else:
+            state_embeds = self.encode_rasters(high_res_raster, low_res_raster, action_seq_length, device)
+        batch_size = state_embeds.shape[0]
 
         if self.config.raster_encoder_type == 'vit':
-            high_res_embed = self.image_downsample(pixel_values=high_res_seq.to(torch.float32).reshape(batch_size * action_seq_length, c, h, w)).last_hidden_state[:, 1:, :]
-            low_res_embed = self.image_downsample(pixel_values=low_res_seq.to(torch.float32).reshape(batch_size * action_seq_length, c, h, w)).last_hidden_state[:, 1:, :]
-            # batch_size * context_length, 196 (14*14), embed_dim//2
-            _, sequence_length, half_embed = high_res_embed.shape
-            high_res_embed = high_res_embed.reshape(batch_size, action_seq_length, sequence_length, half_embed)
-            low_res_embed = low_res_embed.reshape(batch_size, action_seq_length, sequence_length, half_embed)
-
-            state_embeds = torch.cat((high_res_embed, low_res_embed), dim=-1).to(torch.float32)  # batch_size, action_seq_length, sequence_length, embed_dim
+            sequence_length = state_embeds.shape[2]
             n_embed = action_embeds.shape[-1]
             context_length = action_seq_length + action_seq_length * sequence_length
             input_embeds = torch.zeros(
@@ -189,12 +232,6 @@ class NuplanRasterizeEncoder(TrajectoryEncoder):
                 input_embeds[:, j * (1 + sequence_length): j * (1 + sequence_length) + sequence_length, :] = state_embeds[:, j, :, :]
             input_embeds[:, sequence_length::1 + sequence_length, :] = action_embeds
         else:
-            high_res_embed = self.cnn_downsample(high_res_seq.to(torch.float32).reshape(batch_size * action_seq_length, c, h, w))
-            low_res_embed = self.cnn_downsample(low_res_seq.to(torch.float32).reshape(batch_size * action_seq_length, c, h, w))
-            high_res_embed = high_res_embed.reshape(batch_size, action_seq_length, -1)
-            low_res_embed = low_res_embed.reshape(batch_size, action_seq_length, -1)
-
-            state_embeds = torch.cat((high_res_embed, low_res_embed), dim=-1).to(torch.float32)
             n_embed = action_embeds.shape[-1]
             context_length = action_seq_length * 2
             input_embeds = torch.zeros(
@@ -206,14 +243,26 @@ class NuplanRasterizeEncoder(TrajectoryEncoder):
             input_embeds[:, 1::2, :] = action_embeds  # index: 1, 3, 5, .., 19
 
         if self.camera_image_encoder is not None:
-            camera_images = kwargs.get("camera_images", None)
-            assert camera_images is not None, "camera_image should not be None"
-            if self.image_processor is not None:
-                _, _, image_width, image_height, image_channels = camera_images.shape
-                camera_images = camera_images.reshape(batch_size*8, image_width, image_height, image_channels)
-                camera_inputs = self.image_processor(camera_images, return_tensors="pt")
-            camera_inputs = camera_inputs.to(device)
-            camera_image_feature = self.camera_image_encoder(**camera_inputs).last_hidden_state  # batch_size * 8, 257, 768
+            camera_image_features = kwargs.get("camera_image_features", None)
+            camera_pixel_values = kwargs.get("camera_pixel_values", None)
+            if camera_image_features is not None:
+                # features of the frozen dinov2 from the camera feature store
+                camera_image_feature = camera_image_features.to(device=device, dtype=torch.float32)
+            else:
+                if camera_pixel_values is not None:
+                    # resized and cropped by the camera image store, only rescale and normalize
+                    from transformer4planning.preprocess.camera_image_store import normalize_camera_pixel_values
+                    camera_pixel_values = camera_pixel_values.reshape(batch_size * 8, *camera_pixel_values.shape[2:]).to(device)
+                    camera_inputs = dict(pixel_values=normalize_camera_pixel_values(camera_pixel_values, self.image_processor))
+                else:
+                    camera_images = kwargs.get("camera_images", None)
+                    assert camera_images is not None, "camera_image should not be None"
+                    if self.image_processor is not None:
+                        _, _, image_width, image_height, image_channels = camera_images.shape
+                        camera_images = camera_images.reshape(batch_size*8, image_width, image_height, image_channels)
+                        camera_inputs = self.image_processor(camera_images, return_tensors="pt")
+                    camera_inputs = camera_inputs.to(device)
+                camera_image_feature = self.camera_image_encoder(**camera_inputs).last_hidden_state  # batch_size * 8, 257, 768
 
             # compress all patches into one hidden state
             # camera_image_feature = camera_image_feature.reshape(batch_size, 8, 257 * 768)
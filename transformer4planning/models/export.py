@@ -0,0 +1,399 @@
+import os
+import json
+import time
+import argparse
+from types import SimpleNamespace
+from typing import List, Tuple
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# TorchScript export of STR for cpu inference, e.g. in the nuplan simulation.
+# STR.generate reruns the backbone over the whole growing sequence for every key point. The exported model instead:
+#   - traces the encoder (raster encoder and action embeddings) at fixed input shapes
+#   - rebuilds the gpt2 backbone as a scripted module with a preallocated key/value cache, so every key point step runs
+#     a single token through the backbone
+#   - runs the key point loop and the trajectory decoder in one scripted module, saved as a single file with its config
+# ExportedSTR loads the file and serves the generate contract used by STRPlanner.
+# Supported: nuplan raster encoder, gpt2 backbone, mlp key point decoder, without proposals or camera images.
+# The off-road and IDM corrections of key points in STR.generate are not exported.
+
+EXPORT_CONFIG_FILE = 'export_config.json'
+ACTIVATIONS = ['relu', 'silu', 'gelu', 'tanh', 'gelu_new']
+
+
+class CachedGPT2Block(nn.Module):
+    def __init__(self, n_embd: int, n_inner: int, n_head: int, layer_norm_epsilon: float, scaling: float,
+                 activation: str):
+        super().__init__()
+        self.n_head = n_head
+        self.head_dim = n_embd // n_head
+        self.scaling = scaling
+        self.activation = activation
+        self.ln_1 = nn.LayerNorm(n_embd, eps=layer_norm_epsilon)
+        self.c_attn = nn.Linear(n_embd, 3 * n_embd)
+        self.attn_proj = nn.Linear(n_embd, n_embd)
+        self.ln_2 = nn.LayerNorm(n_embd, eps=layer_norm_epsilon)
+        self.c_fc = nn.Linear(n_embd, n_inner)
+        self.mlp_proj = nn.Linear(n_inner, n_embd)
+
+    def act(self, x):
+        if self.activation == 'relu':
+            return F.relu(x)
+        elif self.activation == 'silu':
+            return F.silu(x)
+        elif self.activation == 'gelu':
+            return F.gelu(x)
+        elif self.activation == 'tanh':
+            return torch.tanh(x)
+        return F.gelu(x, approximate='tanh')
+
+    def forward(self, hidden_states, k_cache, v_cache, start: int, attention_mask):
+        """
+        Args:
+            hidden_states: (batch_size, seq, n_embd) of the new tokens at positions [start, start + seq)
+            k_cache, v_cache: (batch_size, n_head, max_length, head_dim), updated in place with the new tokens
+            attention_mask: (seq, start + seq) additive causal mask
+        """
+        batch_size, seq, n_embd = hidden_states.shape
+        end = start + seq
+        q, k, v = self.c_attn(self.ln_1(hidden_states)).split(n_embd, dim=2)
+        q = q.reshape(batch_size, seq, self.n_head, self.head_dim).transpose(1, 2)
+        k_cache[:, :, start:end] = k.reshape(batch_size, seq, self.n_head, self.head_dim).transpose(1, 2)
+        v_cache[:, :, start:end] = v.reshape(batch_size, seq, self.n_head, self.head_dim).transpose(1, 2)
+        attn_weights = torch.matmul(q, k_cache[:, :, :end].transpose(-1, -2)) * self.scaling + attention_mask
+        attn_output = torch.matmul(attn_weights.softmax(dim=-1), v_cache[:, :, :end])
+        attn_output = attn_output.transpose(1, 2).reshape(batch_size, seq, n_embd)
+        hidden_states = hidden_states + self.attn_proj(attn_output)
+        return hidden_states + self.mlp_proj(self.act(self.c_fc(self.ln_2(hidden_states))))
+
+
+class CachedGPT2(nn.Module):
+    """
+    The GPT2Model of STR_GPT2 for inference with a key/value cache, the layers are nn.Linear for dynamic quantization.
+    """
+    def __init__(self, config):
+        super().__init__()
+        assert config.activation_function in ACTIVATIONS, f'activation {config.activation_function} not supported'
+        assert not config.reorder_and_upcast_attn, 'reorder_and_upcast_attn not supported'
+        self.n_layer = config.n_layer
+        self.n_head = config.n_head
+        self.head_dim = config.n_embd // config.n_head
+        n_inner = config.n_inner if config.n_inner is not None else 4 * config.n_embd
+        blocks = []
+        for layer_idx in range(config.n_layer):
+            scaling = self.head_dim ** -0.5 if config.scale_attn_weights else 1.0
+            if config.scale_attn_by_inverse_layer_idx:
+                scaling /= float(layer_idx + 1)
+            blocks.append(CachedGPT2Block(config.n_embd, n_inner, config.n_head, config.layer_norm_epsilon, scaling,
+                                          config.activation_function))
+        self.wpe = nn.Embedding(config.n_positions, config.n_embd)
+        self.blocks = nn.ModuleList(blocks)
+        self.ln_f = nn.LayerNorm(config.n_embd, eps=config.layer_norm_epsilon)
+
+    @torch.jit.unused
+    def load_from_gpt2(self, transformer):
+        """
+        Copies the weights of a transformers GPT2Model, the Conv1D weights are transposed to nn.Linear.
+        """
+        def copy_linear(linear, conv1d):
+            linear.weight.data.copy_(conv1d.weight.data.t())
+            linear.bias.data.copy_(conv1d.bias.data)
+
+        self.wpe.load_state_dict(transformer.wpe.state_dict())
+        self.ln_f.load_state_dict(transformer.ln_f.state_dict())
+        for block, layer in zip(self.blocks, transformer.h):
+            block.ln_1.load_state_dict(layer.ln_1.state_dict())
+            block.ln_2.load_state_dict(layer.ln_2.state_dict())
+            copy_linear(block.c_attn, layer.attn.c_attn)
+            copy_linear(block.attn_proj, layer.attn.c_proj)
+            copy_linear(block.c_fc, layer.mlp.c_fc)
+            copy_linear(block.mlp_proj, layer.mlp.c_proj)
+        return self
+
+    def new_cache(self, batch_size: int, max_length: int, device: torch.device):
+        return torch.zeros((self.n_layer, batch_size, self.n_head, max_length, self.head_dim), device=device)
+
+    def forward(self, input_embeds, k_cache, v_cache, start: int):
+        """
+        Args:
+            input_embeds: (batch_size, seq, n_embd) at positions [start, start + seq)
+            k_cache, v_cache: (n_layer, batch_size, n_head, max_length, head_dim) from new_cache
+        Returns:
+            (batch_size, seq, n_embd) last hidden states of the new tokens
+        """
+        seq = input_embeds.shape[1]
+        device = input_embeds.device
+        positions = torch.arange(start, start + seq, device=device)
+        attention_mask = torch.zeros((seq, start + seq), device=device)
+        attention_mask = attention_mask.masked_fill(torch.arange(start + seq, device=device)[None, :] > positions[:, None],
+                                                    float('-inf'))
+        hidden_states = input_embeds + self.wpe(positions)[None, :, :]
+        for i, block in enumerate(self.blocks):
+            hidden_states = block(hidden_states, k_cache[i], v_cache[i], start, attention_mask)
+        return self.ln_f(hidden_states)
+
+
+class ContextEncoder(nn.Module):
+    """
+    Embeds the context (rasters and context actions) with the encoder of STR, traced at fixed input shapes.
+    """
+    def __init__(self, encoder, pred_length, context_length):
+        super().__init__()
+        self.encoder = encoder
+        self.pred_length = pred_length
+        self.context_length = context_length
+
+    def forward(self, context_actions, high_res_raster, low_res_raster):
+        trajectory_label = torch.zeros((context_actions.shape[0], self.pred_length, 4), device=context_actions.device)
+        input_embeds, _ = self.encoder(is_training=False, context_actions=context_actions, high_res_raster=high_res_raster,
+                                       low_res_raster=low_res_raster, trajectory_label=trajectory_label)
+        return input_embeds[:, :self.context_length, :]
+
+
+class STRInference(nn.Module):
+    """
+    The generate loop of STR with a key/value cache, scripted as one module.
+    """
+    def __init__(self, context_encoder, backbone, key_points_decoder, key_point_embed, traj_decoder,
+                 context_length: int, key_points_num: int, pred_length: int, k: int, predict_yaw: bool, use_speed: bool):
+        super().__init__()
+        self.context_encoder = context_encoder
+        self.backbone = backbone
+        self.key_points_decoder = key_points_decoder
+        self.key_point_embed = key_point_embed
+        self.traj_decoder = traj_decoder
+        self.context_length = context_length
+        self.key_points_num = key_points_num
+        self.pred_length = pred_length
+        self.k = k
+        self.predict_yaw = predict_yaw
+        self.use_speed = use_speed
+
+    def forward(self, context_actions, high_res_raster, low_res_raster) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns:
+            traj_logits: (batch_size, pred_length, 2/4), or (batch_size, k, pred_length, 2/4) if k > 1
+            key_points_logits: (batch_size, key_points_num, 2/4), or (batch_size, k, key_points_num, 2/4) if k > 1
+        """
+        context_embeds = self.context_encoder(context_actions, high_res_raster, low_res_raster)
+        batch_size, _, n_embd = context_embeds.shape
+        device = context_embeds.device
+        # the last position (zero embedding of the last future frame) never feeds the trajectory decoder
+        max_length = self.context_length + self.key_points_num + self.pred_length - 1
+        k_cache = self.backbone.new_cache(batch_size, max_length, device)
+        v_cache = self.backbone.new_cache(batch_size, max_length, device)
+        last_hidden_state = self.backbone(context_embeds, k_cache, v_cache, 0)[:, -1:, :]
+
+        key_points: List[torch.Tensor] = []
+        for i in range(self.key_points_num):
+            key_points_logit = self.key_points_decoder(last_hidden_state).reshape(batch_size, 1, -1)
+            pred_key_point = torch.zeros((batch_size, 1, 4), device=device)
+            if self.predict_yaw:
+                pred_key_point[:, 0, :] = key_points_logit[:, 0, :]
+                key_points.append(pred_key_point.clone())
+            else:
+                pred_key_point[:, 0, :2] = key_points_logit[:, 0, :]
+                key_points.append(pred_key_point[:, :, :2].clone())
+            if self.use_speed:
+                # padding speed, padding the last dimension from 4 to 7
+                pred_key_point = torch.cat([pred_key_point, torch.zeros((batch_size, 1, 3), device=device)], dim=-1)
+            key_point_embed = self.key_point_embed(pred_key_point).reshape(batch_size, 1, -1)
+            last_hidden_state = self.backbone(key_point_embed, k_cache, v_cache, self.context_length + i)
+
+        # the trajectory decoder reads the hidden states of the last key point (or context) and the first pred_length - 1 future frames
+        future_embeds = torch.zeros((batch_size, self.pred_length - 1, n_embd), device=device)
+        future_hidden_state = self.backbone(future_embeds, k_cache, v_cache, self.context_length + self.key_points_num)
+        traj_logits = self.traj_decoder(torch.cat([last_hidden_state, future_hidden_state], dim=1))
+        if len(key_points) > 0:
+            key_points_logits = torch.cat(key_points, dim=1)
+        else:
+            key_points_logits = torch.zeros((batch_size, 0, 4 if self.predict_yaw else 2), device=device)
+        if self.k > 1:
+            # without proposals all modes of STR.generate are identical
+            traj_logits = torch.stack([traj_logits] * self.k, dim=1)
+            key_points_logits = torch.stack([key_points_logits] * self.k, dim=1)
+        return traj_logits, key_points_logits
+
+
+def check_exportable(model):
+    config = model.config
+    assert config.task == 'nuplan' and 'raster' in config.encoder_type, 'only the nuplan raster encoder can be exported'
+    assert hasattr(model, 'transformer') and hasattr(model.transformer, 'wpe'), 'only the gpt2 backbone can be exported'
+    assert not model.use_proposal, 'proposals can not be exported'
+    assert model.encoder.camera_image_encoder is None, 'camera image encoder can not be exported'
+    if model.use_key_points != 'no':
+        assert model.kp_decoder_type == 'mlp', 'only the mlp key point decoder can be exported'
+        assert 'denoise_kp' not in model.use_key_points, 'denoise_kp can not be exported'
+
+
+def export_str(model, export_path, context_actions, high_res_raster, low_res_raster, pred_length):
+    """
+    Exports STR to a TorchScript file at the shapes of the example inputs.
+    Args:
+        model: STR_GPT2 with a nuplan raster encoder
+        context_actions: (batch_size, context_frames, 4 / 7) example tensor
+        high_res_raster, low_res_raster: (batch_size, 224, 224, channels) example tensors
+        pred_length: number of future frames to generate
+    Returns:
+        the scripted module
+    """
+    check_exportable(model)
+    model.eval()
+    device = next(model.parameters()).device
+    context_actions = context_actions.to(device=device, dtype=torch.float32)
+    high_res_raster = high_res_raster.to(device=device, dtype=torch.float32)
+    low_res_raster = low_res_raster.to(device=device, dtype=torch.float32)
+    config = model.config
+    with torch.no_grad():
+        trajectory_label = torch.zeros((context_actions.shape[0], pred_length, 4), device=device)
+        input_embeds, info_dict = model.encoder(is_training=False, context_actions=context_actions,
+                                                high_res_raster=high_res_raster, low_res_raster=low_res_raster,
+                                                trajectory_label=trajectory_label)
+        context_length = info_dict['context_length']
+        key_points_num = 0 if model.use_key_points == 'no' else info_dict['future_key_points'].shape[1]
+        assert input_embeds.shape[1] == context_length + key_points_num + pred_length
+        assert input_embeds.shape[1] <= config.n_positions, f'sequence length {input_embeds.shape[1]} exceeds n_positions'
+
+        context_encoder = torch.jit.trace(ContextEncoder(model.encoder, pred_length, context_length),
+                                          (context_actions, high_res_raster, low_res_raster), check_trace=False)
+        example_hidden = input_embeds[:, :1, :]
+        traj_decoder = torch.jit.trace(model.traj_decoder.model, (example_hidden,))
+        if key_points_num > 0:
+            key_points_decoder = torch.jit.trace(model.key_points_decoder.model, (example_hidden,))
+        else:
+            key_points_decoder = nn.Identity()
+        key_point_embed = model.encoder.kps_m_embed if config.separate_kp_encoder else model.encoder.action_m_embed
+    backbone = CachedGPT2(config).load_from_gpt2(model.transformer).to(device).eval()
+    inference = STRInference(context_encoder, backbone, key_points_decoder, key_point_embed, traj_decoder,
+                             context_length=context_length, key_points_num=key_points_num, pred_length=pred_length,
+                             k=model.k, predict_yaw=bool(config.predict_yaw),
+                             use_speed=bool(config.use_speed) and not config.separate_kp_encoder)
+    scripted = torch.jit.script(inference.eval())
+    export_config = dict(
+        model_config=json.loads(config.to_json_string()),
+        context_actions_shape=list(context_actions.shape),
+        raster_shape=list(high_res_raster.shape),
+        pred_length=pred_length,
+        use_key_points=model.use_key_points != 'no',
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(export_path)), exist_ok=True)
+    torch.jit.save(scripted, export_path, _extra_files={EXPORT_CONFIG_FILE: json.dumps(export_config)})
+    print(f'STR exported to {export_path}, context length {context_length}, {key_points_num} key points')
+    return scripted
+
+
+class ExportedSTR:
+    """
+    Runs an exported STR with the generate contract of STR, e.g. as the model of STRPlanner.
+    """
+    def __init__(self, export_path, map_location='cpu'):
+        extra_files = {EXPORT_CONFIG_FILE: ''}
+        self.module = torch.jit.load(export_path, map_location=map_location, _extra_files=extra_files)
+        self.module.eval()
+        self.export_config = json.loads(extra_files[EXPORT_CONFIG_FILE])
+        self.config = SimpleNamespace(**self.export_config['model_config'])
+        self.device = torch.device(map_location)
+
+    def to(self, device):
+        self.module.to(device)
+        self.device = torch.device(device)
+        return self
+
+    def eval(self):
+        return self
+
+    @torch.no_grad()
+    def generate(self, **kwargs):
+        """
+        Same inputs as STR.generate with the nuplan raster encoder, inputs other than context_actions, high_res_raster,
+        low_res_raster and trajectory_label are ignored. Input shapes must match the shapes at export.
+        """
+        inputs = []
+        for key, shape_key in [('context_actions', 'context_actions_shape'), ('high_res_raster', 'raster_shape'),
+                               ('low_res_raster', 'raster_shape')]:
+            tensor = torch.as_tensor(kwargs[key]).to(device=self.device, dtype=torch.float32)
+            assert list(tensor.shape) == self.export_config[shape_key], \
+                f'{key} of shape {list(tensor.shape)} does not match the exported shape {self.export_config[shape_key]}'
+            inputs.append(tensor)
+        trajectory_label = kwargs.get('trajectory_label', None)
+        if trajectory_label is not None:
+            assert trajectory_label.shape[1] == self.export_config['pred_length'], \
+                f'pred length {trajectory_label.shape[1]} does not match the exported {self.export_config["pred_length"]}'
+        traj_logits, key_points_logits = self.module(*inputs)
+        pred_dict = {"traj_logits": traj_logits}
+        if self.export_config['use_key_points']:
+            pred_dict["key_points_logits"] = key_points_logits
+        return pred_dict
+
+
+def load_model_from_checkpoint(checkpoint_path):
+    """
+    Builds STR from a checkpoint folder with the model args in config.json, as the planner builder.
+    """
+    from transformers import HfArgumentParser
+    from transformer4planning.utils.args import ModelArguments
+    from transformer4planning.models.backbone.str_base import build_models
+    parser = HfArgumentParser((ModelArguments))
+    model_args, = parser.parse_json_file(os.path.join(checkpoint_path, 'config.json'), allow_extra_keys=True)
+    model_args.model_pretrain_name_or_path = checkpoint_path
+    model_args.model_name = model_args.model_name.replace('scratch', 'pretrain')
+    return build_models(model_args=model_args)
+
+
+def example_inputs(config, context_frames=20, raster_size=224, batch_size=1):
+    """
+    Zero inputs of the planner shapes, the raster channels are the route, road and traffic light channels
+    and 8 agent types for every context frame.
+    """
+    raster_channels = config.raster_channels - 8 + 8 * context_frames
+    action_dim = 7 if config.use_speed else 4
+    return dict(
+        context_actions=torch.zeros((batch_size, context_frames, action_dim)),
+        high_res_raster=torch.zeros((batch_size, raster_size, raster_size, raster_channels)),
+        low_res_raster=torch.zeros((batch_size, raster_size, raster_size, raster_channels)),
+    )
+
+
+def benchmark_generate(model, inputs, pred_length, num_ticks=20):
+    """
+    Returns:
+        mean latency in milliseconds of one generate call, as one planner tick
+    """
+    inputs = dict(inputs, trajectory_label=torch.zeros((inputs['context_actions'].shape[0], pred_length, 4)))
+    with torch.no_grad():
+        model.generate(**inputs)  # warm up
+        start = time.perf_counter()
+        for _ in range(num_ticks):
+            model.generate(**inputs)
+    return (time.perf_counter() - start) / num_ticks * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Export STR to TorchScript for cpu inference')
+    parser.add_argument('--model_path', type=str, required=True, help='checkpoint folder with config.json')
+    parser.add_argument('--export_path', type=str, default=None, help='default as model_path/str_exported.pt')
+    parser.add_argument('--context_frames', type=int, default=20)
+    parser.add_argument('--raster_size', type=int, default=224)
+    parser.add_argument('--benchmark', action='store_true', help='compare latency and outputs with the eager model')
+    parser.add_argument('--num_ticks', type=int, default=20)
+    args = parser.parse_args()
+
+    model = load_model_from_checkpoint(args.model_path).to('cpu').eval()
+    export_path = args.export_path if args.export_path is not None else os.path.join(args.model_path, 'str_exported.pt')
+    pred_length = int(160 / model.config.future_sample_interval)
+    inputs = example_inputs(model.config, args.context_frames, args.raster_size)
+    export_str(model, export_path, pred_length=pred_length, **inputs)
+    if args.benchmark:
+        exported = ExportedSTR(export_path)
+        # random rasters and actions to compare the outputs
+        inputs = {key: torch.rand_like(value) for key, value in inputs.items()}
+        trajectory_label = torch.zeros((1, pred_length, 4))
+        eager_output = model.generate(trajectory_label=trajectory_label, **inputs)
+        exported_output = exported.generate(trajectory_label=trajectory_label, **inputs)
+        for key in eager_output:
+            print(f'max abs diff of {key}: {(eager_output[key] - exported_output[key]).abs().max().item():.2e}')
+        eager_ms = benchmark_generate(model, inputs, pred_length, args.num_ticks)
+        exported_ms = benchmark_generate(exported, inputs, pred_length, args.num_ticks)
+        print(f'cpu latency per tick with {torch.get_num_threads()} threads: eager {eager_ms:.1f} ms, '
+              f'exported {exported_ms:.1f} ms, {eager_ms / exported_ms:.2f}x')
@@ -0,0 +1,198 @@
+import os
+import io
+import copy
+import json
+import time
+import torch
+import torch.nn as nn
+from tqdm import tqdm
+from torch.utils.data import DataLoader
+
+# Post-training int8 quantization of STR for cpu inference, e.g. in the nuplan simulation.
+#   - dynamic int8 for the nn.Linear layers of the transformer backbone and the vit raster encoder: int8 weights,
+#     activations quantized on the fly. The Conv1D layers of gpt2 are converted to nn.Linear first.
+#   - static int8 for the resnet raster encoder by fx graph mode quantization. Its activation ranges are calibrated
+#     over the rasters of cached samples.
+# The trajectory and key point decoders and the action embeddings stay in fp32.
+# A quantized model is saved as config.json with `quantization` set and the int8 state dict in QUANTIZED_WEIGHTS_NAME.
+# build_models then rebuilds the quantized modules and loads the state dict. Quantized models run on cpu only.
+
+QUANTIZED_WEIGHTS_NAME = 'quantized_model.bin'
+QUANTIZATION_TYPES = ['int8']
+
+
+def conv1d_to_linear(module):
+    """
+    Replaces the transformers Conv1D layers (weight of shape (in, out)) of the module with nn.Linear in place.
+    """
+    from transformers.pytorch_utils import Conv1D
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features, device=child.weight.device, dtype=child.weight.dtype)
+            linear.weight.data.copy_(child.weight.data.t())
+            linear.bias.data.copy_(child.bias.data)
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+    return module
+
+
+def quantize_linears_dynamic(module):
+    conv1d_to_linear(module)
+    return torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def prepare_quantization(model):
+    """
+    Quantizes the linears of the backbone and the vit raster encoder, and inserts observers into the resnet raster encoder.
+    Run rasters through model.encoder.encode_rasters to calibrate, then call convert_quantization.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx
+    config = model.config
+    assert config.task == 'nuplan' and 'raster' in config.encoder_type, 'only the nuplan raster models can be quantized'
+    model.eval().to('cpu')
+    quantize_linears_dynamic(model.transformer)
+    if hasattr(model.encoder, 'image_downsample'):
+        quantize_linears_dynamic(model.encoder.image_downsample)
+    else:
+        example_raster = torch.zeros((1, config.raster_channels, 224, 224))
+        model.encoder.cnn_downsample = prepare_fx(model.encoder.cnn_downsample,
+                                                  get_default_qconfig_mapping(torch.backends.quantized.engine),
+                                                  example_inputs=(example_raster,))
+    return model
+
+
+def convert_quantization(model):
+    from torch.ao.quantization.quantize_fx import convert_fx
+    if not hasattr(model.encoder, 'image_downsample'):
+        model.encoder.cnn_downsample = convert_fx(model.encoder.cnn_downsample)
+    model.config.quantization = 'int8'
+    return model
+
+
+def quantize_model(model, calibration_batches=()):
+    """
+    Args:
+        model: fp32 STR with a nuplan raster encoder, quantized in place
+        calibration_batches: iterable of collated batches to calibrate the resnet raster encoder
+    Returns:
+        the quantized model
+    """
+    prepare_quantization(model)
+    if not hasattr(model.encoder, 'image_downsample'):
+        num_samples = 0
+        with torch.no_grad():
+            for batch in tqdm(calibration_batches, desc='calibrating'):
+                if len(batch) == 0:
+                    continue
+                model.encoder.encode_rasters(batch['high_res_raster'], batch['low_res_raster'],
+                                             batch['context_actions'].shape[1], 'cpu')
+                num_samples += batch['context_actions'].shape[0]
+        assert num_samples > 0, 'no samples to calibrate the resnet raster encoder'
+    return convert_quantization(model)
+
+
+def save_quantized_model(model, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    model.config.save_pretrained(output_dir)
+    torch.save(model.state_dict(), os.path.join(output_dir, QUANTIZED_WEIGHTS_NAME))
+
+
+def load_quantized_model(model, checkpoint_path):
+    """
+    Args:
+        model: fp32 STR built with the config of the quantized checkpoint
+        checkpoint_path: folder saved by save_quantized_model
+    Returns:
+        the quantized model with the int8 weights loaded
+    """
+    assert model.config.quantization in QUANTIZATION_TYPES, f'unknown quantization {model.config.quantization}'
+    # observers without calibration, the scales and zero points are loaded with the state dict
+    convert_quantization(prepare_quantization(model))
+    state_dict = torch.load(os.path.join(checkpoint_path, QUANTIZED_WEIGHTS_NAME), map_location='cpu', weights_only=False)
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+
+def state_dict_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 / 1024
+
+
+def evaluate_open_loop(model, dataloader):
+    """
+    Returns:
+        ade and fde of the generated trajectories, each as the average of the 3, 5 and 8 seconds horizons
+        as metric_ade and metric_fde of the eval metrics
+    """
+    ade_sum = fde_sum = num_samples = 0
+    with torch.no_grad():
+        for batch in tqdm(dataloader, desc='open loop evaluation'):
+            if len(batch) == 0:
+                continue
+            traj_logits = model.generate(**batch)['traj_logits']
+            labels = batch['trajectory_label']
+            if traj_logits.dim() == 4:
+                traj_logits = traj_logits[:, 0]
+            displacement = torch.norm(traj_logits[..., :2] - labels[..., :2], dim=-1)  # batch_size, 80
+            ade = (displacement[:, :30].mean(dim=1) + displacement[:, :50].mean(dim=1) + displacement[:, :80].mean(dim=1)) / 3
+            fde = (displacement[:, 29] + displacement[:, 49] + displacement[:, -1]) / 3
+            ade_sum += ade.sum().item()
+            fde_sum += fde.sum().item()
+            num_samples += labels.shape[0]
+    return dict(ade=ade_sum / max(num_samples, 1), fde=fde_sum / max(num_samples, 1), samples=num_samples)
+
+
+def measure_latency(model, dataset, collate_fn, num_ticks=20):
+    """
+    Returns:
+        mean latency in milliseconds of generate with batch size 1, as one planner tick, excluding the rasterization
+    """
+    batches = []
+    for i in range(len(dataset)):
+        batch = collate_fn([dataset[i]])
+        if len(batch) > 0:
+            batches.append(batch)
+        if len(batches) == num_ticks + 1:
+            break
+    assert len(batches) > 1, 'not enough valid samples to measure latency'
+    with torch.no_grad():
+        model.generate(**batches[0])  # warm up
+        start = time.perf_counter()
+        for batch in batches[1:]:
+            model.generate(**batch)
+    return (time.perf_counter() - start) / (len(batches) - 1) * 1000
+
+
+def calibrate_and_evaluate(model, dataset, collate_fn, output_dir, calibration_samples=256, eval_samples=256,
+                           batch_size=16, num_workers=0):
+    """
+    Quantizes the model calibrated over the first samples of the dataset, compares latency, model size and open loop
+    ade/fde with the fp32 model over the following samples, and saves the quantized model and the report to output_dir.
+    Returns:
+        the report
+    """
+    model.eval().to('cpu')
+    calibration_dataset = dataset.select(range(min(calibration_samples, len(dataset))))
+    eval_start = min(calibration_samples, max(len(dataset) - eval_samples, 0))
+    eval_dataset = dataset.select(range(eval_start, min(eval_start + eval_samples, len(dataset))))
+
+    def dataloader(each_dataset):
+        return DataLoader(each_dataset, batch_size=batch_size, num_workers=num_workers, collate_fn=collate_fn, drop_last=False)
+
+    quantized_model = quantize_model(copy.deepcopy(model), dataloader(calibration_dataset))
+    report = dict(calibration_samples=len(calibration_dataset), num_threads=torch.get_num_threads())
+    for name, each_model in [('fp32', model), ('int8', quantized_model)]:
+        report[name] = evaluate_open_loop(each_model, dataloader(eval_dataset))
+        report[name]['latency_ms'] = measure_latency(each_model, eval_dataset, collate_fn)
+        report[name]['size_mb'] = state_dict_size_mb(each_model)
+    report['delta'] = {key: report['int8'][key] - report['fp32'][key] for key in ['ade', 'fde', 'latency_ms', 'size_mb']}
+
+    save_quantized_model(quantized_model, output_dir)
+    with open(os.path.join(output_dir, 'quantization_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'quantized model saved to {output_dir}: ', json.dumps(report, indent=2))
+    return report
@@ -0,0 +1,163 @@
+import os
+import json
+import numpy as np
+import torch
+from multiprocessing import Pool
+from tqdm import tqdm
+from transformer4planning.utils.tensor_store import ShardedTensorStore
+
+# Offline preprocessing of the camera images for the dinov2 camera image encoder.
+# The image store keeps every camera frame decoded, resized and center cropped by the image processor of the encoder, as
+# (3, crop_height, crop_width) uint8 keyed by the image path relative to the camera image folder. Only rescaling and
+# normalization are left for the encoder, done on its device (see normalize_camera_pixel_values).
+# The optional feature store keeps the dinov2 patch features (257, 768) of every image, for training with the frozen
+# dinov2 without running it online.
+
+CAMERA_THUMBNAIL_SIZE = (1080 // 4, 1920 // 4)
+
+
+def load_camera_image(image_path):
+    """
+    Decodes a camera image at the resolution of the online loading of static_coor_rasterize.
+    Returns:
+        (height, width, 3) uint8 array
+    """
+    import PIL.Image
+    image = PIL.Image.open(image_path)
+    image.thumbnail(CAMERA_THUMBNAIL_SIZE)
+    return np.array(image)
+
+
+def camera_pixel_values(images, image_processor):
+    """
+    Resizes and center crops images as the image processor, without rescaling and normalizing.
+    Args:
+        images: list of (height, width, 3) uint8 arrays
+    Returns:
+        (num_images, 3, crop_height, crop_width) uint8 array
+    """
+    pixel_values = image_processor(images, do_rescale=False, do_normalize=False, return_tensors="np")["pixel_values"]
+    return np.clip(np.rint(pixel_values), 0, 255).astype(np.uint8)
+
+
+def normalize_camera_pixel_values(pixel_values, image_processor):
+    """
+    Rescales and normalizes the uint8 pixel values of the image store as the image processor, on their device.
+    Args:
+        pixel_values: (num_images, 3, crop_height, crop_width) uint8 tensor
+    Returns:
+        float32 tensor of the same shape, the pixel_values input of dinov2
+    """
+    pixel_values = pixel_values.to(torch.float32)
+    if image_processor.do_rescale:
+        pixel_values = pixel_values * image_processor.rescale_factor
+    if image_processor.do_normalize:
+        mean = torch.tensor(image_processor.image_mean, dtype=torch.float32, device=pixel_values.device)
+        std = torch.tensor(image_processor.image_std, dtype=torch.float32, device=pixel_values.device)
+        pixel_values = (pixel_values - mean[:, None, None]) / std[:, None, None]
+    return pixel_values
+
+
+def image_store_info(image_processor):
+    return dict(thumbnail=list(CAMERA_THUMBNAIL_SIZE), image_processor=image_processor.to_dict())
+
+
+def _image_store_kwargs(image_processor):
+    crop_size = image_processor.crop_size if image_processor.do_center_crop else image_processor.size
+    assert 'height' in crop_size and 'width' in crop_size, f'images of various sizes can not be stored, {crop_size}'
+    return dict(shape=(3, crop_size['height'], crop_size['width']), dtype=np.uint8, shard_size=4096,
+                info=image_store_info(image_processor))
+
+
+_worker_store = None
+_worker_image_processor = None
+_worker_key_to_folder = None
+
+
+def _init_image_worker(store_path, image_processor, key_to_folder):
+    global _worker_store, _worker_image_processor, _worker_key_to_folder
+    _worker_store = ShardedTensorStore(store_path, writable=True)
+    _worker_image_processor = image_processor
+    _worker_key_to_folder = key_to_folder
+
+
+def _store_one_image(key):
+    image_path = os.path.join(_worker_key_to_folder[key], key)
+    if not os.path.exists(image_path):
+        return False
+    try:
+        image = load_camera_image(image_path)
+    except OSError as e:
+        print('failed to decode image: ', image_path, e)
+        return False
+    _worker_store.write(key, camera_pixel_values([image], _worker_image_processor)[0])
+    return True
+
+
+def build_camera_image_store(datasets_and_folders, store_path, image_processor, num_workers=8):
+    """
+    Decodes, resizes and crops every camera image of the datasets once, resuming an interrupted build.
+    Args:
+        datasets_and_folders: list of (index dataset with the images_path column, camera image folder of the dataset)
+        store_path: path of the image store
+        image_processor: image processor of the camera image encoder
+    Returns:
+        the image store
+    """
+    key_to_folder = dict()
+    for dataset, images_folder in datasets_and_folders:
+        assert images_folder is not None, 'camera image folder of the dataset should not be None'
+        for images_paths in dataset['images_path']:
+            for image_path in images_paths:
+                key_to_folder.setdefault(image_path, images_folder)
+    keys = sorted(key_to_folder.keys())
+    key_to_folder = {key: key_to_folder[key] for key in keys}
+    store = ShardedTensorStore(store_path, keys=keys, **_image_store_kwargs(image_processor))
+    # creates all shards in the main process, workers never race on file creation
+    missing_keys = store.missing_keys()
+    print(f'building camera image store at {store_path}: {len(missing_keys)} / {len(store)} images missing')
+    if len(missing_keys) > 0:
+        num_failed = 0
+        with Pool(max(num_workers, 1), initializer=_init_image_worker,
+                  initargs=(store_path, image_processor, key_to_folder)) as pool:
+            for stored in tqdm(pool.imap_unordered(_store_one_image, missing_keys, chunksize=64), total=len(missing_keys)):
+                num_failed += not stored
+        print(f'camera image store finished, {num_failed} images not found or failed to decode')
+    return store
+
+
+def build_camera_feature_store(image_store_path, store_path, image_processor, camera_image_encoder,
+                               device='cpu', batch_size=64, dtype=np.float16):
+    """
+    Runs the frozen camera image encoder once over the image store, storing its last hidden states keyed by image path.
+    Images missing in the image store stay missing in the feature store.
+    Args:
+        dtype: numpy dtype of the stored features, float16 by default to halve the storage
+    Returns:
+        the feature store
+    """
+    image_store = ShardedTensorStore(image_store_path)
+    assert image_store.info == json.loads(json.dumps(image_store_info(image_processor))), \
+        f'image store at {image_store_path} was built with another image processor'
+    device = torch.device(device)
+    camera_image_encoder.to(device)
+    camera_image_encoder.eval()
+    # the number of patches and hidden size are fixed by the encoder config and the crop size
+    with torch.no_grad():
+        dummy = torch.zeros((1,) + image_store.shape, dtype=torch.float32, device=device)
+        feature_shape = tuple(camera_image_encoder(pixel_values=dummy).last_hidden_state.shape[1:])
+    store = ShardedTensorStore(store_path, keys=image_store.keys, shape=feature_shape, dtype=dtype, shard_size=1024,
+                               info=dict(image_store=image_store.info,
+                                         camera_image_encoder=camera_image_encoder.config.to_dict()))
+    missing_keys = [key for key in store.missing_keys() if image_store.is_written(key)]
+    print(f'building camera feature store at {store_path}: {len(missing_keys)} / {len(store)} images missing')
+    with torch.no_grad():
+        for start in tqdm(range(0, len(missing_keys), batch_size)):
+            keys = missing_keys[start:start + batch_size]
+            pixel_values = torch.from_numpy(image_store.read(keys)).to(device)
+            features = camera_image_encoder(pixel_values=normalize_camera_pixel_values(pixel_values, image_processor)).last_hidden_state
+            features = features.cpu().numpy().astype(dtype)
+            for key, feature in zip(keys, features):
+                store.write(key, feature)
+    store.flush()
+    return store
@@ -0,0 +1,97 @@
+import argparse
+import copy
+import os
+import pickle
+import time
+
+import numpy as np
+
+from transformer4planning.preprocess import nuplan_rasterize
+from transformer4planning.preprocess.test.test_agent_rasterization import contour_box_corners, draw_boxes_with_contours
+
+# Checks the vectorized agent rasterization (agent_box_corners + fill_boxes with cv2.fillPoly) against the per-box
+# generate_contour_pts + cv2.drawContours it replaced on stored samples of a dataset, random boxes are checked in
+# test/test_agent_rasterization.py.
+
+
+def rasterize(samples, reference, **kwargs):
+    """
+    Collates the samples with the vectorized or the reference agent rasterization.
+    """
+    agent_box_corners, fill_boxes = nuplan_rasterize.agent_box_corners, nuplan_rasterize.fill_boxes
+    if reference:
+        nuplan_rasterize.agent_box_corners, nuplan_rasterize.fill_boxes = contour_box_corners, draw_boxes_with_contours
+    try:
+        start = time.perf_counter()
+        result = nuplan_rasterize.nuplan_rasterize_collate_func(copy.deepcopy(samples), **kwargs)
+        return result, time.perf_counter() - start
+    finally:
+        nuplan_rasterize.agent_box_corners, nuplan_rasterize.fill_boxes = agent_box_corners, fill_boxes
+
+
+def check_samples(samples, batch_size=8, **kwargs):
+    """
+    Rasterizes the samples with both paths.
+    Returns:
+        number of differing raster pixels by raster, run time of the vectorized and the reference path in seconds
+    """
+    pixel_diff = dict(high_res_raster=0, low_res_raster=0)
+    run_times = np.zeros(2)
+    for i in range(0, len(samples), batch_size):
+        batch = samples[i:i + batch_size]
+        result, run_time = rasterize(batch, reference=False, **kwargs)
+        reference_result, reference_run_time = rasterize(batch, reference=True, **kwargs)
+        run_times += [run_time, reference_run_time]
+        for key in pixel_diff:
+            if key in result:
+                pixel_diff[key] += (result[key] != reference_result[key]).sum().item()
+    return pixel_diff, run_times
+
+
+def load_samples(saved_dataset_folder, split, num_samples):
+    """
+    Loads num_samples samples spread over the index datasets of the split (one per city, as runner.load_dataset)
+    and the maps of the dataset.
+    """
+    from datasets import Dataset, concatenate_datasets
+    index_root = os.path.join(saved_dataset_folder, split)
+    index_paths = [os.path.join(index_root, each) for each in sorted(os.listdir(index_root))
+                   if os.path.isdir(os.path.join(index_root, each))]
+    datasets = [Dataset.load_from_disk(each) for each in index_paths] if len(index_paths) > 0 \
+        else [Dataset.load_from_disk(index_root)]
+    dataset = concatenate_datasets(datasets)
+    if 'split' not in dataset.column_names:
+        dataset = dataset.add_column(name='split', column=[split] * len(dataset))
+    dataset.set_format(type='torch')
+    indices = np.linspace(0, len(dataset) - 1, min(num_samples, len(dataset))).astype(np.int64)
+    samples = [dataset[int(i)] for i in indices]
+
+    all_maps_dic = {}
+    map_folder = os.path.join(saved_dataset_folder, 'map')
+    for each_map in os.listdir(map_folder):
+        if each_map.endswith('.pkl'):
+            with open(os.path.join(map_folder, each_map), 'rb') as f:
+                all_maps_dic[each_map.split('.')[0]] = pickle.load(f)
+    return samples, all_maps_dic
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parity of the vectorized (fillPoly) vs per-box (drawContours) agent rasterization')
+    parser.add_argument('--saved_dataset_folder', type=str, required=True,
+                        help='nuplan dataset with index, map and pickle folders')
+    parser.add_argument('--split', type=str, default='test')
+    parser.add_argument('--samples', type=int, default=64, help='number of stored samples to rasterize')
+    parser.add_argument('--batch_size', type=int, default=8)
+    args = parser.parse_args()
+
+    samples, all_maps_dic = load_samples(args.saved_dataset_folder, args.split, args.samples)
+    pixel_diff, run_times = check_samples(samples, batch_size=args.batch_size,
+                                          dic_path=args.saved_dataset_folder, all_maps_dic=all_maps_dic)
+    print(f'{len(samples)} stored samples: differing pixels {pixel_diff}, '
+          f'collate fillPoly {run_times[0] / len(samples) * 1e3:.1f} ms '
+          f'vs drawContours {run_times[1] / len(samples) * 1e3:.1f} ms per sample')
+    assert sum(pixel_diff.values()) == 0, 'rasters differ from the per-box reference!'
+
+
+if __name__ == '__main__':
+    main()
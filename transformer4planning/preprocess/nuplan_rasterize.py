@@ -9,8 +9,20 @@ from functools import partial
 from torch.utils.data._utils.collate import default_collate
 from transformer4planning.utils.nuplan_utils import generate_contour_pts, normalize_angle
 from transformer4planning.utils.common_utils import save_raster
+from transformer4planning.preprocess.raster_embedding_cache import raster_embedding_key
 
-def nuplan_rasterize_collate_func(batch, dic_path=None, autoregressive=False, **encode_kwargs):
+def _empty_batch_tensor(shape, dtype, pin_memory=False):
+    """
+    Allocates a batch tensor for the collate function to write samples to.
+    In dataloader workers, the tensor is allocated in shared memory as default_collate does, thus it is passed to the main
+    process without copy. Pinned tensors (main process only) are not copied again by the pin_memory of the dataloader.
+    """
+    if torch.utils.data.get_worker_info() is not None:
+        return torch.empty(shape, dtype=dtype).share_memory_()
+    return torch.empty(shape, dtype=dtype, pin_memory=pin_memory and torch.cuda.is_available())
+
+
+def nuplan_rasterize_collate_func(batch, dic_path=None, autoregressive=False, pin_memory=False, **encode_kwargs):
     """
     'nuplan_collate_fn' is designed for nuplan dataset online generation.
     To use it, you need to provide a dictionary path of road dictionaries and agent&traffic dictionaries,  
@@ -18,6 +30,10 @@ def nuplan_rasterize_collate_func(batch, dic_path=None, autoregressive=False, **
 
     The batch is the raw indexes data for one nuplan data item, each data in batch includes:
     road_ids, route_ids, traffic_ids, agent_ids, file_name, frame_id, map and timestamp.
+
+    Batch tensors of the array outputs (rasters, context actions, trajectory label, ...) are allocated once with the shapes
+    of the first sample, the following samples are rasterized directly into them.
+    Set pin_memory to allocate them in pinned memory when collating in the main process.
     """
     # padding for tensor data
     expected_padding_keys = ["road_ids", "route_ids", "traffic_ids"]
@@ -46,19 +62,48 @@ def nuplan_rasterize_collate_func(batch, dic_path=None, autoregressive=False, **
     # with ThreadPoolExecutor(max_workers=len(batch)) as executor:
     #     new_batch = list(executor.map(map_func, batch))
     new_batch = list()
+    batch_tensors = None
+    batch_arrays = None
     for i, d in enumerate(batch):
-        rst = map_func(d)
+        valid_index = len(new_batch)
+        if batch_arrays is not None and not autoregressive and "high_res_raster" in batch_arrays:
+            written_keys = ["high_res_raster", "low_res_raster"]
+            rst = map_func(d, output_rasters=(batch_arrays["high_res_raster"][valid_index],
+                                              batch_arrays["low_res_raster"][valid_index]))
+        else:
+            written_keys = []
+            rst = map_func(d)
         if rst is None:
             continue
+        if batch_tensors is None:
+            # sized from the first valid sample, numeric arrays only
+            batch_tensors = {key: _empty_batch_tensor((len(batch),) + value.shape,
+                                                      torch.from_numpy(np.empty(0, dtype=value.dtype)).dtype, pin_memory)
+                             for key, value in rst.items()
+                             if isinstance(value, np.ndarray) and (value.dtype.kind in 'bif' or value.dtype == np.uint8)}
+            batch_arrays = {key: value.numpy() for key, value in batch_tensors.items()}
+        for key, array in batch_arrays.items():
+            if key in written_keys:
+                continue
+            if rst.get(key) is None:
+                print('Error: None value', key)
+                array[valid_index] = 0
+            else:
+                # numpy would broadcast mismatching samples into the row silently
+                assert np.shape(rst[key]) == array.shape[1:], \
+                    f'{key} of shape {np.shape(rst[key])} does not match the batch shape {array.shape[1:]}'
+                array[valid_index] = rst[key]
         new_batch.append(rst)
 
     if len(new_batch) == 0:
         return {}
-    
+
     # process as data dictionary
     result = dict()
+    for key, value in batch_tensors.items():
+        result[key] = value[:len(new_batch)]
     for key in new_batch[0].keys():
-        if key is None:
+        if key is None or key in result:
             continue
         list_of_dvalues = []
         for d in new_batch:
@@ -71,13 +116,74 @@ def nuplan_rasterize_collate_func(batch, dic_path=None, autoregressive=False, **
         result[key] = default_collate(list_of_dvalues)
     return result
 
+def agent_box_corners(poses, shapes, origin_ego_pose, cos_, sin_):
+    """
+    Vectorized generate_contour_pts of agent boxes, rotated to the ego frame.
+    Computed in float64 with the same operations as the per-box python version.
+    :param poses: (num_boxes, 4) x, y, z, heading in global coordinates
+    :param shapes: (num_boxes, 2) width, length
+    :param cos_, sin_: rotation to the ego frame
+    :return: (num_boxes, 4, 2) int32 corners, truncated to meters
+    """
+    poses = poses.copy()
+    poses -= origin_ego_pose
+    poses = poses.astype(np.float64)
+    shapes = shapes.astype(np.float64)
+    # box center as (y, x) in the ego frame
+    ox = poses[:, 0] * sin_ + poses[:, 1] * cos_
+    oy = poses[:, 0] * cos_ - poses[:, 1] * sin_
+    cos_direction, sin_direction = np.cos(-poses[:, 3]), np.sin(-poses[:, 3])
+    half_w, half_l = shapes[:, 0] / 2, shapes[:, 1] / 2
+    rect_pts = np.empty((poses.shape[0], 4, 2), dtype=np.int32)
+    for i, (sign_w, sign_l) in enumerate([(-1, -1), (1, -1), (1, 1), (-1, 1)]):
+        px = ox - half_w if sign_w < 0 else ox + half_w
+        py = oy - half_l if sign_l < 0 else oy + half_l
+        rect_pts[:, i, 0] = ox + cos_direction * (px - ox) - sin_direction * (py - oy)
+        rect_pts[:, i, 1] = oy + sin_direction * (px - ox) + cos_direction * (py - oy)
+    return rect_pts
+
+
+def fill_boxes(channels, channel_indices, rect_pts):
+    """
+    Fills boxes on raster channels with one cv2.fillPoly per channel.
+    fillPoly fills the polygons of one call by the even-odd rule, thus boxes whose bounding box touches another box of the
+    same channel are filled one by one, which gives the same raster as filling each box separately.
+    :param channels: (num_channels, h, w) uint8 rasters
+    :param channel_indices: (num_boxes, ) channel of every box
+    :param rect_pts: (num_boxes, 4, 2) pixel coordinates of the box corners
+    """
+    order = np.argsort(channel_indices, kind='stable')
+    rect_pts = rect_pts[order].astype(np.int32)
+    unique_channels, starts, counts = np.unique(channel_indices[order], return_index=True, return_counts=True)
+    # pairwise bounding box test of the boxes within each channel, padded to the largest channel
+    group = np.repeat(np.arange(len(unique_channels)), counts)
+    position = np.arange(len(order)) - starts[group]
+    lower = np.full((len(unique_channels), counts.max(), 2), np.iinfo(np.int32).max, dtype=np.int64)
+    upper = np.full((len(unique_channels), counts.max(), 2), np.iinfo(np.int32).min, dtype=np.int64)
+    lower[group, position] = rect_pts.min(axis=1) - 1
+    upper[group, position] = rect_pts.max(axis=1) + 1
+    touching = ((lower[:, :, None] <= upper[:, None]) & (lower[:, None] <= upper[:, :, None])).all(-1)
+    touching[:, np.arange(counts.max()), np.arange(counts.max())] = False
+    separate = ~touching.any(-1)[group, position]
+
+    for channel, start, end in zip(unique_channels.tolist(), starts.tolist(), (starts + counts).tolist()):
+        contours, channel_separate = rect_pts[start:end], separate[start:end]
+        if channel_separate.all():
+            cv2.fillPoly(channels[channel], list(contours), (255, 255, 255))
+            continue
+        if channel_separate.any():
+            cv2.fillPoly(channels[channel], list(contours[channel_separate]), (255, 255, 255))
+        for contour in contours[~channel_separate]:
+            cv2.fillPoly(channels[channel], [contour], (255, 255, 255))
+
+
 def static_coor_rasterize(sample, data_path, raster_shape=(224, 224),
                           frame_rate=20, past_seconds=2, future_seconds=8,
                           high_res_scale=4, low_res_scale=0.77,
                           road_types=20, agent_types=8, traffic_types=4,
                           past_sample_interval=2, future_sample_interval=2,
                           debug_raster_path=None, all_maps_dic=None, agent_dic=None,
-                          frequency_change_rate=2, **kwargs):
+                          frequency_change_rate=2, output_rasters=None, **kwargs):
     """
     WARNING: frame_rate has been change to 10 as default to generate new dataset pickles, this is automatically processed by hard-coded logits
     :param sample: a dictionary containing the following keys:
@@ -92,6 +198,8 @@ def static_coor_rasterize(sample, data_path, raster_shape=(224, 224),
         - frame_id: the frame id of the current frame, this is the global index which is irrelevant to frame rate of agent_dic pickles (20Hz)
         - debug_raster_path: if a debug_path past, will save rasterized images to disk, warning: will slow down the process
     :param data_path: the root path to load pickle files
+    :param output_rasters: optional (high_res_raster, low_res_raster) bool arrays of shape (h, w, channels) to write the rasters to,
+        views of the batch tensors of the collate function
     starting_frame, ending_frame, sample_frame in 20Hz,
     """
     filename = sample["file_name"]
@@ -226,187 +334,6 @@ def static_coor_rasterize(sample, data_path, raster_shape=(224, 224),
     # origin_ego_pose = agent_dic["ego"]["pose"][num_frame].copy()  # hard-coded resample rate 2
     if np.isinf(origin_ego_pose[0]) or np.isinf(origin_ego_pose[1]):
         assert False, f"Error: ego pose is inf {origin_ego_pose}, not enough precision while generating dictionary"
-    # channels:
-    # 0-2: route raster
-    # 3-22: road raster
-    # 23-26: traffic raster
-    # 27-91: agent raster (64=8 (agent_types) * 8 (sample_frames_in_past))
-    route_channel = 2
-    route_channel += 1 if ego_point is not None else 0
-
-    total_raster_channels = route_channel + road_types + traffic_types + agent_types * len(sample_frames_in_past)
-    rasters_high_res = np.zeros([raster_shape[0],
-                                 raster_shape[1],
-                                 total_raster_channels], dtype=np.uint8)
-    rasters_low_res = np.zeros([raster_shape[0],
-                                raster_shape[1],
-                                total_raster_channels], dtype=np.uint8)
-    rasters_high_res_channels = cv2.split(rasters_high_res)
-    rasters_low_res_channels = cv2.split(rasters_low_res)
-
-    # route raster
-    cos_, sin_ = math.cos(-origin_ego_pose[3] - math.pi / 2), math.sin(-origin_ego_pose[3] - math.pi / 2)
-
-    for route_id in route_ids:
-        if int(route_id) == -1:
-            continue
-        # raster route blocks
-        xyz = road_dic[int(route_id)]["xyz"].copy()
-        xyz[:, :2] -= origin_ego_pose[:2]
-        pts = list(zip(xyz[:, 0], xyz[:, 1]))
-        line = shapely.geometry.LineString(pts)
-        simplified_xyz_line = line.simplify(1)
-        simplified_x, simplified_y = simplified_xyz_line.xy
-        simplified_xyz = np.ones((len(simplified_x), 2)) * -1
-        simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_x, simplified_y
-        simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_xyz[:, 0].copy() * cos_ - simplified_xyz[:, 1].copy() * sin_, simplified_xyz[:, 0].copy() * sin_ + simplified_xyz[:, 1].copy() * cos_
-        simplified_xyz[:, 1] *= -1
-        simplified_xyz[:, 0] *= y_inverse
-        high_res_route = (simplified_xyz * high_res_scale + raster_shape[0] // 2).astype('int32')
-        low_res_route = (simplified_xyz * low_res_scale + raster_shape[0] // 2).astype('int32')
-
-        cv2.fillPoly(rasters_high_res_channels[0], np.int32([high_res_route[:, :2]]), (255, 255, 255))
-        cv2.fillPoly(rasters_low_res_channels[0], np.int32([low_res_route[:, :2]]), (255, 255, 255))
-
-        # raster route lanes
-        route_lanes = road_dic[int(route_id)]["lower_level"]
-        for each_route_lane in route_lanes:
-            xyz = road_dic[int(each_route_lane)]["xyz"].copy()
-            xyz[:, :2] -= origin_ego_pose[:2]
-            pts = list(zip(xyz[:, 0], xyz[:, 1]))
-            line = shapely.geometry.LineString(pts)
-            simplified_xyz_line = line.simplify(1)
-            simplified_x, simplified_y = simplified_xyz_line.xy
-            simplified_xyz = np.ones((len(simplified_x), 2)) * -1
-            simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_x, simplified_y
-            simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_xyz[:, 0].copy() * cos_ - simplified_xyz[:, 1].copy() * sin_, simplified_xyz[:, 0].copy() * sin_ + simplified_xyz[:, 1].copy() * cos_
-            simplified_xyz[:, 1] *= -1
-            simplified_xyz[:, 0] *= y_inverse
-            high_res_route = (simplified_xyz * high_res_scale).astype('int32') + raster_shape[0] // 2
-            low_res_route = (simplified_xyz * low_res_scale).astype('int32') + raster_shape[0] // 2
-            for j in range(simplified_xyz.shape[0] - 1):
-                cv2.line(rasters_high_res_channels[1], tuple(high_res_route[j, :2]),
-                         tuple(high_res_route[j + 1, :2]), (255, 255, 255), 2)
-                cv2.line(rasters_low_res_channels[1], tuple(low_res_route[j, :2]),
-                         tuple(low_res_route[j + 1, :2]), (255, 255, 255), 2)
-
-        # raster ego point
-        if ego_point is not None:
-            ego_point[:2] -= origin_ego_pose[:2]
-            ego_point[0], ego_point[1] = ego_point[0].copy() * cos_ - ego_point[1].copy() * sin_, ego_point[0].copy() * sin_ + ego_point[1].copy() * cos_
-            ego_point[1] *= -1
-            ego_point[0] *= y_inverse
-            high_res_ego_point = (ego_point * high_res_scale).astype('int32') + raster_shape[0] // 2
-            low_res_ego_point = (ego_point * low_res_scale).astype('int32') + raster_shape[0] // 2
-            cv2.circle(rasters_high_res_channels[2], tuple(high_res_ego_point[:2]), 3, (255, 255, 255), -1)
-            cv2.circle(rasters_low_res_channels[2], tuple(low_res_ego_point[:2]), 3, (255, 255, 255), -1)
-
-    # road raster
-    for road_id in road_ids:
-        if int(road_id) == -1:
-            continue
-        if int(road_id) not in road_dic:
-            print('Warning: road_id not in road_dic! ', road_id)
-            continue
-        xyz = road_dic[int(road_id)]["xyz"].copy()
-        road_type = int(road_dic[int(road_id)]["type"])
-        assert 0 <= road_type < road_types, f'road_type {road_type} is larger than road_types {road_types}'
-        xyz[:, :2] -= origin_ego_pose[:2]
-        pts = list(zip(xyz[:, 0], xyz[:, 1]))
-        line = shapely.geometry.LineString(pts)
-        simplified_xyz_line = line.simplify(1)
-        simplified_x, simplified_y = simplified_xyz_line.xy
-        simplified_xyz = np.ones((len(simplified_x), 2)) * -1
-        simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_x, simplified_y
-        simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_xyz[:, 0].copy() * cos_ - simplified_xyz[:,1].copy() * sin_, simplified_xyz[:, 0].copy() * sin_ + simplified_xyz[:, 1].copy() * cos_
-        simplified_xyz[:, 1] *= -1
-        simplified_xyz[:, 0] *= y_inverse
-        high_res_road = (simplified_xyz * high_res_scale).astype('int32') + raster_shape[0] // 2
-        low_res_road = (simplified_xyz * low_res_scale).astype('int32') + raster_shape[0] // 2
-        if road_type in [5, 17, 18, 19]:
-            cv2.fillPoly(rasters_high_res_channels[road_type + route_channel], np.int32([high_res_road[:, :2]]), (255, 255, 255))
-            cv2.fillPoly(rasters_low_res_channels[road_type + route_channel], np.int32([low_res_road[:, :2]]), (255, 255, 255))
-        else:
-            for j in range(simplified_xyz.shape[0] - 1):
-                cv2.line(rasters_high_res_channels[road_type + route_channel], tuple(high_res_road[j, :2]),
-                        tuple(high_res_road[j + 1, :2]), (255, 255, 255), 2)
-                cv2.line(rasters_low_res_channels[road_type + route_channel], tuple(low_res_road[j, :2]),
-                        tuple(low_res_road[j + 1, :2]), (255, 255, 255), 2)
-    # traffic channels drawing
-    for idx, traffic_id in enumerate(traffic_light_ids):
-        traffic_state = int(traffic_light_states[idx])
-        if int(traffic_id) == -1 or int(traffic_id) not in list(road_dic.keys()):
-            continue
-        assert 0 <= traffic_state < traffic_types, f'traffic_state {traffic_state} is larger than traffic_types {traffic_types}'
-        xyz = road_dic[int(traffic_id)]["xyz"].copy()
-        xyz[:, :2] -= origin_ego_pose[:2]
-        # traffic_state = traffic_dic[traffic_id.item()]["state"]
-        pts = list(zip(xyz[:, 0], xyz[:, 1]))
-        line = shapely.geometry.LineString(pts)
-        simplified_xyz_line = line.simplify(1)
-        simplified_x, simplified_y = simplified_xyz_line.xy
-        simplified_xyz = np.ones((len(simplified_x), 2)) * -1
-        simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_x, simplified_y
-        simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_xyz[:, 0].copy() * cos_ - simplified_xyz[:, 1].copy() * sin_, simplified_xyz[:, 0].copy() * sin_ + simplified_xyz[:, 1].copy() * cos_
-        simplified_xyz[:, 1] *= -1
-        simplified_xyz[:, 0] *= y_inverse
-        high_res_traffic = (simplified_xyz * high_res_scale).astype('int32') + raster_shape[0] // 2
-        low_res_traffic = (simplified_xyz * low_res_scale).astype('int32') + raster_shape[0] // 2
-        # traffic state order is GREEN, RED, YELLOW, UNKNOWN
-        for j in range(simplified_xyz.shape[0] - 1):
-            cv2.line(rasters_high_res_channels[route_channel + road_types + traffic_state],
-                     tuple(high_res_traffic[j, :2]),
-                     tuple(high_res_traffic[j + 1, :2]), (255, 255, 255), 2)
-            cv2.line(rasters_low_res_channels[route_channel + road_types + traffic_state],
-                     tuple(low_res_traffic[j, :2]),
-                     tuple(low_res_traffic[j + 1, :2]), (255, 255, 255), 2)
-    # agent raster
-    cos_, sin_ = math.cos(-origin_ego_pose[3]), math.sin(-origin_ego_pose[3])
-
-    for _, agent_id in enumerate(agent_ids):
-        if agent_id == "null":
-            continue
-        if agent_id not in list(agent_dic.keys()):
-            print('unknown agent id', agent_id)
-            continue
-        for i, sample_frame in enumerate(sample_frames_in_past):
-            if relative_frame_id:
-                agent_starting_frame = agent_dic[agent_id]['starting_frame']
-                agent_ending_frame = agent_dic[agent_id]['ending_frame']
-                if sample_frame < agent_starting_frame:
-                    continue
-                if agent_ending_frame != -1 and sample_frame >= agent_ending_frame:
-                    continue
-                pose = agent_dic[agent_id]['pose'][(sample_frame - agent_starting_frame)//frequency_change_rate, :].copy()  # Hard-coded frequency change
-                shape = agent_dic[agent_id]['shape'][(sample_frame - agent_starting_frame)//frequency_change_rate, :]
-            else:
-                pose = agent_dic[agent_id]['pose'][sample_frame, :].copy()
-                shape = agent_dic[agent_id]['shape'][sample_frame, :]
-            if pose[0] < 0 and pose[1] < 0:
-                continue
-            pose -= origin_ego_pose
-            agent_type = int(agent_dic[agent_id]['type'])
-            assert 0 <= agent_type < agent_types, f'agent_type {agent_type} is larger than agent_types {agent_types}'
-            rotated_pose = [pose[0] * cos_ - pose[1] * sin_,
-                            pose[0] * sin_ + pose[1] * cos_]
-            # rect_pts = cv2.boxPoints(((rotated_pose[0], rotated_pose[1]),
-            #   (shape[1], shape[0]), np.rad2deg(pose[3])))
-            rect_pts = generate_contour_pts((rotated_pose[1], rotated_pose[0]), w=shape[0], l=shape[1],
-                                            direction=-pose[3])
-            rect_pts = np.array(rect_pts, dtype=np.int32)
-            rect_pts[:, 0] *= y_inverse
-            # draw on high resolution
-            rect_pts_high_res = (high_res_scale * rect_pts).astype(np.int64) + raster_shape[0]//2
-            # example: if frame_interval = 10, past frames = 40
-            # channel number of [index:0-frame_0, index:1-frame_10, index:2-frame_20, index:3-frame_30, index:4-frame_40]  for agent_type = 0
-            # channel number of [index:5-frame_0, index:6-frame_10, index:7-frame_20, index:8-frame_30, index:9-frame_40]  for agent_type = 1
-            # ...
-            cv2.drawContours(rasters_high_res_channels[route_channel + road_types + traffic_types + agent_type * len(sample_frames_in_past) + i],
-                             [rect_pts_high_res], -1, (255, 255, 255), -1)
-            # draw on low resolution
-            rect_pts_low_res = (low_res_scale * rect_pts).astype(np.int64) + raster_shape[0]//2
-            cv2.drawContours(rasters_low_res_channels[route_channel + road_types + traffic_types + agent_type * len(sample_frames_in_past) + i],
-                             [rect_pts_low_res], -1, (255, 255, 255), -1)
 
     # context action computation
     cos_, sin_ = math.cos(-origin_ego_pose[3]), math.sin(-origin_ego_pose[3])
@@ -450,19 +377,219 @@ def static_coor_rasterize(sample, data_path, raster_shape=(224, 224),
     trajectory_label[:, 1] = traj_x * sin_ + traj_y * cos_
     trajectory_label[:, 1] *= y_inverse
 
-    rasters_high_res = cv2.merge(rasters_high_res_channels).astype(bool)
-    rasters_low_res = cv2.merge(rasters_low_res_channels).astype(bool)
-
+    raster_embedding_store = kwargs.get('raster_embedding_store', None)
     result_to_return = dict()
-    result_to_return["high_res_raster"] = np.array(rasters_high_res, dtype=bool)
-    result_to_return["low_res_raster"] = np.array(rasters_low_res, dtype=bool)
+    if raster_embedding_store is None:
+        # channels:
+        # 0-2: route raster
+        # 3-22: road raster
+        # 23-26: traffic raster
+        # 27-91: agent raster (64=8 (agent_types) * 8 (sample_frames_in_past))
+        route_channel = 2
+        route_channel += 1 if ego_point is not None else 0
+
+        total_raster_channels = route_channel + road_types + traffic_types + agent_types * len(sample_frames_in_past)
+        # channel first, every channel is a contiguous image for cv2 to draw on in place
+        rasters_high_res_channels = np.zeros([total_raster_channels,
+                                              raster_shape[0],
+                                              raster_shape[1]], dtype=np.uint8)
+        rasters_low_res_channels = np.zeros([total_raster_channels,
+                                             raster_shape[0],
+                                             raster_shape[1]], dtype=np.uint8)
+
+        # route raster
+        cos_, sin_ = math.cos(-origin_ego_pose[3] - math.pi / 2), math.sin(-origin_ego_pose[3] - math.pi / 2)
+
+        for route_id in route_ids:
+            if int(route_id) == -1:
+                continue
+            # raster route blocks
+            xyz = road_dic[int(route_id)]["xyz"].copy()
+            xyz[:, :2] -= origin_ego_pose[:2]
+            pts = list(zip(xyz[:, 0], xyz[:, 1]))
+            line = shapely.geometry.LineString(pts)
+            simplified_xyz_line = line.simplify(1)
+            simplified_x, simplified_y = simplified_xyz_line.xy
+            simplified_xyz = np.ones((len(simplified_x), 2)) * -1
+            simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_x, simplified_y
+            simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_xyz[:, 0].copy() * cos_ - simplified_xyz[:, 1].copy() * sin_, simplified_xyz[:, 0].copy() * sin_ + simplified_xyz[:, 1].copy() * cos_
+            simplified_xyz[:, 1] *= -1
+            simplified_xyz[:, 0] *= y_inverse
+            high_res_route = (simplified_xyz * high_res_scale + raster_shape[0] // 2).astype('int32')
+            low_res_route = (simplified_xyz * low_res_scale + raster_shape[0] // 2).astype('int32')
+
+            cv2.fillPoly(rasters_high_res_channels[0], np.int32([high_res_route[:, :2]]), (255, 255, 255))
+            cv2.fillPoly(rasters_low_res_channels[0], np.int32([low_res_route[:, :2]]), (255, 255, 255))
+
+            # raster route lanes
+            route_lanes = road_dic[int(route_id)]["lower_level"]
+            for each_route_lane in route_lanes:
+                xyz = road_dic[int(each_route_lane)]["xyz"].copy()
+                xyz[:, :2] -= origin_ego_pose[:2]
+                pts = list(zip(xyz[:, 0], xyz[:, 1]))
+                line = shapely.geometry.LineString(pts)
+                simplified_xyz_line = line.simplify(1)
+                simplified_x, simplified_y = simplified_xyz_line.xy
+                simplified_xyz = np.ones((len(simplified_x), 2)) * -1
+                simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_x, simplified_y
+                simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_xyz[:, 0].copy() * cos_ - simplified_xyz[:, 1].copy() * sin_, simplified_xyz[:, 0].copy() * sin_ + simplified_xyz[:, 1].copy() * cos_
+                simplified_xyz[:, 1] *= -1
+                simplified_xyz[:, 0] *= y_inverse
+                high_res_route = (simplified_xyz * high_res_scale).astype('int32') + raster_shape[0] // 2
+                low_res_route = (simplified_xyz * low_res_scale).astype('int32') + raster_shape[0] // 2
+                for j in range(simplified_xyz.shape[0] - 1):
+                    cv2.line(rasters_high_res_channels[1], tuple(high_res_route[j, :2]),
+                             tuple(high_res_route[j + 1, :2]), (255, 255, 255), 2)
+                    cv2.line(rasters_low_res_channels[1], tuple(low_res_route[j, :2]),
+                             tuple(low_res_route[j + 1, :2]), (255, 255, 255), 2)
+
+            # raster ego point
+            if ego_point is not None:
+                ego_point[:2] -= origin_ego_pose[:2]
+                ego_point[0], ego_point[1] = ego_point[0].copy() * cos_ - ego_point[1].copy() * sin_, ego_point[0].copy() * sin_ + ego_point[1].copy() * cos_
+                ego_point[1] *= -1
+                ego_point[0] *= y_inverse
+                high_res_ego_point = (ego_point * high_res_scale).astype('int32') + raster_shape[0] // 2
+                low_res_ego_point = (ego_point * low_res_scale).astype('int32') + raster_shape[0] // 2
+                cv2.circle(rasters_high_res_channels[2], tuple(high_res_ego_point[:2]), 3, (255, 255, 255), -1)
+                cv2.circle(rasters_low_res_channels[2], tuple(low_res_ego_point[:2]), 3, (255, 255, 255), -1)
+
+        # road raster
+        for road_id in road_ids:
+            if int(road_id) == -1:
+                continue
+            if int(road_id) not in road_dic:
+                print('Warning: road_id not in road_dic! ', road_id)
+                continue
+            xyz = road_dic[int(road_id)]["xyz"].copy()
+            road_type = int(road_dic[int(road_id)]["type"])
+            assert 0 <= road_type < road_types, f'road_type {road_type} is larger than road_types {road_types}'
+            xyz[:, :2] -= origin_ego_pose[:2]
+            pts = list(zip(xyz[:, 0], xyz[:, 1]))
+            line = shapely.geometry.LineString(pts)
+            simplified_xyz_line = line.simplify(1)
+            simplified_x, simplified_y = simplified_xyz_line.xy
+            simplified_xyz = np.ones((len(simplified_x), 2)) * -1
+            simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_x, simplified_y
+            simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_xyz[:, 0].copy() * cos_ - simplified_xyz[:,1].copy() * sin_, simplified_xyz[:, 0].copy() * sin_ + simplified_xyz[:, 1].copy() * cos_
+            simplified_xyz[:, 1] *= -1
+            simplified_xyz[:, 0] *= y_inverse
+            high_res_road = (simplified_xyz * high_res_scale).astype('int32') + raster_shape[0] // 2
+            low_res_road = (simplified_xyz * low_res_scale).astype('int32') + raster_shape[0] // 2
+            if road_type in [5, 17, 18, 19]:
+                cv2.fillPoly(rasters_high_res_channels[road_type + route_channel], np.int32([high_res_road[:, :2]]), (255, 255, 255))
+                cv2.fillPoly(rasters_low_res_channels[road_type + route_channel], np.int32([low_res_road[:, :2]]), (255, 255, 255))
+            else:
+                for j in range(simplified_xyz.shape[0] - 1):
+                    cv2.line(rasters_high_res_channels[road_type + route_channel], tuple(high_res_road[j, :2]),
+                            tuple(high_res_road[j + 1, :2]), (255, 255, 255), 2)
+                    cv2.line(rasters_low_res_channels[road_type + route_channel], tuple(low_res_road[j, :2]),
+                            tuple(low_res_road[j + 1, :2]), (255, 255, 255), 2)
+        # traffic channels drawing
+        for idx, traffic_id in enumerate(traffic_light_ids):
+            traffic_state = int(traffic_light_states[idx])
+            if int(traffic_id) == -1 or int(traffic_id) not in list(road_dic.keys()):
+                continue
+            assert 0 <= traffic_state < traffic_types, f'traffic_state {traffic_state} is larger than traffic_types {traffic_types}'
+            xyz = road_dic[int(traffic_id)]["xyz"].copy()
+            xyz[:, :2] -= origin_ego_pose[:2]
+            # traffic_state = traffic_dic[traffic_id.item()]["state"]
+            pts = list(zip(xyz[:, 0], xyz[:, 1]))
+            line = shapely.geometry.LineString(pts)
+            simplified_xyz_line = line.simplify(1)
+            simplified_x, simplified_y = simplified_xyz_line.xy
+            simplified_xyz = np.ones((len(simplified_x), 2)) * -1
+            simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_x, simplified_y
+            simplified_xyz[:, 0], simplified_xyz[:, 1] = simplified_xyz[:, 0].copy() * cos_ - simplified_xyz[:, 1].copy() * sin_, simplified_xyz[:, 0].copy() * sin_ + simplified_xyz[:, 1].copy() * cos_
+            simplified_xyz[:, 1] *= -1
+            simplified_xyz[:, 0] *= y_inverse
+            high_res_traffic = (simplified_xyz * high_res_scale).astype('int32') + raster_shape[0] // 2
+            low_res_traffic = (simplified_xyz * low_res_scale).astype('int32') + raster_shape[0] // 2
+            # traffic state order is GREEN, RED, YELLOW, UNKNOWN
+            for j in range(simplified_xyz.shape[0] - 1):
+                cv2.line(rasters_high_res_channels[route_channel + road_types + traffic_state],
+                         tuple(high_res_traffic[j, :2]),
+                         tuple(high_res_traffic[j + 1, :2]), (255, 255, 255), 2)
+                cv2.line(rasters_low_res_channels[route_channel + road_types + traffic_state],
+                         tuple(low_res_traffic[j, :2]),
+                         tuple(low_res_traffic[j + 1, :2]), (255, 255, 255), 2)
+        # agent raster
+        cos_, sin_ = math.cos(-origin_ego_pose[3]), math.sin(-origin_ego_pose[3])
+
+        # gather poses of all visible (agent, past frame) pairs
+        past_frames = np.array(sample_frames_in_past, dtype=np.int64)
+        agent_poses, agent_shapes, agent_channels = [], [], []
+        for _, agent_id in enumerate(agent_ids):
+            if agent_id == "null":
+                continue
+            if agent_id not in agent_dic:
+                print('unknown agent id', agent_id)
+                continue
+            frame_indices = np.arange(len(sample_frames_in_past))
+            if relative_frame_id:
+                agent_starting_frame = agent_dic[agent_id]['starting_frame']
+                agent_ending_frame = agent_dic[agent_id]['ending_frame']
+                visible = past_frames >= agent_starting_frame
+                if agent_ending_frame != -1:
+                    visible &= past_frames < agent_ending_frame
+                frame_indices = frame_indices[visible]
+                pose_indices = (past_frames[visible] - agent_starting_frame) // frequency_change_rate  # Hard-coded frequency change
+            else:
+                pose_indices = past_frames
+            poses = agent_dic[agent_id]['pose'][pose_indices, :]
+            visible = ~((poses[:, 0] < 0) & (poses[:, 1] < 0))
+            if not visible.any():
+                continue
+            agent_type = int(agent_dic[agent_id]['type'])
+            assert 0 <= agent_type < agent_types, f'agent_type {agent_type} is larger than agent_types {agent_types}'
+            agent_poses.append(poses[visible])
+            agent_shapes.append(agent_dic[agent_id]['shape'][pose_indices[visible], :])
+            # example: if frame_interval = 10, past frames = 40
+            # channel number of [index:0-frame_0, index:1-frame_10, index:2-frame_20, index:3-frame_30, index:4-frame_40]  for agent_type = 0
+            # channel number of [index:5-frame_0, index:6-frame_10, index:7-frame_20, index:8-frame_30, index:9-frame_40]  for agent_type = 1
+            # ...
+            agent_channels.append(route_channel + road_types + traffic_types + agent_type * len(sample_frames_in_past) + frame_indices[visible])
+
+        if len(agent_poses) > 0:
+            rect_pts = agent_box_corners(np.concatenate(agent_poses), np.concatenate(agent_shapes), origin_ego_pose, cos_, sin_)
+            rect_pts[:, :, 0] *= y_inverse
+            agent_channels = np.concatenate(agent_channels)
+            # draw on high resolution
+            rect_pts_high_res = (high_res_scale * rect_pts).astype(np.int64) + raster_shape[0]//2
+            fill_boxes(rasters_high_res_channels, agent_channels, rect_pts_high_res)
+            # draw on low resolution
+            rect_pts_low_res = (low_res_scale * rect_pts).astype(np.int64) + raster_shape[0]//2
+            fill_boxes(rasters_low_res_channels, agent_channels, rect_pts_low_res)
+
+        if output_rasters is None:
+            rasters_high_res = np.empty([raster_shape[0], raster_shape[1], total_raster_channels], dtype=bool)
+            rasters_low_res = np.empty([raster_shape[0], raster_shape[1], total_raster_channels], dtype=bool)
+        else:
+            rasters_high_res, rasters_low_res = output_rasters
+            assert rasters_high_res.shape == (raster_shape[0], raster_shape[1], total_raster_channels), \
+                f'raster shape {rasters_high_res.shape} of the batch does not match {total_raster_channels} channels of {filename}'
+        # channel last bool rasters, written in one pass
+        np.not_equal(rasters_high_res_channels.transpose(1, 2, 0), 0, out=rasters_high_res)
+        np.not_equal(rasters_low_res_channels.transpose(1, 2, 0), 0, out=rasters_low_res)
+
+        result_to_return["high_res_raster"] = rasters_high_res
+        result_to_return["low_res_raster"] = rasters_low_res
+
+        del rasters_high_res_channels
+        del rasters_low_res_channels
+        del rasters_high_res
+        del rasters_low_res
+    else:
+        # rasters encoded offline by the frozen raster encoder, see preprocess/raster_embedding_cache.py
+        from transformer4planning.utils.tensor_store import load_tensor_store
+        try:
+            result_to_return['raster_embeds'] = load_tensor_store(raster_embedding_store).read([raster_embedding_key(sample)])[0]
+        except KeyError as e:
+            print('sample not in the raster embedding cache: ', e)
+            return None
     result_to_return["context_actions"] = np.array(context_actions, dtype=np.float32)
     result_to_return['trajectory_label'] = trajectory_label.astype(np.float32)
 
-    del rasters_high_res_channels
-    del rasters_low_res_channels
-    del rasters_high_res
-    del rasters_low_res
     del trajectory_label
 
     # print('inspect: ', result_to_return["context_actions"].shape)
@@ -470,6 +597,9 @@ def static_coor_rasterize(sample, data_path, raster_shape=(224, 224),
     camera_image_encoder = kwargs.get('camera_image_encoder', None)
     if camera_image_encoder is not None and 'test' not in split:
         import PIL.Image
+        # images decoded and preprocessed offline, see preprocess/camera_image_store.py
+        camera_image_store = kwargs.get('camera_image_store', None)
+        camera_feature_store = kwargs.get('camera_feature_store', None)
         # load images
         if 'train' in split:
             images_folder = kwargs.get('train_camera_image_folder', None)
@@ -479,7 +609,7 @@ def static_coor_rasterize(sample, data_path, raster_shape=(224, 224),
             raise ValueError('split not recognized: ', split)
 
         images_paths = sample['images_path']
-        if images_folder is None or len(images_paths) == 0:
+        if (images_folder is None and camera_image_store is None and camera_feature_store is None) or len(images_paths) == 0:
             print('images_folder or images_paths not valid', images_folder, images_paths, filename, map, split, frame_id)
             return None
         if len(images_paths) != 8:
@@ -495,10 +625,21 @@ def static_coor_rasterize(sample, data_path, raster_shape=(224, 224),
                 images_paths = list(camera_dic.values())
             assert len(images_paths) == 8, images_paths
 
+        if camera_feature_store is not None or camera_image_store is not None:
+            from transformer4planning.utils.tensor_store import load_tensor_store
+            try:
+                if camera_feature_store is not None:
+                    # shape: 8(cameras), 257, 768
+                    result_to_return['camera_image_features'] = load_tensor_store(camera_feature_store).read(images_paths)
+                else:
+                    # shape: 8(cameras), 3, 224, 224
+                    result_to_return['camera_pixel_values'] = load_tensor_store(camera_image_store).read(images_paths)
+            except KeyError as e:
+                print('camera images not in the store: ', e, filename, map, split, frame_id)
+                return None
         # check if image exists
-        one_image_path = os.path.join(images_folder, images_paths[0])
-        if not os.path.exists(one_image_path):
-            print('image folder not exist: ', one_image_path)
+        elif not os.path.exists(os.path.join(images_folder, images_paths[0])):
+            print('image folder not exist: ', os.path.join(images_folder, images_paths[0]))
             return None
         else:
             images = []
@@ -516,7 +657,7 @@ def static_coor_rasterize(sample, data_path, raster_shape=(224, 224),
             result_to_return['camera_images'] = np.array(images, dtype=np.float32)
             del images
 
-    if debug_raster_path is not None:
+    if debug_raster_path is not None and raster_embedding_store is None:
         # check if path not exist, create
         if not os.path.exists(debug_raster_path):
             os.makedirs(debug_raster_path)
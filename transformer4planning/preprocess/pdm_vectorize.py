@@ -5,14 +5,19 @@ import numpy as np
 import torch
 import math
 from copy import deepcopy
-from typing import List
+from typing import List, Tuple
 from shapely.geometry import Polygon, Point
-from functools import partial
+from functools import partial, lru_cache
 from torch.utils.data._utils.collate import default_collate
 from nuplan.common.actor_state.state_representation import StateSE2, Point2D, StateVector2D
 from nuplan.common.actor_state.ego_state import EgoState
 from nuplan.planning.training.preprocessing.features.trajectory_utils import convert_absolute_to_relative_poses
-from transformer4planning.preprocess.utils import compute_derivative, route_roadblock_correction
+from transformer4planning.preprocess.utils import (
+    compute_derivative,
+    route_roadblock_correction,
+    correct_route_roadblocks,
+    get_current_roadblock_candidates,
+)
 from nuplan.common.maps.nuplan_map.map_factory import get_maps_api
 from nuplan.common.maps.maps_datatypes import SemanticMapLayer
 from nuplan.common.maps.abstract_map_objects import RoadBlockGraphEdgeMapObject
@@ -27,6 +32,9 @@ from nuplan_garage.planning.simulation.planner.pdm_planner.utils.pdm_geometry_ut
 from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.dijkstra import (
     Dijkstra,
 )
+from nuplan_garage.planning.simulation.planner.pdm_planner.utils.graph_search.compiled_graph import (
+    get_lane_graph,
+)
 
 DRIVABLE_MAP_LAYERS = [
     SemanticMapLayer.ROADBLOCK,
@@ -34,6 +42,9 @@ DRIVABLE_MAP_LAYERS = [
     SemanticMapLayer.CARPARK_AREA,
 ]
 
+# number of routes (per map) of which route dictionaries, lane maps and centerlines are kept, per process
+ROUTE_CACHE_SIZE = 1024
+
 def nuplan_vector_collate_func(batch, dic_path=None, map_api=dict(), **kwargs):
     use_centerline = kwargs.get("use_centerline", False)
     expected_padding_keys = ["road_ids", "route_ids", "traffic_ids"]
@@ -199,11 +210,12 @@ def get_intersecting_lanes(ego_position, drivible_area_map, routd_ids):
 
     return on_route_lanes, on_route_heading_errors
 
-def get_discrete_centerline(current_lane, route_block_dict, route_lane_dict, search_depth=30):
+def get_discrete_centerline(current_lane, route_block_dict, route_lane_dict, search_depth=30, lane_graph=None):
     """
     Applies a Dijkstra search on the lane-graph to retrieve discrete centerline.
     :param current_lane: lane object of starting lane.
     :param search_depth: depth of search (for runtime), defaults to 30
+    :param lane_graph: compiled lane graph of the map (see get_lane_graph), defaults to None
     :return: list of discrete states on centerline (x,y,θ)
     """
     roadblocks = list(route_block_dict.values())
@@ -214,7 +226,7 @@ def get_discrete_centerline(current_lane, route_block_dict, route_lane_dict, sea
     )
     roadblock_window = roadblocks[start_idx : start_idx + search_depth]
     
-    graph_search = Dijkstra(current_lane, list(route_lane_dict.keys()))
+    graph_search = Dijkstra(current_lane, list(route_lane_dict.keys()), lane_graph)
     route_plan, path_found = graph_search.search(roadblock_window[-1])
 
     centerline_discrete_path: List[StateSE2] = []
@@ -224,6 +236,84 @@ def get_discrete_centerline(current_lane, route_block_dict, route_lane_dict, sea
     return centerline_discrete_path
 
 
+@lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def get_cached_route_dicts(route_roadblock_ids: Tuple, map_api):
+    """
+    Cached version of load_route_dicts. The returned dictionaries are shared and must not be modified.
+    :param route_roadblock_ids: tuple of on-route roadblock ids
+    :param map_api: map object
+    :return: lane and roadblock dictionaries of the route
+    """
+    return load_route_dicts(list(route_roadblock_ids), map_api)
+
+@lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def get_cached_corrected_route(route_roadblock_ids: Tuple, starting_block_id: str, starting_block_ids: Tuple[str, ...], map_api) -> Tuple[str, ...]:
+    """
+    Cached route correction, which only depends on the roadblock candidates of ego.
+    :param route_roadblock_ids: tuple of on-route roadblock ids
+    :param starting_block_id: id of most promising roadblock of ego
+    :param starting_block_ids: ids of roadblock candidates of ego
+    :param map_api: map object
+    :return: tuple of roadblock ids of corrected route
+    """
+    _, route_block_dict = get_cached_route_dicts(route_roadblock_ids, map_api)
+    return tuple(correct_route_roadblocks(starting_block_id, list(starting_block_ids), map_api, route_block_dict))
+
+@lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def get_cached_route_lane_map(route_roadblock_ids: Tuple, map_api) -> PDMOccupancyMap:
+    """
+    Cached occupancy map (str-tree) of on-route lanes.
+    Only on-route lanes of the drivable area are considered to find the starting lane, thus the
+    proximal drivable area does not need to be queried from the map-api for every sample.
+    :param route_roadblock_ids: tuple of on-route roadblock ids
+    :param map_api: map object
+    :return: occupancy map of on-route lane polygons
+    """
+    route_lane_dict, _ = get_cached_route_dicts(route_roadblock_ids, map_api)
+    return PDMOccupancyMap(list(route_lane_dict.keys()), [lane.polygon for lane in route_lane_dict.values()])
+
+@lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def get_cached_centerline(route_roadblock_ids: Tuple, starting_lane_id: str, map_api) -> PDMPath:
+    """
+    Cached centerline along the route, starting at a lane.
+    :param route_roadblock_ids: tuple of on-route roadblock ids
+    :param starting_lane_id: id of starting lane (on-route)
+    :param map_api: map object
+    :return: PDMPath of centerline
+    """
+    route_lane_dict, route_block_dict = get_cached_route_dicts(route_roadblock_ids, map_api)
+    current_lane = route_lane_dict[starting_lane_id]
+    return PDMPath(
+        get_discrete_centerline(current_lane, route_block_dict, route_lane_dict, lane_graph=get_lane_graph(map_api))
+    )
+
+def get_route_centerline(ego_position, ego_shape, route_roadblock_ids: List, map_api) -> PDMPath:
+    """
+    Corrects the route and searches the centerline from ego's starting lane, equivalent to
+    route_roadblock_correction, get_starting_lane and get_discrete_centerline.
+    Everything besides the ego-dependent candidate and starting lane lookups is cached per map and route,
+    thus shared across the samples of a scenario.
+    :param ego_position: ego pose (x, y, heading)
+    :param ego_shape: ego shape
+    :param route_roadblock_ids: on-route roadblock ids
+    :param map_api: map object
+    :return: PDMPath of centerline
+    """
+    route_roadblock_ids = tuple(route_roadblock_ids)
+    _, init_route_dict = get_cached_route_dicts(route_roadblock_ids, map_api)
+    starting_block, starting_block_candidates = get_current_roadblock_candidates(ego_position, map_api, init_route_dict)
+    route_roadblock_ids = get_cached_corrected_route(
+        route_roadblock_ids,
+        starting_block.id,
+        tuple(roadblock.id for roadblock in starting_block_candidates),
+        map_api,
+    )
+    route_lane_dict, _ = get_cached_route_dicts(route_roadblock_ids, map_api)
+    route_lane_map = get_cached_route_lane_map(route_roadblock_ids, map_api)
+    current_lane = get_starting_lane(ego_position, route_lane_map, route_lane_dict, ego_shape)
+    return get_cached_centerline(route_roadblock_ids, current_lane.id, map_api)
+
+
 def pdm_vectorize(sample, data_path, map_api=None, map_radius=50, 
                   centerline_samples=120, centerline_interval=1.0, 
                   frame_rate=20, past_seconds=2, use_centerline=False):
@@ -280,17 +370,10 @@ def pdm_vectorize(sample, data_path, map_api=None, map_radius=50,
             file_name=filename,
             frame_id=frame_id
         )
-    # build drivable area map and extract centerline
-    divable_area_map = get_drivable_area_map(map_api, ego_poses[-1], map_radius=map_radius)
-    
-    # compute centerlines
-    _, init_route_dict = load_route_dicts(route_ids, map_api)
+    # compute centerlines, route correction and lane search are cached per map and route
     gc.collect()
     gc.disable()
-    route_ids = route_roadblock_correction(ego_poses[-1], map_api, init_route_dict)
-    route_lane_dict, route_block_dict = load_route_dicts(route_ids, map_api)
-    current_lane = get_starting_lane(ego_poses[-1], divable_area_map, route_lane_dict, ego_shape)
-    centerline = PDMPath(get_discrete_centerline(current_lane, route_block_dict, route_lane_dict))
+    centerline = get_route_centerline(ego_poses[-1], ego_shape, route_ids, map_api)
     current_progress = centerline.project(Point(*anchor_ego_pose.array))
     centerline_progress_values = (
         np.arange(centerline_samples, dtype=np.float64) * centerline_interval + current_progress
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+from tqdm import tqdm
+from torch.utils.data import DataLoader
+from transformer4planning.utils.tensor_store import ShardedTensorStore, META_FILE
+
+# Cache of the frozen raster encoder outputs (state_embeds of NuplanRasterizeEncoder.encode_rasters) of every sample.
+# With the cache, the collate function skips drawing rasters and the encoder skips the resnet/vit, thus an epoch costs
+# the transformer and decoders only.
+# The cache is keyed on the raster encoder weights and the raster config: every combination gets its own store under
+#   raster_embedding_cache/{digest}/
+# so a changed encoder or rasterization never reads stale embeddings.
+# Keys of the samples failed to rasterize are recorded in raster_embedding_cache/{digest}/failed_keys.json, and are not
+# rasterized again when resuming a build.
+
+# model args changing the rasters or their encoding, besides the rasterization parameters of static_coor_rasterize
+RASTER_CONFIG_KEYS = ['raster_channels', 'raster_encoder_type', 'vit_intermediate_size', 'n_embd', 'd_embed',
+                      'with_traffic_light', 'past_sample_interval', 'selected_exponential_past', 'use_mission_goal']
+RASTERIZE_PARAMETERS = ['raster_shape', 'frame_rate', 'past_seconds', 'high_res_scale', 'low_res_scale', 'road_types',
+                        'agent_types', 'traffic_types', 'frequency_change_rate']
+FAILED_KEYS_FILE = 'failed_keys.json'
+
+
+def raster_embedding_key(sample):
+    return f"{sample['split']}/{sample['map']}/{sample['file_name']}/{int(sample['frame_id'])}"
+
+
+def encoder_weights_hash(module):
+    """
+    Returns:
+        sha1 hex digest of the parameters and buffers of the module
+    """
+    sha1 = hashlib.sha1()
+    for name, tensor in sorted(module.state_dict().items()):
+        sha1.update(name.encode())
+        sha1.update(str(tensor.dtype).encode())
+        sha1.update(np.ascontiguousarray(tensor.detach().cpu().numpy()).tobytes())
+    return sha1.hexdigest()
+
+
+def get_raster_embedding_store(cache_root, raster_encoder, raster_config):
+    """
+    Args:
+        cache_root: path of the raster embedding cache
+        raster_encoder: the frozen raster encoder module
+        raster_config: dict of model args and rasterization parameters passed to the collate function
+    Returns:
+        path of the store of this encoder and raster config, info of the store
+    """
+    import inspect
+    from transformer4planning.preprocess.nuplan_rasterize import static_coor_rasterize
+    parameters = inspect.signature(static_coor_rasterize).parameters
+    config = {key: raster_config.get(key, parameters[key].default) for key in RASTERIZE_PARAMETERS}
+    config.update({key: raster_config.get(key, None) for key in RASTER_CONFIG_KEYS})
+    info = dict(raster_encoder=encoder_weights_hash(raster_encoder), raster_config=json.loads(json.dumps(config)))
+    digest = hashlib.sha1(json.dumps(info, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(cache_root, digest), info
+
+
+def build_raster_embedding_cache(encoder, datasets, collate_fn, store_path, info,
+                                 batch_size=64, num_workers=0, device='cpu'):
+    """
+    Encodes every sample of the datasets missing in the store with the frozen raster encoder, resuming an interrupted build.
+    Samples failed to rasterize stay missing, and are dropped by the collate function when reading the cache. Their keys
+    are recorded in the store path and skipped by later builds.
+    Writes the memmap shards without locking, call it from one process only.
+    Args:
+        encoder: NuplanRasterizeEncoder with a frozen raster encoder
+        datasets: list of index datasets
+        collate_fn: collate function rasterizing the samples
+    Returns:
+        the store
+    """
+    key_to_row = dict()
+    for dataset_index, dataset in enumerate(datasets):
+        columns = [dataset[column] for column in ['split', 'map', 'file_name', 'frame_id']]
+        for row, (split, map, file_name, frame_id) in enumerate(zip(*columns)):
+            key_to_row.setdefault(raster_embedding_key(dict(split=split, map=map, file_name=file_name, frame_id=frame_id)),
+                                  (dataset_index, row))
+    keys = sorted(key_to_row.keys())
+    if os.path.exists(os.path.join(store_path, META_FILE)):
+        store = ShardedTensorStore(store_path, writable=True)
+        assert store.info == json.loads(json.dumps(info)) and store.keys == keys, \
+            f'raster embedding cache at {store_path} was built for other samples, remove it to rebuild'
+        missing_keys = store.missing_keys()
+    else:
+        store = None
+        missing_keys = keys
+    failed_keys_path = os.path.join(store_path, FAILED_KEYS_FILE)
+    failed_keys = set()
+    if os.path.exists(failed_keys_path):
+        with open(failed_keys_path, 'r') as f:
+            failed_keys = set(json.load(f))
+        missing_keys = [key for key in missing_keys if key not in failed_keys]
+    print(f'building raster embedding cache at {store_path}: {len(missing_keys)} / {len(keys)} samples missing, '
+          f'{len(failed_keys)} failed to rasterize before')
+    if len(missing_keys) == 0:
+        return store
+
+    device = torch.device(device)
+    encoder.to(device)
+    encoder.eval()
+    missing_rows = [[] for _ in datasets]
+    for key in missing_keys:
+        dataset_index, row = key_to_row[key]
+        missing_rows[dataset_index].append(row)
+    written_keys = set()
+    for dataset, rows in zip(datasets, missing_rows):
+        if len(rows) == 0:
+            continue
+        dataloader = DataLoader(dataset.select(sorted(rows)), batch_size=batch_size, num_workers=num_workers,
+                                collate_fn=collate_fn, drop_last=False)
+        with torch.no_grad():
+            for batch in tqdm(dataloader):
+                if len(batch) == 0:
+                    continue
+                state_embeds = encoder.encode_rasters(batch['high_res_raster'], batch['low_res_raster'],
+                                                      batch['context_actions'].shape[1], device).cpu().numpy()
+                if store is None:
+                    store = ShardedTensorStore(store_path, keys=keys, shape=state_embeds.shape[1:], dtype=np.float32,
+                                               info=info)
+                for i, state_embed in enumerate(state_embeds):
+                    key = raster_embedding_key(dict(split=batch['split'][i], map=batch['map'][i],
+                                                    file_name=batch['file_name'][i], frame_id=batch['frame_id'][i]))
+                    store.write(key, state_embed)
+                    written_keys.add(key)
+    if store is not None:
+        store.flush()
+    # recorded only after a complete pass, samples of an interrupted build are retried
+    new_failed_keys = set(missing_keys) - written_keys
+    if len(new_failed_keys) > 0:
+        print(f'{len(new_failed_keys)} samples failed to rasterize, recorded in {failed_keys_path}')
+        os.makedirs(store_path, exist_ok=True)
+        with open(failed_keys_path + '.tmp', 'w') as f:
+            json.dump(sorted(failed_keys | new_failed_keys), f)
+        os.replace(failed_keys_path + '.tmp', failed_keys_path)
+    return store
@@ -0,0 +1,83 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from transformer4planning.preprocess.nuplan_rasterize import agent_box_corners, fill_boxes
+from transformer4planning.utils.nuplan_utils import generate_contour_pts
+
+
+def contour_box_corners(poses, shapes, origin_ego_pose, cos_, sin_):
+    """
+    Reference of agent_box_corners, one generate_contour_pts per box.
+    """
+    rect_pts = []
+    for pose, shape in zip(poses, shapes):
+        pose = pose.copy()
+        pose -= origin_ego_pose
+        rotated_pose = [pose[0] * cos_ - pose[1] * sin_,
+                        pose[0] * sin_ + pose[1] * cos_]
+        rect_pts.append(np.array(generate_contour_pts((rotated_pose[1], rotated_pose[0]), w=shape[0], l=shape[1],
+                                                      direction=-pose[3]), dtype=np.int32))
+    return np.array(rect_pts, dtype=np.int32).reshape(-1, 4, 2)
+
+
+def draw_boxes_with_contours(channels, channel_indices, rect_pts):
+    """
+    Reference of fill_boxes, one cv2.drawContours per box.
+    """
+    for channel, contour in zip(channel_indices, rect_pts):
+        cv2.drawContours(channels[channel], [contour], -1, (255, 255, 255), -1)
+
+
+def random_boxes(rng, max_boxes=200):
+    """
+    Random, mostly overlapping agent boxes around the ego, scaled to pixels of the high resolution raster.
+    Returns:
+        poses (num_boxes, 4), shapes (num_boxes, 2) and the origin ego pose (4, ) in float32 as the agent pickles
+    """
+    num_boxes = rng.integers(1, max_boxes + 1)
+    poses = np.zeros((num_boxes, 4), dtype=np.float32)
+    poses[:, :2] = rng.uniform(-10, 10, (num_boxes, 2)) * 4
+    poses[:, 3] = rng.uniform(-np.pi, np.pi, num_boxes)
+    shapes = np.stack([rng.uniform(0, 3, num_boxes), rng.uniform(0, 20, num_boxes)], axis=-1).astype(np.float32) * 4
+    origin_ego_pose = rng.normal(0, 1, 4).astype(np.float32)
+    return poses, shapes, origin_ego_pose
+
+
+class TestAgentRasterization(unittest.TestCase):
+    """
+    Parity of the vectorized agent rasterization (agent_box_corners + fill_boxes with cv2.fillPoly)
+    with the per-box generate_contour_pts + cv2.drawContours of static_coor_rasterize before.
+    """
+    trials = 300
+    raster_shape = (224, 224)
+    num_channels = 8
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_agent_box_corners(self):
+        for _ in range(self.trials):
+            poses, shapes, origin_ego_pose = random_boxes(self.rng)
+            cos_, sin_ = np.cos(-origin_ego_pose[3]), np.sin(-origin_ego_pose[3])
+            np.testing.assert_array_equal(agent_box_corners(poses, shapes, origin_ego_pose, cos_, sin_),
+                                          contour_box_corners(poses, shapes, origin_ego_pose, cos_, sin_))
+
+    def test_fill_boxes(self):
+        # overlapping boxes of one channel would cancel out under the even-odd rule of a single fillPoly
+        for _ in range(self.trials):
+            poses, shapes, origin_ego_pose = random_boxes(self.rng)
+            cos_, sin_ = np.cos(-origin_ego_pose[3]), np.sin(-origin_ego_pose[3])
+            rect_pts = agent_box_corners(poses, shapes, origin_ego_pose, cos_, sin_).astype(np.int64) + \
+                self.raster_shape[0] // 2
+            channel_indices = self.rng.integers(0, self.num_channels, len(rect_pts))
+            filled = np.zeros((self.num_channels,) + self.raster_shape, dtype=np.uint8)
+            drawn = filled.copy()
+            fill_boxes(filled, channel_indices, rect_pts)
+            draw_boxes_with_contours(drawn, channel_indices, rect_pts.astype(np.int32))
+            np.testing.assert_array_equal(filled, drawn)
+
+
+if __name__ == '__main__':
+    unittest.main()
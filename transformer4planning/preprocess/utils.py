@@ -58,11 +58,39 @@ def route_roadblock_correction(
     )
     starting_block_ids = [roadblock.id for roadblock in starting_block_candidates]
 
+    return correct_route_roadblocks(
+        starting_block.id,
+        starting_block_ids,
+        map_api,
+        route_roadblock_dict,
+        search_depth_backward,
+        search_depth_forward,
+    )
+
+def correct_route_roadblocks(
+    starting_block_id: str,
+    starting_block_ids: List[str],
+    map_api: AbstractMap,
+    route_roadblock_dict: Dict[str, RoadBlockGraphEdgeMapObject],
+    search_depth_backward: int = 15,
+    search_depth_forward: int = 30,
+) -> List[str]:
+    """
+    Corrects route roadblocks, given the roadblock candidates of ego (see route_roadblock_correction).
+    Does not depend on the ego position otherwise, such that results can be shared by samples of a route.
+    :param starting_block_id: id of most promising roadblock of ego
+    :param starting_block_ids: ids of roadblock candidates of ego
+    :param map_api: map object
+    :param route_roadblocks_dict: dictionary of on-route roadblocks
+    :param search_depth_backward: depth of forward BFS search, defaults to 15
+    :param search_depth_forward:  depth of backward BFS search, defaults to 30
+    :return: list of roadblock id's of corrected route
+    """
     route_roadblocks = list(route_roadblock_dict.values())
     route_roadblock_ids = list(route_roadblock_dict.keys())
 
     # Fix 1: when agent starts off-route
-    if starting_block.id not in route_roadblock_ids:
+    if starting_block_id not in route_roadblock_ids:
         # Backward search if current roadblock not in route
         graph_search = BreadthFirstSearchRoadBlock(
             route_roadblock_ids[0], map_api, forward_search=False
@@ -78,7 +106,7 @@ def route_roadblock_correction(
         else:
             # Forward search to any route roadblock
             graph_search = BreadthFirstSearchRoadBlock(
-                starting_block.id, map_api, forward_search=True
+                starting_block_id, map_api, forward_search=True
             )
             (path, path_id), path_found = graph_search.search(
                 route_roadblock_ids[:3], max_depth=search_depth_forward
@@ -5,7 +5,11 @@ import pickle
 from functools import partial
 from transformer4planning.utils.waymo_utils import merge_batch_by_padding_2nd_dim
 
-def waymo_collate_func(batch, dic_path=None):
+# per-sample fields whose 2nd dim (number of objects / polylines) varies across samples
+PADDED_TRACK_AND_POLYLINE_KEYS = ["obj_trajs", "obj_trajs_mask", "map_polylines", "map_polylines_mask", "map_polylines_center",
+                                  "obj_trajs_pos", "obj_trajs_last_pos", "obj_trajs_future_state", "obj_trajs_future_mask"]
+
+def waymo_collate_func(batch, dic_path=None, pin_memory=False):
     map_func = partial(waymo_preprocess, data_path=dic_path)
 
     new_batch = list()
@@ -28,10 +32,9 @@ def waymo_collate_func(batch, dic_path=None):
                 print("Error: None value", key, d[key])   # scenario_type might be none for older dataset
         if key in ["scenario_id", "obj_types", "obj_ids", "center_objects_type", "center_objects_id"]:
             result[key] = np.concatenate(list_of_dvalues, axis=0).reshape(-1)
-        elif key in ["obj_trajs", "obj_trajs_mask", "map_polylines", "map_polylines_mask", "map_polylines_center",
-                "obj_trajs_pos", "obj_trajs_last_pos", "obj_trajs_future_state", "obj_trajs_future_mask"]:
+        elif key in PADDED_TRACK_AND_POLYLINE_KEYS:
             list_of_dvalues = [torch.from_numpy(x) for x in list_of_dvalues]
-            result[key] = merge_batch_by_padding_2nd_dim(list_of_dvalues)
+            result[key] = merge_batch_by_padding_2nd_dim(list_of_dvalues, pin_memory=pin_memory)
         else:
             list_of_dvalues = [torch.from_numpy(x) if isinstance(x, np.ndarray) else x for x in list_of_dvalues]
             result[key] = torch.cat(list_of_dvalues, dim=0)
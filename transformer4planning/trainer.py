@@ -2,7 +2,7 @@ import pickle
 import torch
 import torch.nn as nn
 import numpy as np
-import copy
+import importlib.util
 import os
 import re
 from transformers.utils import is_sagemaker_mp_enabled
@@ -10,11 +10,10 @@ from transformers.trainer_pt_utils import  nested_detach
 from transformers.trainer_callback import TrainerState, TrainerControl, IntervalStrategy, DefaultFlowCallback
 from transformers.training_args import TrainingArguments
 from transformers.trainer import Trainer
+from transformers.trainer_utils import has_length
 from transformers import EvalPrediction
 from typing import List, Optional, Dict, Any, Tuple, Union
-from transformer4planning.utils.nuplan_utils import compute_scores
 from transformer4planning.utils.nuplan_utils import normalize_angle
-from sklearn.metrics import accuracy_score
 
 FDE_THRESHHOLD = 8 # keep same with nuplan simulation
 ADE_THRESHHOLD = 8 # keep same with nuplan simulation
@@ -45,6 +44,282 @@ def batch_angle_normalize(headings):
             headings[i, j] = normalize_angle(headings[i, j])
     return headings
 
+class StreamingMetrics:
+    """
+    Eval metrics updated batch by batch with running sums instead of the concatenated eval set.
+    Pass an instance as compute_metrics and set TrainingArguments.batch_eval_metrics, the Trainer then calls it with
+    the (gathered) predictions of every batch and compute_result=True at the last batch, without accumulating logits.
+    Without batch_eval_metrics, it is called once with all predictions and returns the same metrics.
+    """
+    def __init__(self, num_samples=None):
+        self.reset(num_samples)
+
+    def reset(self, num_samples=None):
+        """
+        Args:
+            num_samples: number of samples of the eval set, predictions beyond are dropped as the Trainer truncates
+                the padding of the distributed sampler
+        """
+        self.num_samples = num_samples
+        self.seen_samples = 0
+        # metric name -> running sum (float64 tensor on device), number of elements
+        self.sums = {}
+        self.counts = {}
+
+    def __call__(self, prediction: EvalPrediction, compute_result: bool = True):
+        self.update(prediction.predictions, prediction.label_ids)
+        if not compute_result:
+            return {}
+        eval_result = self.compute()
+        self.reset(self.num_samples)
+        return eval_result
+
+    def update(self, predictions, labels):
+        raise NotImplementedError
+
+    def compute(self):
+        raise NotImplementedError
+
+    def _add(self, name, values):
+        values = torch.as_tensor(values)
+        self.sums[name] = self.sums.get(name, 0) + values.double().sum()
+        self.counts[name] = self.counts.get(name, 0) + values.numel()
+
+    def _add_loss_items(self, predictions):
+        # check loss items are dictionary, their average is taken over batches
+        loss_items = predictions['loss_items']
+        if isinstance(loss_items, dict):
+            for each_key in loss_items:
+                self._add(each_key, loss_items[each_key])
+
+    def _take(self, batch_size):
+        """
+        Returns:
+            number of samples of the batch to evaluate, 0 for padding beyond num_samples
+        """
+        if self.num_samples is not None:
+            batch_size = max(min(batch_size, self.num_samples - self.seen_samples), 0)
+        self.seen_samples += batch_size
+        return batch_size
+
+
+class StreamingPlanningMetrics(StreamingMetrics):
+    """
+    Streaming nuplan eval metrics, see StreamingMetrics.
+    Errors are reduced on the device of the predictions, only per-sample scalars for the scenario scores
+    and the eval log are moved to host.
+    """
+    def reset(self, num_samples=None):
+        super().reset(num_samples)
+        # per scenario sums of: ade3+ade5+ade8, fde3+fde5+fde8, ahe3+ahe5+ahe8, fhe3+fhe5+fhe8, miss, sample count
+        self.scenario_rows = {}
+        self.scenario_sums = np.zeros((0, 6), dtype=np.float64)
+        self.with_heading = True
+        # per-sample values for the eval log
+        self.scenario15s_ids = []
+        self.fde8 = []
+        self.miss = []
+        self.missing_intention_keys = None
+
+    @staticmethod
+    def _displacement(prediction, label):
+        squared = (prediction[..., 0] - label[..., 0]) ** 2 + (prediction[..., 1] - label[..., 1]) ** 2
+        # sqrt in float64 is rounded to float32 exactly as numpy does, vectorized torch.sqrt is not always
+        return torch.sqrt(squared.double()).to(squared.dtype)
+
+    def _add_scenarios(self, scenario15s_id, values):
+        unique_ids, inverse = np.unique(scenario15s_id, return_inverse=True)
+        rows = np.array([self.scenario_rows.setdefault(int(each_id), len(self.scenario_rows)) for each_id in unique_ids],
+                        dtype=np.int64)
+        if len(self.scenario_rows) > len(self.scenario_sums):
+            new_size = max(len(self.scenario_rows), 2 * len(self.scenario_sums))
+            self.scenario_sums = np.concatenate([self.scenario_sums,
+                                                 np.zeros((new_size - len(self.scenario_sums), 6), dtype=np.float64)])
+        np.add.at(self.scenario_sums, rows[inverse.reshape(-1)], values)
+
+    def update(self, predictions, labels):
+        """
+        Args:
+            predictions: logits dict of PlanningTrainer.prediction_step, tensors or numpy arrays (batch_size, ...)
+            labels: trajectory labels (batch_size, 80, 4)
+        """
+        self._add_loss_items(predictions)
+        batch_size = self._take(len(labels))
+        if batch_size == 0:
+            return
+
+        labels = torch.as_tensor(labels)[:batch_size]
+        prediction_by_generation = predictions['prediction_generation']  # sample_num, 85, 2/4
+        prediction_by_forward = predictions['prediction_forward']  # sample_num, 85, 2/4
+        prediction_trajectory_by_generation = torch.as_tensor(prediction_by_generation["traj_logits"])[:batch_size]  # sample_num, 80, 2/4
+        prediction_trajectory_by_forward = torch.as_tensor(prediction_by_forward['traj_logits'])[:batch_size]  # sample_num, 80, 2/4
+        prediction_horizon = labels.shape[1]
+
+        # calculate error for generation results
+        with_key_points = 'key_points_logits' in prediction_by_generation
+        if with_key_points:
+            selected_indices = torch.as_tensor(predictions['selected_indices'])[0].tolist()  # 5
+            assert len(selected_indices) > 1, selected_indices
+            assert prediction_trajectory_by_forward.shape[1] == prediction_horizon, f'{prediction_trajectory_by_forward.shape[1]} {prediction_horizon}'
+            label_key_points = labels[:, selected_indices, :]
+            # WIP: skip the first 10 key points for ade
+            first_key_point = 10 if len(selected_indices) > 10 else 0
+            # the last key point is the first one for backward key points
+            final_key_point = 0 if selected_indices[0] > selected_indices[-1] else -1
+            prediction_key_points_by_generation = torch.as_tensor(prediction_by_generation["key_points_logits"])[:batch_size]  # sample_num, 5, 2/4
+            key_points_error_gen = self._displacement(prediction_key_points_by_generation, label_key_points)
+            self._add('ade_keypoints_gen', key_points_error_gen[:, first_key_point:])
+            self._add('fde_keypoints_gen', key_points_error_gen[:, final_key_point])
+
+        # ADE metrics computation
+        ade_gen = self._displacement(prediction_trajectory_by_generation, labels)
+        ade3_gen = ade_gen[:, :30].mean(dim=1)
+        ade5_gen = ade_gen[:, :50].mean(dim=1)
+        ade8_gen = ade_gen[:, :80].mean(dim=1)
+        avg_ade_gen = (ade3_gen + ade5_gen + ade8_gen) / 3
+        self._add('ade_horizon3_gen', ade3_gen)
+        self._add('ade_horizon5_gen', ade5_gen)
+        self._add('ade_horizon8_gen', ade8_gen)
+        self._add('metric_ade', avg_ade_gen)
+        self._add('ade_score', torch.clamp(1 - avg_ade_gen / ADE_THRESHHOLD, min=0))
+
+        # FDE metrics computation
+        fde3_gen = ade_gen[:, 29]
+        fde5_gen = ade_gen[:, 49]
+        fde8_gen = ade_gen[:, -1]
+        avg_fde_gen = (fde3_gen + fde5_gen + fde8_gen) / 3
+        self._add('fde_horizon3_gen', fde3_gen)
+        self._add('fde_horizon5_gen', fde5_gen)
+        self._add('fde_horizon8_gen', fde8_gen)
+        self._add('metric_fde', avg_fde_gen)
+        self._add('fde_score', torch.clamp(1 - avg_fde_gen / FDE_THRESHHOLD, min=0))
+
+        def normalize_angles(angles):
+            return torch.atan2(torch.sin(angles), torch.cos(angles))
+
+        # heading error
+        self.with_heading = self.with_heading and prediction_trajectory_by_generation.shape[-1] == 4
+        if self.with_heading:
+            heading_diff_gen = normalize_angles(prediction_trajectory_by_generation[:, :, -1]) - normalize_angles(labels[:, :, -1])
+            heading_error_gen = torch.abs(normalize_angles(heading_diff_gen))
+            # average heading error computation
+            ahe3_gen = heading_error_gen[:, :30].mean(dim=1)
+            ahe5_gen = heading_error_gen[:, :50].mean(dim=1)
+            ahe8_gen = heading_error_gen[:, :80].mean(dim=1)
+            avg_ahe = (ahe3_gen + ahe5_gen + ahe8_gen) / 3
+            self._add('ahe_horizon3_gen', ahe3_gen)
+            self._add('ahe_horizon5_gen', ahe5_gen)
+            self._add('ahe_horizon8_gen', ahe8_gen)
+            self._add('metric_ahe', avg_ahe)
+            self._add('ahe_score', torch.clamp(1 - avg_ahe / HEADING_ERROR_THRESHHOLD, min=0))
+            # final heading error computation
+            fhe3_gen = heading_error_gen[:, 29]
+            fhe5_gen = heading_error_gen[:, 49]
+            fhe8_gen = heading_error_gen[:, 79]
+            avg_fhe = (fhe3_gen + fhe5_gen + fhe8_gen) / 3
+            self._add('fhe_horizon3_gen', fhe3_gen)
+            self._add('fhe_horizon5_gen', fhe5_gen)
+            self._add('fhe_horizon8_gen', fhe8_gen)
+            self._add('metric_fhe', avg_fhe)
+            self._add('fhe_score', torch.clamp(1 - avg_fhe / HEADING_ERROR_THRESHHOLD, min=0))
+
+        # missing rate, miss = 1, not miss = 0
+        miss3 = (ade_gen[:, :30].max(dim=1).values > MISS_THRESHHOLD[0]).float()
+        miss5 = (ade_gen[:, :50].max(dim=1).values > MISS_THRESHHOLD[1]).float()
+        miss8 = (ade_gen[:, :80].max(dim=1).values > MISS_THRESHHOLD[2]).float()
+        miss = ((miss3 + miss5 + miss8) >= 1).float()
+        self._add('miss_rate3', miss3)
+        self._add('miss_rate5', miss5)
+        self._add('miss_rate8', miss8)
+        self._add('total_miss_rate', miss)
+
+        # compute error for forward results
+        ade_for = self._displacement(prediction_trajectory_by_forward, labels)
+        self._add('ade_forward', ade_for)
+        self._add('fde_forward', ade_for[:, -1])
+        if with_key_points:
+            prediction_key_points_by_forward = torch.as_tensor(prediction_by_forward['kp_logits'])[:batch_size]  # sample_num, 5, 2/4
+            key_points_error_for = self._displacement(prediction_key_points_by_forward, label_key_points)
+            self._add('ade_keypoints_forward', key_points_error_for[:, first_key_point:])
+            self._add('fde_keypoints_forward', key_points_error_for[:, final_key_point])
+            if prediction_key_points_by_forward.shape[-1] == 4:
+                self._add('heading_error_forward', torch.abs(prediction_key_points_by_forward[:, :, -1] - label_key_points[:, :, -1]))
+
+        if 'proposal' in prediction_by_generation:
+            # TODO: add waymo proposal accuracy to eval result
+            if 'halfs_intention' in prediction_by_generation:
+                proposal_labels = prediction_by_generation['halfs_intention']  # sample_num, 1
+            elif 'intentions' in prediction_by_generation:
+                proposal_labels = prediction_by_generation['intentions']  # sample_num, 16
+            else:
+                proposal_labels = None
+                self.missing_intention_keys = list(prediction_by_generation.keys())
+            if proposal_labels is not None:
+                prediction_proposal_class_by_generation = torch.as_tensor(prediction_by_generation["proposal"])[:batch_size]
+                proposal_labels = torch.as_tensor(proposal_labels)[:batch_size]
+                self._add('proposal_accuracy', proposal_labels.flatten() == prediction_proposal_class_by_generation.flatten())
+
+        # per-sample values of the scenario scores and the eval log, the only host transfer of the batch
+        scenario15s_id = torch.as_tensor(predictions['scenario15s_id'])[:batch_size].cpu().numpy()
+        if self.with_heading:
+            scenario_values = torch.stack([ade3_gen + ade5_gen + ade8_gen, fde3_gen + fde5_gen + fde8_gen,
+                                           ahe3_gen + ahe5_gen + ahe8_gen, fhe3_gen + fhe5_gen + fhe8_gen,
+                                           miss, torch.ones_like(miss)], dim=1).double().cpu().numpy()
+            self._add_scenarios(scenario15s_id, scenario_values)
+        self.scenario15s_ids.append(scenario15s_id)
+        self.fde8.append(fde8_gen.cpu().numpy())
+        self.miss.append(miss.cpu().numpy())
+
+    def compute(self):
+        """
+        Returns:
+            eval_result: dict of metrics, the eval log is saved to EVAL_LOG_SAVING_PATH
+        """
+        eval_result = {key: (self.sums[key] / self.counts[key]).item() for key in self.sums}
+        if self.missing_intention_keys is not None:
+            print('WARNING: no intention found in generation. ', self.missing_intention_keys)
+
+        if self.with_heading and len(self.scenario_rows) > 0:
+            # nuplan scores are averaged by scenario first, see nuplan_utils.compute_scores
+            scenario_sums = self.scenario_sums[:len(self.scenario_rows)]
+            scenario_count = scenario_sums[:, 5]
+            ade_score = np.maximum(1 - scenario_sums[:, 0] / scenario_count / 3 / ADE_THRESHHOLD, 0)
+            fde_score = np.maximum(1 - scenario_sums[:, 1] / scenario_count / 3 / FDE_THRESHHOLD, 0)
+            ahe_score = np.maximum(1 - scenario_sums[:, 2] / scenario_count / 3 / HEADING_ERROR_THRESHHOLD, 0)
+            fhe_score = np.maximum(1 - scenario_sums[:, 3] / scenario_count / 3 / HEADING_ERROR_THRESHHOLD, 0)
+            miss_score = np.where(scenario_sums[:, 4] >= 5, 0, 1)
+            score = (ade_score + fde_score + ahe_score * HEADING_WEIGHT + fhe_score * HEADING_WEIGHT) / 6
+            eval_result["average_score"] = np.average(miss_score * score)
+            eval_result["miss_score"] = np.average(miss_score)
+
+        # include inputs by passing args.include_inputs_for_metrics = True to save eval result to pickle
+        if EVAL_LOG_SAVING_PATH is not None:
+            print('Saving eval result to pickle file: ', EVAL_LOG_SAVING_PATH)
+            scenario15s_id = np.concatenate(self.scenario15s_ids)
+            fde8_gen = np.concatenate(self.fde8)
+            miss = np.concatenate(self.miss)
+            eval_result_to_save = {}
+            # get miss scenarios
+            miss_indices = np.where(miss == 1)[0]
+            scenario15s_id_miss = scenario15s_id[miss_indices]
+            # [(file_name, frame_id), ...]
+            eval_result_to_save["miss_scenarios"] = scenario15s_id_miss
+            # get top fde scenarios (about 10%)
+            total_num = len(fde8_gen)
+            fde_indices = np.argsort(fde8_gen)[::-1][:int(total_num/10)]
+            scenario15s_id_high_fde = scenario15s_id[fde_indices]
+            fde8s_value = fde8_gen[fde_indices]
+            # [(file_name, frame_id, fde8s_value), ...]
+            eval_result_to_save["top_fde_scenarios"] = list(zip(scenario15s_id_high_fde, fde8s_value))
+            # save eval result
+            with open(EVAL_LOG_SAVING_PATH, "wb") as f:
+                pickle.dump(eval_result_to_save, f, protocol=pickle.HIGHEST_PROTOCOL)
+            print(f'Eval result saved to {EVAL_LOG_SAVING_PATH} with {scenario15s_id_miss.shape[0]} miss scenarios and {scenario15s_id_high_fde.shape[0]} top fde scenarios')
+        else:
+            assert False, "EVAL_LOG_SAVING_PATH is None"
+
+        return eval_result
+
 # Custom compute_metrics function
 def compute_metrics(prediction: EvalPrediction):
     """
@@ -52,300 +327,130 @@ def compute_metrics(prediction: EvalPrediction):
     """
     # TODO: Adapt to waymo
     # TODO: Add classification metrics (clf_metrics) for scoring
-    eval_result = {}
-    item_to_save = {}
-
-    predictions = prediction.predictions
-    labels = prediction.label_ids  # nparray: sample_num, 80, 4
-    prediction_horizon = labels.shape[1]
-
-    prediction_by_generation = predictions['prediction_generation']  # sample_num, 85, 2/4
-    prediction_by_forward = predictions['prediction_forward']  # sample_num, 85, 2/4
-    frame_id = predictions['frame_id']
-    scenario15s_id = predictions['scenario15s_id']
-    item_to_save["scenario15s_id"] = scenario15s_id
-    item_to_save["frame_id"] = frame_id
-
-    # select gt key points from gt trajectories
-    if 'key_points_logits' in prediction_by_generation:
-        selected_indices = predictions['selected_indices'][0]  # 5
-
-    loss_items = predictions['loss_items']
-    # check loss items are dictionary
-    if isinstance(loss_items, dict):
-        for each_key in loss_items:
-            # get average loss for each key
-            eval_result[each_key] = np.mean(loss_items[each_key])
-
-    # fetch trajectory and key points predictions
-    if 'key_points_logits' in prediction_by_generation:
-        # first 5 are key points concatentate with trajectory
-        prediction_key_points_by_generation = prediction_by_generation["key_points_logits"]  # sample_num, 5, 2/4
-        assert prediction_by_forward['traj_logits'].shape[1] == prediction_horizon, f'{prediction_by_forward["traj_logits"].shape[1]} {prediction_horizon}'
-        prediction_key_points_by_forward = prediction_by_forward['kp_logits']  # sample_num, 5, 2/4
-
-    prediction_trajectory_by_generation = prediction_by_generation["traj_logits"] # sample_num, 80, 2/4
-    prediction_trajectory_by_forward = prediction_by_forward['traj_logits']  # sample_num, 80, 2/4
-
-    # calculate error for generation results
-    if 'key_points_logits' in prediction_by_generation:
-        assert len(selected_indices) > 1, selected_indices
-        label_key_points = labels[:, selected_indices, :]
-        # WIP
-        if len(selected_indices) > 10:
-            ade_x_error_key_points_gen = prediction_key_points_by_generation[:, 10:, 0] - label_key_points[:, 10:, 0]
-            ade_y_error_key_points_gen = prediction_key_points_by_generation[:, 10:, 1] - label_key_points[:, 10:, 1]
-        else:
-            ade_x_error_key_points_gen = prediction_key_points_by_generation[:, :, 0] - label_key_points[:, :, 0]
-            ade_y_error_key_points_gen = prediction_key_points_by_generation[:, :, 1] - label_key_points[:, :, 1]
-        if selected_indices[0] > selected_indices[-1]:
-            # backward
-            fde_x_error_key_points_gen = prediction_key_points_by_generation[:, 0, 0] - label_key_points[:, 0, 0]
-            fde_y_error_key_points_gen = prediction_key_points_by_generation[:, 0, 1] - label_key_points[:, 0, 1]
-        elif selected_indices[0] < selected_indices[-1]:
-            # forward
-            fde_x_error_key_points_gen = prediction_key_points_by_generation[:, -1, 0] - label_key_points[:, -1, 0]
-            fde_y_error_key_points_gen = prediction_key_points_by_generation[:, -1, 1] - label_key_points[:, -1, 1]
-        ade_key_points_gen = np.sqrt(ade_x_error_key_points_gen ** 2 + ade_y_error_key_points_gen ** 2).mean()
-        eval_result['ade_keypoints_gen'] = ade_key_points_gen
-        fde_key_points_gen = np.sqrt(fde_x_error_key_points_gen ** 2 + fde_y_error_key_points_gen ** 2).mean()
-        eval_result['fde_keypoints_gen'] = fde_key_points_gen
-
-    ade_x_error_gen = prediction_trajectory_by_generation[:, :, 0] - labels[:, :, 0]
-    ade_y_error_gen = prediction_trajectory_by_generation[:, :, 1] - labels[:, :, 1]
-    fde_x_error_gen = prediction_trajectory_by_generation[:, -1, 0] - labels[:, -1, 0]
-    fde_y_error_gen = prediction_trajectory_by_generation[:, -1, 1] - labels[:, -1, 1]
-
-    # ADE metrics computation
-    ade_gen = np.sqrt(copy.deepcopy(ade_x_error_gen) ** 2 + copy.deepcopy(ade_y_error_gen) ** 2)
-    ade3_gen = np.mean(copy.deepcopy(ade_gen[:, :30]), axis=1)
-    ade5_gen = np.mean(copy.deepcopy(ade_gen[:, :50]), axis=1)
-    ade8_gen = np.mean(copy.deepcopy(ade_gen[:, :80]), axis=1)
-    avg_ade_gen = (ade3_gen + ade5_gen + ade8_gen)/3
-    ade_score = np.ones_like(avg_ade_gen) - avg_ade_gen/ADE_THRESHHOLD
-    ade_score = np.where(ade_score < 0, np.zeros_like(ade_score), ade_score)
-    item_to_save["ade_score"] = ade_score
-    item_to_save['ade_horizon3_gen'] = ade3_gen
-    item_to_save['ade_horizon5_gen'] = ade5_gen
-    item_to_save['ade_horizon8_gen'] = ade8_gen
-    eval_result['ade_horizon3_gen'] = ade3_gen.mean()
-    eval_result['ade_horizon5_gen'] = ade5_gen.mean()
-    eval_result['ade_horizon8_gen'] = ade8_gen.mean()
-    eval_result['metric_ade'] = avg_ade_gen.mean()
-    eval_result['ade_score'] = ade_score.mean()
-
-    # FDE metrics computation
-    fde3_gen = copy.deepcopy(ade_gen[:, 29])
-    fde5_gen = copy.deepcopy(ade_gen[:, 49])
-    fde8_gen = np.sqrt(fde_x_error_gen ** 2 + fde_y_error_gen ** 2)
-    avg_fde_gen = (fde3_gen + fde5_gen + fde8_gen)/3
-    fde_score = np.ones_like(avg_fde_gen) - avg_fde_gen/FDE_THRESHHOLD
-    fde_score = np.where(fde_score < 0, np.zeros_like(fde_score), fde_score)
-    item_to_save["fde_score"] = fde_score
-    item_to_save['fde_horizon3_gen'] = fde3_gen
-    item_to_save['fde_horizon5_gen'] = fde5_gen
-    item_to_save['fde_horizon8_gen'] = fde8_gen
-    eval_result['fde_horizon3_gen'] = fde3_gen.mean()
-    eval_result['fde_horizon5_gen'] = fde5_gen.mean()
-    eval_result['fde_horizon8_gen'] = fde8_gen.mean()
-    eval_result['metric_fde'] = avg_fde_gen.mean()
-    eval_result['fde_score'] = fde_score.mean()
-
-    def normalize_angles(angles):
-        return np.arctan2(np.sin(angles), np.cos(angles))
-
-    # heading error
-    if prediction_trajectory_by_generation.shape[-1] == 4:
-        # average heading error computation
-        # heading_error_gen = abs(batch_angle_normalize(prediction_trajectory_by_generation[:, :, -1] - labels[:, :, -1]))
-        heading_diff_gen = normalize_angles(prediction_trajectory_by_generation[:, :, -1]) - normalize_angles(labels[:, :, -1])
-        # normalized_angles = np.fmod(heading_diff_gen + 2 * np.pi, 2 * np.pi)  # normalize to 0, 2pi
-        # normalized_angles = np.where(normalized_angles > np.pi, normalized_angles - 2 * np.pi, normalized_angles)  # normalize to -pi, pi
-        heading_error_gen = abs(normalize_angles(heading_diff_gen))
-
-        ahe3_gen = np.mean(copy.deepcopy(heading_error_gen[:, :30]), axis=1)
-        ahe5_gen = np.mean(copy.deepcopy(heading_error_gen[:, :50]), axis=1)
-        ahe8_gen = np.mean(copy.deepcopy(heading_error_gen[:, :80]), axis=1)
-        avg_ahe = (ahe3_gen + ahe5_gen + ahe8_gen)/3
-        ahe_score = np.ones_like(avg_ahe) - avg_ahe/HEADING_ERROR_THRESHHOLD
-        ahe_score = np.where(ahe_score < 0, np.zeros_like(ahe_score), ahe_score)
-        item_to_save['ahe_score'] = ahe_score
-        item_to_save['ahe_horizon3_gen'] = ahe3_gen
-        item_to_save['ahe_horizon5_gen'] = ahe5_gen
-        item_to_save['ahe_horizon8_gen'] = ahe8_gen
-        eval_result['ahe_horizon3_gen'] = ahe3_gen.mean()
-        eval_result['ahe_horizon5_gen'] = ahe5_gen.mean()
-        eval_result['ahe_horizon8_gen'] = ahe8_gen.mean()
-        eval_result['metric_ahe'] = avg_ahe.mean()
-        eval_result['ahe_score'] = ahe_score.mean()
-
-        # final heading error computation
-        fhe3_gen = copy.deepcopy(heading_error_gen[:, 29])
-        fhe5_gen = copy.deepcopy(heading_error_gen[:, 49])
-        fhe8_gen = copy.deepcopy(heading_error_gen[:, 79])
-        avg_fhe = (fhe3_gen + fhe5_gen + fhe8_gen)/3
-        fhe_score = np.ones_like(avg_fhe) - avg_fhe/HEADING_ERROR_THRESHHOLD
-        fhe_score = np.where(fhe_score < 0, np.zeros_like(fhe_score), fhe_score)
-        item_to_save['fhe_score'] = fhe_score
-        item_to_save['fhe_horizon3_gen'] = fhe3_gen
-        item_to_save['fhe_horizon5_gen'] = fhe5_gen
-        item_to_save['fhe_horizon8_gen'] = fhe8_gen
-        eval_result['fhe_horizon3_gen'] = fhe3_gen.mean()
-        eval_result['fhe_horizon5_gen'] = fhe5_gen.mean()
-        eval_result['fhe_horizon8_gen'] = fhe8_gen.mean()
-        eval_result['metric_fhe'] = avg_fhe.mean()
-        eval_result['fhe_score'] = fhe_score.mean()
-    
-    # missing rate
-    max_displacement3 = np.max(ade_gen[:, :30], axis=1)
-    max_displacement5 = np.max(ade_gen[:, :50], axis=1)
-    max_displacement8 = np.max(ade_gen[:, :80], axis=1)
-    # miss = 1, not miss = 0
-    miss3 = np.where(max_displacement3 > MISS_THRESHHOLD[0], np.ones_like(max_displacement3), np.zeros_like(max_displacement3))
-    miss5 = np.where(max_displacement5 > MISS_THRESHHOLD[1], np.ones_like(max_displacement5), np.zeros_like(max_displacement5))
-    miss8 = np.where(max_displacement8 > MISS_THRESHHOLD[2], np.ones_like(max_displacement8), np.zeros_like(max_displacement8))
-    miss = np.where(miss3 + miss5 + miss8 >= 1, np.ones_like(miss3), np.zeros_like(miss3))
-    item_to_save["miss_score"] = miss
-    eval_result["miss_rate3"] = miss3.mean()
-    eval_result["miss_rate5"] = miss5.mean()
-    eval_result["miss_rate8"] = miss8.mean()
-    eval_result["total_miss_rate"] = miss.mean()
-    # compute error for forward results
-    ade_x_error_for = prediction_trajectory_by_forward[:, :, 0] - labels[:, :, 0]
-    ade_y_error_for = prediction_trajectory_by_forward[:, :, 1] - labels[:, :, 1]
-    fde_x_error_for = prediction_trajectory_by_forward[:, -1, 0] - labels[:, -1, 0]
-    fde_y_error_for = prediction_trajectory_by_forward[:, -1, 1] - labels[:, -1, 1]
-
-    ade_for = np.sqrt(ade_x_error_for ** 2 + ade_y_error_for ** 2).mean()
-    eval_result['ade_forward'] = ade_for
-    fde_for = np.sqrt(fde_x_error_for ** 2 + fde_y_error_for ** 2).mean()
-    eval_result['fde_forward'] = fde_for
-    if 'key_points_logits' in prediction_by_generation:
-        assert len(selected_indices) > 1, selected_indices
-        if len(selected_indices) > 10:
-            ade_x_error_key_points_for = prediction_key_points_by_forward[:, 10:, 0] - label_key_points[:, 10:, 0]
-            ade_y_error_key_points_for = prediction_key_points_by_forward[:, 10:, 1] - label_key_points[:, 10:, 1]
-        else:
-            ade_x_error_key_points_for = prediction_key_points_by_forward[:, :, 0] - label_key_points[:, :, 0]
-            ade_y_error_key_points_for = prediction_key_points_by_forward[:, :, 1] - label_key_points[:, :, 1]
-        if selected_indices[0] > selected_indices[-1]:
-            # forward
-            fde_x_error_key_points_for = prediction_key_points_by_forward[:, 0, 0] - label_key_points[:, 0, 0]
-            fde_y_error_key_points_for = prediction_key_points_by_forward[:, 0, 1] - label_key_points[:, 0, 1]
-        elif selected_indices[0] < selected_indices[-1]:
-            # backward
-            fde_x_error_key_points_for = prediction_key_points_by_forward[:, -1, 0] - label_key_points[:, -1, 0]
-            fde_y_error_key_points_for = prediction_key_points_by_forward[:, -1, 1] - label_key_points[:, -1, 1]
-        ade_key_points_for = np.sqrt(ade_x_error_key_points_for ** 2 + ade_y_error_key_points_for ** 2).mean()
-        eval_result['ade_keypoints_forward'] = ade_key_points_for
-        fde_key_points_for = np.sqrt(fde_x_error_key_points_for ** 2 + fde_y_error_key_points_for ** 2).mean()
-        eval_result['fde_keypoints_forward'] = fde_key_points_for
-
-        if prediction_key_points_by_forward.shape[-1] == 4:
-            heading_error_for = abs(prediction_key_points_by_forward[:, :, -1] - label_key_points[:, :, -1])
-            eval_result['heading_error_forward'] = heading_error_for.mean()
-
-    if 'proposal' in prediction_by_generation:
-        if 'halfs_intention' in prediction_by_generation:
-            # TODO: add waymo proposal accuracy to eval result
-            # evaluate classification accuracy and log to eval_result
-            # print('debuging trainer compute metrics: ', prediction_by_generation['proposal'], prediction_by_forward['proposal'], prediction_by_generation['halfs_intention'])
-            prediction_proposal_class_by_generation = prediction_by_generation["proposal"]  # sample_num, 1
-            proposal_labels = prediction_by_generation['halfs_intention']
-            accuracy_by_generation = accuracy_score(y_true=proposal_labels.flatten(), y_pred=prediction_proposal_class_by_generation.flatten(), normalize=True)
-            # print('inspect trainer compute_metrics: proposal accuracy: ', proposal_labels.flatten(), prediction_proposal_class_by_generation.flatten())
-            eval_result['proposal_accuracy'] = accuracy_by_generation
-        elif 'intentions' in prediction_by_generation:
-            prediction_proposal_class_by_generation = prediction_by_generation["proposal"]  # sample_num, 16
-            proposal_labels = prediction_by_generation['intentions']  # sample_num, 16
-            accuracy_by_generation = accuracy_score(y_true=proposal_labels.flatten(), y_pred=prediction_proposal_class_by_generation.flatten(), normalize=True)
-            # print('inspect trainer compute_metrics: proposal accuracy: ', proposal_labels, prediction_proposal_class_by_generation)
-            eval_result['proposal_accuracy'] = accuracy_by_generation
-        else:
-            print('WARNING: no intention found in generation. ', list(prediction_by_generation.keys()))
-
-    score, miss_score = compute_scores(item_to_save)
-    eval_result["average_score"] = score
-    eval_result["miss_score"] = miss_score
-
-    # include inputs by passing args.include_inputs_for_metrics = True to save eval result to pickle
-    if EVAL_LOG_SAVING_PATH is not None:
-        print('Saving eval result to pickle file: ', EVAL_LOG_SAVING_PATH)
-        eval_result_to_save = {}
-        # get miss scenarios
-        miss_indices = np.where(miss == 1)[0]
-        scenario15s_id_miss = scenario15s_id[miss_indices]
-        # [(file_name, frame_id), ...]
-        eval_result_to_save["miss_scenarios"] = scenario15s_id_miss
-        # get top fde scenarios (about 10%)
-        total_num = len(fde8_gen)
-        fde_indices = np.argsort(fde8_gen)[::-1][:int(total_num/10)]
-        scenario15s_id_high_fde = scenario15s_id[fde_indices]
-        fde8s_value = fde8_gen[fde_indices]
-        # [(file_name, frame_id, fde8s_value), ...]
-        eval_result_to_save["top_fde_scenarios"] = list(zip(scenario15s_id_high_fde, fde8s_value))
-        # save eval result
-        with open(EVAL_LOG_SAVING_PATH, "wb") as f:
-            pickle.dump(eval_result_to_save, f, protocol=pickle.HIGHEST_PROTOCOL)
-        print(f'Eval result saved to {EVAL_LOG_SAVING_PATH} with {scenario15s_id_miss.shape[0]} miss scenarios and {scenario15s_id_high_fde.shape[0]} top fde scenarios')
-    else:
-        assert False, "EVAL_LOG_SAVING_PATH is None"
-
-    return eval_result
-
-def compute_metrics_waymo(prediction: EvalPrediction):
-    from transformer4planning.utils.waymo_utils import tensor_to_str, waymo_evaluation
-    pred_dicts = prediction.predictions['prediction_generation']
-    type_idx_str = {
-            1: 'TYPE_VEHICLE',
-            2: 'TYPE_PEDESTRIAN',
-            3: 'TYPE_CYCLIST',
-        }
-    
-    pred_dict_list = []
-    for idx in range(len(pred_dicts["object_type"])):
-        single_pred_dict = {}
-        for key in pred_dicts.keys():
-            if key == "scenario_id":
-                single_pred_dict[key] = tensor_to_str(torch.from_numpy(pred_dicts[key][idx]).unsqueeze(0))[0]
-            elif key == "object_type":
-                single_pred_dict[key] = type_idx_str[pred_dicts[key][idx]]
-            elif key == "pred_scores":
-                single_pred_dict[key] = pred_dicts[key][idx].reshape(-1)
-            else:
-                single_pred_dict[key] = pred_dicts[key][idx]
-                
-        pred_dict_list.append(single_pred_dict)
-
-    result_dict, result_format_str = waymo_evaluation(pred_dicts=pred_dict_list, num_modes_for_eval=6, eval_second=8)
-    print(result_format_str)
+    return StreamingPlanningMetrics()(prediction)
 
+class StreamingWaymoMetrics(StreamingMetrics):
+    """
+    Streaming waymo eval metrics, see StreamingMetrics.
+    Predictions of every batch are compacted to columns (modes sorted by score, trajectories at the evaluated 2Hz frames),
+    which the official waymo metric ops evaluate at the last batch.
+    Without the waymo_open_dataset package or with official=False, minADE, minFDE and MissRate are accumulated
+    per batch and object type on device instead, and no predictions are kept. These approximate metrics are reported
+    with a 'streamed_' prefix, e.g. 'streamed_minADE - VEHICLE', to keep them apart from the official ones.
+    """
     metric_names = ['minADE', 'minFDE', 'MissRate', 'OverlapRate', 'mAP']
-    agent_type = ['VEHICLE', 'PEDESTRIAN', 'CYCLIST']
-
-    result = {}
-    for m in metric_names:  
-        record_avg = True 
-        for a in agent_type:
-            key = f"{m} - {a}"
-            if result_dict[key] == -1:
-                if record_avg: record_avg = False
-            else:
-                assert result_dict[key] > 0
-                result[key] = result_dict[key]
-
-        if m != "OverlapRate" and record_avg:
-            result[m] = result_dict[m]
+    column_names = ['scenario_id', 'object_id', 'object_type', 'pred_scores', 'pred_trajs', 'gt_trajs', 'gt_is_valid']
+
+    def __init__(self, official=None, eval_second=8, num_modes_for_eval=6, num_samples=None):
+        if official is None:
+            official = importlib.util.find_spec('waymo_open_dataset') is not None
+            if not official:
+                print('WARNING: waymo_open_dataset not found, reporting approximate streamed_ waymo metrics '
+                      'without mAP and OverlapRate. Pass official=False to silence this warning.')
+        self.official = official
+        self.eval_second = eval_second
+        self.num_modes_for_eval = num_modes_for_eval
+        super().__init__(num_samples)
+
+    def reset(self, num_samples=None):
+        super().reset(num_samples)
+        self.columns = {key: [] for key in self.column_names}
+        # sums and counts of the errors, by metric, object type and measurement step
+        self.error_sums = None
+        self.error_counts = None
+
+    def update(self, predictions, labels=None):
+        from transformer4planning.utils.waymo_metrics import compact_predictions, decode_scenario_ids, motion_errors
+        self._add_loss_items(predictions)
+        pred_dicts = predictions['prediction_generation']
+        batch_size = self._take(len(pred_dicts['object_type']))
+        if batch_size == 0:
+            return
+
+        object_type = torch.as_tensor(pred_dicts['object_type'])[:batch_size]
+        pred_scores, pred_trajs, gt_trajs, gt_is_valid = compact_predictions(
+            torch.as_tensor(pred_dicts['pred_scores'])[:batch_size], torch.as_tensor(pred_dicts['pred_trajs'])[:batch_size],
+            torch.as_tensor(pred_dicts['gt_trajs'])[:batch_size], eval_second=self.eval_second)
+        if self.official:
+            batch_columns = {
+                'scenario_id': decode_scenario_ids(torch.as_tensor(pred_dicts['scenario_id'])[:batch_size]),
+                'object_id': torch.as_tensor(pred_dicts['object_id'])[:batch_size].cpu().numpy(),
+                'object_type': object_type.cpu().numpy(),
+                'pred_scores': pred_scores,
+                'pred_trajs': pred_trajs,
+                'gt_trajs': gt_trajs,
+                'gt_is_valid': gt_is_valid,
+            }
+            for key, value in batch_columns.items():
+                self.columns[key].append(value)
+            return
+
+        errors, valid = motion_errors(pred_trajs, gt_trajs, gt_is_valid, eval_second=self.eval_second,
+                                      num_modes_for_eval=self.num_modes_for_eval)
+        device = valid.device
+        if self.error_sums is None:
+            self.error_sums = torch.zeros((len(errors), 5, valid.shape[1]), dtype=torch.float64, device=device)
+            self.error_counts = torch.zeros((5, valid.shape[1]), dtype=torch.float64, device=device)
+        object_type = object_type.to(device).long()
+        for i, each_error in enumerate(errors.values()):
+            self.error_sums[i].index_add_(0, object_type, each_error * valid)
+        self.error_counts.index_add_(0, object_type, valid.double())
+
+    def _compute_official(self):
+        from transformer4planning.utils.waymo_utils import waymo_evaluation_columnar
+        columns = {key: np.concatenate(value) for key, value in self.columns.items()}
+        result_dict, result_format_str = waymo_evaluation_columnar(columns, eval_second=self.eval_second,
+                                                                   num_modes_for_eval=self.num_modes_for_eval)
+        print(result_format_str)
+        return result_dict
+
+    def _compute_streamed(self):
+        from transformer4planning.utils.waymo_metrics import EVAL_OBJECT_TYPES
+        # -1 for object types without objects, as the official metrics
+        result_dict = {}
+        for i, m in enumerate(['minADE', 'minFDE', 'MissRate']):
+            for type_id, type_name in EVAL_OBJECT_TYPES.items():
+                counts = self.error_counts[type_id] if self.error_counts is not None else torch.zeros(1)
+                if counts.sum() == 0:
+                    result_dict[f"{m} - {type_name}"] = -1
+                    continue
+                # average over measurement steps
+                step_mean = self.error_sums[i, type_id][counts > 0] / counts[counts > 0]
+                result_dict[f"{m} - {type_name}"] = step_mean.mean().item()
+            result_dict[m] = np.mean([result_dict[f"{m} - {type_name}"] for type_name in EVAL_OBJECT_TYPES.values()])
+        print('Waymo metrics (streamed, without mAP and OverlapRate):', result_dict)
+        return result_dict
+
+    def compute(self):
+        result_dict = self._compute_official() if self.official else self._compute_streamed()
+        agent_type = ['VEHICLE', 'PEDESTRIAN', 'CYCLIST']
+
+        result = {}
+        for m in self.metric_names:
+            if f"{m} - {agent_type[0]}" not in result_dict:
+                continue
+            record_avg = True
+            for a in agent_type:
+                key = f"{m} - {a}"
+                if result_dict[key] == -1:
+                    if record_avg: record_avg = False
+                else:
+                    # a miss rate of 0 is valid for the streamed metrics
+                    assert result_dict[key] > 0 or (m == 'MissRate' and not self.official)
+                    result[key] = result_dict[key]
 
+            if m != "OverlapRate" and record_avg:
+                result[m] = result_dict[m]
+        if not self.official:
+            result = {f"streamed_{key}": value for key, value in result.items()}
 
-    loss_items = prediction.predictions['loss_items']
-    # check loss items are dictionary
-    if isinstance(loss_items, dict):
-        for each_key in loss_items:
-            # get average loss for each key
-            result[each_key] = np.mean(loss_items[each_key])
+        # average loss items over batches
+        for key in self.sums:
+            result[key] = (self.sums[key] / self.counts[key]).item()
+        return result
 
-    return result
+def compute_metrics_waymo(prediction: EvalPrediction):
+    return StreamingWaymoMetrics()(prediction)
 
 
 class CustomCallback(DefaultFlowCallback):
@@ -394,6 +499,16 @@ class PlanningTrainer(Trainer):
             inputs["mems"] = self._past
         return inputs
 
+    def evaluation_loop(self, dataloader, *args, **kwargs):
+        """
+        Overwrite Note:
+        To reset streaming metrics before each evaluation, with the number of eval samples
+        to drop the padding of the distributed sampler as the gathered predictions are truncated.
+        """
+        if isinstance(self.compute_metrics, StreamingMetrics):
+            self.compute_metrics.reset(num_samples=self.num_examples(dataloader) if has_length(dataloader) else None)
+        return super().evaluation_loop(dataloader, *args, **kwargs)
+
     def prediction_step(
             self,
             model: nn.Module,
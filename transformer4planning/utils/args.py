@@ -60,6 +60,18 @@ class ModelArguments:
     pretrain_encoder: Optional[bool] = field(
         default=False,
     )
+    freeze_raster_encoder: Optional[bool] = field(
+        default=False, metadata={"help": "Freeze the weights of the raster encoder (resnet or vit), which then runs in eval mode."}
+    )
+    raster_embedding_cache: Optional[str] = field(
+        default=None, metadata={"help": "The path of the cache of the frozen raster encoder outputs of every sample. "
+                                        "Missing samples are encoded once before training, then rasters are no longer drawn nor encoded. "
+                                        "Requires freeze_raster_encoder and no raster augmentation."}
+    )
+    quantization: Optional[str] = field(
+        default=None, metadata={"help": "Set as int8 in the config of the quantized checkpoints saved by quantize_model, "
+                                        "then build_models loads the int8 weights. Quantized models run on cpu only."}
+    )
     k: Optional[int] = field(
         default=1,
         metadata={"help": "Set k for top-k predictions, set to -1 to not use top-k predictions."},
@@ -149,6 +161,14 @@ class ModelArguments:
     val_camera_image_folder: Optional[str] = field(
         default=None, metadata={"help": "The folder of camera images for validation. Set None to not use camera images."}
     )
+    camera_image_store: Optional[str] = field(
+        default=None, metadata={"help": "The path of the store of decoded and resized camera images, built by build_camera_image_store. "
+                                        "Set to read camera images from the store instead of the camera image folders."}
+    )
+    camera_feature_store: Optional[str] = field(
+        default=None, metadata={"help": "The path of the store of dinov2 features of the camera images, built by build_camera_image_store. "
+                                        "Set to train with the frozen dinov2 without running it."}
+    )
     ####### end of camera images args ########
 
     ######## begin of nuplan args ########
@@ -330,6 +350,31 @@ class PlanningTrainingArguments(TrainingArguments):
     images_cleaning_to_folder: Optional[str] = field(
         default=None, metadata={"help": "Pass a target folder to clean the raw image folder to the target folder."}
     )
+    build_camera_image_store: Optional[bool] = field(
+        default=False, metadata={"help": "Build the camera image store at camera_image_store from the camera image folders, "
+                                         "and the dinov2 feature store at camera_feature_store if given, then exit."}
+    )
+    quantize_model: Optional[bool] = field(
+        default=False, metadata={"help": "Quantize the model to int8 for cpu inference, calibrated over the validation set, "
+                                         "then report latency, model size and open loop ade/fde versus fp32, save the quantized model "
+                                         "to output_dir and exit."}
+    )
+    quantization_calibration_samples: Optional[int] = field(
+        default=256, metadata={"help": "Number of validation samples to calibrate the static quantization of the resnet raster encoder."}
+    )
+    quantization_eval_samples: Optional[int] = field(
+        default=256, metadata={"help": "Number of validation samples to compare the quantized model with the fp32 model."}
+    )
+    predict_num_shards: Optional[int] = field(
+        default=None, metadata={"help": "Number of shards of the test set for do_predict, default as the world size."}
+    )
+    predict_shard_id: Optional[int] = field(
+        default=None, metadata={"help": "Shard of the test set to predict by this process, default as the process index. "
+                                        "Set with predict_num_shards to run shards as independent jobs."}
+    )
+    predict_checkpoint_interval: Optional[int] = field(
+        default=50, metadata={"help": "Number of batches between two checkpoints of the prediction shards."}
+    )
 
     # label_names: Optional[List[str]] = field(
     #     default=lambda: ['trajectory_label']
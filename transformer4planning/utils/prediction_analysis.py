@@ -0,0 +1,294 @@
+import os
+import json
+import pickle
+import numpy as np
+import pyarrow as pa
+from transformer4planning.utils.prediction_shards import SUMMARY_COLUMNS, check_shards, iter_shard_tables, \
+    fixed_size_list_to_numpy
+
+# Vectorized dagger and bias analysis over the prediction shards of do_predict (see prediction_shards).
+# Identifiers and per-sample errors are held as columns (numpy arrays) of the whole test set,
+# trajectories are only read part by part to compute further errors.
+
+# horizons (in seconds) of the trajectory errors, predictions and labels at 10Hz
+ERROR_HORIZONS = [3, 5, 8]
+
+
+def trajectory_errors(predicted_trajectory, trajectory_label, horizons=ERROR_HORIZONS, frequency=10):
+    """
+    Args:
+        predicted_trajectory: (num_samples, num_frames, 2/4)
+        trajectory_label: (num_samples, num_label_frames, 2/4), aligned to the last frames of the prediction,
+            frames padded with -1 are excluded as in prediction_shards.prediction_columns
+    Returns:
+        dict of ade{horizon} and fde{horizon} (num_samples, ) for every horizon within the label length,
+        nan without valid frames (ade) or for a padded last frame (fde)
+    """
+    bias = trajectory_label[:, :, :2].astype(np.float64) - \
+        predicted_trajectory[:, -trajectory_label.shape[1]:, :2].astype(np.float64)
+    valid = (trajectory_label[:, :, :2] != -1).any(-1)
+    distance = np.where(valid, np.sqrt((bias ** 2).sum(-1)), np.nan)
+    errors = dict()
+    for horizon in horizons:
+        num_frames = horizon * frequency
+        if num_frames <= distance.shape[1]:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                errors[f'ade{horizon}'] = np.nansum(distance[:, :num_frames], 1) / valid[:, :num_frames].sum(1)
+            errors[f'fde{horizon}'] = distance[:, num_frames - 1]
+    return errors
+
+
+def load_prediction_columns(prediction_path, columns=SUMMARY_COLUMNS + ['scenario_type'], with_horizon_errors=False):
+    """
+    Reads columns of all shards, in order of the test set.
+    Args:
+        columns: names of the columns to read, missing columns are skipped
+        with_horizon_errors: compute trajectory_errors from the trajectories, part by part
+    Returns:
+        dict of column name to numpy array, object arrays for strings
+    """
+    chunks = dict()
+    trajectory_columns = ['predicted_trajectory', 'trajectory_label'] if with_horizon_errors else []
+    for table in iter_shard_tables(prediction_path, columns=list(columns) + trajectory_columns):
+        for name in columns:
+            if name in table.column_names:
+                chunks.setdefault(name, []).extend(table.column(name).chunks)
+        if with_horizon_errors and 'trajectory_label' in table.column_names:
+            errors = trajectory_errors(fixed_size_list_to_numpy(table.column('predicted_trajectory')),
+                                       fixed_size_list_to_numpy(table.column('trajectory_label')))
+            for name, value in errors.items():
+                chunks.setdefault(name, []).append(pa.array(value))
+    result = dict()
+    for name, value in chunks.items():
+        array = pa.concat_arrays(value)
+        result[name] = array.to_numpy(zero_copy_only=False)
+    return result
+
+
+def group_ids(keys):
+    """
+    Vectorized grouping of identifiers.
+    Args:
+        keys: (num_samples, ) array of identifiers, e.g. file names
+    Returns:
+        unique keys in order of first appearance, (num_samples, ) group index of every sample
+    """
+    encoded = pa.array(keys).dictionary_encode()
+    return encoded.dictionary.to_numpy(zero_copy_only=False), encoded.indices.to_numpy().astype(np.int64)
+
+
+def top_k(values, k):
+    """
+    Returns:
+        indices of the k largest values, largest first
+    """
+    k = min(k, len(values))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    indices = np.argpartition(-values, k - 1)[:k]
+    return indices[np.argsort(-values[indices], kind='stable')]
+
+
+def top_k_per_group(values, groups, k):
+    """
+    Args:
+        values: (num_samples, ) values to rank
+        groups: (num_samples, ) group index of every sample, see group_ids
+    Returns:
+        indices of the k largest values of every group, by group and largest first
+    """
+    order = np.lexsort((-values, groups))
+    sorted_groups = groups[order]
+    rank_in_group = np.arange(len(order)) - np.searchsorted(sorted_groups, sorted_groups, side='left')
+    return order[rank_in_group < k]
+
+
+def group_statistics(groups, num_groups, **values):
+    """
+    Returns:
+        dict of count and the mean and max of every value by group, each (num_groups, )
+    """
+    count = np.bincount(groups, minlength=num_groups)
+    statistics = dict(count=count)
+    for name, value in values.items():
+        value = value.astype(np.float64)
+        statistics[f'{name}_mean'] = np.bincount(groups, weights=value, minlength=num_groups) / np.maximum(count, 1)
+        maximum = np.full(num_groups, -np.inf)
+        np.maximum.at(maximum, groups, value)
+        statistics[f'{name}_max'] = maximum
+    return statistics
+
+
+def _rank_by_file(file_name, frame_id, ade, fde, y_bias, sort_key):
+    num_samples = len(sort_key)
+    # stable as sorted(..., reverse=True): samples with equal keys stay in order of the test set
+    order = np.argsort(-sort_key, kind='stable')
+    rank = np.empty(num_samples, dtype=np.float64)
+    rank[order] = (np.arange(num_samples) + 1) / num_samples
+    # files in order of their best ranked sample, samples of a file by rank
+    files, file_index = group_ids(file_name[order])
+    order = order[np.argsort(file_index, kind='stable')]
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(file_index, minlength=len(files)))]).tolist()
+    columns = dict(frame_id=frame_id, ade=ade, fde=fde, y_bias=y_bias, rank=rank)
+    # one conversion to python lists per column, sliced by file
+    columns = {key: value[order].tolist() for key, value in columns.items()}
+    return {file: {key: value[bounds[i]:bounds[i + 1]] for key, value in columns.items()} for i, file in enumerate(files)}
+
+
+def compute_dagger_dict(file_name, frame_id, ade, fde, y_bias):
+    """
+    Ranks all samples by fde and by absolute y bias, worst first.
+    Args:
+        (num_samples, ) columns of the prediction results, samples with file name null are skipped
+    Returns:
+        fde and y bias dagger dicts of file name to lists of frame_id, ade, fde, abs y_bias and rank (position / num_samples)
+    """
+    file_name = np.asarray(file_name, dtype=object)
+    valid = file_name != 'null'
+    file_name, frame_id, ade, fde = file_name[valid], np.asarray(frame_id)[valid], np.asarray(ade)[valid], np.asarray(fde)[valid]
+    y_bias = np.abs(np.asarray(y_bias)[valid])
+    return _rank_by_file(file_name, frame_id, ade, fde, y_bias, fde), \
+        _rank_by_file(file_name, frame_id, ade, fde, y_bias, y_bias)
+
+
+def draw_histogram_graph(data, title, savepath):
+    import matplotlib.pyplot as plt
+    plt.figure()
+    plt.hist(data, bins=range(20), edgecolor='black')
+    plt.title(title)
+    plt.xlabel("Value")
+    plt.ylabel("Frequency")
+    plt.savefig(os.path.join(savepath, "{}.png".format(title)))
+    plt.close()
+
+
+def summarize_errors(columns):
+    # errors of samples without valid label frames are nan
+    result = {
+        'mean_l2_loss': float(np.nanmean(columns['mse'])),
+        'end_point_x_offset': float(np.nanmean(np.abs(columns['end_bias_x']))),
+        'end_point_y_offset': float(np.nanmean(np.abs(columns['end_bias_y']))),
+        'ADE': float(np.nanmean(columns['ade'])),
+        'FDE': float(np.nanmean(columns['fde'])),
+    }
+    for name in columns:
+        if name[:3] in ['ade', 'fde'] and name[3:].isdigit():
+            result[name] = float(np.nanmean(columns[name]))
+    return result
+
+
+def merge_prediction_shards(prediction_path, output_dir, dagger=False):
+    """
+    Merges the summary columns of all shards to the prediction and dagger results of do_predict,
+    the predicted trajectories are not loaded and stay in the shards (read them with iter_shard_tables).
+    Saves generated_predictions.pickle, and fde_dagger.pkl and ybias_dagger.pkl if dagger is enabled, to output_dir.
+    Returns:
+        dict of mean errors, None if shards are not finished
+    """
+    if not check_shards(prediction_path):
+        return None
+    columns = load_prediction_columns(prediction_path)
+    file_names = columns['file_name'].tolist() if 'file_name' in columns else []
+    frame_ids = columns.get('frame_id', np.zeros(0, dtype=np.int64))
+
+    result = dict()
+    with_errors = 'ade' in columns
+    if with_errors:
+        result = summarize_errors(columns)
+        print('Mean L2 loss: ', result['mean_l2_loss'])
+        print('End point x offset: ', result['end_point_x_offset'])
+        print('End point y offset: ', result['end_point_y_offset'])
+        print('ADE', result['ADE'])
+        print('FDE', result['FDE'])
+
+    if output_dir is not None:
+        output_file_path = os.path.join(output_dir, 'generated_predictions.pickle')
+        with open(output_file_path, 'wb') as handle:
+            pickle.dump({'file_names': file_names, 'current_frame': frame_ids, 'prediction_shards': prediction_path},
+                        handle, protocol=pickle.HIGHEST_PROTOCOL)
+        if dagger and with_errors:
+            draw_histogram_graph(columns['fde'], title="FDE-distributions", savepath=output_dir)
+            draw_histogram_graph(columns['ade'], title="ADE-distributions", savepath=output_dir)
+            draw_histogram_graph(columns['y_bias'], title="ybias-distribution", savepath=output_dir)
+            fde_dagger_dic, y_bias_dagger_dic = compute_dagger_dict(columns['file_name'], frame_ids, columns['ade'],
+                                                                    columns['fde'], columns['y_bias'])
+            dagger_result_path = os.path.join(output_dir, "fde_dagger.pkl")
+            with open(dagger_result_path, 'wb') as handle:
+                pickle.dump(fde_dagger_dic, handle)
+            dagger_result_path = os.path.join(output_dir, "ybias_dagger.pkl")
+            with open(dagger_result_path, 'wb') as handle:
+                pickle.dump(y_bias_dagger_dic, handle)
+            print("dagger results save to {}".format(dagger_result_path))
+    return result
+
+
+def analyze_predictions(columns, group_by='file_name', sort_by='fde', k=10):
+    """
+    Error statistics by group and the worst samples of the test set and of every group.
+    Args:
+        columns: see load_prediction_columns
+        group_by: column of the groups, file_name (scenario) or scenario_type
+        sort_by: error column to rank samples by
+        k: number of worst samples to report, in total and per group
+    Returns:
+        json serializable dict of the analysis
+    """
+    groups, group_index = group_ids(columns[group_by])
+    error_names = [name for name in ['ade', 'fde', 'y_bias', 'end_bias_x', 'end_bias_y', 'ade3', 'fde3', 'ade5',
+                                     'fde5', 'ade8', 'fde8'] if name in columns]
+    statistics = group_statistics(group_index, len(groups), **{name: columns[name] for name in error_names})
+    values = columns[sort_by]
+
+    def samples(indices):
+        return [dict({group_by: columns[group_by][i], 'frame_id': int(columns['frame_id'][i])},
+                     **{name: float(columns[name][i]) for name in error_names}) for i in indices]
+
+    worst_groups = top_k(statistics[f'{sort_by}_mean'], k)
+    worst_in_group = top_k_per_group(values, group_index, k)
+    return {
+        'summary': summarize_errors(columns),
+        'num_samples': len(values),
+        f'num_{group_by}': len(groups),
+        f'worst_{sort_by}': samples(top_k(values, k)),
+        f'worst_{group_by}_by_mean_{sort_by}': [
+            dict({group_by: groups[i]}, **{name: float(value[i]) for name, value in statistics.items()})
+            for i in worst_groups
+        ],
+        f'worst_{sort_by}_per_{group_by}': {
+            groups[i]: samples(worst_in_group[group_index[worst_in_group] == i]) for i in worst_groups
+        },
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prediction_path", type=str, required=True,
+                        help="prediction shards of do_predict, output_dir/prediction_shards")
+    parser.add_argument("--output_dir", type=str, default=None, help="default as the parent folder of prediction_path")
+    parser.add_argument("--group_by", type=str, default="file_name", choices=["file_name", "scenario_type"])
+    parser.add_argument("--sort_by", type=str, default="fde")
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--horizon_errors", action="store_true",
+                        help="compute errors at 3/5/8 seconds from the stored trajectories")
+    parser.add_argument("--dagger", action="store_true", help="save fde_dagger.pkl and ybias_dagger.pkl")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.prediction_path))
+    assert check_shards(args.prediction_path), f'prediction shards at {args.prediction_path} are not complete'
+    columns = load_prediction_columns(args.prediction_path, with_horizon_errors=args.horizon_errors)
+    assert 'ade' in columns, 'prediction shards without trajectory labels, nothing to analyze'
+    analysis = analyze_predictions(columns, group_by=args.group_by, sort_by=args.sort_by, k=args.top_k)
+    analysis_path = os.path.join(output_dir, f"prediction_analysis_{args.group_by}.json")
+    with open(analysis_path, "w") as f:
+        json.dump(analysis, f, indent=2)
+    print(json.dumps(analysis['summary'], indent=2))
+    print("analysis saved to {}".format(analysis_path))
+    if args.dagger:
+        fde_dagger_dic, y_bias_dagger_dic = compute_dagger_dict(columns['file_name'], columns['frame_id'],
+                                                                columns['ade'], columns['fde'], columns['y_bias'])
+        for name, dic in [("fde_dagger.pkl", fde_dagger_dic), ("ybias_dagger.pkl", y_bias_dagger_dic)]:
+            with open(os.path.join(output_dir, name), 'wb') as handle:
+                pickle.dump(dic, handle)
+        print("dagger results save to {}".format(output_dir))
@@ -0,0 +1,280 @@
+import os
+import json
+import numpy as np
+import pyarrow as pa
+import torch
+from tqdm import tqdm
+from torch.utils.data import DataLoader, Subset
+
+# Sharded, resumable prediction outputs of do_predict.
+# Every shard is a contiguous range of the test set, predicted by one process (or one independent job) and written to
+# output_path/shard_{shard_id}_of_{num_shards}/ as arrow part files, one part per checkpoint:
+#   part_00000.arrow, part_00001.arrow, ..., progress.json
+# progress.json is only updated after its part file is complete, thus an interrupted shard resumes from its last
+# checkpoint, parts not listed in progress.json are left overs of the interrupted run and removed.
+
+PROGRESS_FILE = 'progress.json'
+# per-sample scalars of the merge (see prediction_analysis), the trajectories stay in the shards
+SUMMARY_COLUMNS = ['file_name', 'frame_id', 'ade', 'fde', 'y_bias', 'end_bias_x', 'end_bias_y', 'mse']
+
+
+def get_shard_range(num_samples, shard_id, num_shards):
+    """
+    Returns:
+        start and end index of the shard, balanced such that the first num_samples % num_shards shards have one more sample
+    """
+    assert 0 <= shard_id < num_shards, f'shard {shard_id} out of range [0, {num_shards})'
+    shard_size, remainder = divmod(num_samples, num_shards)
+    start = shard_id * shard_size + min(shard_id, remainder)
+    return start, start + shard_size + (1 if shard_id < remainder else 0)
+
+
+def get_shard_path(output_path, shard_id, num_shards):
+    return os.path.join(output_path, f'shard_{shard_id:05d}_of_{num_shards:05d}')
+
+
+def to_fixed_size_list(array):
+    # (n, d0, d1, ...) numpy array to nested arrow fixed size lists of the flat buffer
+    array = np.ascontiguousarray(array)
+    values = pa.array(array.reshape(-1))
+    for size in reversed(array.shape[1:]):
+        values = pa.FixedSizeListArray.from_arrays(values, size)
+    return values
+
+
+def fixed_size_list_to_numpy(column):
+    """
+    Inverse of to_fixed_size_list.
+    Args:
+        column: arrow (chunked) array of nested fixed size lists
+    Returns:
+        (n, d0, d1, ...) numpy array
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    shape = []
+    while pa.types.is_fixed_size_list(column.type):
+        shape.append(column.type.list_size)
+        column = column.flatten()
+    return column.to_numpy(zero_copy_only=False).reshape(-1, *shape)
+
+
+def _write_json(path, dic):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dic, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def load_progress(shard_path):
+    progress_file = os.path.join(shard_path, PROGRESS_FILE)
+    if not os.path.exists(progress_file):
+        return None
+    with open(progress_file, 'r') as f:
+        return json.load(f)
+
+
+class PredictionShardWriter:
+    """
+    Buffers prediction columns of a shard in memory, and writes them as one arrow part file per checkpoint.
+    """
+    def __init__(self, shard_path, shard_info):
+        """
+        Args:
+            shard_path: directory of the shard
+            shard_info: dict of num_samples, num_shards, shard_id, start and end, must match a shard to resume
+        """
+        self.shard_path = shard_path
+        os.makedirs(shard_path, exist_ok=True)
+        self.progress = load_progress(shard_path)
+        if self.progress is None:
+            self.progress = dict(shard_info, num_parts=0, num_consumed=0, num_rows=0, finished=False)
+            _write_json(os.path.join(shard_path, PROGRESS_FILE), self.progress)
+        elif any(self.progress[key] != value for key, value in shard_info.items()):
+            raise ValueError(f'prediction shard at {shard_path} was written for another test set or sharding, '
+                             f'{ {key: self.progress[key] for key in shard_info} } != {shard_info}, remove it to restart')
+        # remove parts after the last checkpoint
+        for file_name in os.listdir(shard_path):
+            if file_name.startswith('part_') and (not file_name.endswith('.arrow') or
+                                                  int(file_name[5:10]) >= self.progress['num_parts']):
+                os.remove(os.path.join(shard_path, file_name))
+        self._batches = []
+
+    def part_path(self, part_id):
+        return os.path.join(self.shard_path, f'part_{part_id:05d}.arrow')
+
+    def add(self, columns):
+        """
+        Args:
+            columns: dict of column name to list or numpy array with one row per sample
+        """
+        arrays = [to_fixed_size_list(value) if isinstance(value, np.ndarray) and value.ndim > 1 else pa.array(value)
+                  for value in columns.values()]
+        self._batches.append(pa.record_batch(arrays, names=list(columns.keys())))
+
+    def checkpoint(self, num_consumed, finished=False):
+        """
+        Writes the buffered rows to a new part file, then records the progress.
+        Args:
+            num_consumed: number of samples of the shard done so far, including samples failed to preprocess
+        """
+        if len(self._batches) > 0:
+            table = pa.Table.from_batches(self._batches)
+            part_path = self.part_path(self.progress['num_parts'])
+            with pa.OSFile(part_path + '.tmp', 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(part_path + '.tmp', part_path)
+            self.progress['num_parts'] += 1
+            self.progress['num_rows'] += table.num_rows
+            self._batches = []
+        self.progress.update(num_consumed=num_consumed, finished=finished)
+        _write_json(os.path.join(self.shard_path, PROGRESS_FILE), self.progress)
+
+
+def prediction_columns(batch, pred_dict):
+    """
+    Per-sample prediction results of a batch of model.generate, with errors to the trajectory label if given.
+    Multi-modal predictions (bsz, k, 80, 2/4) are reduced to their first mode, as in quantization.evaluate_open_loop.
+    Label frames padded with -1 (e.g. waymo) are excluded from the errors, samples without valid frames get nan errors.
+    Returns:
+        dict of column name to list or numpy array
+    """
+    traj_pred = pred_dict['traj_logits'].float()
+    if traj_pred.dim() == 4:
+        traj_pred = traj_pred[:, 0]
+    # bsz, 80, 2/4
+    batch_size = traj_pred.shape[0]
+    columns = dict()
+    columns['file_name'] = list(batch['file_name']) if 'file_name' in batch else ['null'] * batch_size
+    columns['frame_id'] = torch.as_tensor(batch['frame_id']).cpu().numpy().astype(np.int64) if 'frame_id' in batch \
+        else -np.ones(batch_size, dtype=np.int64)
+    if 'scenario_type' in batch:
+        columns['scenario_type'] = list(batch['scenario_type'])
+    columns['predicted_trajectory'] = traj_pred.cpu().numpy()
+    if 'trajectory_label' in batch:
+        trajectory_label = batch['trajectory_label'].float()  # bsz, 80, 4
+        num_frames = trajectory_label.shape[1]
+        valid = (trajectory_label[:, :, :2] != -1).any(-1)  # bsz, 80
+        num_valid = valid.sum(1)
+        bias = trajectory_label[:, :, :2] - traj_pred[:, -num_frames:, :2]
+        distance = torch.sqrt((bias.double() ** 2).sum(-1))
+
+        def masked_mean(value):
+            # nan (0 / 0) for samples without valid frames
+            return ((value * valid).sum(1) / num_valid).cpu().numpy()
+
+        # end point errors at the last valid frame
+        frame_index = torch.arange(num_frames, device=valid.device).expand_as(valid)
+        last_frame = torch.where(valid, frame_index, 0).max(1).values
+        end_bias = bias[torch.arange(batch_size, device=bias.device), last_frame]
+        end_bias[num_valid == 0] = float('nan')
+        columns['trajectory_label'] = trajectory_label.cpu().numpy()
+        columns['ade'] = masked_mean(distance)
+        columns['fde'] = distance[torch.arange(batch_size, device=distance.device), last_frame].masked_fill(
+            num_valid == 0, float('nan')).cpu().numpy()
+        columns['y_bias'] = masked_mean(bias[:, :, 1].double())
+        columns['end_bias_x'] = end_bias[:, 0].cpu().numpy()
+        columns['end_bias_y'] = end_bias[:, 1].cpu().numpy()
+        columns['mse'] = masked_mean((bias.double() ** 2).mean(-1))
+    return columns
+
+
+def predict_shard(model, dataset, collate_fn, output_path, shard_id=0, num_shards=1, batch_size=1,
+                  num_workers=0, device='cpu', pin_memory=False, checkpoint_interval=50):
+    """
+    Predicts a shard of the dataset with model.generate, resuming from the last checkpoint of the shard.
+    Args:
+        device: torch device of the model and inputs, cpu or any cuda device
+        checkpoint_interval: number of batches between two checkpoints
+    Returns:
+        progress dict of the shard
+    """
+    start, end = get_shard_range(len(dataset), shard_id, num_shards)
+    shard_path = get_shard_path(output_path, shard_id, num_shards)
+    writer = PredictionShardWriter(shard_path, dict(num_samples=len(dataset), num_shards=num_shards,
+                                                    shard_id=shard_id, start=start, end=end))
+    if writer.progress['finished']:
+        print(f'prediction shard {shard_id}/{num_shards} already finished at {shard_path}')
+        return writer.progress
+    num_consumed = writer.progress['num_consumed']
+    if num_consumed > 0:
+        print(f'resuming prediction shard {shard_id}/{num_shards} from sample {num_consumed} of {end - start}')
+
+    indices = range(start + num_consumed, end)
+    dataloader = DataLoader(
+        dataset=dataset.select(indices) if hasattr(dataset, 'select') else Subset(dataset, indices),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=collate_fn,
+        pin_memory=pin_memory,
+        drop_last=False
+    )
+    device = torch.device(device)
+    model.to(device)
+    model.eval()
+    with torch.no_grad():
+        for itr, batch in enumerate(tqdm(dataloader, desc=f'predict shard {shard_id}/{num_shards}')):
+            num_consumed = min(num_consumed + batch_size, end - start)
+            # samples failed to preprocess are dropped by the collate function, maybe the whole batch
+            if len(batch) > 0:
+                for key in batch:
+                    if isinstance(batch[key], torch.Tensor):
+                        batch[key] = batch[key].to(device, non_blocking=pin_memory)
+                pred_dict = model.generate(**batch)
+                writer.add(prediction_columns(batch, pred_dict))
+            if (itr + 1) % checkpoint_interval == 0:
+                writer.checkpoint(num_consumed)
+    writer.checkpoint(end - start, finished=True)
+    return writer.progress
+
+
+def list_shards(output_path):
+    """
+    Returns:
+        list of (shard_path, progress) of all shards under output_path, sorted by shard id
+    """
+    shards = []
+    if os.path.isdir(output_path):
+        for dir_name in sorted(os.listdir(output_path)):
+            progress = load_progress(os.path.join(output_path, dir_name))
+            if dir_name.startswith('shard_') and progress is not None:
+                shards.append((os.path.join(output_path, dir_name), progress))
+    return shards
+
+
+def iter_shard_tables(output_path, columns=None):
+    """
+    Iterates over the checkpointed part files of all shards in order of the test set.
+    Part files are memory mapped, only the selected columns are read.
+    Args:
+        columns: list of column names to read, all columns if None, missing columns are skipped
+    Yields:
+        arrow tables
+    """
+    for shard_path, progress in list_shards(output_path):
+        for part_id in range(progress['num_parts']):
+            with pa.memory_map(os.path.join(shard_path, f'part_{part_id:05d}.arrow'), 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+            if columns is not None:
+                table = table.select([column for column in columns if column in table.column_names])
+            yield table
+
+
+def check_shards(output_path):
+    """
+    Returns:
+        True if shards of one sharding of the test set exist and are all finished
+    """
+    shards = list_shards(output_path)
+    if len(shards) == 0:
+        print(f'no prediction shards found at {output_path}')
+        return False
+    num_shards = {progress['num_shards'] for _, progress in shards}
+    if len(num_shards) != 1:
+        print(f'prediction shards of different shardings {num_shards} found at {output_path}')
+        return False
+    unfinished = sorted(set(range(num_shards.pop())) - {progress['shard_id'] for _, progress in shards if progress['finished']})
+    if len(unfinished) > 0:
+        print(f'prediction shards {unfinished} not finished yet, run them to merge results')
+        return False
+    return True
@@ -0,0 +1,149 @@
+import os
+import json
+from functools import lru_cache
+import numpy as np
+
+# Fixed-shape tensors keyed by strings (image paths, sample ids), stored in a few large memmap files.
+# Keys are fixed when the store is created, the key at position `index` lives at offset `index % shard_size` of
+# shard `index // shard_size`. A per-shard valid flag marks the written offsets, thus several processes can fill
+# disjoint keys in parallel and an interrupted build resumes with the missing keys.
+# layout on disk:
+#   store_path/meta.json, keys.json
+#   store_path/shard_00000.npy, valid_00000.npy, ...
+
+META_FILE = 'meta.json'
+KEYS_FILE = 'keys.json'
+
+
+def _write_json(path, obj):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f)
+    os.replace(path + '.tmp', path)
+
+
+class ShardedTensorStore:
+    def __init__(self, store_path, keys=None, shape=None, dtype=None, shard_size=1024, info=None, writable=False):
+        """
+        Opens the store at store_path, or creates it if keys are given.
+        Args:
+            keys: list of unique keys to create the store with, None to open an existing store
+            shape, dtype: shape and numpy dtype of one tensor
+            info: json serializable dict of how the tensors are computed, reopening with keys requires the same info
+            writable: open an existing store for writing, always True when creating
+        """
+        self.store_path = store_path
+        meta_file = os.path.join(store_path, META_FILE)
+        if keys is not None:
+            meta = dict(shape=list(shape), dtype=np.dtype(dtype).str, shard_size=shard_size,
+                        num_keys=len(keys), info=info if info is not None else {})
+            if os.path.exists(meta_file):
+                with open(meta_file, 'r') as f:
+                    saved_meta = json.load(f)
+                with open(os.path.join(store_path, KEYS_FILE), 'r') as f:
+                    saved_keys = json.load(f)
+                if saved_meta != json.loads(json.dumps(meta)) or saved_keys != list(keys):
+                    raise ValueError(f'tensor store at {store_path} was built with other keys or settings, '
+                                     f'remove it or use another path')
+            else:
+                os.makedirs(store_path, exist_ok=True)
+                _write_json(os.path.join(store_path, KEYS_FILE), list(keys))
+                _write_json(meta_file, meta)
+            self.writable = True
+        else:
+            if not os.path.exists(meta_file):
+                raise FileNotFoundError(f'no tensor store found at {store_path}')
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            with open(os.path.join(store_path, KEYS_FILE), 'r') as f:
+                keys = json.load(f)
+            self.writable = writable
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.shard_size = meta['shard_size']
+        self.info = meta['info']
+        self.keys = list(keys)
+        self.key_to_index = {key: index for index, key in enumerate(self.keys)}
+        assert len(self.key_to_index) == len(self.keys), 'keys of a tensor store must be unique'
+        self.num_shards = (len(self.keys) + self.shard_size - 1) // self.shard_size
+        # memmaps are opened lazily, so the store can be pickled into dataloader workers
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.key_to_index
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def _get_shard(self, shard_index):
+        if shard_index not in self._shards:
+            shard_len = min(self.shard_size, len(self.keys) - shard_index * self.shard_size)
+            shard = []
+            for name, shape, dtype in [('shard', self.shape, self.dtype), ('valid', (), np.uint8)]:
+                file_name = os.path.join(self.store_path, f'{name}_{shard_index:05d}.npy')
+                if not os.path.exists(file_name):
+                    if not self.writable:
+                        raise KeyError(f'shard {shard_index} of the tensor store at {self.store_path} not written yet')
+                    # sparse file, zero filled on read
+                    np.lib.format.open_memmap(file_name + '.tmp', mode='w+', dtype=dtype, shape=(shard_len, *shape)).flush()
+                    os.replace(file_name + '.tmp', file_name)
+                shard.append(np.load(file_name, mmap_mode='r+' if self.writable else 'r'))
+            self._shards[shard_index] = shard
+        return self._shards[shard_index]
+
+    def _locate(self, key):
+        if key not in self.key_to_index:
+            raise KeyError(f'{key} not in the tensor store at {self.store_path}')
+        return divmod(self.key_to_index[key], self.shard_size)
+
+    def is_written(self, key):
+        shard_index, offset = self._locate(key)
+        return bool(self._get_shard(shard_index)[1][offset])
+
+    def missing_keys(self):
+        missing = []
+        for shard_index in range(self.num_shards):
+            valid = self._get_shard(shard_index)[1]
+            missing.extend(self.keys[shard_index * self.shard_size + offset] for offset in np.flatnonzero(valid == 0))
+        return missing
+
+    def write(self, key, tensor):
+        assert self.writable, f'tensor store at {self.store_path} is opened read only'
+        shard_index, offset = self._locate(key)
+        tensors, valid = self._get_shard(shard_index)
+        tensors[offset] = tensor
+        # mark valid after the tensor is written, a crashed writer leaves the key missing
+        valid[offset] = 1
+
+    def read(self, keys, out=None):
+        """
+        Args:
+            keys: list of keys
+            out: optional array of shape (len(keys), *shape) to read to
+        Returns:
+            (len(keys), *shape) array of the tensors, raises KeyError if any key is missing or not written yet
+        """
+        if out is None:
+            out = np.empty((len(keys),) + self.shape, dtype=self.dtype)
+        for i, key in enumerate(keys):
+            shard_index, offset = self._locate(key)
+            tensors, valid = self._get_shard(shard_index)
+            if not valid[offset]:
+                raise KeyError(f'{key} not written to the tensor store at {self.store_path}')
+            out[i] = tensors[offset]
+        return out
+
+    def flush(self):
+        for shard in self._shards.values():
+            for array in shard:
+                array.flush()
+
+
+@lru_cache(maxsize=None)
+def load_tensor_store(store_path):
+    # opened once per process for reading, e.g. by the collate functions in dataloader workers
+    return ShardedTensorStore(store_path)
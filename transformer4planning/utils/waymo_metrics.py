@@ -0,0 +1,188 @@
+import numpy as np
+import torch
+
+# tensorflow free helpers for waymo evaluation, on stacked per-object arrays (columns) instead of per-object dicts
+
+object_type_to_id = {
+    'TYPE_UNSET': 0,
+    'TYPE_VEHICLE': 1,
+    'TYPE_PEDESTRIAN': 2,
+    'TYPE_CYCLIST': 3,
+    'TYPE_OTHER': 4
+}
+EVAL_OBJECT_TYPES = {1: 'VEHICLE', 2: 'PEDESTRIAN', 3: 'CYCLIST'}
+
+# same as the motion metrics config of waymo_utils._default_metrics_config
+TRACK_HISTORY_SAMPLES = 10
+SAMPLED_INTERVAL = 5
+SPEED_LOWER_BOUND, SPEED_UPPER_BOUND = 1.4, 11.0
+SPEED_SCALE_LOWER, SPEED_SCALE_UPPER = 0.5, 1.0
+# measurement step (of the 2Hz predictions), lateral and longitudinal miss thresholds
+MEASUREMENT_STEPS = {
+    3: [(5, 1.0, 2.0)],
+    5: [(5, 1.0, 2.0), (9, 1.8, 3.6)],
+    8: [(5, 1.0, 2.0), (9, 1.8, 3.6), (15, 3.0, 6.0)],
+}
+
+
+def get_eval_frames(eval_second=8):
+    """
+    Returns:
+        num_frames_in_total: ground truth frames, history and future
+        num_frame_to_eval: predicted frames at 2Hz
+    """
+    assert eval_second in [3, 5, 8]
+    num_frame_to_eval = eval_second * 2
+    return TRACK_HISTORY_SAMPLES + 1 + num_frame_to_eval * SAMPLED_INTERVAL, num_frame_to_eval
+
+
+def decode_scenario_ids(scenario_id):
+    """
+    Vectorized tensor_to_str.
+    Args:
+        scenario_id: (num_objects, max_length) char codes padded by -100, from str_to_tensor
+    Returns:
+        (num_objects, ) fixed length byte strings
+    """
+    codes = torch.as_tensor(scenario_id).cpu().numpy()
+    codes = np.where(codes == -100, 0, codes).astype(np.uint8)
+    return np.ascontiguousarray(codes).view(f'S{max(codes.shape[1], 1)}').reshape(-1)
+
+
+def compact_predictions(pred_scores, pred_trajs, gt_trajs, top_k_for_eval=-1, eval_second=8):
+    """
+    Keeps only what waymo evaluation reads of the predictions of a batch, as transform_preds_to_waymo_format does
+    per object: modes sorted and normalized by score, trajectories at the evaluated 2Hz frames.
+    Args:
+        pred_scores: (num_objects, num_modes) or any shape with num_modes elements per object
+        pred_trajs: (num_objects, num_modes, 80, 2)
+        gt_trajs: (num_objects, 91, 10) [cx, cy, cz, dx, dy, dz, heading, vel_x, vel_y, valid]
+    Returns:
+        pred_scores: (num_objects, top_k) float32
+        pred_trajs: (num_objects, top_k, num_frame_to_eval, 2) float32
+        gt_trajs: (num_objects, num_frames_in_total, 7) float32, [cx, cy, dx, dy, heading, vel_x, vel_y]
+        gt_is_valid: (num_objects, num_frames_in_total) uint8
+    """
+    num_frames_in_total, num_frame_to_eval = get_eval_frames(eval_second)
+    pred_trajs = torch.as_tensor(pred_trajs)
+    num_objects, top_k = pred_trajs.shape[:2]
+    if top_k_for_eval != -1:
+        top_k = min(top_k_for_eval, top_k)
+
+    # sorted on host with numpy, such that ties are broken as in transform_preds_to_waymo_format
+    pred_scores = torch.as_tensor(pred_scores).reshape(num_objects, -1).cpu().numpy()
+    sort_idxs = pred_scores.argsort(axis=-1)[:, ::-1]
+    pred_scores = np.take_along_axis(pred_scores, sort_idxs, axis=-1)
+    pred_scores = pred_scores / pred_scores.sum(axis=-1, keepdims=True)
+
+    sort_idxs = torch.as_tensor(np.ascontiguousarray(sort_idxs[:, :top_k]), device=pred_trajs.device)
+    pred_trajs = pred_trajs[torch.arange(num_objects, device=pred_trajs.device)[:, None], sort_idxs]
+    pred_trajs = pred_trajs[:, :, SAMPLED_INTERVAL - 1::SAMPLED_INTERVAL][:, :, :num_frame_to_eval]
+    gt_trajs = torch.as_tensor(gt_trajs)[:, :num_frames_in_total]
+    return (
+        np.ascontiguousarray(pred_scores[:, :top_k], dtype=np.float32),
+        pred_trajs.float().cpu().numpy(),
+        gt_trajs.index_select(-1, torch.tensor([0, 1, 3, 4, 6, 7, 8], device=gt_trajs.device)).float().cpu().numpy(),
+        gt_trajs[..., -1].to(torch.uint8).cpu().numpy(),
+    )
+
+
+def group_by_scenario(scenario_id, object_id, object_type, pred_scores, pred_trajs, gt_trajs, gt_is_valid):
+    """
+    Vectorized transform_preds_to_waymo_format on compacted columns (see compact_predictions):
+    objects are scattered into (num_scenario, num_max_objs_per_scene) arrays, scenarios and objects in order of appearance.
+    Returns:
+        batch_pred_scores, batch_pred_trajs, gt_infos, object_type_cnt_dict as transform_preds_to_waymo_format
+    """
+    unique_ids, first_index, inverse = np.unique(scenario_id, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # scenario index by first appearance
+    scene_rank = np.empty(len(unique_ids), dtype=np.int64)
+    scene_rank[np.argsort(first_index, kind='stable')] = np.arange(len(unique_ids))
+    scene_idx = scene_rank[inverse]
+    # object index within its scenario
+    order = np.argsort(scene_idx, kind='stable')
+    scene_counts = np.bincount(scene_idx, minlength=len(unique_ids))
+    scene_starts = np.concatenate([[0], np.cumsum(scene_counts)[:-1]])
+    obj_idx = np.empty(len(scene_idx), dtype=np.int64)
+    obj_idx[order] = np.arange(len(scene_idx)) - scene_starts[scene_idx[order]]
+
+    num_scenario, num_max_objs_per_scene = len(unique_ids), int(scene_counts.max())
+    batch_pred_trajs = np.zeros((num_scenario, num_max_objs_per_scene, pred_trajs.shape[1], 1) + pred_trajs.shape[2:], dtype=np.float32)
+    batch_pred_scores = np.zeros((num_scenario, num_max_objs_per_scene, pred_scores.shape[1]), dtype=np.float32)
+    batch_gt_trajs = np.zeros((num_scenario, num_max_objs_per_scene) + gt_trajs.shape[1:], dtype=np.float32)
+    batch_gt_is_valid = np.zeros((num_scenario, num_max_objs_per_scene, gt_is_valid.shape[1]), dtype=np.int64)
+    pred_gt_idxs = np.zeros((num_scenario, num_max_objs_per_scene, 1))
+    pred_gt_idx_valid_mask = np.zeros((num_scenario, num_max_objs_per_scene, 1), dtype=np.int64)
+    batch_object_type = np.zeros((num_scenario, num_max_objs_per_scene), dtype=np.int64)
+    batch_object_id = np.zeros((num_scenario, num_max_objs_per_scene), dtype=np.int64)
+
+    batch_pred_trajs[scene_idx, obj_idx, :, 0] = pred_trajs
+    batch_pred_scores[scene_idx, obj_idx] = pred_scores
+    batch_gt_trajs[scene_idx, obj_idx] = gt_trajs
+    batch_gt_is_valid[scene_idx, obj_idx] = gt_is_valid
+    pred_gt_idxs[scene_idx, obj_idx, 0] = obj_idx
+    pred_gt_idx_valid_mask[scene_idx, obj_idx, 0] = 1
+    batch_object_type[scene_idx, obj_idx] = object_type
+    batch_object_id[scene_idx, obj_idx] = object_id
+
+    type_counts = np.bincount(object_type, minlength=len(object_type_to_id))
+    object_type_cnt_dict = {key: int(type_counts[type_id]) for key, type_id in object_type_to_id.items()}
+
+    gt_infos = {
+        'scenario_id': [each_id.decode() for each_id in unique_ids[np.argsort(first_index, kind='stable')]],
+        'object_id': batch_object_id.tolist(),
+        'object_type': batch_object_type.tolist(),
+        'gt_is_valid': batch_gt_is_valid,
+        'gt_trajectory': batch_gt_trajs,
+        'pred_gt_indices': pred_gt_idxs,
+        'pred_gt_indices_mask': pred_gt_idx_valid_mask
+    }
+    return batch_pred_scores, batch_pred_trajs, gt_infos, object_type_cnt_dict
+
+
+def motion_errors(pred_trajs, gt_trajs, gt_is_valid, eval_second=8, num_modes_for_eval=6):
+    """
+    minADE, minFDE and miss of every object at every measurement step, following the definitions of the waymo
+    motion metrics: errors of the best of the top modes, misses by speed scaled lateral and longitudinal thresholds
+    in the ground truth heading frame. mAP and overlap rate need the official metric ops (waymo_utils.waymo_evaluation).
+    Args:
+        pred_trajs, gt_trajs, gt_is_valid: compacted columns of a batch, see compact_predictions
+    Returns:
+        dict of metric name to (num_objects, num_measurement_steps) errors,
+        (num_objects, num_measurement_steps) valid mask of objects with ground truth at the measurement step
+    """
+    pred_trajs = torch.as_tensor(pred_trajs)[:, :num_modes_for_eval].double()
+    gt_trajs = torch.as_tensor(gt_trajs, device=pred_trajs.device).double()
+    gt_is_valid = torch.as_tensor(gt_is_valid, device=pred_trajs.device).bool()
+    num_frame_to_eval = pred_trajs.shape[2]
+    # ground truth at the predicted frames
+    eval_frames = TRACK_HISTORY_SAMPLES + SAMPLED_INTERVAL * torch.arange(1, num_frame_to_eval + 1, device=pred_trajs.device)
+    gt_eval, valid_eval = gt_trajs[:, eval_frames], gt_is_valid[:, eval_frames]  # (num_objects, num_frame_to_eval, 7)
+
+    delta = pred_trajs - gt_eval[:, None, :, :2]  # (num_objects, num_modes, num_frame_to_eval, 2)
+    displacement = torch.linalg.norm(delta, dim=-1)
+    speed = torch.linalg.norm(gt_trajs[:, TRACK_HISTORY_SAMPLES, 5:7], dim=-1)
+    speed_scale = SPEED_SCALE_LOWER + (SPEED_SCALE_UPPER - SPEED_SCALE_LOWER) * torch.clamp(
+        (speed - SPEED_LOWER_BOUND) / (SPEED_UPPER_BOUND - SPEED_LOWER_BOUND), 0, 1)
+    cos_heading, sin_heading = torch.cos(gt_eval[..., 4]), torch.sin(gt_eval[..., 4])
+    longitudinal = delta[..., 0] * cos_heading[:, None] + delta[..., 1] * sin_heading[:, None]
+    lateral = -delta[..., 0] * sin_heading[:, None] + delta[..., 1] * cos_heading[:, None]
+
+    # average displacement over the valid frames up to each frame
+    valid_count = torch.cumsum(valid_eval.double(), dim=-1).clamp(min=1)
+    average_displacement = torch.cumsum(displacement * valid_eval[:, None], dim=-1) / valid_count[:, None]
+
+    min_ade, min_fde, miss, valid = [], [], [], []
+    for step, lateral_threshold, longitudinal_threshold in MEASUREMENT_STEPS[eval_second]:
+        min_ade.append(average_displacement[:, :, step].min(dim=1).values)
+        min_fde.append(displacement[:, :, step].min(dim=1).values)
+        hit = (lateral[:, :, step].abs() <= lateral_threshold * speed_scale[:, None]) & \
+              (longitudinal[:, :, step].abs() <= longitudinal_threshold * speed_scale[:, None])
+        miss.append((~hit.any(dim=1)).double())
+        valid.append(valid_eval[:, step])
+    return {
+        'minADE': torch.stack(min_ade, dim=1),
+        'minFDE': torch.stack(min_fde, dim=1),
+        'MissRate': torch.stack(miss, dim=1),
+    }, torch.stack(valid, dim=1)
@@ -38,35 +38,32 @@ def rotate_points_along_z(points, angle):
         points_rot = torch.cat((points_rot, points[:, :, 3:]), dim=-1)
     return points_rot.numpy() if is_numpy else points_rot
 
-def merge_batch_by_padding_2nd_dim(tensor_list, return_pad_mask=False):
+def merge_batch_by_padding_2nd_dim(tensor_list, return_pad_mask=False, pin_memory=False):
+    """
+    Concatenate tensors along the 1st dim while zero-padding their 2nd dim to the longest one.
+    The output (and the mask) is allocated once and each sample is copied in with slicing.
+    Args:
+        tensor_list: list of (num_i, len_i, C) or (num_i, len_i, C1, C2) tensors
+        return_pad_mask: also return the (sum(num_i), max(len_i)) bool valid mask
+        pin_memory: allocate the outputs in page-locked memory for faster host-to-device copies
+    """
     assert len(tensor_list[0].shape) in [3, 4]
-    only_3d_tensor = False
-    if len(tensor_list[0].shape) == 3:
-        tensor_list = [x.unsqueeze(dim=-1) for x in tensor_list]
-        only_3d_tensor = True
+    feat_shape = tensor_list[0].shape[2:]
     maxt_feat0 = max([x.shape[1] for x in tensor_list])
+    num_stacked_samples = sum([x.shape[0] for x in tensor_list])
 
-    _, _, num_feat1, num_feat2 = tensor_list[0].shape
-
-    ret_tensor_list = []
-    ret_mask_list = []
-    for k in range(len(tensor_list)):
-        cur_tensor = tensor_list[k]
-        assert cur_tensor.shape[2] == num_feat1 and cur_tensor.shape[3] == num_feat2
-
-        new_tensor = cur_tensor.new_zeros(cur_tensor.shape[0], maxt_feat0, num_feat1, num_feat2)
-        new_tensor[:, :cur_tensor.shape[1], :, :] = cur_tensor
-        ret_tensor_list.append(new_tensor)
-
-        new_mask_tensor = cur_tensor.new_zeros(cur_tensor.shape[0], maxt_feat0)
-        new_mask_tensor[:, :cur_tensor.shape[1]] = 1
-        ret_mask_list.append(new_mask_tensor.bool())
+    ret_tensor = torch.zeros((num_stacked_samples, maxt_feat0, *feat_shape), dtype=tensor_list[0].dtype,
+                             device=tensor_list[0].device, pin_memory=pin_memory)  # (num_stacked_samples, num_feat0_maxt, num_feat1, num_feat2)
+    ret_mask = torch.zeros((num_stacked_samples, maxt_feat0), dtype=torch.bool,
+                           device=tensor_list[0].device, pin_memory=pin_memory)
 
-    ret_tensor = torch.cat(ret_tensor_list, dim=0)  # (num_stacked_samples, num_feat0_maxt, num_feat1, num_feat2)
-    ret_mask = torch.cat(ret_mask_list, dim=0)
-
-    if only_3d_tensor:
-        ret_tensor = ret_tensor.squeeze(dim=-1)
+    start = 0
+    for cur_tensor in tensor_list:
+        assert cur_tensor.shape[2:] == feat_shape
+        end = start + cur_tensor.shape[0]
+        ret_tensor[start:end, :cur_tensor.shape[1]] = cur_tensor
+        ret_mask[start:end, :cur_tensor.shape[1]] = True
+        start = end
 
     if return_pad_mask:
         return ret_tensor, ret_mask
@@ -362,6 +359,22 @@ def waymo_evaluation(pred_dicts, top_k=-1, eval_second=8, num_modes_for_eval=6):
     pred_score, pred_trajectory, gt_infos, object_type_cnt_dict = transform_preds_to_waymo_format(
         pred_dicts, top_k_for_eval=top_k, eval_second=eval_second,
     )
+    return _evaluate_waymo_format(pred_score, pred_trajectory, gt_infos, object_type_cnt_dict,
+                                  eval_second=eval_second, num_modes_for_eval=num_modes_for_eval)
+
+def waymo_evaluation_columnar(columns, eval_second=8, num_modes_for_eval=6):
+    """
+    waymo_evaluation on stacked per-object arrays instead of a list of per-object dicts.
+    Args:
+        columns: dict of scenario_id, object_id, object_type, pred_scores, pred_trajs, gt_trajs, gt_is_valid,
+            compacted by waymo_metrics.compact_predictions
+    """
+    from transformer4planning.utils.waymo_metrics import group_by_scenario
+    pred_score, pred_trajectory, gt_infos, object_type_cnt_dict = group_by_scenario(**columns)
+    return _evaluate_waymo_format(pred_score, pred_trajectory, gt_infos, object_type_cnt_dict,
+                                  eval_second=eval_second, num_modes_for_eval=num_modes_for_eval)
+
+def _evaluate_waymo_format(pred_score, pred_trajectory, gt_infos, object_type_cnt_dict, eval_second=8, num_modes_for_eval=6):
     eval_config = _default_metrics_config(eval_second=eval_second, num_modes_for_eval=num_modes_for_eval)
 
     pred_score = tf.convert_to_tensor(pred_score, np.float32)